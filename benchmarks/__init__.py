@@ -0,0 +1,28 @@
+"""Performance benchmarks for photom, run them as modules, e.g. `python -m benchmarks.async_store`."""
+
+import os
+import platform
+import statistics
+
+
+def percentiles(samples: list[float]) -> dict[str, float]:
+    """Summarize latency samples (in seconds) as milliseconds."""
+    ordered = sorted(samples)
+    quantiles = statistics.quantiles(ordered, n=100, method="inclusive") if len(ordered) > 1 else ordered * 99
+    return {
+        "count": len(ordered),
+        "mean_ms": statistics.fmean(ordered) * 1000 if ordered else 0.0,
+        "p50_ms": quantiles[49] * 1000,
+        "p99_ms": quantiles[98] * 1000,
+        "max_ms": ordered[-1] * 1000,
+    }
+
+
+def environment() -> dict[str, str | int | None]:
+    """Describe where the benchmark ran, results are only comparable between runs on the same kind of machine."""
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+    }
@@ -0,0 +1,95 @@
+"""Compare event loop latency under concurrent store load, calling the store directly vs. through `ThreadedStore`.
+
+Every simulated request reads and writes one record of a file store with fsync enabled. A probe task measures how
+late the event loop wakes up a cheap concurrent request, which is what every other in-flight request experiences.
+
+    python -m benchmarks.async_store --concurrency 32 --requests 50
+"""
+
+import argparse
+import asyncio
+import json
+import tempfile
+import time
+from typing import Awaitable, Callable
+
+from fastapi_sso.sso.base import OpenID
+
+from benchmarks import percentiles
+from photom.models import Auth
+from photom.store.file import FileStore
+from photom.store.threaded import ThreadedStore, shutdown_executor
+
+PROBE_INTERVAL = 0.001
+
+
+def make_auth(index: int) -> Auth:
+    """Create a sample record."""
+    email = f"user{index}@example.com"
+    return Auth(openid=OpenID(id=str(index), email=email), access_token="access", refresh_token="refresh")
+
+
+async def probe(stop: asyncio.Event, lags: list[float]) -> None:
+    """Measure how late the event loop wakes a sleeping task up."""
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(PROBE_INTERVAL)
+        lags.append(time.perf_counter() - start - PROBE_INTERVAL)
+
+
+async def run(request: Callable[[int], Awaitable[None]], concurrency: int, requests: int) -> dict:
+    """Run `requests` requests in each of `concurrency` workers next to the probe."""
+    latencies: list[float] = []
+    lags: list[float] = []
+    stop = asyncio.Event()
+
+    async def worker(offset: int) -> None:
+        for index in range(requests):
+            start = time.perf_counter()
+            await request(offset * requests + index)
+            latencies.append(time.perf_counter() - start)
+
+    probe_task = asyncio.create_task(probe(stop, lags))
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(offset) for offset in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await probe_task
+    return {
+        "requests_per_second": concurrency * requests / elapsed,
+        "request_latency": percentiles(latencies),
+        "event_loop_lag": percentiles(lags),
+    }
+
+
+async def main(concurrency: int, requests: int) -> dict:
+    """Run the benchmark for both ways of calling the store."""
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        store = FileStore(directory)
+
+        async def blocking(index: int) -> None:
+            # what the routes did before: blocking calls straight from the coroutine
+            with store:
+                store.get(f"user{index - 1}@example.com", Auth)
+                store.set(f"user{index}@example.com", make_auth(index))
+
+        threaded = ThreadedStore(store, max_workers=concurrency)
+
+        async def non_blocking(index: int) -> None:
+            async with threaded:
+                await threaded.get(f"user{index - 1}@example.com", Auth)
+                await threaded.set(f"user{index}@example.com", make_auth(index))
+
+        results["blocking"] = await run(blocking, concurrency, requests)
+        results["threaded"] = await run(non_blocking, concurrency, requests)
+        shutdown_executor()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=50)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(main(args.concurrency, args.requests)), indent=2))
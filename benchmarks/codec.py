@@ -0,0 +1,139 @@
+"""Microbenchmarks of store serialization for every model in `photom.models`.
+
+Compares the previous two-pass serialization (`model_dump` + `json`, `json.loads` + `model(**data)`) with the store
+codecs, which serialize in one pass and validate straight from the encoded data.
+
+    python -m benchmarks.codec --number 20000
+"""
+
+import argparse
+import inspect
+import json
+import timeit
+from typing import Callable
+
+from fastapi_sso.sso.base import OpenID
+
+import photom.models
+from photom.models import BaseModel
+from photom.store.codec import CODECS
+
+SAMPLES: dict[type[BaseModel], BaseModel] = {
+    photom.models.Auth: photom.models.Auth(
+        openid=OpenID(
+            id="1234567890",
+            email="test@example.com",
+            first_name="Test",
+            last_name="Testowitch",
+            display_name="Test Testowitch",
+            picture="https://example.com/picture.png",
+            provider="google",
+        ),
+        access_token="ya29." + "a" * 200,
+        refresh_token="1//" + "r" * 100,
+    ),
+    photom.models.DriveFile: photom.models.DriveFile(
+        id="1" + "x" * 32,
+        name="IMG_20230812_104512.jpg",
+        mime_type="image/jpeg",
+        md5_checksum="d41d8cd98f00b204e9800998ecf8427e",
+        size=4_194_304,
+    ),
+    photom.models.DriveFolder: photom.models.DriveFolder(
+        files=[
+            photom.models.DriveFile(
+                id=f"{index}" + "x" * 32,
+                name=f"IMG_20230812_{index:06d}.jpg",
+                mime_type="image/jpeg",
+                md5_checksum="d41d8cd98f00b204e9800998ecf8427e",
+                size=4_194_304,
+                parents=["0" + "f" * 32],
+                modified_time="2023-08-12T10:45:12.000Z",
+            )
+            for index in range(20)
+        ],
+        folders=[f"{index}" + "f" * 32 for index in range(5)],
+    ),
+    photom.models.DriveTree: photom.models.DriveTree(
+        folders={f"{index}" + "f" * 32: "2023-08-12T10:45:12.000Z" for index in range(200)} | {"root": None}
+    ),
+    photom.models.DriveSyncState: photom.models.DriveSyncState(
+        changes_token="1234567", listing_token="~!!~AI9FV7T" * 8
+    ),
+    photom.models.TransferRecord: photom.models.TransferRecord(
+        email="test@example.com",
+        file=photom.models.DriveFile(id="1" + "x" * 32, name="IMG_20230812_104512.jpg", mime_type="image/jpeg"),
+        media_item_id="A" * 100,
+    ),
+    photom.models.Job: photom.models.Job(
+        id=123456,
+        kind="sync",
+        key="sync:test@example.com",
+        payload={"email": "test@example.com"},
+        status="done",
+        attempts=1,
+        created_at=1691836800.0,
+        finished_at=1691836860.0,
+        result={"files": 1200, "bytes": 4_800_000_000, "failed": 0, "seconds": 60.0, "skipped": 0},
+    ),
+    photom.models.AccountProgress: photom.models.AccountProgress(
+        email="test@example.com",
+        files=1200,
+        bytes=4_800_000_000,
+        failed=2,
+        skipped=35,
+        pending=240,
+        seconds=600.5,
+        bytes_per_second=7_993_338.9,
+        eta=120.1,
+    ),
+}
+
+
+def measure(func: Callable[[], object], number: int) -> float:
+    """Best time of a call in microseconds."""
+    return min(timeit.repeat(func, number=number, repeat=5)) / number * 1_000_000
+
+
+def benchmark(model: type[BaseModel], number: int) -> dict:
+    """Benchmark encoding and decoding of a model."""
+    sample = SAMPLES[model]
+    legacy = json.dumps(sample.model_dump())
+
+    def legacy_decode() -> BaseModel:
+        return model(**json.loads(legacy))
+
+    results = {
+        "legacy": {
+            "encode_us": measure(lambda: json.dumps(sample.model_dump()), number),
+            "decode_us": measure(legacy_decode, number),
+            "size_bytes": len(legacy.encode("utf-8")),
+        }
+    }
+    for name, codec_class in CODECS.items():
+        try:
+            codec = codec_class()
+        except RuntimeError:
+            continue
+        data = codec.encode(sample)
+        results[name] = {
+            "encode_us": measure(lambda codec=codec: codec.encode(sample), number),
+            "decode_us": measure(lambda codec=codec, data=data: codec.decode(data, model), number),
+            "size_bytes": len(data.encode("utf-8") if isinstance(data, str) else data),
+        }
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--number", type=int, default=20000)
+    args = parser.parse_args()
+    models = [
+        model
+        for _, model in inspect.getmembers(photom.models, inspect.isclass)
+        if issubclass(model, BaseModel) and model.__module__ == photom.models.__name__
+    ]
+    missing = [model.__name__ for model in models if model not in SAMPLES]
+    if missing:
+        parser.error(f"Add samples for {', '.join(missing)}")
+    print(json.dumps({model.__name__: benchmark(model, args.number) for model in models}, indent=2))
@@ -0,0 +1,111 @@
+"""Measure the cost of keeping store caches of several processes coherent, and how long they serve stale values.
+
+Overhead compares cache hits with and without following the change log, a read of the SQLite database for scale, and
+writes with and without logging them. Staleness is measured with a writer process updating a value over and over,
+while the benchmark process reads it through its cache: the window is the time from the commit of each write until
+the new value is read, for several poll intervals.
+
+    python -m benchmarks.coherence --number 20000 --writes 200
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+import timeit
+from multiprocessing.queues import Queue
+from typing import Callable
+
+from fastapi_sso.sso.base import OpenID
+
+from benchmarks import environment, percentiles
+from photom.models import Auth
+from photom.store.cached import CachedStore, StoreCache
+from photom.store.coherence import ChangeWatcher
+from photom.store.sqlite import SQLiteStore, close_pools
+
+KEY = "test@example.com"
+
+
+def make_auth(access_token: str) -> Auth:
+    """Create a sample record."""
+    return Auth(openid=OpenID(id="1", email=KEY), access_token=access_token, refresh_token="refresh")
+
+
+def measure(func: Callable[[], object], number: int) -> float:
+    """Best time of a call in microseconds."""
+    return min(timeit.repeat(func, number=number, repeat=5)) / number * 1_000_000
+
+
+def overhead(directory: str, number: int) -> dict:
+    """Cost of reads and writes with and without coherence, in separate databases since the change log is kept for
+    all writers once a table is tracked."""
+    tracked = os.path.join(directory, "tracked.db")
+    with CachedStore(SQLiteStore(os.path.join(directory, "plain.db")), StoreCache(10)) as plain, CachedStore(
+        SQLiteStore(tracked, track_changes=True), StoreCache(10, watcher=ChangeWatcher(tracked))
+    ) as coherent:
+        plain.set(KEY, make_auth("access"))
+        coherent.set(KEY, make_auth("access"))
+        plain.get(KEY, Auth)
+        coherent.get(KEY, Auth)
+        results = {
+            "cache_hit_us": measure(lambda: plain.get(KEY, Auth), number),
+            "coherent_cache_hit_us": measure(lambda: coherent.get(KEY, Auth), number),
+            "sqlite_get_us": measure(lambda: plain.store.get(KEY, Auth), number),
+            "set_us": measure(lambda: plain.store.set("other", make_auth("access")), number // 10),
+            "tracked_set_us": measure(lambda: coherent.store.set("other", make_auth("access")), number // 10),
+        }
+    close_pools()
+    return results
+
+
+def _write(database: str, writes: int, written: Queue, seen: Queue) -> None:
+    """Write new values one by one, once the reader has seen the previous one."""
+    with SQLiteStore(database, track_changes=True) as store:
+        for index in range(writes):
+            store.set(KEY, make_auth(str(index)))
+            written.put(time.monotonic())
+            seen.get()
+    close_pools()
+
+
+def staleness(database: str, writes: int, interval: float) -> dict:
+    """Time from commits of another process until the new values are read through the cache."""
+    context = multiprocessing.get_context("spawn")
+    written, seen = context.Queue(), context.Queue()
+    windows, stale = [], 0
+    with CachedStore(
+        SQLiteStore(database, track_changes=True), StoreCache(10, watcher=ChangeWatcher(database, interval))
+    ) as store:
+        store.set(KEY, make_auth("initial"))
+        writer = context.Process(target=_write, args=(database, writes, written, seen))
+        writer.start()
+        for index in range(writes):
+            committed = written.get()
+            while (value := store.get(KEY, Auth)) is None or value.access_token != str(index):
+                stale += 1
+            windows.append(time.monotonic() - committed)
+            seen.put(None)
+        writer.join()
+    close_pools()
+    return {"stale_reads": stale, **{f"window_{key}": value for key, value in percentiles(windows).items()}}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--number", type=int, default=20000)
+    parser.add_argument("--writes", type=int, default=200, help="values written by the other process")
+    parser.add_argument("--intervals", type=float, nargs="+", default=[0.0, 0.01, 0.1])
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as workdir:
+        report = {
+            "environment": environment(),
+            "overhead": overhead(workdir, args.number),
+            "staleness": {
+                str(interval): staleness(os.path.join(workdir, f"staleness-{interval}.db"), args.writes, interval)
+                for interval in args.intervals
+            },
+        }
+    print(json.dumps(report, indent=2))
@@ -0,0 +1,89 @@
+"""Compare results of two benchmark runs and fail on regressions.
+
+Results of every benchmark are compared value by value. Durations (keys ending in `_us`, `_ms` or `seconds`) regress
+when they grow, throughputs (keys ending in `per_second`) and efficiencies when they shrink, by more than the
+threshold relative to the baseline. Other values, like counts or the environment, are not compared, nor are maximum
+latencies, a single slow sample is noise. `--include` limits the comparison to keys matching any of the patterns.
+Results are only comparable between runs on the same kind of machine.
+
+    python -m benchmarks.stores > baseline.json
+    python -m benchmarks.stores > current.json
+    python -m benchmarks.compare baseline.json current.json --threshold 0.2 --include "*.ops_per_second"
+"""
+
+import argparse
+import fnmatch
+import json
+import sys
+from typing import Any, Iterator
+
+DEFAULT_THRESHOLD = 0.2
+LOWER_IS_BETTER = ("_us", "_ms", "seconds")
+HIGHER_IS_BETTER = ("per_second", "efficiency")
+IGNORED = ("max_ms",)
+
+
+def direction(key: str) -> int:
+    """1 if a larger value of the key is better, -1 if a smaller one is, 0 if it is not compared."""
+    if key in IGNORED:
+        return 0
+    if key.endswith(HIGHER_IS_BETTER):
+        return 1
+    if key.endswith(LOWER_IS_BETTER):
+        return -1
+    return 0
+
+
+def values(results: Any, path: tuple[str, ...] = ()) -> Iterator[tuple[tuple[str, ...], float]]:
+    """Numeric values of the results with the keys leading to them, the environment left out."""
+    if isinstance(results, dict):
+        for key, value in results.items():
+            if key != "environment":
+                yield from values(value, path + (str(key),))
+    elif isinstance(results, (int, float)) and not isinstance(results, bool):
+        yield path, float(results)
+
+
+def compare(
+    baseline: Any, current: Any, threshold: float = DEFAULT_THRESHOLD, include: list[str] | None = None
+) -> dict[str, list[dict[str, Any]]]:
+    """Find values that got worse or better than the baseline by more than the threshold, only those with keys
+    matching the `include` patterns if given."""
+
+    def compared(path: tuple[str, ...]) -> bool:
+        key = ".".join(path)
+        return bool(direction(path[-1])) and (not include or any(fnmatch.fnmatch(key, pattern) for pattern in include))
+
+    known = {path: value for path, value in values(baseline) if compared(path)}
+    report: dict[str, list[dict[str, Any]]] = {"regressions": [], "improvements": [], "missing": []}
+    seen = set()
+    for path, value in values(current):
+        if path not in known:
+            continue
+        sign = direction(path[-1])
+        seen.add(path)
+        before = known[path]
+        if not before:
+            continue
+        change = (value - before) / abs(before)
+        entry = {"key": ".".join(path), "baseline": before, "current": value, "change": change}
+        if change * sign < -threshold:
+            report["regressions"].append(entry)
+        elif change * sign > threshold:
+            report["improvements"].append(entry)
+    report["missing"] = [{"key": ".".join(path)} for path in known if path not in seen]
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline", type=argparse.FileType())
+    parser.add_argument("current", type=argparse.FileType())
+    parser.add_argument(
+        "--threshold", type=float, default=DEFAULT_THRESHOLD, help="relative change that counts, 0.2 is 20%%"
+    )
+    parser.add_argument("--include", nargs="+", metavar="PATTERN", help="only compare keys matching these patterns")
+    args = parser.parse_args()
+    result = compare(json.load(args.baseline), json.load(args.current), args.threshold, args.include)
+    print(json.dumps(result, indent=2))
+    sys.exit(1 if result["regressions"] else 0)
@@ -0,0 +1,105 @@
+"""Load test of the auth API: listing logins with `GET /auth/` and deleting them with `DELETE /auth/{email}`.
+
+Concurrent clients send requests for as long as there are logins left to delete, every `--list-every`th request of a
+client lists a page of logins. By default requests go to the ASGI app in process, with its store in a SQLite database
+file filled beforehand. With `--url`, a running server is loaded instead, whose store has to hold the same logins, see
+`--fill-only`.
+
+    python -m benchmarks.load --logins 5000 --concurrency 32 > load.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+from collections import defaultdict
+
+import httpx
+
+from benchmarks import environment, percentiles
+from benchmarks.stores import fill
+from photom.api.asgi import app, lifespan
+from photom.config import Config
+from photom.store.sqlite import close_pools
+
+
+async def load(client: httpx.AsyncClient, logins: int, concurrency: int, list_every: int, page: int) -> dict:
+    """Run concurrent clients deleting all logins and listing pages of them in between."""
+    emails = iter(f"user{index}@example.com" for index in range(logins))
+    latencies: dict[str, list[float]] = defaultdict(list)
+    errors: dict[str, int] = defaultdict(int)
+
+    async def request(endpoint: str, method: str, url: str, params: dict | None = None) -> None:
+        began = time.perf_counter()
+        response = await client.request(method, url, params=params)
+        latencies[endpoint].append(time.perf_counter() - began)
+        if response.is_error:
+            errors[endpoint] += 1
+
+    async def user() -> None:
+        sent = 0
+        for email in emails:
+            sent += 1
+            if sent % list_every == 0:
+                await request("GET /auth/", "GET", "/auth/", {"limit": page, "after": email})
+            await request("DELETE /auth/{email}", "DELETE", f"/auth/{email}")
+
+    start = time.perf_counter()
+    await asyncio.gather(*(user() for _ in range(concurrency)))
+    seconds = time.perf_counter() - start
+    total = sum(len(samples) for samples in latencies.values())
+    return {
+        "requests": total,
+        "seconds": seconds,
+        "requests_per_second": total / seconds,
+        "endpoints": {
+            endpoint: {
+                "requests_per_second": len(samples) / seconds,
+                "errors": errors[endpoint],
+                **percentiles(samples),
+            }
+            for endpoint, samples in latencies.items()
+        },
+    }
+
+
+def prepare(database: str, logins: int) -> None:
+    """Point the configuration at a SQLite database file holding the logins."""
+    os.environ["STORE_BACKEND"] = "photom.store.sqlite.SQLiteStore"
+    os.environ["STORE_BACKEND_PATH"] = database
+    Config().reload()
+    with Config().get_store_backend() as store:
+        fill(store, logins)
+
+
+async def main(args: argparse.Namespace) -> dict:
+    """Load the app in process or the server at the URL."""
+    if args.url is not None:
+        async with httpx.AsyncClient(base_url=args.url, timeout=None) as client:
+            return await load(client, args.logins, args.concurrency, args.list_every, args.page)
+    with tempfile.TemporaryDirectory() as directory:
+        prepare(os.path.join(directory, "bench.db"), args.logins)
+        async with lifespan(app):
+            transport = httpx.ASGITransport(app)  # type: ignore[arg-type]
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+                results = await load(client, args.logins, args.concurrency, args.list_every, args.page)
+        close_pools()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logins", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--list-every", type=int, default=10, help="list logins every this many requests")
+    parser.add_argument("--page", type=int, default=50, help="logins per listed page")
+    parser.add_argument("--url", help="base URL of a running server to load instead of the app in process")
+    parser.add_argument("--fill-only", metavar="DATABASE", help="only fill the SQLite database file with the logins")
+    arguments = parser.parse_args()
+    if arguments.fill_only:
+        prepare(arguments.fill_only, arguments.logins)
+        close_pools()
+    else:
+        print(json.dumps({"environment": environment(), "load": asyncio.run(main(arguments))}, indent=2))
@@ -0,0 +1,132 @@
+"""Measure the overhead of metrics on the hot paths they instrument.
+
+Times recording a sample, a store read of a SQLite database file with and without `InstrumentedStore`, and an API
+request with and without `MetricsMiddleware`. Overheads are given in microseconds and as a share of the bare call.
+
+    python -m benchmarks.metrics --number 20000
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+import timeit
+from typing import Callable
+
+import httpx
+from fastapi import FastAPI
+from fastapi_sso.sso.base import OpenID
+from prometheus_client import CollectorRegistry, Counter, Histogram
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from photom.api._metrics import MetricsMiddleware
+from photom.metrics import DEFAULT_BUCKETS
+from photom.models import Auth
+from photom.store.base import Store
+from photom.store.instrumented import InstrumentedStore
+from photom.store.sqlite import SQLiteStore, close_pools
+
+
+def measure(func: Callable[[], object], number: int) -> float:
+    """Best time of a call in microseconds."""
+    return min(timeit.repeat(func, number=number, repeat=5)) / number * 1_000_000
+
+
+def overhead(bare_us: float, instrumented_us: float) -> dict:
+    """Compare the times of a bare and an instrumented call."""
+    return {
+        "bare_us": bare_us,
+        "instrumented_us": instrumented_us,
+        "overhead_us": instrumented_us - bare_us,
+        "overhead_percent": (instrumented_us - bare_us) / bare_us * 100,
+    }
+
+
+def primitives(number: int) -> dict:
+    """Cost of recording samples."""
+    registry = CollectorRegistry()
+    counter = Counter("bench_total", "Benchmark", ("kind",), registry=registry)
+    histogram = Histogram("bench_seconds", "Benchmark", ("kind",), registry=registry, buckets=DEFAULT_BUCKETS)
+    child = histogram.labels("a")
+    return {
+        "counter_inc_us": measure(lambda: counter.labels("a").inc(), number),
+        "histogram_observe_us": measure(lambda: histogram.labels("a").observe(0.003), number),
+        "histogram_observe_child_us": measure(lambda: child.observe(0.003), number),
+        "perf_counter_us": measure(time.perf_counter, number),
+    }
+
+
+def store(number: int) -> dict:
+    """Overhead of instrumenting store reads."""
+    auth = Auth(openid=OpenID(id="1", email="test@example.com"), access_token="access", refresh_token="refresh")
+    with tempfile.TemporaryDirectory() as directory:
+        database = os.path.join(directory, "bench.db")
+        with SQLiteStore(database) as bare, InstrumentedStore(SQLiteStore(database)) as instrumented:
+            bare.set("test@example.com", auth)
+
+            def get(backend: Store) -> Callable[[], object]:
+                return lambda: backend.get("test@example.com", Auth)
+
+            results = overhead(measure(get(bare), number), measure(get(instrumented), number))
+        close_pools()
+    return results
+
+
+def api(number: int) -> dict:
+    """Overhead of timing API requests. A full request is too noisy to tell the difference, so the middleware is timed
+    around a bare ASGI app and compared with a request to a FastAPI app."""
+    app = FastAPI()
+
+    @app.get("/items/{item_id}")
+    async def get_item(item_id: int) -> dict:
+        return {"id": item_id}
+
+    async def endpoint(_scope: Scope, _receive: Receive, send: Send) -> None:
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"{}"})
+
+    async def receive() -> Message:
+        return {"type": "http.request", "body": b""}
+
+    async def send(_message: Message) -> None:
+        pass
+
+    async def calls(asgi: ASGIApp) -> float:
+        best = float("inf")
+        for _ in range(5):
+            start = time.perf_counter()
+            for _ in range(number):
+                await asgi({"type": "http", "method": "GET", "route": app.routes[-1]}, receive, send)
+            best = min(best, time.perf_counter() - start)
+        return best / number * 1_000_000
+
+    async def requests() -> float:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app), base_url="http://bench") as client:
+            best = float("inf")
+            for _ in range(5):
+                start = time.perf_counter()
+                for index in range(number // 10):
+                    await client.get(f"/items/{index}")
+                best = min(best, time.perf_counter() - start)
+        return best / (number // 10) * 1_000_000
+
+    async def compare() -> dict:
+        middleware_us = await calls(MetricsMiddleware(endpoint)) - await calls(endpoint)
+        request_us = await requests()
+        return overhead(request_us, request_us + middleware_us)
+
+    return asyncio.run(compare())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--number", type=int, default=20000)
+    args = parser.parse_args()
+    print(
+        json.dumps(
+            {"primitives": primitives(args.number), "store_get": store(args.number), "api_request": api(args.number)},
+            indent=2,
+        )
+    )
@@ -0,0 +1,185 @@
+"""Benchmark store backends at growing numbers of keys, in memory and on disk, and under concurrent access.
+
+Every backend is filled with `size` records, then timed reading, overwriting and deleting random keys one by one,
+scanning all values and finding the transfer records of random accounts by their indexed email. File stores are kept
+in memory on tmpfs (`/dev/shm`) where it exists. Concurrent access is measured with threads and with processes
+sharing a store on disk, each of them reading and occasionally writing.
+
+    python -m benchmarks.stores --sizes 100 10000 1000000 --backends sqlite-disk > stores.json
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Barrier
+from typing import Callable
+
+from fastapi_sso.sso.base import OpenID
+
+from benchmarks import environment, percentiles
+from photom.models import Auth, DriveFile, TransferRecord
+from photom.store.base import Store
+from photom.store.file import FileStore
+from photom.store.sharded import ShardedSQLiteStore
+from photom.store.sqlite import SQLiteStore, close_pools
+
+TMPFS = "/dev/shm"
+FILL_BATCH = 10000
+WRITE_RATIO = 0.1
+RECORDS_PER_ACCOUNT = 10
+
+BACKENDS: dict[str, tuple[Callable[[str], Store], bool]] = {
+    # name: (factory taking a directory, whether the store is shared by all connections to it)
+    "sqlite-memory": (lambda directory: SQLiteStore(":memory:"), False),
+    "sqlite-disk": (lambda directory: SQLiteStore(os.path.join(directory, "bench.db")), True),
+    "sqlite-sharded": (lambda directory: ShardedSQLiteStore(os.path.join(directory, "bench.db")), True),
+    "file-memory": (FileStore, True),
+    "file-disk": (FileStore, True),
+}
+
+
+def make_auth(index: int) -> Auth:
+    """Create a sample record."""
+    email = f"user{index}@example.com"
+    return Auth(openid=OpenID(id=str(index), email=email), access_token="access", refresh_token="refresh")
+
+
+def make_record(index: int) -> TransferRecord:
+    """Create a sample transfer record of one of the accounts."""
+    file = DriveFile(id=str(index), name=f"{index}.jpg", mimeType="image/jpeg")
+    return TransferRecord(email=f"user{index // RECORDS_PER_ACCOUNT}@example.com", file=file, media_item_id=str(index))
+
+
+def fill(store: Store, size: int) -> None:
+    """Add `size` records to the store."""
+    for start in range(0, size, FILL_BATCH):
+        store.set_many(
+            {f"user{index}@example.com": make_auth(index) for index in range(start, min(size, start + FILL_BATCH))}
+        )
+
+
+def operations(name: str, run: Callable[[int], object], keys: list[int]) -> dict:
+    """Time an operation on each of the keys."""
+    latencies = []
+    start = time.perf_counter()
+    for index in keys:
+        began = time.perf_counter()
+        run(index)
+        latencies.append(time.perf_counter() - began)
+    seconds = time.perf_counter() - start
+    return {name: {"ops_per_second": len(keys) / seconds, **percentiles(latencies)}}
+
+
+def single(store: Store, size: int, count: int) -> dict:
+    """Time single-key operations and a full scan of a store filled with `size` records."""
+    fill(store, size)
+    sample = random.Random(size).sample(range(size), min(count, size))
+    results = operations("get", lambda index: store.get(f"user{index}@example.com", Auth), sample)
+    results |= operations("set", lambda index: store.set(f"user{index}@example.com", make_auth(index)), sample)
+    start = time.perf_counter()
+    scanned = sum(1 for _ in store.iter_values(Auth))
+    seconds = time.perf_counter() - start
+    results["iter_values"] = {"items": scanned, "seconds": seconds, "items_per_second": scanned / seconds}
+    results |= operations("delete", lambda index: store.delete(f"user{index}@example.com", Auth), sample)
+    for start in range(0, size, FILL_BATCH):
+        store.set_many({str(index): make_record(index) for index in range(start, min(size, start + FILL_BATCH))})
+    accounts = max(size // RECORDS_PER_ACCOUNT, 1)
+    sample = random.Random(size).sample(range(accounts), min(count, accounts))
+    results |= operations(
+        "find", lambda index: list(store.find(TransferRecord, email=f"user{index}@example.com")), sample
+    )
+    return results
+
+
+def _access(  # pylint: disable=too-many-arguments
+    backend: str, directory: str, size: int, count: int, seed: int, barrier: Barrier | None = None
+) -> tuple[list[float], float, float]:
+    """Read and occasionally write random keys of a shared store once all workers are ready, return the latencies and
+    when the worker started and finished."""
+    factory, _ = BACKENDS[backend]
+    generator = random.Random(seed)
+    latencies = []
+    with factory(directory) as store:
+        (barrier or _barrier).wait()  # type: ignore[union-attr]
+        started = time.monotonic()
+        for _ in range(count):
+            index = generator.randrange(size)
+            began = time.perf_counter()
+            if generator.random() < WRITE_RATIO:
+                store.set(f"user{index}@example.com", make_auth(index))
+            else:
+                store.get(f"user{index}@example.com", Auth)
+            latencies.append(time.perf_counter() - began)
+        finished = time.monotonic()
+    close_pools()
+    return latencies, started, finished
+
+
+_barrier: Barrier | None = None
+
+
+def _share_barrier(barrier: Barrier) -> None:
+    """Keep the barrier of the pool in a worker process."""
+    global _barrier  # pylint: disable=global-statement
+    _barrier = barrier
+
+
+def concurrent(  # pylint: disable=too-many-arguments
+    backend: str, directory: str, size: int, count: int, workers: int, processes: bool
+) -> dict:
+    """Time `workers` threads or processes accessing the same store at once, startup of the workers not included."""
+    arguments = [(backend, directory, size, count, seed) for seed in range(workers)]
+    if processes:
+        context = multiprocessing.get_context("spawn")
+        with context.Pool(workers, initializer=_share_barrier, initargs=(context.Barrier(workers),)) as pool:
+            results = pool.starmap(_access, arguments)
+    else:
+        barrier = threading.Barrier(workers)
+        with ThreadPoolExecutor(workers) as executor:
+            results = list(executor.map(lambda args: _access(*args, barrier=barrier), arguments))
+    seconds = max(finished for _, _, finished in results) - min(started for _, started, _ in results)
+    latencies = [latency for result, _, _ in results for latency in result]
+    return {"ops_per_second": len(latencies) / seconds, **percentiles(latencies)}
+
+
+def benchmark(backend: str, size: int, count: int, workers: int) -> dict:
+    """Run all measurements of a backend at a size."""
+    factory, shared = BACKENDS[backend]
+    parent = TMPFS if backend == "file-memory" else None
+    with tempfile.TemporaryDirectory(dir=parent) as directory:
+        with factory(directory) as store:
+            results = single(store, size, count)
+            fill(store, size)
+        if shared:
+            results["threads"] = concurrent(backend, directory, size, count, workers, processes=False)
+            results["processes"] = concurrent(backend, directory, size, count, workers, processes=True)
+        close_pools()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=list(BACKENDS))
+    parser.add_argument("--operations", type=int, default=1000, help="operations per measurement and worker")
+    parser.add_argument("--workers", type=int, default=4, help="threads and processes accessing a store at once")
+    args = parser.parse_args()
+    backends = [backend for backend in args.backends if backend != "file-memory" or os.path.isdir(TMPFS)]
+    print(
+        json.dumps(
+            {
+                "environment": environment(),
+                "stores": {
+                    backend: {str(size): benchmark(backend, size, args.operations, args.workers) for size in args.sizes}
+                    for backend in backends
+                },
+            },
+            indent=2,
+        )
+    )
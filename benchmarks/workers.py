@@ -0,0 +1,73 @@
+"""Measure how job throughput scales with the number of worker processes sharing the SQLite job queue.
+
+Every job keeps a core busy for a while, standing in for the CPU work of a transfer (TLS, hashing, JSON), and workers
+run in burst mode until the queue is empty. With enough cores, throughput grows close to linearly with processes.
+
+    python -m benchmarks.workers --jobs 200 --job-ms 20 --processes 1 2 4
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+
+from photom.models import Job
+from photom.store.jobs import JobQueue
+from photom.store.sqlite import close_pools
+from photom.worker import Worker
+
+
+def spin(milliseconds: float) -> None:
+    """Keep a core busy."""
+    end = time.perf_counter() + milliseconds / 1000
+    while time.perf_counter() < end:
+        pass
+
+
+async def work(database: str) -> int:
+    """Run jobs until the queue is empty, return how many."""
+
+    async def busy(job: Job) -> None:
+        spin(job.payload["milliseconds"])
+
+    return await Worker(JobQueue(database), {"busy": busy}).run(burst=True)
+
+
+def run_worker(database: str) -> int:
+    """Run a worker process."""
+    try:
+        return asyncio.run(work(database))
+    finally:
+        close_pools()
+
+
+def run(processes: int, jobs: int, job_ms: float) -> dict:
+    """Queue jobs and time worker processes running all of them."""
+    with tempfile.TemporaryDirectory() as directory:
+        database = os.path.join(directory, "jobs.db")
+        queue = JobQueue(database)
+        for _ in range(jobs):
+            queue.enqueue("busy", {"milliseconds": job_ms})
+        close_pools()
+        with multiprocessing.get_context("spawn").Pool(processes) as pool:
+            start = time.perf_counter()
+            counts = pool.map(run_worker, [database] * processes)
+            seconds = time.perf_counter() - start
+        close_pools()
+    return {"jobs": sum(counts), "seconds": seconds, "jobs_per_second": sum(counts) / seconds}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=200)
+    parser.add_argument("--job-ms", type=float, default=20.0)
+    parser.add_argument("--processes", type=int, nargs="+", default=[1, 2, 4])
+    args = parser.parse_args()
+    results = {str(count): run(count, args.jobs, args.job_ms) for count in args.processes}
+    single = results[str(args.processes[0])]["jobs_per_second"] / args.processes[0]
+    for count, result in results.items():
+        result["scaling_efficiency"] = result["jobs_per_second"] / (single * int(count))
+    print(json.dumps({"cpus": os.cpu_count(), "processes": results}, indent=2))
@@ -1,39 +1,115 @@
 """Google SSO Auth routes"""
 
-from fastapi import APIRouter, Request, Response, status
-from fastapi.responses import RedirectResponse
+import json
+import time
+from functools import lru_cache, partial
+from typing import Any, AsyncIterable, AsyncIterator, Callable
+
+import httpx
+from fastapi import APIRouter, Depends, Query, Request, Response, status
+from fastapi.responses import RedirectResponse, StreamingResponse
+from fastapi_sso.sso.base import DiscoveryDocument, OpenID
 from fastapi_sso.sso.google import GoogleSSO
 from oauthlib.oauth2.rfc6749.errors import OAuth2Error
 
 import photom.exceptions
-from photom.config import Config
-from photom.models import Auth
+from photom.config import Config, Settings
+from photom.models import Auth, BaseModel
+from photom.transfer.limits import API_EXTENSION
 
 config = Config()
 
+STREAM_CHUNK_SIZE = 64
+
 auth = APIRouter(prefix="/auth", tags=["auth"])
 
 
-def get_google_sso() -> GoogleSSO:
-    """Google SSO instance with config values"""
-    return GoogleSSO(
+GOOGLE_SCOPES = [
+    "openid",
+    "email",
+    "profile",
+    "https://www.googleapis.com/auth/photoslibrary",
+    "https://www.googleapis.com/auth/drive",
+]
+
+
+def get_http_client(request: Request) -> httpx.AsyncClient:
+    """Pooled client shared by all requests, opened for the lifespan of the application"""
+    return request.app.state.http_client
+
+
+class LimitedGoogleSSO(GoogleSSO):
+    """Google SSO sending its requests to Google through the shared, rate limited client of the application"""
+
+    def __init__(self, client: httpx.AsyncClient, *args, **kwargs):
+        """Initialize the SSO of a single login flow"""
+        super().__init__(*args, **kwargs)
+        self.client = client
+
+    async def get_discovery_document(self) -> DiscoveryDocument:
+        """Get document containing handy urls, cached for all login flows"""
+        return await config.discovery_cache.get(self.client, self.discovery_url)  # type: ignore[return-value]
+
+    async def process_login(
+        self,
+        code: str,
+        request: Request,
+        *,
+        params: dict[str, Any] | None = None,
+        additional_headers: dict[str, Any] | None = None,
+        redirect_uri: str | None = None,
+    ) -> OpenID | None:
+        """Exchange the code for tokens and get user info, as `GoogleSSO` does but with the limited client.
+        Instances are used as context managers, which start every login flow with a new OAuth client."""
+        url = request.url
+        scheme = url.scheme if self.allow_insecure_http else "https"
+        current_url = str(url) if self.allow_insecure_http else str(url).replace("http://", "https://")
+        token_url, headers, body = self.oauth_client.prepare_token_request(
+            await self.token_endpoint,
+            authorization_response=current_url,
+            redirect_url=redirect_uri or self.redirect_uri or f"{scheme}://{url.netloc}{url.path}",
+            code=code,
+            **(params or {}),
+        )  # type: ignore
+        if token_url is None:  # pragma: no cover
+            return None
+        headers.update((additional_headers or {}) | (self.additional_headers or {}))
+        return await self.openid_from_response(await self._exchange(token_url, headers, body))
+
+    async def _exchange(self, token_url: str, headers: dict[str, Any], body: str) -> dict[str, Any]:
+        """Get tokens at the token endpoint, then the user info with them"""
+        basic = httpx.BasicAuth(self.client_id, self.client_secret)
+        extensions = {API_EXTENSION: "oauth"}
+        response = await self.client.post(token_url, headers=headers, content=body, auth=basic, extensions=extensions)
+        content = response.json()
+        self._refresh_token = content.get("refresh_token")
+        self.oauth_client.parse_request_body_response(json.dumps(content))
+        uri, headers, _ = self.oauth_client.add_token(await self.userinfo_endpoint)
+        response = await self.client.get(uri, headers=headers, extensions=extensions)
+        return response.json()
+
+
+@lru_cache(maxsize=1)
+def _google_sso_factory(settings: Settings) -> Callable[[httpx.AsyncClient], LimitedGoogleSSO]:
+    """Google SSO factory bound to the given settings, resolved again whenever the config is reloaded"""
+    return partial(
+        LimitedGoogleSSO,
         client_id=config.google_client_id,
         client_secret=config.google_client_secret,
-        allow_insecure_http=config.oauthlib_insecure_transport,
-        scope=[
-            "openid",
-            "email",
-            "profile",
-            "https://www.googleapis.com/auth/photoslibrary",
-            "https://www.googleapis.com/auth/drive",
-        ],
+        allow_insecure_http=settings.oauthlib_insecure_transport,
+        scope=GOOGLE_SCOPES,
     )
 
 
+def get_google_sso(client: httpx.AsyncClient) -> LimitedGoogleSSO:
+    """Google SSO instance with config values, a new one for every login flow as it keeps the flow state"""
+    return _google_sso_factory(config.settings)(client)
+
+
 @auth.get("/login")
-async def login(request: Request, state: str | None = None):
+async def login(request: Request, state: str | None = None, client: httpx.AsyncClient = Depends(get_http_client)):
     """Redirect to Google login page"""
-    with get_google_sso() as sso:
+    with get_google_sso(client) as sso:
         return await sso.get_login_redirect(
             redirect_uri=request.url_for("login_callback"),
             state=state,
@@ -42,31 +118,59 @@ async def login(request: Request, state: str | None = None):
 
 
 @auth.get("/callback", response_model=Auth)
-async def login_callback(request: Request, state: str | None = None) -> Auth | RedirectResponse:
+async def login_callback(
+    request: Request, state: str | None = None, client: httpx.AsyncClient = Depends(get_http_client)
+) -> Auth | RedirectResponse:
     """Process login response from Google and return user info"""
-    with get_google_sso() as sso:
+    with get_google_sso(client) as sso:
         try:
             openid = await sso.verify_and_process(request)
         except OAuth2Error as error:
             raise photom.exceptions.NotAuthorized("Login using Google SSO failed") from error
-        auth_info = Auth(openid=openid, access_token=sso.access_token, refresh_token=sso.refresh_token)
-        with config.get_store_backend() as store:
-            store.set(auth_info.openid.email, auth_info)
+        expires_in = sso.oauth_client.expires_in
+        auth_info = Auth(
+            openid=openid,
+            access_token=sso.access_token,
+            refresh_token=sso.refresh_token,
+            expires_at=time.time() + int(expires_in) if expires_in else None,
+        )
+        async with config.get_async_store_backend() as store:
+            await store.set(auth_info.openid.email, auth_info)
         if state:
             return RedirectResponse(url=state)
         return auth_info
 
 
-@auth.get("/")
-async def list_accounts() -> list[Auth]:
-    """List all logins currently present in the store"""
-    with config.get_store_backend() as store:
-        return list(store.iter_values(Auth))
+async def stream_json_array(values: AsyncIterable[BaseModel]) -> AsyncIterator[str]:
+    """Serialize models into a JSON array piece by piece, several models per chunk"""
+    separator = "["
+    chunk: list[str] = []
+    async for value in values:
+        chunk.append(separator)
+        chunk.append(value.model_dump_json())
+        separator = ","
+        if len(chunk) >= 2 * STREAM_CHUNK_SIZE:
+            yield "".join(chunk)
+            chunk.clear()
+    chunk.append("]" if separator == "," else "[]")
+    yield "".join(chunk)
+
+
+@auth.get("/", response_model=list[Auth])
+async def list_accounts(limit: int | None = Query(default=None, ge=1), after: str | None = None) -> StreamingResponse:
+    """List logins present in the store ordered by email, use `after` with the last email seen to get the next page"""
+
+    async def stream() -> AsyncIterator[str]:
+        async with config.get_async_store_backend() as store:
+            async for chunk in stream_json_array(store.iter_values(Auth, limit=limit, after_key=after)):
+                yield chunk
+
+    return StreamingResponse(stream(), media_type="application/json")
 
 
 @auth.delete("/{email}")
 async def delete_account(email: str):
     """Delete a stored login identified by its email address"""
-    with config.get_store_backend() as store:
-        store.delete(email, Auth)
+    async with config.get_async_store_backend() as store:
+        await store.delete(email, Auth)
         return Response(status_code=status.HTTP_204_NO_CONTENT)
@@ -0,0 +1,41 @@
+"""Background job routes, the API only queues jobs and worker processes run them"""
+
+import asyncio
+
+from fastapi import APIRouter, status
+
+import photom.exceptions
+from photom.config import Config
+from photom.models import Auth, Job
+from photom.store.jobs import JobQueue
+from photom.worker import SYNC
+
+config = Config()
+
+jobs = APIRouter(prefix="/jobs", tags=["jobs"])
+
+
+def _queue() -> JobQueue:
+    """Configured job queue"""
+    if config.job_queue is None:
+        raise photom.exceptions.ServiceUnavailable("Jobs need the SQLite store with its database in a file")
+    return config.job_queue
+
+
+@jobs.post("/sync/{email}", response_model=Job, status_code=status.HTTP_202_ACCEPTED)
+async def enqueue_sync(email: str) -> Job:
+    """Queue a sync of the Drive of a stored login to Photos, a sync already waiting for the account is reused"""
+    queue = _queue()
+    async with config.get_async_store_backend() as store:
+        if await store.get(email, Auth) is None:
+            raise photom.exceptions.NotFound(f"There is no login of {email}")
+    return await asyncio.to_thread(queue.enqueue, SYNC, {"email": email}, f"{SYNC}:{email}")
+
+
+@jobs.get("/{job_id}", response_model=Job)
+async def get_job(job_id: int) -> Job:
+    """Get the status of a job"""
+    job = await asyncio.to_thread(_queue().get, job_id)
+    if job is None:
+        raise photom.exceptions.NotFound(f"There is no job {job_id}")
+    return job
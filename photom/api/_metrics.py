@@ -0,0 +1,59 @@
+"""Metrics route and request timing, see `photom.metrics`"""
+
+import asyncio
+import time
+
+from fastapi import APIRouter, Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+import photom.exceptions
+from photom.config import Config
+from photom.metrics import CONTENT_TYPE, ENABLED, histogram, render
+
+config = Config()
+
+REQUEST_SECONDS = histogram(
+    "photom_http_request_seconds", "Duration of requests served by the API", ("method", "route", "status")
+)
+
+metrics = APIRouter(tags=["metrics"])
+
+
+class MetricsMiddleware:  # pylint: disable=too-few-public-methods
+    """Times every HTTP request, labelled by the path template of its route so that paths with IDs share a label"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = 500
+
+        async def send_status(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            route = scope.get("route")
+            REQUEST_SECONDS.labels(scope["method"], getattr(route, "path", "unmatched"), str(status)).observe(
+                time.perf_counter() - start
+            )
+
+
+@metrics.get("/metrics", include_in_schema=False)
+async def get_metrics() -> Response:
+    """Metrics of the API process in the Prometheus text format"""
+    if not ENABLED:
+        raise photom.exceptions.ServiceUnavailable(
+            "Metrics need prometheus_client, install photom with the metrics extra"
+        )
+    # resolve the queue, so that its collector reports jobs even before the first job request
+    _ = config.job_queue
+    return Response(await asyncio.to_thread(render), media_type=CONTENT_TYPE)
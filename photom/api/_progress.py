@@ -0,0 +1,45 @@
+"""Progress routes, clients follow syncs run by worker processes with server-sent events instead of polling"""
+
+from typing import AsyncIterator
+
+from fastapi import APIRouter
+from fastapi.responses import StreamingResponse
+
+from photom.config import Config
+from photom.models import AccountProgress
+from photom.progress import BUS
+
+config = Config()
+
+KEEPALIVE_SECONDS = 15.0
+
+progress = APIRouter(prefix="/progress", tags=["progress"])
+
+
+def server_sent_event(state: AccountProgress) -> str:
+    """Format the state of an account as a `progress` event"""
+    return f"event: progress\ndata: {state.model_dump_json()}\n\n"
+
+
+@progress.get("/", response_model=list[AccountProgress])
+async def list_progress() -> list[AccountProgress]:
+    """Get the latest progress of syncs of every account, ordered by email"""
+    return [BUS.latest[email] for email in sorted(BUS.latest)]
+
+
+@progress.get("/stream")
+async def stream_progress() -> StreamingResponse:
+    """Stream progress of syncs as server-sent `progress` events, the latest state of every account first, then the
+    states of accounts that changed, at most once every `PROGRESS_INTERVAL` seconds. States published in between are
+    dropped, so slow clients skip to the latest state instead of falling behind."""
+
+    async def stream() -> AsyncIterator[str]:
+        with BUS.subscribe(config.progress_interval) as subscription:
+            while True:
+                states = await subscription.get(KEEPALIVE_SECONDS)
+                # comments keep idle connections open through proxies
+                yield "".join(server_sent_event(state) for state in states) if states else ": keepalive\n\n"
+
+    return StreamingResponse(
+        stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
@@ -1,20 +1,56 @@
 """ASGI Application for photom."""
 
+import asyncio
+from contextlib import asynccontextmanager, suppress
+from typing import AsyncIterator
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
-from photom.config import EnvProxy
+from photom.config import Config, EnvProxy
+from photom.progress import BUS, relay
+from photom.store.sqlite import close_pools
+from photom.store.threaded import shutdown_executor
 from photom.version import __version__
 
 from ._auth import auth
-
-app = FastAPI(title="Photom API", version=__version__)
+from ._jobs import jobs
+from ._metrics import MetricsMiddleware, metrics
+from ._progress import progress
+
+
+@asynccontextmanager
+async def lifespan(application: FastAPI) -> AsyncIterator[None]:
+    """Open the store once on startup so that pooled connections are warm, and the HTTP client shared by all requests
+    to Google, release them on shutdown. Progress written by worker processes is relayed to streaming clients."""
+    config = Config()
+    async with config.get_async_store_backend():
+        pass
+    log = config.progress_log
+    relaying = asyncio.create_task(relay(BUS, log, config.progress_interval)) if log is not None else None
+    async with config.get_http_client() as client:
+        application.state.http_client = client
+        yield
+    if relaying is not None:
+        relaying.cancel()
+        with suppress(asyncio.CancelledError):
+            await relaying
+    shutdown_executor()
+    close_pools()
+
+
+app = FastAPI(title="Photom API", version=__version__, lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"], allow_credentials=True
 )
 
+app.add_middleware(MetricsMiddleware)
+
 app.include_router(auth)
+app.include_router(jobs)
+app.include_router(metrics)
+app.include_router(progress)
 
 if __name__ == "__main__":
     import uvicorn
@@ -1,20 +1,116 @@
-"""Configuration"""
+"""Configuration
+Environment is read once into an immutable `Settings` snapshot, everything built from it (the store factory, the store
+cache) is resolved on first use and kept until `Config.reload()` is called."""
 
 import logging
 import warnings
+from functools import cached_property, partial
 from importlib import import_module
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Any, Callable
 
+import httpx
 from dotenv import load_dotenv
 from env_proxy import EnvProxy
+from pydantic import BaseModel, ConfigDict, Field, field_validator
+
+from photom.store.cached import CachedStore, StoreCache
+from photom.store.codec import CODECS, get_codec
+from photom.store.coherence import ChangeWatcher, MultiChangeWatcher
+from photom.store.dedup import DedupIndex
+from photom.store.instrumented import InstrumentedStore
+from photom.store.jobs import JobQueue
+from photom.store.progress import ProgressLog
+from photom.store.sharded import ShardedSQLiteStore, shard_path
+from photom.store.sqlite import SQLiteStore
+from photom.store.threaded import ThreadedStore
+from photom.transfer.http import DiscoveryCache, create_client
+from photom.transfer.limits import RateLimiter
 
 if TYPE_CHECKING:
-    from photom.store.base import Store  # pragma: no cover
+    from photom.store.base import AsyncStore, Store  # pragma: no cover
 
 logger = logging.getLogger(__name__)
 
 
-class Config:
+class Settings(BaseModel):
+    """Validated, immutable snapshot of the configuration"""
+
+    model_config = ConfigDict(frozen=True)
+
+    store_backend: str = "photom.store.sqlite.SQLiteStore"
+    store_backend_path: str = ":memory:"
+    store_codec: str = "json"
+    store_shards: int = Field(default=4, ge=1)
+    store_cache_size: int = Field(default=0, ge=0)
+    store_cache_ttl: float | None = Field(default=None, gt=0)
+    store_cache_poll_interval: float = Field(default=0.0, ge=0)
+    store_threads: int = Field(default=8, ge=1)
+    transfer_concurrency: int = Field(default=8, ge=1)
+    transfer_chunk_size: int = Field(default=4 * 1024 * 1024, ge=1)
+    transfer_batch_wait: float = Field(default=1.0, gt=0)
+    job_lease_seconds: float = Field(default=60.0, gt=0)
+    job_max_attempts: int = Field(default=3, ge=1)
+    worker_poll_interval: float = Field(default=1.0, gt=0)
+    progress_interval: float = Field(default=0.5, gt=0)
+    sqlite_pool_size: int = Field(default=8, ge=0)
+    sqlite_synchronous: str | None = Field(default=None, pattern=r"^(?i:OFF|NORMAL|FULL|EXTRA|[0-3])$")
+    sqlite_cache_size: int | None = None
+    sqlite_mmap_size: int | None = Field(default=None, ge=0)
+    google_client_id: str | None = None
+    google_client_secret: str | None = None
+    google_rate_limit: float = Field(default=10.0, gt=0)
+    google_concurrency: int = Field(default=8, ge=1)
+    google_discovery_ttl: float = Field(default=3600.0, ge=0)
+    http_max_connections: int = Field(default=100, ge=1)
+    http_max_keepalive: int = Field(default=20, ge=0)
+    http_keepalive_expiry: float = Field(default=30.0, ge=0)
+    oauthlib_insecure_transport: bool = False
+
+    @field_validator("store_codec")
+    @classmethod
+    def _validate_codec(cls, value: str) -> str:
+        """Only accept known codecs"""
+        if value not in CODECS:
+            raise ValueError(f"Unknown codec {value}, choose one of {', '.join(CODECS)}")
+        return value
+
+    @classmethod
+    def from_env(cls) -> "Settings":
+        """Read settings from environment, unset variables fall back to defaults"""
+        values = {
+            "store_backend": EnvProxy.get_str("STORE_BACKEND"),
+            "store_backend_path": EnvProxy.get_str("STORE_BACKEND_PATH"),
+            "store_codec": EnvProxy.get_str("STORE_CODEC"),
+            "store_shards": EnvProxy.get_int("STORE_SHARDS"),
+            "store_cache_size": EnvProxy.get_int("STORE_CACHE_SIZE"),
+            "store_cache_ttl": EnvProxy.get_float("STORE_CACHE_TTL"),
+            "store_cache_poll_interval": EnvProxy.get_float("STORE_CACHE_POLL_INTERVAL"),
+            "store_threads": EnvProxy.get_int("STORE_THREADS"),
+            "transfer_concurrency": EnvProxy.get_int("TRANSFER_CONCURRENCY"),
+            "transfer_chunk_size": EnvProxy.get_int("TRANSFER_CHUNK_SIZE"),
+            "transfer_batch_wait": EnvProxy.get_float("TRANSFER_BATCH_WAIT"),
+            "job_lease_seconds": EnvProxy.get_float("JOB_LEASE_SECONDS"),
+            "job_max_attempts": EnvProxy.get_int("JOB_MAX_ATTEMPTS"),
+            "worker_poll_interval": EnvProxy.get_float("WORKER_POLL_INTERVAL"),
+            "progress_interval": EnvProxy.get_float("PROGRESS_INTERVAL"),
+            "sqlite_pool_size": EnvProxy.get_int("SQLITE_POOL_SIZE"),
+            "sqlite_synchronous": EnvProxy.get_str("SQLITE_SYNCHRONOUS"),
+            "sqlite_cache_size": EnvProxy.get_int("SQLITE_CACHE_SIZE"),
+            "sqlite_mmap_size": EnvProxy.get_int("SQLITE_MMAP_SIZE"),
+            "google_client_id": EnvProxy.get_str("GOOGLE_CLIENT_ID"),
+            "google_client_secret": EnvProxy.get_str("GOOGLE_CLIENT_SECRET"),
+            "google_rate_limit": EnvProxy.get_float("GOOGLE_RATE_LIMIT"),
+            "google_concurrency": EnvProxy.get_int("GOOGLE_CONCURRENCY"),
+            "google_discovery_ttl": EnvProxy.get_float("GOOGLE_DISCOVERY_TTL"),
+            "http_max_connections": EnvProxy.get_int("HTTP_MAX_CONNECTIONS"),
+            "http_max_keepalive": EnvProxy.get_int("HTTP_MAX_KEEPALIVE"),
+            "http_keepalive_expiry": EnvProxy.get_float("HTTP_KEEPALIVE_EXPIRY"),
+            "oauthlib_insecure_transport": bool(EnvProxy.get_int("OAUTHLIB_INSECURE_TRANSPORT")),
+        }
+        return cls(**{key: value for key, value in values.items() if value is not None})
+
+
+class Config:  # pylint: disable=too-many-public-methods
     """Configuration class for photom."""
 
     _singleton: "Config | None" = None
@@ -24,41 +120,236 @@ class Config:
             cls._singleton = super().__new__(cls)
         return cls._singleton
 
-    def __init__(self):
+    @cached_property
+    def settings(self) -> Settings:
+        """Settings resolved from environment (and `.env`) on first use"""
         load_dotenv()
+        return Settings.from_env()
+
+    def reload(self) -> None:
+        """Drop resolved settings and everything built from them, so that they are resolved again on next use."""
+        for name in (
+            "settings",
+            "store_factory",
+            "store_cache",
+            "dedup_index",
+            "job_queue",
+            "progress_log",
+            "rate_limiter",
+            "discovery_cache",
+        ):
+            self.__dict__.pop(name, None)
 
     @property
     def store_backend(self) -> str:
         """Store backend import name"""
-        return EnvProxy.get_str("STORE_BACKEND") or "photom.store.sqlite.SQLiteStore"
+        return self.settings.store_backend
 
     @property
     def store_backend_path(self) -> str:
         """Store backend path"""
-        return EnvProxy.get_str("STORE_BACKEND_PATH") or ":memory:"
+        return self.settings.store_backend_path
+
+    @cached_property
+    def store_factory(self) -> Callable[[], "Store"]:
+        """Factory of store backends, the backend class is imported and its arguments are prepared only once.
+        Backends are instrumented, see `photom.store.instrumented`. SQLite backends track their changes for caches of
+        other processes when the cache is enabled, see `photom.store.coherence`."""
+        settings = self.settings
+        if settings.store_backend == "photom.store.sqlite.SQLiteStore" and settings.store_backend_path == ":memory:":
+            warnings.warn("Using in-memory SQLite store. Data will not be saved.", UserWarning)
+
+        module, cls = settings.store_backend.rsplit(".", 1)
+        backend = getattr(import_module(module), cls)
+        codec = get_codec(settings.store_codec)
+        factory: Callable[[], "Store"]
+        if issubclass(backend, (SQLiteStore, ShardedSQLiteStore)):
+            factory = partial(
+                backend,
+                settings.store_backend_path,
+                pool_size=settings.sqlite_pool_size,
+                pragmas=self.sqlite_pragmas,
+                codec=codec,
+                track_changes=self.store_cache is not None,
+            )
+            if issubclass(backend, ShardedSQLiteStore):
+                factory = partial(factory, shards=settings.store_shards)
+        else:
+            factory = partial(backend, settings.store_backend_path, codec=codec)
+        if self.store_cache is None:
+            return lambda: InstrumentedStore(factory(), cls)
+        cache: StoreCache = self.store_cache
+        return lambda: CachedStore(InstrumentedStore(factory(), cls), cache)
 
     def get_store_backend(self) -> "Store":
         """Get the store backend."""
-        if self.store_backend == "photom.store.sqlite.SQLiteStore" and self.store_backend_path == ":memory:":
-            warnings.warn("Using in-memory SQLite store. Data will not be saved.", UserWarning)
+        return self.store_factory()
+
+    @property
+    def store_shards(self) -> int:
+        """Number of databases a sharded SQLite store spreads values over"""
+        return self.settings.store_shards
+
+    @property
+    def store_codec(self) -> str:
+        """Name of the codec serializing models in the store, json or msgpack"""
+        return self.settings.store_codec
+
+    @property
+    def store_cache_size(self) -> int:
+        """Number of model instances cached in memory, 0 disables the cache"""
+        return self.settings.store_cache_size
+
+    @property
+    def store_cache_ttl(self) -> float | None:
+        """Seconds a cached model instance is valid for, unset means until it is evicted"""
+        return self.settings.store_cache_ttl
+
+    @cached_property
+    def store_cache(self) -> StoreCache | None:
+        """Process-wide cache shared by all store backends created by this config, kept coherent with writes of other
+        processes to a SQLite database file"""
+        if not self.store_cache_size:
+            return None
+        watcher: ChangeWatcher | MultiChangeWatcher | None = None
+        interval = self.settings.store_cache_poll_interval
+        if self._sqlite_file_store and issubclass(self._store_backend_class, ShardedSQLiteStore):
+            databases = [shard_path(self.store_backend_path, index) for index in range(self.store_shards)]
+            watcher = MultiChangeWatcher(databases, interval, self.sqlite_pool_size)
+        elif self._sqlite_file_store:
+            watcher = ChangeWatcher(self.store_backend_path, interval, self.sqlite_pool_size)
+        return StoreCache(self.store_cache_size, self.store_cache_ttl, watcher)
+
+    def get_async_store_backend(self) -> "AsyncStore":
+        """Get the store backend wrapped for use from asyncio code."""
+        return ThreadedStore(self.store_factory(), max_workers=self.settings.store_threads)
+
+    @cached_property
+    def dedup_index(self) -> DedupIndex | None:
+        """Index of content transferred before, kept in the database of the SQLite store, None with other backends or
+        an in-memory database"""
+        if not self._sqlite_file_store:
+            return None
+        return DedupIndex(self.store_backend_path, pool_size=self.sqlite_pool_size, pragmas=self.sqlite_pragmas)
+
+    @cached_property
+    def job_queue(self) -> JobQueue | None:
+        """Queue of background jobs, kept in the database of the SQLite store so that it is shared by the API and all
+        worker processes, None with other backends or an in-memory database"""
+        if not self._sqlite_file_store:
+            return None
+        return JobQueue(
+            self.store_backend_path,
+            pool_size=self.sqlite_pool_size,
+            pragmas=self.sqlite_pragmas,
+            lease_seconds=self.settings.job_lease_seconds,
+            max_attempts=self.settings.job_max_attempts,
+        )
 
+    @cached_property
+    def progress_log(self) -> ProgressLog | None:
+        """Latest progress of syncs, kept in the database of the SQLite store so that worker processes share it with the
+        API, None with other backends or an in-memory database"""
+        if not self._sqlite_file_store:
+            return None
+        return ProgressLog(self.store_backend_path, pool_size=self.sqlite_pool_size, pragmas=self.sqlite_pragmas)
+
+    @property
+    def _store_backend_class(self) -> type:
+        """Class of the store backend"""
         module, cls = self.store_backend.rsplit(".", 1)
-        return getattr(import_module(module), cls)(self.store_backend_path)
+        return getattr(import_module(module), cls)
+
+    @property
+    def _sqlite_file_store(self) -> bool:
+        """Whether the store backend is SQLite, sharded or not, with its main database in a file"""
+        return (
+            issubclass(self._store_backend_class, (SQLiteStore, ShardedSQLiteStore))
+            and self.store_backend_path != ":memory:"
+        )
+
+    @property
+    def store_threads(self) -> int:
+        """Number of threads running blocking store calls for asyncio code"""
+        return self.settings.store_threads
+
+    @property
+    def transfer_concurrency(self) -> int:
+        """Maximum number of files transferred at once"""
+        return self.settings.transfer_concurrency
+
+    @property
+    def transfer_chunk_size(self) -> int:
+        """Bytes of a file each transfer holds in memory, uploads are sent in chunks of this size"""
+        return self.settings.transfer_chunk_size
+
+    @property
+    def transfer_batch_wait(self) -> float:
+        """Seconds an upload waits for others to create media items in one batch with"""
+        return self.settings.transfer_batch_wait
+
+    @property
+    def worker_poll_interval(self) -> float:
+        """Seconds an idle worker waits before looking for queued jobs again"""
+        return self.settings.worker_poll_interval
+
+    @property
+    def progress_interval(self) -> float:
+        """Seconds between progress updates of an account pushed to a client, at least"""
+        return self.settings.progress_interval
+
+    @property
+    def sqlite_pool_size(self) -> int:
+        """Maximum number of idle SQLite connections kept per database"""
+        return self.settings.sqlite_pool_size
+
+    @property
+    def sqlite_pragmas(self) -> dict[str, Any]:
+        """Pragmas applied to every new SQLite connection, unset ones fall back to the store defaults"""
+        return {
+            "synchronous": self.settings.sqlite_synchronous,
+            "cache_size": self.settings.sqlite_cache_size,
+            "mmap_size": self.settings.sqlite_mmap_size,
+        }
 
     @property
     def google_client_id(self) -> str:
         """Google client ID"""
-        return EnvProxy.get_str_strict("GOOGLE_CLIENT_ID")
+        if self.settings.google_client_id is None:
+            raise ValueError("No value for key GOOGLE_CLIENT_ID in environment")
+        return self.settings.google_client_id
 
     @property
     def google_client_secret(self) -> str:
         """Google client secret"""
-        return EnvProxy.get_str_strict("GOOGLE_CLIENT_SECRET")
+        if self.settings.google_client_secret is None:
+            raise ValueError("No value for key GOOGLE_CLIENT_SECRET in environment")
+        return self.settings.google_client_secret
+
+    @cached_property
+    def rate_limiter(self) -> RateLimiter:
+        """Process-wide limiter of requests to Google APIs, per account and API"""
+        return RateLimiter(rate=self.settings.google_rate_limit, concurrency=self.settings.google_concurrency)
+
+    @cached_property
+    def discovery_cache(self) -> DiscoveryCache:
+        """Process-wide cache of OpenID discovery documents"""
+        return DiscoveryCache(self.settings.google_discovery_ttl)
+
+    def get_http_client(self) -> httpx.AsyncClient:
+        """Get a new pooled client for requests to Google APIs, meant to be shared for as long as the application
+        runs."""
+        return create_client(
+            self.rate_limiter,
+            max_connections=self.settings.http_max_connections,
+            max_keepalive=self.settings.http_max_keepalive,
+            keepalive_expiry=self.settings.http_keepalive_expiry,
+        )
 
     @property
     def oauthlib_insecure_transport(self) -> bool:
         """OAuthlib insecure transport"""
-        return bool(EnvProxy.get_int("OAUTHLIB_INSECURE_TRANSPORT"))
+        return self.settings.oauthlib_insecure_transport
 
 
-__all__ = ["Config"]
+__all__ = ["Config", "Settings"]
@@ -8,3 +8,17 @@ class NotAuthorized(HTTPException):
 
     def __init__(self, detail: str = "Not authorized"):
         super().__init__(status_code=status.HTTP_401_UNAUTHORIZED, detail=detail)
+
+
+class NotFound(HTTPException):
+    """Not found - 404"""
+
+    def __init__(self, detail: str = "Not found"):
+        super().__init__(status_code=status.HTTP_404_NOT_FOUND, detail=detail)
+
+
+class ServiceUnavailable(HTTPException):
+    """Service unavailable - 503"""
+
+    def __init__(self, detail: str = "Service unavailable"):
+        super().__init__(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=detail)
@@ -0,0 +1,143 @@
+"""Process-wide Prometheus metrics, kept by `prometheus_client` when photom is installed with the `metrics` extra.
+Metrics are registered in the default registry of `prometheus_client` and rendered on every scrape, by `/metrics` of the
+API and by the metrics server of worker processes. Values that are cheaper to read than to keep up to date, like the
+number of queued jobs, are set by collectors right before every scrape. Without `prometheus_client`, metrics record
+nothing and are not served."""
+
+import logging
+import threading
+import weakref
+from contextlib import contextmanager
+from typing import Callable, Iterator
+
+try:
+    import prometheus_client
+    from prometheus_client.metrics_core import Metric
+except ImportError:  # pragma: no cover
+    prometheus_client = None  # type: ignore[assignment]
+
+logger = logging.getLogger(__name__)
+
+ENABLED = prometheus_client is not None
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class _Disabled:
+    """Metric recording nothing, used when `prometheus_client` is not installed."""
+
+    def labels(self, *_values: str) -> "_Disabled":
+        """The metric itself, whatever the label values."""
+        return self
+
+    def inc(self, amount: float = 1.0) -> None:
+        """Do nothing."""
+
+    def set(self, value: float) -> None:
+        """Do nothing."""
+
+    def observe(self, value: float) -> None:
+        """Do nothing."""
+
+    @contextmanager
+    def time(self) -> Iterator[None]:
+        """Run the block."""
+        yield
+
+
+class _Collectors:
+    """Callbacks setting metrics right before every scrape, registered before any metric so that they run first."""
+
+    def __init__(self) -> None:
+        """Initialize without any callbacks."""
+        self._callbacks: list[Callable[[], Callable[[], None] | None]] = []
+        self._lock = threading.Lock()
+
+    def add(self, callback: Callable[[], None]) -> None:
+        """Call the callback before every scrape. Callbacks that are methods are only kept as long as their object is
+        alive."""
+        with self._lock:
+            if hasattr(callback, "__self__"):
+                self._callbacks.append(weakref.WeakMethod(callback))  # type: ignore[arg-type]
+            else:
+                self._callbacks.append(lambda: callback)
+
+    def describe(self) -> list["Metric"]:
+        """No metrics of their own, the callbacks set registered ones."""
+        return []
+
+    def collect(self) -> Iterator["Metric"]:
+        """Run the callbacks, a failing one is logged and skipped."""
+        with self._lock:
+            self._callbacks = references = [reference for reference in self._callbacks if reference() is not None]
+        for reference in references:
+            callback = reference()
+            if callback is None:
+                continue
+            try:
+                callback()
+            except Exception:  # pylint: disable=broad-exception-caught
+                logger.exception("Collecting metrics failed")
+        yield from ()
+
+
+_COLLECTORS = _Collectors()
+if prometheus_client is not None:
+    # creation timestamps of every child would double the series scraped, rates do not need them
+    prometheus_client.disable_created_metrics()
+    prometheus_client.REGISTRY.register(_COLLECTORS)  # type: ignore[arg-type]
+
+
+def counter(name: str, documentation: str, labels: tuple[str, ...] = ()) -> "prometheus_client.Counter":
+    """Register a counter."""
+    if prometheus_client is None:  # pragma: no cover
+        return _Disabled()  # type: ignore[return-value]
+    return prometheus_client.Counter(name, documentation, labels)
+
+
+def gauge(name: str, documentation: str, labels: tuple[str, ...] = ()) -> "prometheus_client.Gauge":
+    """Register a gauge."""
+    if prometheus_client is None:  # pragma: no cover
+        return _Disabled()  # type: ignore[return-value]
+    return prometheus_client.Gauge(name, documentation, labels)
+
+
+def histogram(
+    name: str, documentation: str, labels: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS
+) -> "prometheus_client.Histogram":
+    """Register a histogram with the upper bounds of its buckets."""
+    if prometheus_client is None:  # pragma: no cover
+        return _Disabled()  # type: ignore[return-value]
+    return prometheus_client.Histogram(name, documentation, labels, buckets=buckets)
+
+
+def add_collector(collector: Callable[[], None]) -> None:
+    """Call the collector before every scrape, see `_Collectors.add`."""
+    _COLLECTORS.add(collector)
+
+
+def render() -> bytes:
+    """All metrics of the process in the Prometheus text format."""
+    if prometheus_client is None:  # pragma: no cover
+        raise RuntimeError("prometheus_client is not installed, install photom with the metrics extra")
+    return prometheus_client.generate_latest()
+
+
+def start_server(host: str, port: int) -> None:
+    """Serve the metrics of the process over HTTP from a daemon thread, for processes without an API of their own."""
+    if prometheus_client is None:  # pragma: no cover
+        raise RuntimeError("prometheus_client is not installed, install photom with the metrics extra")
+    prometheus_client.start_http_server(port, host)
+
+
+__all__ = [
+    "CONTENT_TYPE",
+    "DEFAULT_BUCKETS",
+    "ENABLED",
+    "add_collector",
+    "counter",
+    "gauge",
+    "histogram",
+    "render",
+    "start_server",
+]
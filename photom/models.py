@@ -1,12 +1,94 @@
 """Pydantic models"""
 
+from typing import Any, ClassVar
+
 from fastapi_sso.sso.base import OpenID
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict, Field
 
 
 class Auth(BaseModel):
     """Authentication data for Google APIs"""
 
+    indexed_fields: ClassVar[tuple[str, ...]] = ("openid.id",)
+
     openid: OpenID
     access_token: str | None
     refresh_token: str
+    expires_at: float | None = None
+
+
+class DriveFile(BaseModel):
+    """File stored in Google Drive, as listed by the Drive API"""
+
+    model_config = ConfigDict(populate_by_name=True)
+
+    id: str
+    name: str
+    mime_type: str = Field(alias="mimeType")
+    md5_checksum: str | None = Field(default=None, alias="md5Checksum")
+    size: int | None = None
+    parents: list[str] | None = None
+    modified_time: str | None = Field(default=None, alias="modifiedTime")
+
+
+class DriveFolder(BaseModel):
+    """Contents of a Drive folder as of its last crawl: images in it and IDs of its subfolders"""
+
+    files: list[DriveFile]
+    folders: list[str]
+
+
+class DriveTree(BaseModel):
+    """Snapshot of the folder tree of a Drive, modified times of its crawled folders by their IDs"""
+
+    folders: dict[str, str | None]
+
+
+class DriveSyncState(BaseModel):
+    """Checkpoint of synchronizing a Drive of an account to Photos"""
+
+    changes_token: str
+    listing_token: str | None = None
+    failed: list[str] = []
+
+
+class TransferRecord(BaseModel):
+    """Outcome of transferring a single Drive file to Photos"""
+
+    indexed_fields: ClassVar[tuple[str, ...]] = ("email",)
+
+    email: str
+    file: DriveFile
+    media_item_id: str | None = None
+    error: str | None = None
+    deduplicated: bool = False
+
+
+class Job(BaseModel):
+    """Background job of the job queue"""
+
+    id: int
+    kind: str
+    key: str | None = None
+    payload: dict[str, Any]
+    status: str
+    attempts: int = 0
+    created_at: float
+    finished_at: float | None = None
+    error: str | None = None
+    result: dict[str, Any] | None = None
+
+
+class AccountProgress(BaseModel):
+    """Progress of a sync of an account, files are counted once handled out of those listed so far"""
+
+    email: str
+    files: int = 0
+    bytes: int = 0
+    failed: int = 0
+    skipped: int = 0
+    pending: int = 0
+    seconds: float = 0.0
+    bytes_per_second: float = 0.0
+    eta: float | None = None
+    done: bool = False
@@ -0,0 +1,188 @@
+"""Progress of syncs pushed to subscribers, such as clients of the `/progress/stream` route of the API.
+Syncs publish the state of their account to `BUS` whenever they handled a file. Subscribers do not queue states: each
+one keeps the latest state of every account published since it last read them and is handed them at most once every
+`interval` seconds. However fast states are published and however slowly a subscriber reads them, it holds a single
+state per account and intermediate states are dropped. The bus lives in a single process and is used from its event
+loop. Syncs run in worker processes, where `record` writes the states published to the `progress` table of the SQLite
+store database, and `relay` publishes the rows written by any process to the bus of the API process."""
+
+import asyncio
+import logging
+import sqlite3
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+from photom.models import AccountProgress, TransferRecord
+from photom.store.progress import ProgressLog
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL = 0.5
+
+
+class Subscription:
+    """Latest states of the accounts published since a subscriber last read them."""
+
+    def __init__(self, interval: float = DEFAULT_INTERVAL) -> None:
+        """Initialize an empty subscription, states are handed out at most once every `interval` seconds."""
+        self._interval = interval
+        self._pending: dict[str, AccountProgress] = {}
+        self._changed = asyncio.Event()
+        self._read = float("-inf")
+        self.dropped = 0
+
+    def put(self, progress: AccountProgress) -> None:
+        """Keep the state of an account, replacing its state not read yet."""
+        if progress.email in self._pending:
+            self.dropped += 1
+        self._pending[progress.email] = progress
+        self._changed.set()
+
+    def flush(self) -> list[AccountProgress]:
+        """Take the states not read yet, right away."""
+        states = list(self._pending.values())
+        self._pending.clear()
+        self._changed.clear()
+        self._read = time.monotonic()
+        return states
+
+    async def get(self, timeout: float | None = None) -> list[AccountProgress]:
+        """Wait for states published since the last read, no sooner than `interval` seconds after it. Nothing is
+        returned if none was published within `timeout` seconds."""
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            return []
+        delay = self._read + self._interval - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return self.flush()
+
+
+class ProgressBus:
+    """Latest progress of every account, fanned out to subscriptions."""
+
+    def __init__(self) -> None:
+        """Initialize a bus without any progress or subscriptions."""
+        self.latest: dict[str, AccountProgress] = {}
+        self._subscriptions: set[Subscription] = set()
+
+    @property
+    def subscribers(self) -> int:
+        """Number of current subscriptions."""
+        return len(self._subscriptions)
+
+    def publish(self, progress: AccountProgress) -> None:
+        """Publish the state of an account to all subscriptions."""
+        self.latest[progress.email] = progress
+        for subscription in self._subscriptions:
+            subscription.put(progress)
+
+    @contextmanager
+    def subscribe(self, interval: float = DEFAULT_INTERVAL, snapshot: bool = True) -> Iterator[Subscription]:
+        """Subscribe for as long as the block runs, starting with the latest state of every account with `snapshot`."""
+        subscription = Subscription(interval)
+        if snapshot:
+            for progress in self.latest.values():
+                subscription.put(progress)
+        self._subscriptions.add(subscription)
+        try:
+            yield subscription
+        finally:
+            self._subscriptions.discard(subscription)
+
+
+BUS = ProgressBus()
+
+
+class SyncProgress:  # pylint: disable=too-many-instance-attributes
+    """Counts files handled by a sync of an account and publishes its state after every change."""
+
+    def __init__(self, email: str, bus: ProgressBus | None = None):
+        """Initialize the counters of a sync starting now, states are published to `bus`, if any."""
+        self._email = email
+        self._bus = bus
+        self._start = time.monotonic()
+        self.files = self.bytes = self.failed = self.skipped = self.pending = 0
+
+    def state(self, done: bool = False) -> AccountProgress:
+        """Current state of the sync, the ETA is extrapolated from the rate files were handled at so far."""
+        seconds = time.monotonic() - self._start
+        handled = self.files + self.failed + self.skipped
+        eta = None
+        if done or not self.pending:
+            eta = 0.0
+        elif handled and seconds:
+            eta = self.pending * seconds / handled
+        return AccountProgress(
+            email=self._email,
+            files=self.files,
+            bytes=self.bytes,
+            failed=self.failed,
+            skipped=self.skipped,
+            pending=self.pending,
+            seconds=seconds,
+            bytes_per_second=self.bytes / seconds if seconds else 0.0,
+            eta=eta,
+            done=done,
+        )
+
+    def _publish(self, done: bool = False) -> None:
+        """Publish the current state, if there is a bus."""
+        if self._bus is not None:
+            self._bus.publish(self.state(done))
+
+    def listed(self, count: int) -> None:
+        """Count files found to transfer."""
+        self.pending += count
+        self._publish()
+
+    def handled(self, result: TransferRecord) -> None:
+        """Count a file whose transfer finished."""
+        self.pending -= 1
+        if result.media_item_id is None:
+            self.failed += 1
+        elif result.deduplicated:
+            self.skipped += 1
+        else:
+            self.files += 1
+            self.bytes += result.file.size or 0
+        self._publish()
+
+    def finish(self) -> None:
+        """Publish the final state of the sync."""
+        self._publish(done=True)
+
+
+async def record(bus: ProgressBus, log: ProgressLog, interval: float = DEFAULT_INTERVAL) -> None:
+    """Write states published to the bus to the log, at most once every `interval` seconds, until cancelled. States
+    not written yet are written on cancellation."""
+    with bus.subscribe(interval, snapshot=False) as subscription:
+        try:
+            while True:
+                states = await subscription.get()
+                try:
+                    await asyncio.to_thread(log.write, states)
+                except sqlite3.Error as error:
+                    logger.warning("Writing progress failed: %s", error)
+        finally:
+            log.write(subscription.flush())
+
+
+async def relay(bus: ProgressBus, log: ProgressLog, interval: float = DEFAULT_INTERVAL) -> None:
+    """Publish states written to the log by any process to the bus, the log is read every `interval` seconds until
+    cancelled."""
+    version = 0
+    while True:
+        try:
+            version, states = await asyncio.to_thread(log.read, version)
+        except sqlite3.Error as error:
+            logger.warning("Reading progress failed: %s", error)
+        else:
+            for progress in states:
+                bus.publish(progress)
+        await asyncio.sleep(interval)
+
+
+__all__ = ["BUS", "ProgressBus", "Subscription", "SyncProgress", "record", "relay"]
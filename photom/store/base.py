@@ -1,17 +1,64 @@
-"""Base for all store types. Store enables you to persist and retrieve data from the store."""
+"""Base for all store types. Store enables you to persist and retrieve data from the store.
+Models may declare `indexed_fields`, values are then looked up by those fields with `find`, which stores back with
+indexes of their own."""
 
 from abc import ABC, abstractmethod
+from contextlib import contextmanager
 from types import TracebackType
-from typing import Iterable, Type, TypeVar
+from typing import Any, AsyncContextManager, AsyncIterator, Iterable, Iterator, Mapping, Type, TypeVar
 
 from photom.models import BaseModel
 
 T = TypeVar("T", bound=BaseModel)
 
 
+def indexed_fields(model: type[BaseModel]) -> tuple[str, ...]:
+    """Fields of a model its values can be found by, as declared in its `indexed_fields`."""
+    return getattr(model, "indexed_fields", ())
+
+
+def index_values(value: BaseModel, fields: Iterable[str]) -> dict[str, Any]:
+    """Values of the given fields of an instance, as they are serialized. Fields of nested models are given by dotted
+    paths, such as `openid.id`."""
+    fields = list(fields)
+    include: dict[str, Any] = {}
+    for field in fields:
+        node = include
+        *parents, name = field.split(".")
+        for parent in parents:
+            node = node.setdefault(parent, {})
+            if node is True:
+                break
+        else:
+            node[name] = True
+    data = value.model_dump(mode="json", include=include)
+    values = {}
+    for field in fields:
+        found: Any = data
+        for name in field.split("."):
+            found = found.get(name) if isinstance(found, dict) else None
+        values[field] = found
+    return values
+
+
+def check_filters(model: type[BaseModel], filters: Mapping[str, Any]) -> None:
+    """Make sure values of a model can be found by the filtered fields."""
+    unindexed = set(filters) - set(indexed_fields(model))
+    if unindexed:
+        raise ValueError(f"{model.__name__} has no index on {', '.join(sorted(unindexed))}")
+
+
+def matches(value: BaseModel, filters: Mapping[str, Any]) -> bool:
+    """Whether the fields of an instance equal the filtered values."""
+    values = index_values(value, filters)
+    return all(values[field] == expected for field, expected in filters.items())
+
+
 class Store(ABC):
     """Base class for all store types."""
 
+    _transaction_depth = 0
+
     @abstractmethod
     def __init__(self, **kwargs):
         """Initialize the store."""
@@ -25,12 +72,14 @@ class Store(ABC):
         """Exit the store context."""
 
     @abstractmethod
-    def iter_keys(self, model: type[T]) -> Iterable[str]:
-        """Iterate through all keys in the store for a given model."""
+    def iter_keys(self, model: type[T], limit: int | None = None, after_key: str | None = None) -> Iterable[str]:
+        """Iterate through keys in the store for a given model, ordered by key.
+        Only keys greater than `after_key` are yielded, at most `limit` of them."""
 
     @abstractmethod
-    def iter_values(self, model: type[T]) -> Iterable[T]:
-        """Iterate through all values in the store for a given model."""
+    def iter_values(self, model: type[T], limit: int | None = None, after_key: str | None = None) -> Iterable[T]:
+        """Iterate through values in the store for a given model, ordered by key.
+        Only values with keys greater than `after_key` are yielded, at most `limit` of them."""
 
     @abstractmethod
     def get(self, key: str, model: type[T]) -> T | None:
@@ -43,3 +92,108 @@ class Store(ABC):
     @abstractmethod
     def delete(self, key: str, model: type[T]) -> None:
         """Delete a value from the store."""
+
+    @abstractmethod
+    def get_many(self, keys: Iterable[str], model: type[T]) -> dict[str, T]:
+        """Get multiple values from the store at once. Keys that are not present are left out of the result."""
+
+    @abstractmethod
+    def set_many(self, values: Mapping[str, BaseModel]) -> None:
+        """Set multiple values in the store at once."""
+
+    @abstractmethod
+    def delete_many(self, keys: Iterable[str], model: type[T]) -> None:
+        """Delete multiple values from the store at once."""
+
+    def find(self, model: type[T], **filters: Any) -> Iterable[T]:
+        """Iterate through values of a model whose indexed fields equal the filters, ordered by key.
+        Filtering by fields the model does not index raises a `ValueError`. Backends look the values up in their
+        indexes, this implementation scans all of them."""
+        check_filters(model, filters)
+        return (value for value in self.iter_values(model) if matches(value, filters))
+
+    @property
+    def in_transaction(self) -> bool:
+        """Whether there is a transaction in progress."""
+        return self._transaction_depth > 0
+
+    @contextmanager
+    def transaction(self) -> Iterator[None]:
+        """Group writes made within the context so that they are committed together, or discarded on error.
+        Nested transactions join the outermost one."""
+        self._transaction_depth += 1
+        try:
+            yield
+        except BaseException:
+            self._transaction_depth -= 1
+            if not self._transaction_depth:
+                self._rollback_transaction()
+            raise
+        self._transaction_depth -= 1
+        if not self._transaction_depth:
+            self._commit_transaction()
+
+    @abstractmethod
+    def _commit_transaction(self) -> None:
+        """Commit writes made within the outermost transaction."""
+
+    @abstractmethod
+    def _rollback_transaction(self) -> None:
+        """Discard writes made within the outermost transaction."""
+
+
+class AsyncStore(ABC):
+    """Base class for all asynchronous store types, an asyncio counterpart of `Store`."""
+
+    @abstractmethod
+    async def __aenter__(self) -> "AsyncStore":
+        """Enter the store context."""
+
+    @abstractmethod
+    async def __aexit__(
+        self, _exc_type: Type[BaseException], _exc_val: BaseException, _exc_tb: TracebackType | None
+    ) -> None:
+        """Exit the store context."""
+
+    @abstractmethod
+    def iter_keys(self, model: type[T], limit: int | None = None, after_key: str | None = None) -> AsyncIterator[str]:
+        """Iterate through keys in the store for a given model, ordered by key.
+        Only keys greater than `after_key` are yielded, at most `limit` of them."""
+
+    @abstractmethod
+    def iter_values(self, model: type[T], limit: int | None = None, after_key: str | None = None) -> AsyncIterator[T]:
+        """Iterate through values in the store for a given model, ordered by key.
+        Only values with keys greater than `after_key` are yielded, at most `limit` of them."""
+
+    @abstractmethod
+    def find(self, model: type[T], **filters: Any) -> AsyncIterator[T]:
+        """Iterate through values of a model whose indexed fields equal the filters, ordered by key."""
+
+    @abstractmethod
+    async def get(self, key: str, model: type[T]) -> T | None:
+        """Get a value from the store."""
+
+    @abstractmethod
+    async def set(self, key: str, value: BaseModel) -> None:
+        """Set a value in the store."""
+
+    @abstractmethod
+    async def delete(self, key: str, model: type[T]) -> None:
+        """Delete a value from the store."""
+
+    @abstractmethod
+    async def get_many(self, keys: Iterable[str], model: type[T]) -> dict[str, T]:
+        """Get multiple values from the store at once. Keys that are not present are left out of the result."""
+
+    @abstractmethod
+    async def set_many(self, values: Mapping[str, BaseModel]) -> None:
+        """Set multiple values in the store at once."""
+
+    @abstractmethod
+    async def delete_many(self, keys: Iterable[str], model: type[T]) -> None:
+        """Delete multiple values from the store at once."""
+
+    @abstractmethod
+    def transaction(self) -> AsyncContextManager[None]:
+        """Group writes made within the context so that they are committed together, or discarded on error.
+        Nested transactions join the outermost one."""
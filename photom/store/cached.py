@@ -0,0 +1,266 @@
+"""Read-through cache layer for any store.
+Validated model instances are kept in a bounded LRU cache with an optional TTL, so repeated lookups of the same key
+skip both the backend and model validation. Cached instances are shared between callers and must not be mutated.
+With a `ChangeWatcher`, instances written by other processes are dropped before every read, see
+`photom.store.coherence`."""
+
+import logging
+import threading
+import time
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from types import TracebackType
+from typing import TYPE_CHECKING, Any, Iterable, Iterator, Mapping, NamedTuple, TypeVar
+
+from photom.models import BaseModel
+from photom.store.base import Store
+
+if TYPE_CHECKING:
+    from photom.store.coherence import ChangeWatcher, MultiChangeWatcher  # pragma: no cover
+
+T = TypeVar("T", bound=BaseModel)
+
+logger = logging.getLogger(__name__)
+
+CacheKey = tuple[type[BaseModel], str]
+
+
+class CacheStats(NamedTuple):
+    """Counters of a store cache."""
+
+    hits: int
+    misses: int
+    evictions: int
+    expirations: int
+    size: int
+    invalidations: int = 0
+
+
+class StoreCache:
+    """Bounded LRU cache of model instances with an optional TTL in seconds, safe to share between threads."""
+
+    def __init__(
+        self, size: int, ttl: float | None = None, watcher: "ChangeWatcher | MultiChangeWatcher | None" = None
+    ):
+        """Initialize the cache, changes made by other processes are followed by the watcher if given."""
+        self._size = size
+        self._ttl = ttl
+        self._watcher = watcher
+        self._entries: OrderedDict[CacheKey, tuple[BaseModel, float]] = OrderedDict()
+        self._models: dict[str, type[BaseModel]] = {}
+        self._lock = threading.Lock()
+        self._counts: Counter[str] = Counter()
+
+    @property
+    def stats(self) -> CacheStats:
+        """Current counters of the cache."""
+        with self._lock:
+            counts = self._counts
+            return CacheStats(
+                counts["hits"],
+                counts["misses"],
+                counts["evictions"],
+                counts["expirations"],
+                len(self._entries),
+                counts["invalidations"],
+            )
+
+    def get(self, model: type[T], key: str) -> T | None:
+        """Get a cached instance, None if it is not cached or has expired."""
+        with self._lock:
+            entry = self._entries.get((model, key))
+            if entry is None:
+                self._counts["misses"] += 1
+                return None
+            value, expires = entry
+            if expires < time.monotonic():
+                del self._entries[(model, key)]
+                self._counts["expirations"] += 1
+                self._counts["misses"] += 1
+                return None
+            self._entries.move_to_end((model, key))
+            self._counts["hits"] += 1
+            return value  # type: ignore[return-value]
+
+    @property
+    def generation(self) -> int:
+        """Number of writes seen by the cache, take it before reading a value to `fill` the cache with."""
+        with self._lock:
+            return self._counts["writes"]
+
+    def _insert(self, key: str, value: BaseModel) -> None:
+        """Insert an instance, evicting the least recently used ones above the size limit."""
+        expires = time.monotonic() + self._ttl if self._ttl is not None else float("inf")
+        self._models[value.__class__.__name__] = value.__class__
+        self._entries[(value.__class__, key)] = (value, expires)
+        self._entries.move_to_end((value.__class__, key))
+        while len(self._entries) > self._size:
+            self._entries.popitem(last=False)
+            self._counts["evictions"] += 1
+
+    def put(self, key: str, value: BaseModel) -> None:
+        """Cache a freshly written instance."""
+        with self._lock:
+            self._counts["writes"] += 1
+            self._insert(key, value)
+
+    def fill(self, key: str, value: BaseModel, generation: int) -> None:
+        """Cache an instance read from a store, unless there were writes since the read started,
+        in which case the instance might already be outdated."""
+        with self._lock:
+            if self._counts["writes"] == generation:
+                self._insert(key, value)
+
+    def invalidate(self, model: type[BaseModel], key: str) -> None:
+        """Drop an instance from the cache."""
+        with self._lock:
+            self._counts["writes"] += 1
+            self._entries.pop((model, key), None)
+
+    def clear(self) -> None:
+        """Drop all instances from the cache."""
+        with self._lock:
+            self._counts["writes"] += 1
+            self._entries.clear()
+
+    def refresh(self) -> None:
+        """Drop instances changed by other processes since the last refresh, all of them if changes were missed."""
+        if self._watcher is None:
+            return
+        changes = self._watcher.poll()
+        if changes is None:
+            self.clear()
+            return
+        if not changes:
+            return
+        with self._lock:
+            self._counts["writes"] += 1
+            for table, key in changes:
+                model = self._models.get(table)
+                if model is not None and self._entries.pop((model, key), None) is not None:
+                    self._counts["invalidations"] += 1
+
+
+class CachedStore(Store):
+    """Store wrapping another store with a read-through, write-through cache.
+    Writes made within a transaction only reach the cache once the transaction is committed."""
+
+    def __init__(self, store: Store, cache: StoreCache, **kwargs):
+        """Initialize the store."""
+        self._store = store
+        self._cache = cache
+        self._pending: dict[CacheKey, BaseModel | None] = {}
+
+    @property
+    def store(self) -> Store:
+        """The wrapped store."""
+        return self._store
+
+    @property
+    def cache(self) -> StoreCache:
+        """The cache in use."""
+        return self._cache
+
+    def __enter__(self) -> "CachedStore":
+        """Enter the store context."""
+        self._store.__enter__()
+        return self
+
+    def __exit__(self, _exc_type: type[BaseException], _exc_val: BaseException, _exc_tb: TracebackType | None):
+        """Exit the store context."""
+        return self._store.__exit__(_exc_type, _exc_val, _exc_tb)
+
+    def _written(self, key: str, model: type[BaseModel], value: BaseModel | None) -> None:
+        """Reflect a write (or a deletion if value is None) in the cache."""
+        self._cache.invalidate(model, key)
+        if self.in_transaction:
+            self._pending[(model, key)] = value
+        elif value is not None:
+            self._cache.put(key, value)
+
+    def _commit_transaction(self) -> None:
+        """Cache values written within the transaction."""
+        pending, self._pending = self._pending, {}
+        for (_, key), value in pending.items():
+            if value is not None:
+                self._cache.put(key, value)
+
+    def _rollback_transaction(self) -> None:
+        """Make sure nothing written within the transaction stays cached."""
+        pending, self._pending = self._pending, {}
+        for model, key in pending:
+            self._cache.invalidate(model, key)
+
+    @contextmanager
+    def transaction(self) -> Iterator[None]:
+        """Group writes made within the context in a transaction of the wrapped store.
+        The wrapped store commits first, so the cache is only updated once the writes are persisted."""
+        with super().transaction(), self._store.transaction():
+            yield
+
+    def iter_keys(self, model: type[T], limit: int | None = None, after_key: str | None = None) -> Iterable[str]:
+        """Iterate through keys in the store for a given model, ordered by key."""
+        return self._store.iter_keys(model, limit, after_key)
+
+    def iter_values(self, model: type[T], limit: int | None = None, after_key: str | None = None) -> Iterable[T]:
+        """Iterate through values in the store for a given model, ordered by key.
+        Values are not cached, so that a scan does not evict frequently used instances."""
+        return self._store.iter_values(model, limit, after_key)
+
+    def find(self, model: type[T], **filters: Any) -> Iterable[T]:
+        """Find values in the wrapped store by their indexed fields, they are not cached either."""
+        return self._store.find(model, **filters)
+
+    def get(self, key: str, model: type[T]) -> T | None:
+        """Get a value from the cache, or from the wrapped store if it is not cached."""
+        self._cache.refresh()
+        value = self._cache.get(model, key)
+        if value is None:
+            generation = self._cache.generation
+            value = self._store.get(key, model)
+            if value is not None and not self.in_transaction:
+                self._cache.fill(key, value, generation)
+        return value
+
+    def set(self, key: str, value: BaseModel) -> None:
+        """Set a value in the wrapped store and in the cache."""
+        self._store.set(key, value)
+        self._written(key, value.__class__, value)
+
+    def delete(self, key: str, model: type[T]) -> None:
+        """Delete a value from the wrapped store and from the cache."""
+        self._store.delete(key, model)
+        self._written(key, model, None)
+
+    def get_many(self, keys: Iterable[str], model: type[T]) -> dict[str, T]:
+        """Get multiple values, only keys that are not cached are read from the wrapped store."""
+        self._cache.refresh()
+        result: dict[str, T] = {}
+        missing: list[str] = []
+        for key in keys:
+            value = self._cache.get(model, key)
+            if value is None:
+                missing.append(key)
+            else:
+                result[key] = value
+        if missing:
+            generation = self._cache.generation
+            loaded = self._store.get_many(missing, model)
+            if not self.in_transaction:
+                for key, value in loaded.items():
+                    self._cache.fill(key, value, generation)
+            result.update(loaded)
+        return result
+
+    def set_many(self, values: Mapping[str, BaseModel]) -> None:
+        """Set multiple values in the wrapped store and in the cache."""
+        self._store.set_many(values)
+        for key, value in values.items():
+            self._written(key, value.__class__, value)
+
+    def delete_many(self, keys: Iterable[str], model: type[T]) -> None:
+        """Delete multiple values from the wrapped store and from the cache."""
+        keys = list(keys)
+        self._store.delete_many(keys, model)
+        for key in keys:
+            self._written(key, model, None)
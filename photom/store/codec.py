@@ -0,0 +1,73 @@
+"""Codecs serializing models for stores.
+Every codec encodes a model in a single pass and decodes it straight into a validated model instance."""
+
+from abc import ABC, abstractmethod
+from typing import TypeVar
+
+from photom.models import BaseModel
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+T = TypeVar("T", bound=BaseModel)
+
+
+class Codec(ABC):
+    """Base class for all codecs."""
+
+    @abstractmethod
+    def encode(self, value: BaseModel) -> str | bytes:
+        """Serialize a model."""
+
+    @abstractmethod
+    def decode(self, data: str | bytes, model: type[T]) -> T:
+        """Deserialize and validate a model."""
+
+
+class JSONCodec(Codec):
+    """JSON codec, models are validated directly from JSON without parsing it into Python objects first."""
+
+    def encode(self, value: BaseModel) -> str:
+        """Serialize a model to JSON."""
+        return value.model_dump_json()
+
+    def decode(self, data: str | bytes, model: type[T]) -> T:
+        """Validate a model from JSON."""
+        return model.model_validate_json(data)
+
+
+class MsgpackCodec(Codec):
+    """Compact binary codec using msgpack, requires the `msgpack` extra.
+    Values stored as JSON are still decoded, so that an existing store can switch to this codec."""
+
+    def __init__(self):
+        """Initialize the codec."""
+        if msgpack is None:
+            raise RuntimeError("msgpack is not installed, install photom with the msgpack extra")
+
+    def encode(self, value: BaseModel) -> bytes:
+        """Serialize a model to msgpack."""
+        return msgpack.packb(value.model_dump(mode="json"))
+
+    def decode(self, data: str | bytes, model: type[T]) -> T:
+        """Validate a model from msgpack, or from JSON for values written by the JSON codec."""
+        # a model is always packed as a map, which never starts with "{"
+        if isinstance(data, str) or data[:1] == b"{":
+            return model.model_validate_json(data)
+        return model.model_validate(msgpack.unpackb(data))
+
+
+CODECS: dict[str, type[Codec]] = {"json": JSONCodec, "msgpack": MsgpackCodec}
+
+
+def get_codec(name: str) -> Codec:
+    """Get a codec by its name."""
+    try:
+        return CODECS[name]()
+    except KeyError:
+        raise ValueError(f"Unknown codec {name}, choose one of {', '.join(CODECS)}") from None
+
+
+__all__ = ["Codec", "JSONCodec", "MsgpackCodec", "get_codec"]
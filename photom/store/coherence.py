@@ -0,0 +1,108 @@
+"""Coherence of store caches of processes sharing a SQLite database.
+Stores created with `track_changes` record every write to a model table in the `store_changes` log of the database.
+A `ChangeWatcher` follows the log from a dedicated connection: it polls `PRAGMA data_version`, which only changes once
+another connection committed, and only then reads the log entries added since its last poll. `StoreCache` drops the
+cached instances of the changed keys, so every process keeps a warm cache without serving values written over by
+others. Polls are at most `interval` seconds apart, which bounds how long a cache may serve a stale value.
+Caches of sharded stores follow the logs of all shards with a `MultiChangeWatcher`."""
+
+import logging
+import sqlite3
+import threading
+import time
+from typing import Iterable
+
+from photom.store.sqlite import CHANGES_TABLE, DEFAULT_POOL_SIZE, STORE_SCHEMA, borrow_connection
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL = 0.0
+
+
+class ChangeWatcher:  # pylint: disable=too-many-instance-attributes
+    """Follows the change log of a SQLite database, safe to share between threads."""
+
+    def __init__(self, database: str, interval: float = DEFAULT_INTERVAL, pool_size: int = DEFAULT_POOL_SIZE):
+        """Initialize the watcher, changes are followed from now on and polled at most once every `interval` seconds."""
+        self._database = database
+        self._interval = interval
+        self._pool_size = pool_size
+        self._lock = threading.Lock()
+        self._data_version = 0
+        self._last_change = 0
+        self._polled = float("-inf")
+        self._connection: sqlite3.Connection | None = self._connect()
+
+    def _connect(self) -> sqlite3.Connection:
+        """Open the connection the database is watched from, changes are followed from the latest one on."""
+        with borrow_connection(self._database, CHANGES_TABLE, self._pool_size, schema=STORE_SCHEMA):
+            # the database is migrated, so the change log exists
+            pass
+        connection = sqlite3.connect(self._database, check_same_thread=False, isolation_level=None)
+        (self._data_version,) = connection.execute("PRAGMA data_version").fetchone()
+        (self._last_change,) = connection.execute(f"SELECT coalesce(max(id), 0) FROM {CHANGES_TABLE}").fetchone()
+        logger.info("Watching changes of database %s", self._database)
+        return connection
+
+    def poll(self) -> list[tuple[str, str]] | None:
+        """Get models and keys changed since the last poll, by this or any other process, in the order they were
+        written. None means that changes may have been missed, because the log was trimmed past the last one seen or
+        the watcher was closed, and any cached value may be stale. Nothing is returned until `interval` seconds passed
+        since the last poll."""
+        with self._lock:
+            now = time.monotonic()
+            if now - self._polled < self._interval:
+                return []
+            self._polled = now
+            if self._connection is None:
+                self._connection = self._connect()
+                return None
+            (data_version,) = self._connection.execute("PRAGMA data_version").fetchone()
+            if data_version == self._data_version:
+                return []
+            self._data_version = data_version
+            rows = self._connection.execute(
+                f"SELECT id, model, key FROM {CHANGES_TABLE} WHERE id > ? ORDER BY id", (self._last_change,)
+            ).fetchall()
+            if not rows:
+                return []
+            missed = rows[0][0] != self._last_change + 1
+            self._last_change = rows[-1][0]
+            if missed:
+                logger.warning("Changes of database %s were missed, the whole cache is dropped", self._database)
+                return None
+            return [(model, key) for _, model, key in rows]
+
+    def close(self) -> None:
+        """Close the connection of the watcher, it is opened again on the next poll, which reports missed changes."""
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+class MultiChangeWatcher:
+    """Follows the change logs of several SQLite databases, such as the shards of a sharded store."""
+
+    def __init__(
+        self, databases: Iterable[str], interval: float = DEFAULT_INTERVAL, pool_size: int = DEFAULT_POOL_SIZE
+    ):
+        """Initialize the watcher, changes of every database are followed from now on."""
+        self._watchers = [ChangeWatcher(database, interval, pool_size) for database in databases]
+
+    def poll(self) -> list[tuple[str, str]] | None:
+        """Get models and keys changed in any of the databases since the last poll, None if changes of any of them may
+        have been missed."""
+        changes: list[tuple[str, str]] | None = []
+        for watcher in self._watchers:
+            polled = watcher.poll()
+            if polled is None:
+                changes = None
+            elif changes is not None:
+                changes.extend(polled)
+        return changes
+
+    def close(self) -> None:
+        """Close the connections of all watchers."""
+        for watcher in self._watchers:
+            watcher.close()
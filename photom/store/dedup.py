@@ -0,0 +1,190 @@
+"""Index of content already transferred to Google Photos.
+Every transferred file is indexed by its account, Drive MD5 checksum and size in the `transferred_media` table, created
+by a migration of the SQLite store database. A whole listing page is looked up in one statement, and an in-memory Bloom
+filter in front of the table answers for content that was never transferred without touching the database. Content
+indexed by the process is added to the filter right away, rows added by other processes are picked up at most every
+`refresh_interval` seconds."""
+
+import hashlib
+import json
+import logging
+import math
+import threading
+import time
+from typing import Any, ContextManager, Iterable, Iterator
+
+from photom.models import DriveFile
+from photom.store.sqlite import DEFAULT_POOL_SIZE, SchemaConnection, borrow_connection, migration
+
+logger = logging.getLogger(__name__)
+
+TABLE = "transferred_media"
+DEFAULT_CAPACITY = 100_000
+DEFAULT_ERROR_RATE = 0.01
+DEFAULT_REFRESH_INTERVAL = 1.0
+
+
+@migration(1)
+def _create_transferred_media(cursor) -> None:
+    """Create the table of transferred content."""
+    cursor.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {TABLE} (
+            id INTEGER PRIMARY KEY,
+            email TEXT NOT NULL,
+            md5_checksum TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            media_item_id TEXT NOT NULL
+        )
+        """
+    )
+    cursor.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {TABLE}_content ON {TABLE} (email, md5_checksum, size)")
+
+
+def _content_key(email: str, md5_checksum: str, size: int) -> bytes:
+    """Key of a piece of content of an account in the Bloom filter."""
+    return f"{email}\0{md5_checksum}\0{size}".encode()
+
+
+class BloomFilter:
+    """Set of keys that may answer a false positive, at `error_rate` when holding `capacity` keys, but never a false
+    negative."""
+
+    def __init__(self, capacity: int, error_rate: float = DEFAULT_ERROR_RATE):
+        """Initialize an empty filter sized for `capacity` keys."""
+        self.capacity = max(capacity, 1)
+        self.count = 0
+        self._bits = max(8, math.ceil(-self.capacity * math.log(error_rate) / math.log(2) ** 2))
+        self._hashes = max(1, round(self._bits / self.capacity * math.log(2)))
+        self._array = bytearray((self._bits + 7) // 8)
+
+    def _positions(self, key: bytes) -> Iterator[int]:
+        """Bit positions of a key, derived from two halves of a single digest."""
+        digest = hashlib.blake2b(key, digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        return ((first + index * second) % self._bits for index in range(self._hashes))
+
+    def add(self, key: bytes) -> None:
+        """Add a key."""
+        for position in self._positions(key):
+            self._array[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key: bytes) -> bool:
+        """Whether the key may have been added."""
+        return all(self._array[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class DedupIndex:  # pylint: disable=too-many-instance-attributes
+    """Index of content transferred per account, kept in a SQLite database next to the store.
+
+    Files are matched by Drive MD5 checksum and size, files missing either are never considered transferred. The Bloom
+    filter follows rows added by any process by their row IDs, it is rebuilt twice as large once it fills up.
+    """
+
+    def __init__(
+        self,
+        database: str,
+        pool_size: int = DEFAULT_POOL_SIZE,
+        pragmas: dict[str, Any] | None = None,
+        capacity: int = DEFAULT_CAPACITY,
+        error_rate: float = DEFAULT_ERROR_RATE,
+        refresh_interval: float = DEFAULT_REFRESH_INTERVAL,
+    ):  # pylint: disable=too-many-arguments
+        """Initialize the index, connections are borrowed from the process-wide pool of the database. Rows added by
+        other processes are read into the Bloom filter at most once every `refresh_interval` seconds."""
+        self._database = database
+        self._pool_size = pool_size
+        self._pragmas = pragmas
+        self._error_rate = error_rate
+        self._refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._filter = BloomFilter(capacity, error_rate)
+        self._last_id = 0
+        self._refreshed = float("-inf")
+
+    def _connection(self) -> ContextManager[SchemaConnection]:
+        """Borrow a connection to the database of the index."""
+        return borrow_connection(self._database, TABLE, self._pool_size, self._pragmas)
+
+    def _refresh(self) -> None:
+        """Add rows inserted since the last refresh to the Bloom filter, unless it was refreshed less than
+        `refresh_interval` seconds ago."""
+        now = time.monotonic()
+        if now - self._refreshed < self._refresh_interval:
+            return
+        self._refreshed = now
+        with self._connection() as connection:
+            (last_id,) = connection.execute(f"SELECT COALESCE(MAX(id), 0) FROM {TABLE}").fetchone()
+            if last_id <= self._last_id:
+                return
+            after = self._last_id
+            if self._filter.count + last_id - after > self._filter.capacity:
+                capacity = max(self._filter.capacity, last_id) * 2
+                logger.info("Rebuilding the dedup Bloom filter of %s for %d entries", self._database, capacity)
+                self._filter = BloomFilter(capacity, self._error_rate)
+                after = 0
+            rows = connection.execute(
+                f"SELECT email, md5_checksum, size FROM {TABLE} WHERE id > ? AND id <= ?", (after, last_id)
+            )
+            for row in rows:
+                self._filter.add(_content_key(*row))
+        self._last_id = last_id
+
+    def find(self, email: str, files: Iterable[DriveFile]) -> dict[str, str]:
+        """Find files whose content was already transferred for the account, return their IDs mapped to the IDs of the
+        media items created from the content. All files that may have been transferred are queried in one statement,
+        the database is not queried when none may have been."""
+        with self._lock:
+            self._refresh()
+            candidates = [
+                file
+                for file in files
+                if file.md5_checksum is not None
+                and file.size is not None
+                and _content_key(email, file.md5_checksum, file.size) in self._filter
+            ]
+        if not candidates:
+            return {}
+        with self._connection() as connection:
+            logger.debug("Looking up %d files of %s in the dedup index", len(candidates), email)
+            rows = connection.execute(
+                f"""
+                SELECT md5_checksum, size, media_item_id
+                FROM json_each(?) AS page
+                JOIN {TABLE} ON email = ?
+                    AND md5_checksum = json_extract(page.value, '$[0]')
+                    AND size = json_extract(page.value, '$[1]')
+                """,
+                (json.dumps([[file.md5_checksum, file.size] for file in candidates]), email),
+            ).fetchall()
+        found = {(md5_checksum, size): media_item_id for md5_checksum, size, media_item_id in rows}
+        return {
+            file.id: found[(file.md5_checksum, file.size)]
+            for file in candidates
+            if (file.md5_checksum, file.size) in found
+        }
+
+    def add(self, email: str, transferred: Iterable[tuple[DriveFile, str]]) -> None:
+        """Index content of files transferred for the account, given with the IDs of media items created from them.
+        Files missing a checksum or size are left out, content indexed before keeps its media item."""
+        rows = [
+            (email, file.md5_checksum, file.size, media_item_id)
+            for file, media_item_id in transferred
+            if file.md5_checksum is not None and file.size is not None
+        ]
+        if not rows:
+            return
+        logger.debug("Indexing %d files of %s", len(rows), email)
+        with self._connection() as connection:
+            connection.executemany(
+                f"INSERT OR IGNORE INTO {TABLE} (email, md5_checksum, size, media_item_id) VALUES (?, ?, ?, ?)", rows
+            )
+            connection.commit()
+        with self._lock:
+            for row in rows:
+                self._filter.add(_content_key(*row[:3]))
+
+
+__all__ = ["BloomFilter", "DedupIndex"]
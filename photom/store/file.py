@@ -1,32 +1,131 @@
 """File store implementation.
 This store stores stored data in a directory structure. Each model has a subdirectory, each model's key is a file in
-that subdirectory. The file contains the JSON representation of the model."""
+that subdirectory. The file contains the model serialized by the store's codec, JSON by default.
+
+Writes are staged into temporary files in a staging directory and moved in place with `os.replace` when they are
+committed, so a crash never leaves a truncated file behind. Writes made within one `transaction()` are committed
+together, which batches their fsyncs. Keys of each model directory are kept in an index, persisted as a manifest next
+to the directory, so that listing keys does not have to touch the filesystem for every key. The index is only checked
+against the mtime of the directory, which can miss a file written by someone else right after it was built, so keys
+missing from it are looked up on the filesystem before they are reported missing.
+
+Indexed fields of a model are kept in inverted indexes, one per field, mapping each value to the keys holding it. They
+are persisted next to the model directory as well, kept up to date by commits and only rebuilt by reading all values
+when the directory was modified by someone else."""
 
 
 import json
 import logging
 import os
-from typing import Any, Iterable, TypeVar
+import tempfile
+import threading
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Any, Callable, Iterable, Mapping, TypeVar
 
 from photom.models import BaseModel
-from photom.store.base import Store
+from photom.store.base import Store, check_filters, index_values, indexed_fields, matches
+from photom.store.codec import Codec, JSONCodec
 
 T = TypeVar("T", bound=BaseModel)
 
 logger = logging.getLogger(__name__)
 
+R = TypeVar("R")
+
+TEMP_PREFIX = ".photom-tmp-"
+STAGING_DIRECTORY = ".staging"
+READ_BATCH_SIZE = 64
+
+_executor: ThreadPoolExecutor | None = None
+_executor_lock = threading.Lock()
+
 
 def _nonone(values: Iterable[Any | None]) -> Iterable[Any]:
     """Iterate through an iterable of non-None values."""
     yield from (value for value in values if value is not None)
 
 
+def _parallel_map(func: Callable[..., R], *iterables: Iterable[Any]) -> list[R]:
+    """Map a function over the iterables on a shared thread pool, as file I/O releases the GIL."""
+    global _executor  # pylint: disable=global-statement
+    args = list(zip(*iterables))
+    if len(args) < 2:
+        return [func(*arg) for arg in args]
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(thread_name_prefix="photom-file-store")
+    return list(_executor.map(func, *zip(*args)))
+
+
+def _fsync(path: str) -> None:
+    """Flush a file or a directory to disk."""
+    descriptor = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(descriptor)
+    finally:
+        os.close(descriptor)
+
+
+def _mtime_ns(path: str) -> int | None:
+    """Get modification time of a path, None if it does not exist."""
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+class _DirectoryIndex:  # pylint: disable=too-few-public-methods
+    """Keys present in a model directory, valid as long as the directory modification time matches."""
+
+    def __init__(self, mtime_ns: int, keys: set[str]):
+        self.mtime_ns = mtime_ns
+        self.keys = keys
+
+
+class _FieldIndex:
+    """Keys of a model directory by values of one of its indexed fields, valid as long as the directory modification
+    time matches."""
+
+    def __init__(self, mtime_ns: int, keys: Mapping[Any, Iterable[str]]):
+        self.mtime_ns = mtime_ns
+        self.keys: dict[Any, set[str]] = {value: set(value_keys) for value, value_keys in keys.items()}
+        self.values: dict[str, Any] = {key: value for value, value_keys in self.keys.items() for key in value_keys}
+
+    def update(self, key: str, value: Any) -> None:
+        """Move a key to the keys of its new value."""
+        self.discard(key)
+        self.values[key] = value
+        self.keys.setdefault(value, set()).add(key)
+
+    def discard(self, key: str) -> None:
+        """Remove a key from the index."""
+        if key not in self.values:
+            return
+        value = self.values.pop(key)
+        self.keys[value].discard(key)
+        if not self.keys[value]:
+            del self.keys[value]
+
+
+_indexes: dict[str, _DirectoryIndex] = {}
+_field_indexes: dict[str, _FieldIndex] = {}
+_indexes_lock = threading.RLock()
+
+
 class FileStore(Store):
-    """File store backend for photom."""
+    """File store backend for photom.
+    Writes are staged and committed together at the end of a transaction, each single write being a transaction of
+    its own. Reads within a transaction see the staged writes."""
 
-    def __init__(self, directory: str, **kwargs):
-        """Initialize the store."""
+    def __init__(self, directory: str, fsync: bool = True, codec: Codec | None = None, **kwargs):
+        """Initialize the store. With `fsync` disabled, committed writes are not flushed to disk explicitly."""
         self._directory = os.path.abspath(directory)
+        self._fsync = fsync
+        self._codec = codec or JSONCodec()
+        self._pending: dict[str, str | None] = {}
+        self._pending_fields: dict[str, tuple[type[BaseModel], dict[str, Any] | None]] = {}
         os.makedirs(self._directory, exist_ok=True)
 
     def __enter__(self):
@@ -45,34 +144,313 @@ class FileStore(Store):
             keyhint = model_or_instance.__name__
         return os.path.join(self._directory, keyhint, key)
 
-    def iter_keys(self, model: type[T]) -> Iterable[str]:
-        """Iterate through all keys in the store for a given model."""
+    def _encode(self, value: BaseModel) -> bytes:
+        """Serialize a model to be written to a file."""
+        data = self._codec.encode(value)
+        return data.encode("utf-8") if isinstance(data, str) else data
+
+    def _manifest_path(self, model_dir: str) -> str:
+        """Get path to the manifest of a model directory."""
+        return os.path.join(self._directory, f".{os.path.basename(model_dir)}.manifest")
+
+    def _index(self, model_dir: str) -> _DirectoryIndex | None:
+        """Get index of a model directory, it is only rebuilt when the directory was modified by someone else."""
+        mtime_ns = _mtime_ns(model_dir)
+        if mtime_ns is None:
+            return None
+        with _indexes_lock:
+            index = _indexes.get(model_dir)
+            if index is None or index.mtime_ns != mtime_ns:
+                index = self._load_manifest(model_dir, mtime_ns) or self._scan(model_dir, mtime_ns)
+                _indexes[model_dir] = index
+            return index
+
+    def _load_manifest(self, model_dir: str, mtime_ns: int) -> _DirectoryIndex | None:
+        """Load index of a model directory from its manifest, unless the manifest is outdated."""
+        try:
+            with open(self._manifest_path(model_dir), "r", encoding="utf-8") as file:
+                manifest = json.load(file)
+        except (FileNotFoundError, ValueError):
+            return None
+        if manifest.get("mtime_ns") != mtime_ns:
+            return None
+        return _DirectoryIndex(mtime_ns, set(manifest["keys"]))
+
+    def _scan(self, model_dir: str, mtime_ns: int) -> _DirectoryIndex:
+        """Build index of a model directory by scanning it and persist it as a manifest."""
+        logger.debug("Scanning %s", model_dir)
+        with os.scandir(model_dir) as entries:
+            keys = {entry.name for entry in entries if entry.is_file()}
+        index = _DirectoryIndex(mtime_ns, keys)
+        self._write_manifest(model_dir, index)
+        return index
+
+    def _write_manifest(self, model_dir: str, index: _DirectoryIndex) -> None:
+        """Atomically write a manifest."""
+        self._write_json(self._manifest_path(model_dir), {"mtime_ns": index.mtime_ns, "keys": sorted(index.keys)})
+
+    def _write_json(self, path: str, data: Any) -> None:
+        """Atomically write a manifest or an index, they are only caches, so they are never fsynced."""
+        descriptor, temp = tempfile.mkstemp(prefix=TEMP_PREFIX, dir=self._directory)
+        with os.fdopen(descriptor, "w", encoding="utf-8") as file:
+            json.dump(data, file)
+        os.replace(temp, path)
+
+    def _field_index_path(self, model_dir: str, field: str) -> str:
+        """Get path to the inverted index of a field of a model directory."""
+        return os.path.join(self._directory, f".{os.path.basename(model_dir)}.{field}.index")
+
+    def _write_field_index(self, model_dir: str, field: str, index: _FieldIndex) -> None:
+        """Persist an inverted index, values may not be strings, so it is written as pairs of a value and its keys."""
+        pairs = [[value, sorted(keys)] for value, keys in index.keys.items()]
+        self._write_json(self._field_index_path(model_dir, field), {"mtime_ns": index.mtime_ns, "keys": pairs})
+
+    def _load_field_index(self, model_dir: str, field: str, mtime_ns: int | None) -> _FieldIndex | None:
+        """Get the inverted index of a field as of the given directory modification time, from memory or from disk,
+        None if it is outdated or was never built. A directory that does not exist has an empty index."""
+        if mtime_ns is None:
+            return _FieldIndex(0, {})
+        path = self._field_index_path(model_dir, field)
+        index = _field_indexes.get(path)
+        if index is not None and index.mtime_ns == mtime_ns:
+            return index
+        try:
+            with open(path, "r", encoding="utf-8") as file:
+                persisted = json.load(file)
+        except (FileNotFoundError, ValueError):
+            return None
+        if persisted.get("mtime_ns") != mtime_ns:
+            return None
+        index = _FieldIndex(mtime_ns, dict(persisted["keys"]))
+        _field_indexes[path] = index
+        return index
+
+    def _indexed_keys(self, model: type[T], field: str, value: Any) -> set[str]:
+        """Get committed keys of a model whose indexed field has the given value. Indexes of all indexed fields are
+        built by reading all values when the one of the field is outdated."""
         model_dir = os.path.join(self._directory, model.__name__)
-        if not os.path.isdir(model_dir):
+        with _indexes_lock:
+            directory = self._index(model_dir)
+            if directory is None:
+                return set()
+            index = self._load_field_index(model_dir, field, directory.mtime_ns)
+            if index is None:
+                index = self._build_field_indexes(model_dir, model, directory)[field]
+            return set(index.keys.get(value, ()))
+
+    def _build_field_indexes(
+        self, model_dir: str, model: type[T], directory: _DirectoryIndex
+    ) -> dict[str, _FieldIndex]:
+        """Build inverted indexes of all indexed fields of a model directory and persist them."""
+        logger.debug("Indexing %s", model_dir)
+        fields = indexed_fields(model)
+        keys = sorted(directory.keys)
+        indexes = {field: _FieldIndex(directory.mtime_ns, {}) for field in fields}
+        for key, value in zip(keys, _parallel_map(self._read, [os.path.join(model_dir, key) for key in keys])):
+            if value is None:
+                continue
+            for field, field_value in index_values(self._codec.decode(value, model), fields).items():
+                indexes[field].update(key, field_value)
+        for field, index in indexes.items():
+            _field_indexes[self._field_index_path(model_dir, field)] = index
+            self._write_field_index(model_dir, field, index)
+        return indexes
+
+    @staticmethod
+    def _read(path: str) -> bytes | None:
+        """Read a file, None if it does not exist."""
+        try:
+            with open(path, "rb") as file:
+                return file.read()
+        except FileNotFoundError:
+            return None
+
+    def _stage_fields(self, path: str, model: type[BaseModel], value: BaseModel | None) -> None:
+        """Stage indexed fields of a written value (or the removal of a deleted one) to be committed to the indexes."""
+        fields = indexed_fields(model)
+        if fields:
+            self._pending_fields[path] = (model, index_values(value, fields) if value is not None else None)
+
+    def _stage(self, path: str, data: bytes | None) -> None:
+        """Stage a write (or a deletion if data is None) to be committed with the current transaction.
+        Staged files live outside of model directories, so that staging does not invalidate their indexes."""
+        temp = None
+        if data is not None:
+            staging = os.path.join(self._directory, STAGING_DIRECTORY)
+            os.makedirs(staging, exist_ok=True)
+            descriptor, temp = tempfile.mkstemp(prefix=TEMP_PREFIX, dir=staging)
+            with os.fdopen(descriptor, "wb") as file:
+                file.write(data)
+        previous = self._pending.get(path)
+        self._pending[path] = temp
+        if previous is not None:
+            os.remove(previous)
+
+    def _commit_transaction(self) -> None:
+        """Move all staged files in place, fsyncing them in one batch."""
+        pending, self._pending = self._pending, {}
+        pending_fields, self._pending_fields = self._pending_fields, {}
+        if not pending:
             return
-        yield from os.listdir(model_dir)
+        if self._fsync:
+            _parallel_map(_fsync, [temp for temp in pending.values() if temp is not None])
+        changes: dict[str, dict[str, bool]] = {}
+        for path, temp in pending.items():
+            changes.setdefault(os.path.dirname(path), {})[os.path.basename(path)] = temp is not None
+        with _indexes_lock:
+            mtimes_before = {model_dir: _mtime_ns(model_dir) for model_dir in changes}
+            for path, temp in pending.items():
+                if temp is not None:
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    os.replace(temp, path)
+                elif os.path.isfile(path):
+                    os.remove(path)
+            for model_dir, keys in changes.items():
+                self._update_index(model_dir, keys, mtimes_before[model_dir])
+            self._update_field_indexes(pending_fields, mtimes_before)
+        if self._fsync:
+            for model_dir in changes:
+                _fsync(model_dir)
 
-    def iter_values(self, model: type[T]) -> Iterable[T]:
-        """Iterate through all values in the store for a given model."""
-        yield from _nonone((self.get(key, model) for key in self.iter_keys(model)))
+    def _update_index(self, model_dir: str, changes: dict[str, bool], mtime_before: int | None) -> None:
+        """Apply committed changes to the index of a model directory, drop the index if it was outdated anyway."""
+        index = _indexes.get(model_dir)
+        if index is None:
+            return
+        if index.mtime_ns != mtime_before:
+            del _indexes[model_dir]
+            return
+        for key, present in changes.items():
+            if present:
+                index.keys.add(key)
+            else:
+                index.keys.discard(key)
+        index.mtime_ns = _mtime_ns(model_dir) or 0
+        if len(changes) > 1:
+            self._write_manifest(model_dir, index)
+
+    def _update_field_indexes(
+        self,
+        pending_fields: dict[str, tuple[type[BaseModel], dict[str, Any] | None]],
+        mtimes_before: dict[str, int | None],
+    ) -> None:
+        """Apply committed indexed fields to the indexes that were up to date, outdated ones are rebuilt when needed."""
+        changes: dict[tuple[str, type[BaseModel]], dict[str, dict[str, Any] | None]] = {}
+        for path, (model, values) in pending_fields.items():
+            changes.setdefault((os.path.dirname(path), model), {})[os.path.basename(path)] = values
+        for (model_dir, model), values_by_key in changes.items():
+            mtime_ns = _mtime_ns(model_dir) or 0
+            for field in indexed_fields(model):
+                index = self._load_field_index(model_dir, field, mtimes_before[model_dir])
+                if index is None:
+                    continue
+                for key, values in values_by_key.items():
+                    if values is None:
+                        index.discard(key)
+                    else:
+                        index.update(key, values[field])
+                index.mtime_ns = mtime_ns
+                _field_indexes[self._field_index_path(model_dir, field)] = index
+                self._write_field_index(model_dir, field, index)
+
+    def _rollback_transaction(self) -> None:
+        """Discard all staged files."""
+        self._pending_fields = {}
+        pending, self._pending = self._pending, {}
+        for temp in pending.values():
+            if temp is not None:
+                os.remove(temp)
+
+    def _keys(self, model_dir: str) -> list[str]:
+        """Get sorted keys of a model directory, including staged changes."""
+        index = self._index(model_dir)
+        with _indexes_lock:
+            keys = set(index.keys) if index else set()
+        for path, temp in self._pending.items():
+            if os.path.dirname(path) == model_dir:
+                if temp is None:
+                    keys.discard(os.path.basename(path))
+                else:
+                    keys.add(os.path.basename(path))
+        return sorted(keys)
+
+    def iter_keys(self, model: type[T], limit: int | None = None, after_key: str | None = None) -> Iterable[str]:
+        """Iterate through keys in the store for a given model, ordered by key."""
+        keys = self._keys(os.path.join(self._directory, model.__name__))
+        start = 0 if after_key is None else bisect_right(keys, after_key)
+        yield from islice(keys, start, None if limit is None else start + limit)
+
+    def iter_values(self, model: type[T], limit: int | None = None, after_key: str | None = None) -> Iterable[T]:
+        """Iterate through values in the store for a given model, ordered by key, reading files in parallel batches."""
+        keys = iter(self.iter_keys(model, limit, after_key))
+        while batch := list(islice(keys, READ_BATCH_SIZE)):
+            yield from _nonone(_parallel_map(self.get, batch, [model] * len(batch)))
 
     def get(self, key: str, model: type[T]) -> T | None:
         """Get a value from the store."""
-        key = self._get_key(key, model)
-        if not os.path.isfile(key):
+        path = self._get_key(key, model)
+        if path in self._pending:
+            source = self._pending[path]
+        else:
+            index = self._index(os.path.dirname(path))
+            # a file written by someone else within the mtime granularity of the directory is missing from the index
+            source = path if index is not None and (key in index.keys or os.path.isfile(path)) else None
+        if source is None:
             return None
-        with open(key, "r", encoding="utf-8") as file:
-            return model(**json.load(file))
+        data = self._read(source)
+        return self._codec.decode(data, model) if data is not None else None
+
+    def find(self, model: type[T], **filters: Any) -> Iterable[T]:
+        """Iterate through values of a model whose indexed fields equal the filters, ordered by key.
+        Keys are looked up in the inverted indexes, keys with writes staged within the transaction are checked by
+        their staged values."""
+        check_filters(model, filters)
+        if not filters:
+            return self.iter_values(model)
+        keys = set.intersection(*(self._indexed_keys(model, field, value) for field, value in filters.items()))
+        model_dir = os.path.join(self._directory, model.__name__)
+        staged = {os.path.basename(path) for path in self._pending if os.path.dirname(path) == model_dir}
+        return self._find(model, filters, sorted(keys | staged), staged)
+
+    def _find(self, model: type[T], filters: dict[str, Any], keys: list[str], staged: set[str]) -> Iterable[T]:
+        """Read values of the keys found in parallel batches, dropping staged values that do not match."""
+        keys_iterator = iter(keys)
+        while batch := list(islice(keys_iterator, READ_BATCH_SIZE)):
+            values: list[T | None] = _parallel_map(self.get, batch, [model] * len(batch))
+            for key, value in zip(batch, values):
+                if value is not None and (key not in staged or matches(value, filters)):
+                    yield value
 
     def set(self, key: str, value: BaseModel) -> None:
         """Set a value in the store."""
-        key = self._get_key(key, value)
-        os.makedirs(os.path.dirname(key), exist_ok=True)
-        with open(key, "w", encoding="utf-8") as file:
-            json.dump(value.model_dump(), file)
+        path = self._get_key(key, value)
+        with self.transaction():
+            self._stage(path, self._encode(value))
+            self._stage_fields(path, value.__class__, value)
 
     def delete(self, key: str, model: type[T]) -> None:
         """Delete a value from the store."""
-        key = self._get_key(key, model)
-        if os.path.isfile(key):
-            os.remove(key)
+        path = self._get_key(key, model)
+        with self.transaction():
+            self._stage(path, None)
+            self._stage_fields(path, model, None)
+
+    def get_many(self, keys: Iterable[str], model: type[T]) -> dict[str, T]:
+        """Get multiple values from the store, reading the files in parallel."""
+        keys = list(keys)
+        values: list[T | None] = _parallel_map(self.get, keys, [model] * len(keys))
+        return {key: value for key, value in zip(keys, values) if value is not None}
+
+    def set_many(self, values: Mapping[str, BaseModel]) -> None:
+        """Set multiple values in the store, writing the files in parallel and committing them together."""
+        paths = [self._get_key(key, value) for key, value in values.items()]
+        with self.transaction():
+            _parallel_map(self._stage, paths, [self._encode(value) for value in values.values()])
+            for path, value in zip(paths, values.values()):
+                self._stage_fields(path, value.__class__, value)
+
+    def delete_many(self, keys: Iterable[str], model: type[T]) -> None:
+        """Delete multiple values from the store, committing the deletions together."""
+        with self.transaction():
+            for key in keys:
+                self.delete(key, model)
@@ -0,0 +1,134 @@
+"""Instrumentation layer for any store.
+Calls of every store method are counted and timed in `photom_store_call_seconds`, labelled by backend, model and
+method, failed calls are counted in `photom_store_errors_total`. Iterations are timed while the wrapped store produces
+items, not while the caller handles them."""
+
+import time
+from contextlib import contextmanager
+from types import TracebackType
+from typing import Any, Callable, Iterable, Iterator, Mapping, TypeVar, cast
+
+from photom.metrics import counter, histogram
+from photom.models import BaseModel
+from photom.store.base import Store
+
+T = TypeVar("T", bound=BaseModel)
+R = TypeVar("R")
+
+CALL_SECONDS = histogram("photom_store_call_seconds", "Duration of store calls", ("backend", "model", "method"))
+ERRORS = counter("photom_store_errors_total", "Store calls that raised", ("backend", "model", "method"))
+
+
+def _model_name(values: Mapping[str, BaseModel]) -> str:
+    """Name of the model of the values, `mixed` if they are of more than one."""
+    names = {value.__class__.__name__ for value in values.values()}
+    return names.pop() if len(names) == 1 else "mixed"
+
+
+class InstrumentedStore(Store):
+    """Store wrapping another store, recording metrics of every call."""
+
+    def __init__(self, store: Store, backend: str | None = None, **kwargs):
+        """Initialize the store, metrics are labelled with the class name of the wrapped store unless `backend` is
+        given."""
+        self._store = store
+        self.backend = backend or store.__class__.__name__
+
+    @property
+    def store(self) -> Store:
+        """The wrapped store."""
+        return self._store
+
+    def __enter__(self) -> "InstrumentedStore":
+        """Enter the store context."""
+        self._store.__enter__()
+        return self
+
+    def __exit__(self, _exc_type: type[BaseException], _exc_val: BaseException, _exc_tb: TracebackType | None):
+        """Exit the store context."""
+        return self._store.__exit__(_exc_type, _exc_val, _exc_tb)
+
+    def _call(self, method: str, model: str, call: Callable[..., R], *args: Any) -> R:
+        """Make a call of the wrapped store and record it."""
+        start = time.perf_counter()
+        try:
+            return call(*args)
+        except Exception:
+            ERRORS.labels(self.backend, model, method).inc()
+            raise
+        finally:
+            CALL_SECONDS.labels(self.backend, model, method).observe(time.perf_counter() - start)
+
+    def _iterate(self, method: str, model: str, items: Iterable[R]) -> Iterator[R]:
+        """Iterate through items of the wrapped store, recording the time spent producing them as a single call."""
+        labels = (self.backend, model, method)
+        seconds = 0.0
+        try:
+            start = time.perf_counter()
+            iterator = iter(items)
+            seconds += time.perf_counter() - start
+            while True:
+                start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    seconds += time.perf_counter() - start
+                yield item
+        except Exception:
+            ERRORS.labels(*labels).inc()
+            raise
+        finally:
+            CALL_SECONDS.labels(*labels).observe(seconds)
+
+    def _commit_transaction(self) -> None:
+        """Nothing to do, the wrapped store commits its own transaction."""
+
+    def _rollback_transaction(self) -> None:
+        """Nothing to do, the wrapped store discards its own transaction."""
+
+    @contextmanager
+    def transaction(self) -> Iterator[None]:
+        """Group writes made within the context in a transaction of the wrapped store."""
+        with super().transaction(), self._store.transaction():
+            yield
+
+    def iter_keys(self, model: type[T], limit: int | None = None, after_key: str | None = None) -> Iterable[str]:
+        """Iterate through keys in the store for a given model, ordered by key."""
+        return self._iterate("iter_keys", model.__name__, self._store.iter_keys(model, limit, after_key))
+
+    def iter_values(self, model: type[T], limit: int | None = None, after_key: str | None = None) -> Iterable[T]:
+        """Iterate through values in the store for a given model, ordered by key."""
+        return self._iterate("iter_values", model.__name__, self._store.iter_values(model, limit, after_key))
+
+    def find(self, model: type[T], **filters: Any) -> Iterable[T]:
+        """Iterate through values of a model whose indexed fields equal the filters, ordered by key."""
+        return self._iterate("find", model.__name__, self._store.find(model, **filters))
+
+    def get(self, key: str, model: type[T]) -> T | None:
+        """Get a value from the store."""
+        return cast("T | None", self._call("get", model.__name__, self._store.get, key, model))
+
+    def set(self, key: str, value: BaseModel) -> None:
+        """Set a value in the store."""
+        self._call("set", value.__class__.__name__, self._store.set, key, value)
+
+    def delete(self, key: str, model: type[T]) -> None:
+        """Delete a value from the store."""
+        self._call("delete", model.__name__, self._store.delete, key, model)
+
+    def get_many(self, keys: Iterable[str], model: type[T]) -> dict[str, T]:
+        """Get multiple values from the store at once."""
+        return self._call("get_many", model.__name__, self._store.get_many, keys, model)
+
+    def set_many(self, values: Mapping[str, BaseModel]) -> None:
+        """Set multiple values in the store at once."""
+        self._call("set_many", _model_name(values), self._store.set_many, values)
+
+    def delete_many(self, keys: Iterable[str], model: type[T]) -> None:
+        """Delete multiple values from the store at once."""
+        self._call("delete_many", model.__name__, self._store.delete_many, keys, model)
+
+
+__all__ = ["InstrumentedStore"]
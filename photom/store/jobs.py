@@ -0,0 +1,239 @@
+"""Durable queue of background jobs, kept in the `jobs` table of the SQLite store database.
+Any number of worker processes claim jobs with a single `UPDATE ... RETURNING` statement in an immediate transaction,
+so a job is never handed to two workers at once. A claimed job is leased to its worker for `lease_seconds`, which the
+worker keeps extending with heartbeats while the job runs. Jobs whose lease ran out, because their worker died or
+hung, are queued again until they run out of attempts. The number of jobs in every status is exposed as
+`photom_jobs`."""
+
+import json
+import logging
+import time
+from contextlib import contextmanager
+from typing import Any, ContextManager, Iterator
+
+from photom.metrics import add_collector, gauge
+from photom.models import Job
+from photom.store.sqlite import DEFAULT_POOL_SIZE, SchemaConnection, borrow_connection, migration
+
+logger = logging.getLogger(__name__)
+
+TABLE = "jobs"
+DEFAULT_LEASE_SECONDS = 60.0
+DEFAULT_MAX_ATTEMPTS = 3
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+JOBS = gauge("photom_jobs", "Jobs in the queue, by status", ("status",))
+
+_COLUMNS = "id, kind, key, payload, status, attempts, created_at, finished_at, error, result"
+
+
+@migration(2)
+def _create_jobs(cursor) -> None:
+    """Create the table of jobs."""
+    cursor.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {TABLE} (
+            id INTEGER PRIMARY KEY,
+            kind TEXT NOT NULL,
+            key TEXT,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            lease_owner TEXT,
+            lease_expires REAL,
+            heartbeat_at REAL,
+            created_at REAL NOT NULL,
+            finished_at REAL,
+            error TEXT,
+            result TEXT
+        )
+        """
+    )
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS {TABLE}_queued ON {TABLE} (id) WHERE status = '{QUEUED}'")
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS {TABLE}_leases ON {TABLE} (lease_expires) WHERE status = '{RUNNING}'")
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS {TABLE}_keys ON {TABLE} (key) WHERE status = '{QUEUED}'")
+
+
+def _job(row: tuple) -> Job:
+    """Job of a row of `_COLUMNS`."""
+    job_id, kind, key, payload, status, attempts, created_at, finished_at, error, result = row
+    return Job(
+        id=job_id,
+        kind=kind,
+        key=key,
+        payload=json.loads(payload),
+        status=status,
+        attempts=attempts,
+        created_at=created_at,
+        finished_at=finished_at,
+        error=error,
+        result=json.loads(result) if result is not None else None,
+    )
+
+
+class JobQueue:
+    """Queue of jobs shared by all processes using the same SQLite database."""
+
+    def __init__(
+        self,
+        database: str,
+        pool_size: int = DEFAULT_POOL_SIZE,
+        pragmas: dict[str, Any] | None = None,
+        lease_seconds: float = DEFAULT_LEASE_SECONDS,
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+    ):  # pylint: disable=too-many-arguments
+        """Initialize the queue, connections are borrowed from the process-wide pool of the database."""
+        self._database = database
+        self._pool_size = pool_size
+        self._pragmas = pragmas
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        add_collector(self.collect_metrics)
+
+    def _connection(self) -> ContextManager[SchemaConnection]:
+        """Borrow a connection to the database of the queue."""
+        return borrow_connection(self._database, TABLE, self._pool_size, self._pragmas)
+
+    @contextmanager
+    def _transaction(self) -> Iterator[SchemaConnection]:
+        """Borrow a connection holding the write lock of the database until the block ends."""
+        with self._connection() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield connection
+            except BaseException:
+                connection.rollback()
+                raise
+            connection.commit()
+
+    def enqueue(self, kind: str, payload: dict[str, Any], key: str | None = None) -> Job:
+        """Add a job of the given kind, return it. A job with a `key` is only added if there is no queued job with the
+        same key yet, the queued one is returned otherwise."""
+        with self._transaction() as connection:
+            if key is not None:
+                row = connection.execute(
+                    f"SELECT {_COLUMNS} FROM {TABLE} WHERE key = ? AND status = '{QUEUED}' ORDER BY id LIMIT 1", (key,)
+                ).fetchone()
+                if row is not None:
+                    return _job(row)
+            row = connection.execute(
+                f"""
+                INSERT INTO {TABLE} (kind, key, payload, status, created_at)
+                VALUES (?, ?, ?, '{QUEUED}', ?)
+                RETURNING {_COLUMNS}
+                """,
+                (kind, key, json.dumps(payload), time.time()),
+            ).fetchone()
+        logger.debug("Enqueued %s job %d", kind, row[0])
+        return _job(row)
+
+    def _expire(self, connection: SchemaConnection, now: float) -> None:
+        """Queue jobs whose lease ran out again, or fail them once they are out of attempts."""
+        expired = connection.execute(
+            f"""
+            UPDATE {TABLE}
+            SET status = CASE WHEN attempts >= :max_attempts THEN '{FAILED}' ELSE '{QUEUED}' END,
+                finished_at = CASE WHEN attempts >= :max_attempts THEN :now END,
+                error = 'Lease of ' || lease_owner || ' expired',
+                lease_owner = NULL,
+                lease_expires = NULL
+            WHERE status = '{RUNNING}' AND lease_expires < :now
+            RETURNING id
+            """,
+            {"max_attempts": self.max_attempts, "now": now},
+        ).fetchall()
+        for (job_id,) in expired:
+            logger.warning("Lease of job %d expired", job_id)
+
+    def claim(self, owner: str) -> Job | None:
+        """Lease the oldest queued job to the owner, None if there is nothing to do."""
+        now = time.time()
+        with self._transaction() as connection:
+            self._expire(connection, now)
+            row = connection.execute(
+                f"""
+                UPDATE {TABLE}
+                SET status = '{RUNNING}', attempts = attempts + 1, lease_owner = ?, lease_expires = ?, heartbeat_at = ?
+                WHERE id = (SELECT id FROM {TABLE} WHERE status = '{QUEUED}' ORDER BY id LIMIT 1)
+                RETURNING {_COLUMNS}
+                """,
+                (owner, now + self.lease_seconds, now),
+            ).fetchone()
+        if row is None:
+            return None
+        logger.debug("Job %d claimed by %s", row[0], owner)
+        return _job(row)
+
+    def _update(self, job_id: int, owner: str, assignments: str, params: dict[str, Any]) -> bool:
+        """Update a job leased to the owner, return whether it still was."""
+        with self._connection() as connection:
+            updated = connection.execute(
+                f"""
+                UPDATE {TABLE} SET {assignments}
+                WHERE id = :id AND status = '{RUNNING}' AND lease_owner = :owner
+                """,
+                params | {"id": job_id, "owner": owner},
+            ).rowcount
+            connection.commit()
+        if not updated:
+            logger.warning("Job %d is no longer leased to %s", job_id, owner)
+        return bool(updated)
+
+    def heartbeat(self, job_id: int, owner: str) -> bool:
+        """Extend the lease of a running job, return False if the owner lost it."""
+        now = time.time()
+        return self._update(
+            job_id,
+            owner,
+            "lease_expires = :expires, heartbeat_at = :now",
+            {"expires": now + self.lease_seconds, "now": now},
+        )
+
+    def complete(self, job_id: int, owner: str, result: dict[str, Any] | None = None) -> bool:
+        """Mark a running job done, return False if the owner lost its lease."""
+        return self._update(
+            job_id,
+            owner,
+            f"status = '{DONE}', finished_at = :now, result = :result, error = NULL, lease_owner = NULL",
+            {"now": time.time(), "result": json.dumps(result) if result is not None else None},
+        )
+
+    def fail(self, job_id: int, owner: str, error: str, retry: bool = True) -> bool:
+        """Queue a failed job again if it may be retried and has attempts left, mark it failed otherwise. Return False
+        if the owner lost its lease."""
+        return self._update(
+            job_id,
+            owner,
+            f"""
+            status = CASE WHEN :retry AND attempts < :max_attempts THEN '{QUEUED}' ELSE '{FAILED}' END,
+            finished_at = CASE WHEN :retry AND attempts < :max_attempts THEN NULL ELSE :now END,
+            error = :error,
+            lease_owner = NULL,
+            lease_expires = NULL
+            """,
+            {"retry": retry, "max_attempts": self.max_attempts, "now": time.time(), "error": error},
+        )
+
+    def get(self, job_id: int) -> Job | None:
+        """Get a job by its ID."""
+        with self._connection() as connection:
+            row = connection.execute(f"SELECT {_COLUMNS} FROM {TABLE} WHERE id = ?", (job_id,)).fetchone()
+        return _job(row) if row is not None else None
+
+    def counts(self) -> dict[str, int]:
+        """Number of jobs in every status."""
+        with self._connection() as connection:
+            rows = connection.execute(f"SELECT status, COUNT(*) FROM {TABLE} GROUP BY status").fetchall()
+        return {status: 0 for status in (QUEUED, RUNNING, DONE, FAILED)} | dict(rows)
+
+    def collect_metrics(self) -> None:
+        """Set the gauge of jobs in every status."""
+        for status, count in self.counts().items():
+            JOBS.labels(status).set(count)
+
+
+__all__ = ["JobQueue"]
@@ -0,0 +1,70 @@
+"""Latest progress of syncs of every account, kept in the `progress` table of the SQLite store database so that worker
+processes running syncs share it with the API processes streaming it. Every state written takes the next version of the
+table, readers ask for the rows written since the last version they read, see `photom.progress`."""
+
+import logging
+from typing import Any, ContextManager, Iterable
+
+from photom.models import AccountProgress
+from photom.store.sqlite import DEFAULT_POOL_SIZE, SchemaConnection, borrow_connection, migration
+
+logger = logging.getLogger(__name__)
+
+TABLE = "progress"
+
+
+@migration(5)
+def _create_progress(cursor) -> None:
+    """Create the table of the latest progress of every account."""
+    cursor.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {TABLE} (
+            email TEXT PRIMARY KEY,
+            version INTEGER NOT NULL,
+            state TEXT NOT NULL
+        )
+        """
+    )
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS {TABLE}_version ON {TABLE} (version)")
+
+
+class ProgressLog:
+    """Latest progress of every account shared by all processes using the same SQLite database."""
+
+    def __init__(self, database: str, pool_size: int = DEFAULT_POOL_SIZE, pragmas: dict[str, Any] | None = None):
+        """Initialize the log, connections are borrowed from the process-wide pool of the database."""
+        self._database = database
+        self._pool_size = pool_size
+        self._pragmas = pragmas
+
+    def _connection(self) -> ContextManager[SchemaConnection]:
+        """Borrow a connection to the database of the log."""
+        return borrow_connection(self._database, TABLE, self._pool_size, self._pragmas)
+
+    def write(self, states: Iterable[AccountProgress]) -> None:
+        """Replace the progress of the accounts of the states, in one transaction."""
+        with self._connection() as connection:
+            # the version is read by the statement taking the write lock, so writers never share one
+            connection.executemany(
+                f"""
+                INSERT INTO {TABLE} (email, version, state)
+                VALUES (?, (SELECT coalesce(max(version), 0) + 1 FROM {TABLE}), ?)
+                ON CONFLICT (email) DO UPDATE SET version = excluded.version, state = excluded.state
+                """,
+                [(state.email, state.model_dump_json()) for state in states],
+            )
+            connection.commit()
+
+    def read(self, after: int = 0) -> tuple[int, list[AccountProgress]]:
+        """Get the progress of accounts written since version `after` in the order it was written, together with the
+        version to read from next time."""
+        with self._connection() as connection:
+            rows = connection.execute(
+                f"SELECT version, state FROM {TABLE} WHERE version > ? ORDER BY version", (after,)
+            ).fetchall()
+        if not rows:
+            return after, []
+        return rows[-1][0], [AccountProgress.model_validate_json(state) for _, state in rows]
+
+
+__all__ = ["ProgressLog"]
@@ -0,0 +1,339 @@
+"""Sharded SQLite store backend for photom.
+Values are spread over several SQLite databases, so that writes to different shards do not wait for the same write
+lock. Keys are routed by the account they belong to, the part before the first `:`, so all values of an account live
+in the same shard and transactions of a single account stay atomic. Accounts are assigned to shards by jump consistent
+hashing: when shards are added, only the accounts that move to the new shards change their shard.
+
+Shards are the files `<database>.shard<n>` next to the main database, which keeps the job queue, the dedup index and
+the number of shards the values are laid out for. A store refuses to open the database with a different number of
+shards, `python -m photom.store.sharded <database> --shards <n>` moves values to their new shards while no store is
+using the database."""
+
+import argparse
+import hashlib
+import heapq
+import logging
+import os
+import threading
+from contextlib import ExitStack, contextmanager
+from itertools import islice
+from operator import itemgetter
+from sqlite3 import Cursor
+from types import TracebackType
+from typing import Any, Iterable, Iterator, Mapping, TypeVar
+
+from photom.models import BaseModel
+from photom.store.base import Store
+from photom.store.codec import Codec
+from photom.store.sqlite import (
+    CHANGES_TABLE,
+    DEFAULT_POOL_SIZE,
+    STORE_SCHEMA,
+    SchemaConnection,
+    SQLiteStore,
+    borrow_connection,
+    migration,
+)
+
+T = TypeVar("T", bound=BaseModel)
+K = TypeVar("K")
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SHARDS = 4
+LAYOUT_TABLE = "store_shards"
+REBALANCE_BATCH_SIZE = 1000
+
+# numbers of shards each database was checked to be laid out for by this process
+_layouts: dict[str, int] = {}
+_layouts_lock = threading.Lock()
+
+
+@migration(4)
+def _create_store_shards(cursor: Cursor) -> None:
+    """Create the table keeping the number of shards values are laid out for, and the number they are being moved to
+    while a rebalance runs."""
+    cursor.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {LAYOUT_TABLE} (
+            id INTEGER PRIMARY KEY CHECK (id = 0),
+            shards INTEGER NOT NULL,
+            rebalancing_to INTEGER
+        )
+        """
+    )
+
+
+def shard_path(database: str, index: int) -> str:
+    """Path of a shard of a database, shards of an in-memory database are in memory as well."""
+    return database if database == ":memory:" else f"{database}.shard{index}"
+
+
+def jump_hash(key: int, buckets: int) -> int:
+    """Jump consistent hash of a 64-bit key to one of the buckets, growing the buckets from n to n + 1 only moves keys
+    to the new bucket."""
+    bucket, jump = -1, 0
+    while jump < buckets:
+        bucket = jump
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        jump = int((bucket + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return bucket
+
+
+def shard_of(key: str, shards: int) -> int:
+    """Shard of a key, by the account it belongs to."""
+    account = key.partition(":")[0]
+    return jump_hash(int.from_bytes(hashlib.blake2b(account.encode("utf-8"), digest_size=8).digest(), "little"), shards)
+
+
+def _read_layout(connection: SchemaConnection) -> tuple[int, int | None] | None:
+    """Number of shards of the database and the number it is being rebalanced to, None if it was never sharded."""
+    return connection.execute(f"SELECT shards, rebalancing_to FROM {LAYOUT_TABLE}").fetchone()
+
+
+def check_layout(
+    database: str, shards: int, pool_size: int = DEFAULT_POOL_SIZE, pragmas: dict[str, Any] | None = None
+) -> None:
+    """Make sure values of a database are laid out for the number of shards, a database used for the first time is
+    laid out for it. Each database is only checked once per process."""
+    with _layouts_lock:
+        if _layouts.get(database) == shards:
+            return
+        with borrow_connection(database, LAYOUT_TABLE, pool_size, pragmas) as connection:
+            connection.execute(f"INSERT OR IGNORE INTO {LAYOUT_TABLE} (id, shards) VALUES (0, ?)", (shards,))
+            connection.commit()
+            current, rebalancing_to = _read_layout(connection) or (shards, None)
+        if rebalancing_to is not None:
+            raise RuntimeError(f"Shards of {database} are being rebalanced from {current} to {rebalancing_to}")
+        if current != shards:
+            raise RuntimeError(
+                f"{database} is laid out for {current} shards, not {shards}, "
+                f"rebalance it with `python -m photom.store.sharded {database} --shards {shards}`"
+            )
+        _layouts[database] = shards
+
+
+class ShardedSQLiteStore(Store):
+    """SQLite store backend spreading values over several databases by their accounts.
+    Each shard is a `SQLiteStore` holding a connection of its own while the store is entered. Transactions span all
+    shards, each shard commits its part on its own, so they are only atomic within a shard."""
+
+    def __init__(
+        self,
+        database: str,
+        shards: int = DEFAULT_SHARDS,
+        pool_size: int = DEFAULT_POOL_SIZE,
+        pragmas: dict[str, Any] | None = None,
+        codec: Codec | None = None,
+        track_changes: bool = False,
+        **kwargs,
+    ):  # pylint: disable=too-many-arguments
+        """Initialize the store with `shards` shards of the database, the other arguments apply to each of them."""
+        if shards < 1:
+            raise ValueError("A sharded store needs at least one shard")
+        self._database = database
+        self._pool_size = pool_size
+        self._pragmas = pragmas
+        self._shards = [
+            SQLiteStore(shard_path(database, index), pool_size, pragmas, codec, track_changes, **kwargs)
+            for index in range(shards)
+        ]
+
+    @property
+    def shards(self) -> list[SQLiteStore]:
+        """Stores of the shards, in shard order."""
+        return self._shards
+
+    def __enter__(self) -> "ShardedSQLiteStore":
+        """Enter the store context, connecting to every shard."""
+        if self._database != ":memory:":
+            check_layout(self._database, len(self._shards), self._pool_size, self._pragmas)
+        entered: list[SQLiteStore] = []
+        try:
+            for shard in self._shards:
+                shard.__enter__()
+                entered.append(shard)
+        except BaseException as error:
+            for shard in entered:
+                shard.__exit__(type(error), error, error.__traceback__)
+            raise
+        return self
+
+    def __exit__(self, _exc_type: type[BaseException], _exc_val: BaseException, _exc_tb: TracebackType | None):
+        """Exit the store context."""
+        for shard in self._shards:
+            shard.__exit__(_exc_type, _exc_val, _exc_tb)
+
+    def _shard(self, key: str) -> SQLiteStore:
+        """Store of the shard of a key."""
+        return self._shards[shard_of(key, len(self._shards))]
+
+    def _group(self, items: Iterable[tuple[str, K]]) -> dict[SQLiteStore, dict[str, K]]:
+        """Group items by the shards of their keys."""
+        groups: dict[SQLiteStore, dict[str, K]] = {}
+        for key, item in items:
+            groups.setdefault(self._shard(key), {})[key] = item
+        return groups
+
+    def _commit_transaction(self) -> None:
+        """Nothing to do, every shard commits its own transaction."""
+
+    def _rollback_transaction(self) -> None:
+        """Nothing to do, every shard discards its own transaction."""
+
+    @contextmanager
+    def transaction(self) -> Iterator[None]:
+        """Group writes made within the context in a transaction of every shard."""
+        with super().transaction(), ExitStack() as stack:
+            for shard in self._shards:
+                stack.enter_context(shard.transaction())
+            yield
+
+    def iter_keys(self, model: type[T], limit: int | None = None, after_key: str | None = None) -> Iterable[str]:
+        """Iterate through keys in the store for a given model, ordered by key, merging keys of all shards."""
+        return islice(heapq.merge(*(shard.iter_keys(model, limit, after_key) for shard in self._shards)), limit)
+
+    def iter_values(self, model: type[T], limit: int | None = None, after_key: str | None = None) -> Iterable[T]:
+        """Iterate through values in the store for a given model, ordered by key, merging values of all shards."""
+        items = heapq.merge(*(shard.iter_items(model, limit, after_key) for shard in self._shards), key=itemgetter(0))
+        return (value for _, value in islice(items, limit))
+
+    def find(self, model: type[T], **filters: Any) -> Iterable[T]:
+        """Iterate through values of a model whose indexed fields equal the filters, ordered by key, merging values
+        found in all shards."""
+        items = heapq.merge(*(shard.find_items(model, **filters) for shard in self._shards), key=itemgetter(0))
+        return (value for _, value in items)
+
+    def get(self, key: str, model: type[T]) -> T | None:
+        """Get a value from the store."""
+        return self._shard(key).get(key, model)
+
+    def set(self, key: str, value: BaseModel) -> None:
+        """Set a value in the store."""
+        self._shard(key).set(key, value)
+
+    def delete(self, key: str, model: type[T]) -> None:
+        """Delete a value from the store."""
+        self._shard(key).delete(key, model)
+
+    def get_many(self, keys: Iterable[str], model: type[T]) -> dict[str, T]:
+        """Get multiple values from the store, with one query per shard and batch of keys."""
+        result: dict[str, T] = {}
+        for shard, shard_keys in self._group((key, None) for key in keys).items():
+            result.update(shard.get_many(shard_keys, model))
+        return result
+
+    def set_many(self, values: Mapping[str, BaseModel]) -> None:
+        """Set multiple values in the store, within a transaction of every shard they belong to."""
+        with self.transaction():
+            for shard, shard_values in self._group(values.items()).items():
+                shard.set_many(shard_values)
+
+    def delete_many(self, keys: Iterable[str], model: type[T]) -> None:
+        """Delete multiple values from the store, within a transaction of every shard they belong to."""
+        with self.transaction():
+            for shard, shard_keys in self._group((key, None) for key in keys).items():
+                shard.delete_many(shard_keys, model)
+
+
+def _model_tables(connection: SchemaConnection) -> list[str]:
+    """Names of the model tables of a shard, the tables whose first columns are a key and a value."""
+    tables = []
+    for (table,) in connection.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name"
+    ).fetchall():
+        columns = [row[1] for row in connection.execute(f"PRAGMA table_info({table})")]
+        if columns[:2] == ["key", "value"]:
+            tables.append(table)
+    return tables
+
+
+def _move(database: str, table: str, rows: list[tuple[str, Any]], pool_size: int) -> None:
+    """Write rows of a model table to a shard, overwriting rows a previous run already moved."""
+    with borrow_connection(database, CHANGES_TABLE, pool_size, schema=STORE_SCHEMA) as connection:
+        connection.execute(f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, value TEXT)")
+        connection.executemany(
+            f"INSERT INTO {table} (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value=excluded.value", rows
+        )
+        connection.commit()
+
+
+def _rebalance_shard(  # pylint: disable=too-many-arguments
+    database: str, index: int, shards: int, table: str, pool_size: int, batch_size: int
+) -> int:
+    """Move rows of a model table of a shard that belong to other shards, a batch at a time.
+    Rows are written to their new shard before they are deleted, so an interrupted run loses nothing."""
+    moved, after = 0, ""
+    with borrow_connection(shard_path(database, index), CHANGES_TABLE, pool_size, schema=STORE_SCHEMA) as source:
+        while rows := source.execute(
+            f"SELECT key, value FROM {table} WHERE key > ? ORDER BY key LIMIT ?", (after, batch_size)
+        ).fetchall():
+            after = rows[-1][0]
+            targets: dict[int, list[tuple[str, Any]]] = {}
+            for key, value in rows:
+                if (target := shard_of(key, shards)) != index:
+                    targets.setdefault(target, []).append((key, value))
+            for target, target_rows in targets.items():
+                _move(shard_path(database, target), table, target_rows, pool_size)
+                source.executemany(f"DELETE FROM {table} WHERE key = ?", ((key,) for key, _ in target_rows))
+                source.commit()
+                moved += len(target_rows)
+    return moved
+
+
+def rebalance(
+    database: str, shards: int, pool_size: int = DEFAULT_POOL_SIZE, batch_size: int = REBALANCE_BATCH_SIZE
+) -> int:
+    """Move values of a sharded database to their shards among `shards` shards and lay it out for them, return the
+    number of values moved. No store may use the database meanwhile, stores refuse to open it until the rebalance
+    completed. An interrupted rebalance is resumed by running it again."""
+    if shards < 1:
+        raise ValueError("A sharded store needs at least one shard")
+    with borrow_connection(database, LAYOUT_TABLE, pool_size) as connection:
+        current, rebalancing_to = _read_layout(connection) or (shards, None)
+        connection.execute(
+            f"""
+            INSERT INTO {LAYOUT_TABLE} (id, shards, rebalancing_to) VALUES (0, ?, ?)
+            ON CONFLICT(id) DO UPDATE SET rebalancing_to = excluded.rebalancing_to
+            """,
+            (current, shards),
+        )
+        connection.commit()
+    with _layouts_lock:
+        _layouts.pop(database, None)
+    logger.info("Rebalancing %s from %d to %d shards", database, current, shards)
+    moved = 0
+    for index in range(max(current, rebalancing_to or 0, shards)):
+        if not os.path.exists(shard_path(database, index)):
+            continue
+        with borrow_connection(
+            shard_path(database, index), CHANGES_TABLE, pool_size, schema=STORE_SCHEMA
+        ) as connection:
+            tables = _model_tables(connection)
+        for table in tables:
+            moved += _rebalance_shard(database, index, shards, table, pool_size, batch_size)
+    with borrow_connection(database, LAYOUT_TABLE, pool_size) as connection:
+        connection.execute(f"UPDATE {LAYOUT_TABLE} SET shards = ?, rebalancing_to = NULL", (shards,))
+        connection.commit()
+    for index in range(shards, current):
+        logger.info("Shard %s is empty and can be removed", shard_path(database, index))
+    logger.info("Rebalanced %s to %d shards, %d values moved", database, shards, moved)
+    return moved
+
+
+def main(argv: list[str] | None = None) -> None:
+    """Rebalance a sharded database."""
+    parser = argparse.ArgumentParser(prog="python -m photom.store.sharded", description=main.__doc__)
+    parser.add_argument("database", help="path of the main database, STORE_BACKEND_PATH")
+    parser.add_argument("--shards", type=int, required=True, help="number of shards to lay values out for")
+    parser.add_argument("--batch-size", type=int, default=REBALANCE_BATCH_SIZE, help="rows moved at once")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    rebalance(args.database, args.shards, batch_size=args.batch_size)
+
+
+__all__ = ["ShardedSQLiteStore", "check_layout", "rebalance", "shard_of", "shard_path"]
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,127 @@
-"""SQLite store backend for photom."""
+"""SQLite store backend for photom.
+Tables besides those of models are created by migrations, each belonging to a schema: `STORE_SCHEMA` is migrated in
+every database holding model tables, shards of a sharded store included, `MAIN_SCHEMA` only in the main database, which
+keeps the job queue, the dedup index, the progress log and the layout of shards.
+With `track_changes`, every write to a model table is recorded by triggers in the `store_changes` log, so that
+processes sharing the database can tell which cached values went stale, see `photom.store.coherence`.
+Indexed fields of a model are generated columns of its table, extracted from JSON values, each with an index of its
+own, so `find` is a single indexed query."""
 
-import json
 import logging
+import sqlite3
+import threading
+import time
 from contextlib import contextmanager
-from sqlite3 import Connection
+from itertools import islice
+from queue import Empty, Full, LifoQueue
+from sqlite3 import Connection, Cursor
 from types import TracebackType
-from typing import Iterable, TypeVar
+from typing import Any, Callable, Iterable, Iterator, Mapping, TypeVar
 
 from photom.models import BaseModel
-from photom.store.base import Store
+from photom.store.base import Store, check_filters, indexed_fields, matches
+from photom.store.codec import Codec, JSONCodec
 
 T = TypeVar("T", bound=BaseModel)
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_POOL_SIZE = 8
+FETCH_BATCH_SIZE = 256
+# keep well below SQLITE_MAX_VARIABLE_NUMBER, which is only 999 in older SQLite builds
+MAX_QUERY_VARIABLES = 500
+DEFAULT_PRAGMAS: dict[str, Any] = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -16000,
+    "mmap_size": 0,
+}
+
+CHANGES_TABLE = "store_changes"
+# changes kept in the log, processes that fall further behind drop their whole cache
+CHANGES_KEPT = 10000
+
+MIGRATIONS_TABLE = "schema_migrations"
+
+MAIN_SCHEMA = "main"
+STORE_SCHEMA = "store"
+
+Migration = Callable[[Cursor], None]
+
+# schemas and migrations by version, versions are unique across schemas
+_migrations: dict[int, tuple[str, Migration]] = {}
+
+
+def migration(version: int, schema: str = MAIN_SCHEMA) -> Callable[[Migration], Migration]:
+    """A decorator registering a migration of a schema.
+    Migrations of a schema are applied in version order when a connection to a database is first used with the schema,
+    and recorded in its `schema_migrations` table, so every migration registered in the process is applied once,
+    whatever was registered when the database was migrated before. Migrations use `IF NOT EXISTS`, so that databases
+    migrated before the table was kept are migrated again safely."""
+
+    def decorator(func: Migration) -> Migration:
+        if version in _migrations:
+            raise ValueError(f"Migration {version} is already registered")
+        _migrations[version] = (schema, func)
+        return func
+
+    return decorator
+
+
+def _applied_migrations(connection: Connection) -> set[int]:
+    """Versions of the migrations applied to the connected database."""
+    exists = connection.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (MIGRATIONS_TABLE,)
+    ).fetchone()
+    if exists is None:
+        return set()
+    return {version for (version,) in connection.execute(f"SELECT version FROM {MIGRATIONS_TABLE}")}
+
+
+def _migrate(connection: Connection, schema: str) -> None:
+    """Apply migrations of the schema not applied to the connected database yet."""
+    versions = {version for version, (migrated, _) in _migrations.items() if migrated == schema}
+    if versions <= _applied_migrations(connection):
+        return
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        cursor = connection.cursor()
+        cursor.execute(
+            f"CREATE TABLE IF NOT EXISTS {MIGRATIONS_TABLE} (version INTEGER PRIMARY KEY, applied_at REAL NOT NULL)"
+        )
+        # another connection may have migrated the database while we were waiting for the lock
+        for version in sorted(versions - _applied_migrations(connection)):
+            logger.info("Applying migration %d of the %s schema", version, schema)
+            _migrations[version][1](cursor)
+            cursor.execute(
+                f"INSERT INTO {MIGRATIONS_TABLE} (version, applied_at) VALUES (?, ?)", (version, time.time())
+            )
+        cursor.close()
+    except BaseException:
+        connection.rollback()
+        raise
+    connection.commit()
+
+
+@migration(3, STORE_SCHEMA)
+def _create_store_changes(cursor: Cursor) -> None:
+    """Create the log of writes to model tables, trimmed to the last `CHANGES_KEPT` changes."""
+    cursor.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {CHANGES_TABLE} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            model TEXT NOT NULL,
+            key TEXT NOT NULL
+        )
+        """
+    )
+    cursor.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {CHANGES_TABLE}_trim AFTER INSERT ON {CHANGES_TABLE}
+        BEGIN DELETE FROM {CHANGES_TABLE} WHERE id <= NEW.id - {CHANGES_KEPT}; END
+        """
+    )
+
 
 def _find_model_in_args(*args, **kwargs) -> type[BaseModel] | None:
     """Find a model in the arguments."""
@@ -30,8 +138,19 @@ def _find_model_in_args(*args, **kwargs) -> type[BaseModel] | None:
     raise RuntimeError("No model found in arguments")  # pragma: no cover
 
 
+def index_column(field: str) -> str:
+    """Name of the generated column holding an indexed field, dots of fields of nested models become underscores."""
+    return f"idx_{field.replace('.', '_')}"
+
+
+def index_name(table: str, field: str) -> str:
+    """Name of the index on an indexed field of a model table."""
+    return f"{table}_{index_column(field)}"
+
+
 def ensure_table(func):
-    """A decorator for methods to make sure the table exists."""
+    """A decorator for methods to make sure the table exists.
+    Tables already known to the connection are skipped without touching the database."""
 
     def wrapper(self: "SQLiteStore", *args, **kwargs):
         model = _find_model_in_args(*args, **kwargs)
@@ -42,18 +161,174 @@ def ensure_table(func):
     return wrapper
 
 
-class SQLiteStore(Store):
-    """SQLite store backend for photom."""
+class SchemaConnection(Connection):  # pylint: disable=too-few-public-methods
+    """A connection remembering which tables exist in its database, and which schemas it was migrated to."""
+
+    known_tables: set[str]
+    tracked_tables: set[str]
+    known_indexes: set[str]
+    schemas: set[str]
+
+    def load_schema(self) -> None:
+        """Load names of all existing tables and indexes, and of tables whose writes are logged, in one query."""
+        self.known_tables, self.tracked_tables, self.known_indexes = set(), set(), set()
+        for kind, name, table in self.execute(
+            "SELECT type, name, tbl_name FROM sqlite_master WHERE type IN ('table', 'trigger', 'index')"
+        ):
+            if kind == "table":
+                self.known_tables.add(name)
+            elif kind == "index":
+                self.known_indexes.add(name)
+            elif name == f"{table}_changes_insert":
+                self.tracked_tables.add(table)
+
+
+class ConnectionPool:
+    """A pool of long-lived connections to a single SQLite database.
+
+    Connections are created lazily, configured with the given pragmas, migrated and kept around for reuse.
+    At most `size` idle connections are retained, borrowing never blocks - if there is no idle connection, a new one
+    is opened.
+    In-memory databases are private to their connection, so their connections are never retained.
+    """
+
+    def __init__(
+        self, database: str, size: int = DEFAULT_POOL_SIZE, pragmas: dict[str, Any] | None = None, **connection_kwargs
+    ):
+        """Initialize the pool."""
+        self._database = database
+        self._pragmas = DEFAULT_PRAGMAS | {key: value for key, value in (pragmas or {}).items() if value is not None}
+        self._connection_kwargs = {"check_same_thread": False, **connection_kwargs}
+        self._idle: LifoQueue[SchemaConnection] = LifoQueue(maxsize=0 if self.in_memory else max(size, 1))
+        self._closed = False
+
+    @property
+    def in_memory(self) -> bool:
+        """Whether the pooled database lives in memory only."""
+        return self._database == ":memory:"
+
+    def _connect(self) -> SchemaConnection:
+        """Open and configure a new connection."""
+        connection = SchemaConnection(self._database, **self._connection_kwargs)
+        for pragma, value in self._pragmas.items():
+            connection.execute(f"PRAGMA {pragma}={value}")
+        connection.schemas = set()
+        connection.load_schema()
+        logger.info("Opened connection to database %s", self._database)
+        return connection
+
+    def acquire(self, schema: str = MAIN_SCHEMA) -> SchemaConnection:
+        """Borrow a connection from the pool, its database migrated to the schema."""
+        if self._closed:
+            raise RuntimeError(f"Connection pool for {self._database} is closed")
+        try:
+            connection = self._idle.get_nowait()
+        except Empty:
+            connection = self._connect()
+        if schema not in connection.schemas:
+            try:
+                _migrate(connection, schema)
+            except BaseException:
+                self.release(connection)
+                raise
+            connection.load_schema()
+            connection.schemas.add(schema)
+        return connection
+
+    def release(self, connection: SchemaConnection) -> None:
+        """Return a borrowed connection to the pool."""
+        if connection.in_transaction:
+            connection.rollback()
+        if self.in_memory or self._closed:
+            connection.close()
+            return
+        try:
+            self._idle.put_nowait(connection)
+        except Full:
+            connection.close()
+
+    def close(self) -> None:
+        """Close all idle connections and refuse further borrowing."""
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except Empty:
+                break
+        logger.info("Closed connection pool for database %s", self._database)
+
 
-    def __init__(self, database: str, **kwargs):
-        """Initialize the store."""
+_pools: dict[str, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(
+    database: str, size: int = DEFAULT_POOL_SIZE, pragmas: dict[str, Any] | None = None, **connection_kwargs
+) -> ConnectionPool:
+    """Get the process-wide connection pool for a database, creating it on first use."""
+    with _pools_lock:
+        if database not in _pools:
+            _pools[database] = ConnectionPool(database, size, pragmas, **connection_kwargs)
+        return _pools[database]
+
+
+def close_pools() -> None:
+    """Close all process-wide connection pools."""
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
+
+
+@contextmanager
+def borrow_connection(
+    database: str,
+    table: str,
+    size: int = DEFAULT_POOL_SIZE,
+    pragmas: dict[str, Any] | None = None,
+    schema: str = MAIN_SCHEMA,
+) -> Iterator[SchemaConnection]:
+    """Borrow a connection from the process-wide pool of a database, migrated to the schema, for as long as the block
+    runs. Connections migrated before the migration creating `table` was registered are migrated again first."""
+    pool = get_pool(database, size, pragmas)
+    connection = pool.acquire(schema)
+    try:
+        if table not in connection.known_tables:
+            _migrate(connection, schema)
+            connection.load_schema()
+        yield connection
+    finally:
+        pool.release(connection)
+
+
+class SQLiteStore(Store):  # pylint: disable=too-many-instance-attributes
+    """SQLite store backend for photom.
+    With `track_changes`, every write to a model table is recorded by triggers in the `store_changes` log, so that
+    processes sharing the database can tell which cached values went stale, see `photom.store.coherence`."""
+
+    def __init__(
+        self,
+        database: str,
+        pool_size: int = DEFAULT_POOL_SIZE,
+        pragmas: dict[str, Any] | None = None,
+        codec: Codec | None = None,
+        track_changes: bool = False,
+        **kwargs,
+    ):  # pylint: disable=too-many-arguments
+        """Initialize the store, with `track_changes` writes to model tables are recorded in the change log."""
         self._database = database
-        self._conn: Connection | None = None
+        self._conn: SchemaConnection | None = None
+        self._pool: ConnectionPool | None = None
+        self._pool_size = pool_size
+        self._pragmas = pragmas
+        self._codec = codec or JSONCodec()
+        self._track_changes = track_changes
         self._connection_kwargs = kwargs
 
     def __enter__(self):
         """Enter the store context."""
-        self._conn = Connection(self._database, **self._connection_kwargs)
+        self._pool = get_pool(self._database, self._pool_size, self._pragmas, **self._connection_kwargs)
+        self._conn = self._pool.acquire(STORE_SCHEMA)
         return self
 
     def __exit__(self, _exc_type: type[BaseException], _exc_val: BaseException, _exc_tb: TracebackType | None):
@@ -61,46 +336,154 @@ class SQLiteStore(Store):
         self._close()
 
     @property
-    def _connection(self):
+    def _connection(self) -> SchemaConnection:
         """Get the connection."""
         if self._conn:
             return self._conn
         raise RuntimeError("Connection is not established, use with statement")
 
     def _close(self):
-        """Close the connection."""
-        if self._conn:
-            self._conn.close()
-            logger.info("Closed connection to database %s", self._database)
+        """Return the connection to the pool."""
+        if self._conn and self._pool:
+            self._pool.release(self._conn)
+        self._conn = None
 
     @contextmanager
     def provide_cursor(self):
         """Provide a cursor to the store."""
         cursor = self._connection.cursor()
-        yield cursor
-        cursor.close()
+        try:
+            yield cursor
+        finally:
+            cursor.close()
+
+    def _commit_transaction(self) -> None:
+        """Commit the transaction."""
+        self._connection.commit()
+
+    def _rollback_transaction(self) -> None:
+        """Roll the transaction back."""
+        self._connection.rollback()
+        # tables created within the transaction are gone as well
+        self._connection.load_schema()
+
+    def _commit(self) -> None:
+        """Commit, unless there is a transaction in progress that will commit on its own."""
+        if not self.in_transaction:
+            self._connection.commit()
 
     def _create_model_table(self, model: type[BaseModel]) -> None:
-        """Create a table for a model."""
+        """Create a table for a model, with indexes on its indexed fields and triggers logging writes to it if changes
+        are tracked."""
+        table = model.__name__
+        connection = self._connection
+        missing = [field for field in indexed_fields(model) if index_name(table, field) not in connection.known_indexes]
+        if (
+            table in connection.known_tables
+            and (not self._track_changes or table in connection.tracked_tables)
+            and not missing
+        ):
+            return
         with self.provide_cursor() as cursor:
-            cursor.execute(f"CREATE TABLE IF NOT EXISTS {model.__name__} (key TEXT PRIMARY KEY, value TEXT)")
-            self._connection.commit()
+            cursor.execute(f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, value TEXT)")
+            for field in missing:
+                self._create_index(cursor, table, field)
+                connection.known_indexes.add(index_name(table, field))
+            if self._track_changes:
+                for event, row in (("INSERT", "NEW"), ("UPDATE", "NEW"), ("DELETE", "OLD")):
+                    cursor.execute(
+                        f"""
+                        CREATE TRIGGER IF NOT EXISTS {table}_changes_{event.lower()} AFTER {event} ON {table}
+                        BEGIN INSERT INTO {CHANGES_TABLE} (model, key) VALUES ('{table}', {row}.key); END
+                        """
+                    )
+                connection.tracked_tables.add(table)
+            self._commit()
+        connection.known_tables.add(table)
+
+    @staticmethod
+    def _create_index(cursor: Cursor, table: str, field: str) -> None:
+        """Add the generated column of an indexed field and index it along with keys, so that found values come in key
+        order. Values of other codecs than JSON are stored as blobs and left out of the column."""
+        column = index_column(field)
+        try:
+            cursor.execute(
+                f"""
+                ALTER TABLE {table} ADD COLUMN {column} GENERATED ALWAYS AS
+                (CASE WHEN typeof(value) = 'text' THEN json_extract(value, '$.{field}') END) VIRTUAL
+                """
+            )
+        except sqlite3.OperationalError as error:
+            # the column is there if another connection indexed the field meanwhile
+            if "duplicate column name" not in str(error):
+                raise
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {index_name(table, field)} ON {table} ({column}, key)")
+
+    def _iter_column(
+        self, model: type[T], column: str, limit: int | None, after_key: str | None
+    ) -> Iterable[tuple[Any, ...]]:
+        """Iterate through rows of a single column in key order, fetching them in batches.
+        The cursor stays open for as long as the iteration goes on."""
+        query = f"SELECT {column} FROM {model.__name__}"
+        params: list[Any] = []
+        if after_key is not None:
+            query += " WHERE key > ?"
+            params.append(after_key)
+        query += " ORDER BY key"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        with self.provide_cursor() as cursor:
+            cursor.execute(query, params)
+            while rows := cursor.fetchmany(FETCH_BATCH_SIZE):
+                yield from rows
 
     @ensure_table
-    def iter_keys(self, model: type[T]) -> Iterable[str]:
-        """Iterate through all keys in the store for a given model."""
+    def iter_keys(self, model: type[T], limit: int | None = None, after_key: str | None = None) -> Iterable[str]:
+        """Iterate through keys in the store for a given model, ordered by key."""
         logger.debug("Listing keys for %s", model.__name__)
-        with self.provide_cursor() as cursor:
-            cursor.execute(f"SELECT key FROM {model.__name__}")
-            yield from (row[0] for row in cursor.fetchall())
+        return (row[0] for row in self._iter_column(model, "key", limit, after_key))
 
     @ensure_table
-    def iter_values(self, model: type[T]) -> Iterable[T]:
-        """Iterate through all values in the store for a given model."""
+    def iter_values(self, model: type[T], limit: int | None = None, after_key: str | None = None) -> Iterable[T]:
+        """Iterate through values in the store for a given model, ordered by key."""
         logger.debug("Listing values for %s", model.__name__)
+        return (self._codec.decode(row[0], model) for row in self._iter_column(model, "value", limit, after_key))
+
+    @ensure_table
+    def iter_items(
+        self, model: type[T], limit: int | None = None, after_key: str | None = None
+    ) -> Iterable[tuple[str, T]]:
+        """Iterate through keys and values in the store for a given model, ordered by key."""
+        logger.debug("Listing items for %s", model.__name__)
+        return (
+            (key, self._codec.decode(value, model))
+            for key, value in self._iter_column(model, "key, value", limit, after_key)
+        )
+
+    def find(self, model: type[T], **filters: Any) -> Iterable[T]:
+        """Iterate through values of a model whose indexed fields equal the filters, ordered by key."""
+        return (value for _, value in self.find_items(model, **filters))
+
+    @ensure_table
+    def find_items(self, model: type[T], **filters: Any) -> Iterable[tuple[str, T]]:
+        """Iterate through keys and values of a model whose indexed fields equal the filters, ordered by key.
+        Values written by other codecs than JSON are not indexed, so stores using them scan all values instead."""
+        check_filters(model, filters)
+        if not isinstance(self._codec, JSONCodec):
+            return ((key, value) for key, value in self.iter_items(model) if matches(value, filters))
+        logger.debug("Finding %s by %s", model.__name__, ", ".join(filters))
+        return self._find(model, filters)
+
+    def _find(self, model: type[T], filters: Mapping[str, Any]) -> Iterable[tuple[str, T]]:
+        """Query values by the indexed columns, fetching them in batches."""
+        query = f"SELECT key, value FROM {model.__name__}"
+        if filters:
+            query += " WHERE " + " AND ".join(f"{index_column(field)} IS ?" for field in filters)
         with self.provide_cursor() as cursor:
-            cursor.execute(f"SELECT value FROM {model.__name__}")
-            yield from (model(**json.loads(row[0])) for row in cursor.fetchall())
+            cursor.execute(query + " ORDER BY key", list(filters.values()))
+            while rows := cursor.fetchmany(FETCH_BATCH_SIZE):
+                yield from ((key, self._codec.decode(value, model)) for key, value in rows)
 
     @ensure_table
     def get(self, key: str, model: type[T]) -> T | None:
@@ -111,7 +494,7 @@ class SQLiteStore(Store):
             row = cursor.fetchone()
             if row is None:
                 return None
-            return model(**json.loads(row[0]))
+            return self._codec.decode(row[0], model)
 
     @ensure_table
     def set(self, key: str, value: BaseModel) -> None:
@@ -120,13 +503,13 @@ class SQLiteStore(Store):
         with self.provide_cursor() as cursor:
             cursor.execute(
                 f"""
-                INSERT INTO {value.__class__.__name__} (key, value) 
-                VALUES (?, ?) 
-                ON CONFLICT(key) DO UPDATE SET value=?
+                INSERT INTO {value.__class__.__name__} (key, value)
+                VALUES (?, ?)
+                ON CONFLICT(key) DO UPDATE SET value=excluded.value
                 """,
-                (key, value.model_dump_json(), value.model_dump_json()),
+                (key, self._codec.encode(value)),
             )
-            self._connection.commit()
+            self._commit()
 
     @ensure_table
     def delete(self, key: str, model: type[T]) -> None:
@@ -134,4 +517,42 @@ class SQLiteStore(Store):
         logger.debug("Deleting %s from %s", key, model.__name__)
         with self.provide_cursor() as cursor:
             cursor.execute(f"DELETE FROM {model.__name__} WHERE key=?", (key,))
-            self._connection.commit()
+            self._commit()
+
+    @ensure_table
+    def get_many(self, keys: Iterable[str], model: type[T]) -> dict[str, T]:
+        """Get multiple values from the store, using one query per batch of keys."""
+        result: dict[str, T] = {}
+        keys = iter(keys)
+        with self.provide_cursor() as cursor:
+            while batch := list(islice(keys, MAX_QUERY_VARIABLES)):
+                logger.debug("Getting %d keys from %s", len(batch), model.__name__)
+                placeholders = ",".join("?" * len(batch))
+                cursor.execute(f"SELECT key, value FROM {model.__name__} WHERE key IN ({placeholders})", batch)
+                result.update((key, self._codec.decode(value, model)) for key, value in cursor.fetchall())
+        return result
+
+    def set_many(self, values: Mapping[str, BaseModel]) -> None:
+        """Set multiple values in the store within a single transaction."""
+        by_model: dict[type[BaseModel], list[tuple[str, str | bytes]]] = {}
+        for key, value in values.items():
+            by_model.setdefault(value.__class__, []).append((key, self._codec.encode(value)))
+        with self.transaction(), self.provide_cursor() as cursor:
+            for model, rows in by_model.items():
+                logger.debug("Setting %d keys in %s", len(rows), model.__name__)
+                self._create_model_table(model)
+                cursor.executemany(
+                    f"""
+                    INSERT INTO {model.__name__} (key, value)
+                    VALUES (?, ?)
+                    ON CONFLICT(key) DO UPDATE SET value=excluded.value
+                    """,
+                    rows,
+                )
+
+    @ensure_table
+    def delete_many(self, keys: Iterable[str], model: type[T]) -> None:
+        """Delete multiple values from the store within a single transaction."""
+        logger.debug("Deleting multiple keys from %s", model.__name__)
+        with self.transaction(), self.provide_cursor() as cursor:
+            cursor.executemany(f"DELETE FROM {model.__name__} WHERE key=?", ((key,) for key in keys))
@@ -0,0 +1,184 @@
+"""Asynchronous store running any synchronous store on a dedicated, bounded thread pool.
+Blocking disk I/O and fsyncs of the wrapped store then never stall the event loop.
+The wrapped store has a single transaction, so a transaction of one task holds off calls of other tasks until it is
+done, instead of letting their writes join it and share its fate. Tasks started within a transaction are part of it."""
+
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from functools import partial
+from itertools import islice
+from types import TracebackType
+from typing import Any, AsyncContextManager, AsyncIterator, Callable, Iterable, Mapping, TypeVar
+
+from photom.models import BaseModel
+from photom.store.base import AsyncStore, Store
+
+T = TypeVar("T", bound=BaseModel)
+R = TypeVar("R")
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_WORKERS = 8
+ITER_BATCH_SIZE = 256
+
+_executor: ThreadPoolExecutor | None = None
+_executor_lock = threading.Lock()
+
+
+def get_executor(max_workers: int = DEFAULT_MAX_WORKERS) -> ThreadPoolExecutor:
+    """Get the process-wide store thread pool, `max_workers` only applies when it is created."""
+    global _executor  # pylint: disable=global-statement
+    with _executor_lock:
+        if _executor is None:
+            logger.info("Starting store thread pool with %d workers", max_workers)
+            _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="photom-store")
+        return _executor
+
+
+def shutdown_executor() -> None:
+    """Shut the process-wide store thread pool down, waiting for running calls to finish."""
+    global _executor  # pylint: disable=global-statement
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown()
+            _executor = None
+
+
+# stores whose transaction the current task is part of
+_transactions: ContextVar[frozenset["ThreadedStore"]] = ContextVar("photom_store_transactions", default=frozenset())
+
+
+class ThreadedStore(AsyncStore):  # pylint: disable=too-many-instance-attributes
+    """Asynchronous store delegating to a synchronous store on the store thread pool."""
+
+    def __init__(self, store: Store, max_workers: int = DEFAULT_MAX_WORKERS):
+        """Initialize the store."""
+        self._store = store
+        self._max_workers = max_workers
+        self._idle = asyncio.Condition()
+        self._calls = 0
+        self._waiting = 0
+        self._in_transaction = False
+
+    @property
+    def store(self) -> Store:
+        """The wrapped synchronous store."""
+        return self._store
+
+    async def _run(self, func: Callable[..., R], *args: Any) -> R:
+        """Run a blocking call on the store thread pool, once no transaction of another task is in progress."""
+        if self in _transactions.get():
+            return await self._execute(func, *args)
+        async with self._idle:
+            await self._idle.wait_for(lambda: not self._in_transaction and not self._waiting)
+            self._calls += 1
+        try:
+            return await self._execute(func, *args)
+        finally:
+            async with self._idle:
+                self._calls -= 1
+                self._idle.notify_all()
+
+    async def _execute(self, func: Callable[..., R], *args: Any) -> R:
+        """Run a blocking call on the store thread pool right away."""
+        return await asyncio.get_running_loop().run_in_executor(get_executor(self._max_workers), partial(func, *args))
+
+    async def __aenter__(self) -> "ThreadedStore":
+        """Enter the store context."""
+        await self._run(self._store.__enter__)
+        return self
+
+    async def __aexit__(
+        self, _exc_type: type[BaseException], _exc_val: BaseException, _exc_tb: TracebackType | None
+    ) -> None:
+        """Exit the store context."""
+        await self._run(self._store.__exit__, _exc_type, _exc_val, _exc_tb)
+
+    async def _iterate(self, func: Callable[..., Iterable[R]], *args: Any) -> AsyncIterator[R]:
+        """Iterate through a blocking iterable, advancing it on the thread pool a batch at a time."""
+        iterator = iter(await self._run(func, *args))
+        while batch := await self._run(lambda: list(islice(iterator, ITER_BATCH_SIZE))):
+            for value in batch:
+                yield value
+
+    def iter_keys(self, model: type[T], limit: int | None = None, after_key: str | None = None) -> AsyncIterator[str]:
+        """Iterate through keys in the store for a given model, ordered by key."""
+        return self._iterate(self._store.iter_keys, model, limit, after_key)
+
+    def iter_values(self, model: type[T], limit: int | None = None, after_key: str | None = None) -> AsyncIterator[T]:
+        """Iterate through values in the store for a given model, ordered by key."""
+        return self._iterate(self._store.iter_values, model, limit, after_key)
+
+    def find(self, model: type[T], **filters: Any) -> AsyncIterator[T]:
+        """Iterate through values of a model whose indexed fields equal the filters, ordered by key."""
+        return self._iterate(lambda: self._store.find(model, **filters))
+
+    async def get(self, key: str, model: type[T]) -> T | None:
+        """Get a value from the store."""
+        return await self._run(self._store.get, key, model)
+
+    async def set(self, key: str, value: BaseModel) -> None:
+        """Set a value in the store."""
+        await self._run(self._store.set, key, value)
+
+    async def delete(self, key: str, model: type[T]) -> None:
+        """Delete a value from the store."""
+        await self._run(self._store.delete, key, model)
+
+    async def get_many(self, keys: Iterable[str], model: type[T]) -> dict[str, T]:
+        """Get multiple values from the store at once."""
+        return await self._run(self._store.get_many, list(keys), model)
+
+    async def set_many(self, values: Mapping[str, BaseModel]) -> None:
+        """Set multiple values in the store at once."""
+        await self._run(self._store.set_many, values)
+
+    async def delete_many(self, keys: Iterable[str], model: type[T]) -> None:
+        """Delete multiple values from the store at once."""
+        await self._run(self._store.delete_many, list(keys), model)
+
+    def transaction(self) -> AsyncContextManager[None]:
+        """Group writes made within the context so that they are committed together, or discarded on error."""
+        return self._transaction()
+
+    @asynccontextmanager
+    async def _transaction(self) -> AsyncIterator[None]:
+        """Enter and exit the transaction of the wrapped store on the thread pool. Transactions of tasks that are not
+        part of one in progress wait for it and for running calls to finish, calls made meanwhile wait for it."""
+        if self in _transactions.get():
+            async with self._wrapped_transaction():
+                yield
+            return
+        async with self._idle:
+            self._waiting += 1
+            try:
+                await self._idle.wait_for(lambda: not self._in_transaction and not self._calls)
+            finally:
+                self._waiting -= 1
+                self._idle.notify_all()
+            self._in_transaction = True
+        token = _transactions.set(_transactions.get() | {self})
+        try:
+            async with self._wrapped_transaction():
+                yield
+        finally:
+            _transactions.reset(token)
+            async with self._idle:
+                self._in_transaction = False
+                self._idle.notify_all()
+
+    @asynccontextmanager
+    async def _wrapped_transaction(self) -> AsyncIterator[None]:
+        """Enter and exit the transaction of the wrapped store on the thread pool."""
+        context = self._store.transaction()
+        await self._execute(context.__enter__)
+        try:
+            yield
+        except BaseException as error:
+            await self._execute(context.__exit__, type(error), error, error.__traceback__)
+            raise
+        await self._execute(context.__exit__, None, None, None)
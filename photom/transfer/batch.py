@@ -0,0 +1,154 @@
+"""Batching stage creating Photos media items from uploads.
+Upload tokens are collected per account and album and turned into media items by a single `mediaItems:batchCreate`
+call once `MAX_BATCH_CREATE` of them are waiting, or once the oldest of them waited for `max_wait` seconds. Every
+token is answered separately, with the ID of its media item or the error creating it failed with."""
+
+import asyncio
+import logging
+import time
+from typing import NamedTuple
+
+from photom.metrics import histogram
+from photom.models import DriveFile
+from photom.transfer.google import MAX_BATCH_CREATE, PhotosClient
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_WAIT = 1.0
+
+BATCH_SIZE = histogram(
+    "photom_media_item_batch_size", "Media items created per batch", buckets=(1, 5, 10, 20, 30, 40, MAX_BATCH_CREATE)
+)
+BATCH_SECONDS = histogram("photom_media_item_batch_seconds", "Duration of batch create calls")
+
+
+class BatchMetrics:
+    """Counters of flushed batches."""
+
+    def __init__(self, capacity: int = MAX_BATCH_CREATE):
+        """Initialize the counters of batches holding at most `capacity` items."""
+        self.capacity = capacity
+        self.batches = 0
+        self.items = 0
+        self.flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+
+    def record(self, items: int, seconds: float) -> None:
+        """Count a flushed batch of `items` that took `seconds` to create."""
+        self.batches += 1
+        self.items += items
+        self.flush_seconds += seconds
+        self.max_flush_seconds = max(self.max_flush_seconds, seconds)
+        BATCH_SIZE.observe(items)
+        BATCH_SECONDS.observe(seconds)
+
+    @property
+    def fill_ratio(self) -> float:
+        """Average share of the batch capacity used by flushed batches."""
+        return self.items / (self.batches * self.capacity) if self.batches else 0.0
+
+    @property
+    def mean_flush_seconds(self) -> float:
+        """Average duration of a batch create call."""
+        return self.flush_seconds / self.batches if self.batches else 0.0
+
+
+class _Item(NamedTuple):
+    """Upload waiting to become a media item."""
+
+    file: DriveFile
+    upload_token: str
+    future: "asyncio.Future[str]"
+
+
+class _Batch:  # pylint: disable=too-few-public-methods
+    """Uploads of an account waiting to be added to the same album, created with the client of the latest upload, whose
+    access token is the freshest."""
+
+    def __init__(self, photos: PhotosClient, album_id: str | None, timer: asyncio.TimerHandle):
+        self.photos = photos
+        self.album_id = album_id
+        self.timer = timer
+        self.items: list[_Item] = []
+
+
+class MediaItemBatcher:
+    """Creates media items from uploads in batches of at most `MAX_BATCH_CREATE`, waiting at most `max_wait` seconds
+    for a batch to fill up."""
+
+    def __init__(self, max_wait: float = DEFAULT_MAX_WAIT, size: int = MAX_BATCH_CREATE):
+        """Initialize the batcher."""
+        self._max_wait = max_wait
+        self._size = min(size, MAX_BATCH_CREATE)
+        self._batches: dict[tuple[str, str | None], _Batch] = {}
+        self._flushing: set[asyncio.Task] = set()
+        self.metrics = BatchMetrics(self._size)
+
+    def submit(
+        self, photos: PhotosClient, file: DriveFile, upload_token: str, album_id: str | None = None
+    ) -> "asyncio.Future[str]":
+        """Queue an upload of the account the client belongs to, return a future of the created media item ID.
+        The future fails with `MediaItemError` if the media item was refused, or with the error of the whole call."""
+        loop = asyncio.get_running_loop()
+        key = (photos.account, album_id)
+        batch = self._batches.get(key)
+        if batch is None:
+            batch = self._batches[key] = _Batch(photos, album_id, loop.call_later(self._max_wait, self._flush, key))
+        batch.photos = photos
+        future: asyncio.Future[str] = loop.create_future()
+        batch.items.append(_Item(file, upload_token, future))
+        if len(batch.items) >= self._size:
+            self._flush(key)
+        return future
+
+    async def create(
+        self, photos: PhotosClient, file: DriveFile, upload_token: str, album_id: str | None = None
+    ) -> str:
+        """Create a media item from an upload as part of a batch, return its ID."""
+        return await self.submit(photos, file, upload_token, album_id)
+
+    def _flush(self, key: tuple[str, str | None]) -> None:
+        """Start creating media items of a batch."""
+        batch = self._batches.pop(key, None)
+        if batch is None:
+            return
+        batch.timer.cancel()
+        task = asyncio.create_task(self._create(batch))
+        self._flushing.add(task)
+        task.add_done_callback(self._flushing.discard)
+
+    async def _create(self, batch: _Batch) -> None:
+        """Create media items of a batch and hand out the results."""
+        start = time.monotonic()
+        results: list[str | Exception]
+        try:
+            results = [
+                *await batch.photos.create_media_items(
+                    [(item.file, item.upload_token) for item in batch.items], batch.album_id
+                )
+            ]
+        except Exception as error:  # pylint: disable=broad-exception-caught
+            logger.error("Creating a batch of %d media items failed: %s", len(batch.items), error)
+            results = [error] * len(batch.items)
+        seconds = time.monotonic() - start
+        self.metrics.record(len(batch.items), seconds)
+        logger.debug("Created a batch of %d media items in %.3f s", len(batch.items), seconds)
+        for item, result in zip(batch.items, results):
+            if item.future.done():
+                continue
+            if isinstance(result, Exception):
+                item.future.set_exception(result)
+            else:
+                item.future.set_result(result)
+
+    def flush_account(self, account: str) -> None:
+        """Start creating media items of all waiting uploads of the account with the given email, without waiting for
+        the batches to fill."""
+        for key in [key for key in self._batches if key[0] == account]:
+            self._flush(key)
+
+    async def flush(self) -> None:
+        """Create media items of all waiting uploads right away and wait until they are created."""
+        for key in list(self._batches):
+            self._flush(key)
+        await asyncio.gather(*self._flushing)
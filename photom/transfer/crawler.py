@@ -0,0 +1,206 @@
+"""Breadth-first crawler of Drive folder trees.
+Folders are listed by a bounded pool of workers, the next page of a folder is requested while the current one is being
+processed. Only the fields transfers need are requested, images are streamed out as their pages arrive.
+With a store, the tree is kept as a snapshot: `DriveTree` keyed by the account's email holds modified times of its
+folders and `DriveFolder` keyed by `folder_key` the contents of each. A re-crawl lists all folders of the Drive first
+and only lists contents of folders whose modified time changed since, the others are served from the snapshot.
+Folders are counted in `photom_crawl_folders_total` by whether they were listed or cached."""
+
+import asyncio
+import logging
+from contextlib import aclosing
+from typing import AsyncGenerator
+
+from photom.metrics import counter
+from photom.models import DriveFile, DriveFolder, DriveTree
+from photom.store.base import AsyncStore
+from photom.transfer.google import FOLDER_MIME_TYPE, DriveClient, FilesPage
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONCURRENCY = 8
+ROOT = "root"
+CRAWL_FIELDS = "id,name,mimeType,md5Checksum,size,parents,modifiedTime"
+FOLDERS_QUERY = f"mimeType = '{FOLDER_MIME_TYPE}' and trashed = false"
+
+FOLDERS = counter(
+    "photom_crawl_folders_total", "Drive folders crawled, by whether they were listed or cached", ("source",)
+)
+
+
+def folder_key(email: str, folder_id: str) -> str:
+    """Key of the snapshot of a folder in the store."""
+    return f"{email}:{folder_id}"
+
+
+def children_query(folder_id: str) -> str:
+    """Query of images and subfolders in a folder."""
+    return (
+        f"'{folder_id}' in parents and trashed = false"
+        f" and (mimeType contains 'image/' or mimeType = '{FOLDER_MIME_TYPE}')"
+    )
+
+
+async def prefetched_pages(
+    drive: DriveClient, query: str, page_size: int | None = None
+) -> AsyncGenerator[FilesPage, None]:
+    """Iterate through pages of files matching the query, each next page is requested before the current one is
+    handed out."""
+    fetch: asyncio.Future[FilesPage] | None = asyncio.ensure_future(
+        drive.list_page(None, query, page_size, CRAWL_FIELDS)
+    )
+    try:
+        while fetch is not None:
+            page = await fetch
+            fetch = None
+            if page.next_page_token is not None:
+                fetch = asyncio.ensure_future(drive.list_page(page.next_page_token, query, page_size, CRAWL_FIELDS))
+            yield page
+    finally:
+        if fetch is not None:
+            fetch.cancel()
+            await asyncio.gather(fetch, return_exceptions=True)
+
+
+class DriveCrawler:  # pylint: disable=too-few-public-methods
+    """Crawls folder trees of Drives, listing at most `concurrency` folders at once."""
+
+    def __init__(
+        self, store: AsyncStore | None = None, concurrency: int = DEFAULT_CONCURRENCY, page_size: int | None = None
+    ):
+        """Initialize the crawler, snapshots of crawled trees are kept in the store if given."""
+        self._store = store
+        self._concurrency = concurrency
+        self._page_size = page_size
+
+    async def _snapshot(
+        self, email: str, drive: DriveClient
+    ) -> tuple[DriveTree | None, dict[str, str | None], dict[str, DriveFolder]]:
+        """Load the snapshot of the tree of an account and list modified times of all its folders.
+        Return the snapshot, the modified times and contents of folders that did not change since."""
+        tree = await self._store.get(email, DriveTree) if self._store is not None else None
+        if self._store is None or tree is None:
+            return None, {}, {}
+        modified: dict[str, str | None] = {}
+        async with aclosing(prefetched_pages(drive, FOLDERS_QUERY, self._page_size)) as pages:
+            async for page in pages:
+                modified.update((folder.id, folder.modified_time) for folder in page.files)
+        unchanged = [folder_id for folder_id, time in modified.items() if tree.folders.get(folder_id, "") == time]
+        found = await self._store.get_many([folder_key(email, folder_id) for folder_id in unchanged], DriveFolder)
+        cached = {folder_id: found[key] for folder_id in unchanged if (key := folder_key(email, folder_id)) in found}
+        return tree, modified, cached
+
+    async def _save(
+        self, email: str, tree: DriveTree | None, visited: dict[str, str | None], listed: dict[str, DriveFolder]
+    ) -> None:
+        """Store the snapshot of a crawled tree, dropping folders that are gone."""
+        if self._store is None:
+            return
+        gone = [
+            folder_key(email, folder_id) for folder_id in (tree.folders if tree else {}) if folder_id not in visited
+        ]
+        async with self._store.transaction():
+            await self._store.set_many({folder_key(email, folder_id): folder for folder_id, folder in listed.items()})
+            if gone:
+                await self._store.delete_many(gone, DriveFolder)
+            await self._store.set(email, DriveTree(folders=visited))
+
+    async def crawl(self, email: str, drive: DriveClient, root: str = ROOT) -> AsyncGenerator[DriveFile, None]:
+        """Iterate through images in the folder tree of an account, folder by folder, breadth first.
+        The snapshot is only stored once the whole tree was crawled."""
+        async with aclosing(self.crawl_pages(email, drive, root)) as pages:
+            async for files in pages:
+                for file in files:
+                    yield file
+
+    async def crawl_pages(
+        self, email: str, drive: DriveClient, root: str = ROOT
+    ) -> AsyncGenerator[list[DriveFile], None]:
+        """Iterate through images in the folder tree of an account a page at a time, as `crawl` does."""
+        tree, modified, cached = await self._snapshot(email, drive)
+        crawl = _Crawl(drive, self._page_size, modified, cached, 2 * self._concurrency)
+        crawl.enqueue(root, None)
+        tasks = [asyncio.create_task(crawl.work()) for _ in range(self._concurrency)]
+        tasks.append(asyncio.create_task(crawl.finish()))
+        try:
+            while (files := await crawl.pages.get()) is not None:
+                if isinstance(files, Exception):
+                    raise files
+                yield files
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        logger.info("Crawled %d folders of %s, %d of them listed", len(crawl.visited), email, len(crawl.listed))
+        await self._save(email, tree, crawl.visited, crawl.listed)
+
+
+class _Crawl:  # pylint: disable=too-many-instance-attributes
+    """State of a single crawl shared by its workers: folders waiting to be visited and pages of images found."""
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        drive: DriveClient,
+        page_size: int | None,
+        modified: dict[str, str | None],
+        cached: dict[str, DriveFolder],
+        max_pages: int,
+    ):
+        self._drive = drive
+        self._page_size = page_size
+        self._modified = modified
+        self._cached = cached
+        self._folders: asyncio.Queue[str] = asyncio.Queue()
+        self.pages: asyncio.Queue[list[DriveFile] | Exception | None] = asyncio.Queue(max_pages)
+        self.visited: dict[str, str | None] = {}
+        self.listed: dict[str, DriveFolder] = {}
+
+    def enqueue(self, folder_id: str, modified_time: str | None) -> None:
+        """Queue a folder to be visited unless it was queued before."""
+        if folder_id not in self.visited:
+            self.visited[folder_id] = modified_time
+            self._folders.put_nowait(folder_id)
+
+    async def _visit(self, folder_id: str) -> None:
+        """Hand out images of a folder and queue its subfolders, from the snapshot if the folder did not change."""
+        snapshot = self._cached.get(folder_id)
+        if snapshot is not None:
+            FOLDERS.labels("cached").inc()
+            for subfolder in snapshot.folders:
+                if subfolder in self._modified:
+                    self.enqueue(subfolder, self._modified[subfolder])
+            if snapshot.files:
+                await self.pages.put(snapshot.files)
+            return
+        FOLDERS.labels("listed").inc()
+        contents = DriveFolder(files=[], folders=[])
+        async with aclosing(prefetched_pages(self._drive, children_query(folder_id), self._page_size)) as listing:
+            async for page in listing:
+                images = []
+                for file in page.files:
+                    if file.mime_type == FOLDER_MIME_TYPE:
+                        contents.folders.append(file.id)
+                        self.enqueue(file.id, file.modified_time)
+                    else:
+                        images.append(file)
+                contents.files.extend(images)
+                if images:
+                    await self.pages.put(images)
+        self.listed[folder_id] = contents
+
+    async def work(self) -> None:
+        """Visit queued folders, a failure is handed out in place of images and stops the worker."""
+        while True:
+            folder_id = await self._folders.get()
+            try:
+                await self._visit(folder_id)
+            except Exception as error:  # pylint: disable=broad-exception-caught
+                await self.pages.put(error)
+                return
+            finally:
+                self._folders.task_done()
+
+    async def finish(self) -> None:
+        """Hand out the end of the crawl once all folders were visited."""
+        await self._folders.join()
+        await self.pages.put(None)
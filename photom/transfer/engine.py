@@ -0,0 +1,323 @@
+"""Transfer engine moving images from Google Drive to Google Photos.
+Each file is piped from its Drive download straight into a Photos upload, many files are transferred concurrently.
+Accounts take turns in handing out files to transfer, so that a single large Drive does not starve the others.
+Files are listed by a single Drive query, or with a crawler by walking the folder tree of each Drive, see
+`photom.transfer.crawler`. With a dedup index, files whose content was transferred before are skipped without being
+downloaded. Media items are created from finished uploads in batches, see `photom.transfer.batch`. Files and bytes are
+counted in `photom_transfer_files_total` and `photom_transfer_bytes_total`, whose rates are the throughput of the
+process."""
+
+import asyncio
+import logging
+import time
+from collections import Counter
+from contextlib import aclosing
+from typing import AsyncGenerator, AsyncIterator, Callable, Iterable, NamedTuple
+
+import httpx
+
+from photom.metrics import counter
+from photom.models import Auth, DriveFile, TransferRecord
+from photom.store.dedup import DedupIndex
+from photom.transfer.batch import DEFAULT_MAX_WAIT, BatchMetrics, MediaItemBatcher
+from photom.transfer.crawler import DriveCrawler
+from photom.transfer.google import DRIVE_URL, PHOTOS_URL, DriveClient, FilesPage, MediaItemError, PhotosClient
+from photom.transfer.pipe import DEFAULT_CHUNK_SIZE, PipeError, StreamingPipe
+from photom.transfer.tokens import TokenManager, TokenRefreshError
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONCURRENCY = 8
+
+TRANSFER_ERRORS = (httpx.HTTPError, MediaItemError, PipeError, TokenRefreshError)
+
+FILES = counter("photom_transfer_files_total", "Files handled by transfers, by outcome", ("outcome",))
+BYTES = counter("photom_transfer_bytes_total", "Bytes transferred from Drive to Photos")
+
+
+class TransferStats(NamedTuple):
+    """Counters of a finished transfer run."""
+
+    files: int
+    bytes: int
+    failed: int
+    seconds: float
+    skipped: int = 0
+
+    @property
+    def files_per_second(self) -> float:
+        """Transferred files per second."""
+        return self.files / self.seconds if self.seconds else 0.0
+
+    @property
+    def bytes_per_second(self) -> float:
+        """Transferred bytes per second."""
+        return self.bytes / self.seconds if self.seconds else 0.0
+
+
+async def _listed_pages(drive: DriveClient) -> AsyncGenerator[list[DriveFile], None]:
+    """Iterate through pages of all images of a Drive, listed by a single query."""
+    page = FilesPage([], "")
+    while page.next_page_token is not None:
+        page = await drive.list_page(page.next_page_token)
+        yield page.files
+
+
+class _Account:  # pylint: disable=too-few-public-methods
+    """Account taking part in a transfer run, its files are listed lazily as they are handed out."""
+
+    def __init__(self, email: str, drive: DriveClient, photos: PhotosClient, files: AsyncGenerator[DriveFile, None]):
+        self.email = email
+        self.drive = drive
+        self.photos = photos
+        self.files = files
+
+
+class TransferEngine:  # pylint: disable=too-many-instance-attributes
+    """Transfers images of many accounts from Google Drive to Google Photos, at most `concurrency` files at once."""
+
+    def __init__(
+        self,
+        client: httpx.AsyncClient,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        drive_url: str = DRIVE_URL,
+        photos_url: str = PHOTOS_URL,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        dedup: DedupIndex | None = None,
+        batch_wait: float = DEFAULT_MAX_WAIT,
+        tokens: TokenManager | None = None,
+        crawler: DriveCrawler | None = None,
+    ):  # pylint: disable=too-many-arguments
+        """Initialize the engine, all requests are made with the given client.
+        Each transfer holds at most `chunk_size` bytes of its file in memory, transferred content is kept in `dedup`.
+        Finished uploads wait at most `batch_wait` seconds for others to create their media items with.
+        With `tokens`, access tokens are kept fresh by the manager instead of being used as they are. With `crawler`,
+        runs list files by crawling folder trees instead of a single query."""
+        self._client = client
+        self._concurrency = concurrency
+        self._chunk_size = chunk_size
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._drive_url = drive_url
+        self._photos_url = photos_url
+        self._dedup = dedup
+        self._batcher = MediaItemBatcher(batch_wait)
+        self._tokens = tokens
+        self._crawler = crawler
+
+    @property
+    def batch_metrics(self) -> BatchMetrics:
+        """Metrics of batches media items were created in."""
+        return self._batcher.metrics
+
+    def clients(self, auth: Auth) -> tuple[DriveClient, PhotosClient]:
+        """Drive and Photos clients of an account, which must have an access token."""
+        if auth.access_token is None:
+            raise ValueError(f"There is no access token of {auth.openid.email}")
+        bearer = self._tokens.httpx_auth(auth) if self._tokens else None
+        return (
+            DriveClient(self._client, auth.openid.email, auth.access_token, self._drive_url, bearer),
+            PhotosClient(self._client, auth.openid.email, auth.access_token, self._photos_url, bearer),
+        )
+
+    async def find_transferred(self, email: str, files: list[DriveFile]) -> dict[str, str]:
+        """Find files whose content was transferred for the account before, mapped to their media item IDs."""
+        if self._dedup is None or not files:
+            return {}
+        return await asyncio.to_thread(self._dedup.find, email, files)
+
+    async def _index(self, email: str, transferred: list[tuple[DriveFile, str]]) -> None:
+        """Add transferred files to the dedup index."""
+        if self._dedup is not None and transferred:
+            await asyncio.to_thread(self._dedup.add, email, transferred)
+
+    async def upload(self, drive: DriveClient, photos: PhotosClient, file: DriveFile) -> tuple[str, int]:
+        """Upload a single file, return the upload token and the number of bytes transferred.
+        Downloads of a known length are piped into a resumable upload chunk by chunk, others are streamed as is."""
+        transferred = 0
+        async with drive.download(file) as response:
+            length = response.headers.get("Content-Length") if "Content-Encoding" not in response.headers else None
+            if length is not None:
+                pipe = StreamingPipe(photos, self._chunk_size)
+                source = response.aiter_raw()
+                upload_token = await pipe.pipe(file, source, int(length))
+                transferred = int(length)
+                # the pipe stops at the length, reading to the end of the body returns the connection to the pool
+                async for _ in source:
+                    pass
+            else:
+
+                async def content() -> AsyncIterator[bytes]:
+                    nonlocal transferred
+                    async for chunk in response.aiter_bytes():
+                        transferred += len(chunk)
+                        yield chunk
+
+                upload_token = await photos.upload(file, content())
+        return upload_token, transferred
+
+    async def transfer(self, drive: DriveClient, photos: PhotosClient, file: DriveFile) -> tuple[str, int]:
+        """Transfer a single file on its own, return ID of its media item and the number of bytes transferred."""
+        upload_token, transferred = await self.upload(drive, photos, file)
+        return await photos.create_media_item(file, upload_token), transferred
+
+    async def transfer_batch(
+        self, auth: Auth, files: Iterable[DriveFile], on_record: Callable[[TransferRecord], None] | None = None
+    ) -> list[TransferRecord]:
+        """Transfer files of an account concurrently and record how each of them went, `on_record` is called with
+        every record as soon as its file is handled. Batches running at the same time share the concurrency limit of
+        the engine. Media items are created in batches, the last one is sent as soon as all files are uploaded."""
+        drive, photos = self.clients(auth)
+        email = auth.openid.email
+        files = list(files)
+        known = await self.find_transferred(email, files)
+        uploading = len(files) - len(known)
+
+        async def handle(file: DriveFile) -> TransferRecord:
+            record = await transfer(file)
+            if on_record is not None:
+                on_record(record)
+            return record
+
+        async def transfer(file: DriveFile) -> TransferRecord:
+            nonlocal uploading
+            if file.id in known:
+                FILES.labels("skipped").inc()
+                return TransferRecord(email=email, file=file, media_item_id=known[file.id], deduplicated=True)
+            try:
+                try:
+                    async with self._semaphore:
+                        upload_token, size = await self.upload(drive, photos, file)
+                    created = self._batcher.submit(photos, file, upload_token)
+                finally:
+                    uploading -= 1
+                    if not uploading:
+                        self._batcher.flush_account(photos.account)
+                media_item_id = await created
+            except TRANSFER_ERRORS as error:
+                logger.error("Transferring %s of %s failed: %s", file.name, email, error)
+                FILES.labels("failed").inc()
+                return TransferRecord(email=email, file=file, error=str(error))
+            FILES.labels("transferred").inc()
+            BYTES.inc(size)
+            return TransferRecord(email=email, file=file, media_item_id=media_item_id)
+
+        records = list(await asyncio.gather(*(handle(file) for file in files)))
+        transferred = []
+        for record in records:
+            if record.media_item_id is not None and not record.deduplicated:
+                transferred.append((record.file, record.media_item_id))
+        await self._index(email, transferred)
+        return records
+
+    async def _new_files(self, email: str, drive: DriveClient, counts: Counter[str]) -> AsyncGenerator[DriveFile, None]:
+        """Iterate through files of an account whose content was not transferred before, a listing page at a time."""
+        pages = self._crawler.crawl_pages(email, drive) if self._crawler is not None else _listed_pages(drive)
+        async with aclosing(pages):
+            async for files in pages:
+                known = await self.find_transferred(email, files)
+                counts["skipped"] += len(known)
+                FILES.labels("skipped").inc(len(known))
+                for file in files:
+                    if file.id not in known:
+                        yield file
+
+    def _accounts(self, accounts: Iterable[Auth], counts: Counter[str]) -> list[_Account]:
+        """Prepare accounts for a run, skipping those without an access token."""
+        prepared = []
+        for auth in accounts:
+            if auth.access_token is None:
+                logger.warning("Skipping %s, there is no access token", auth.openid.email)
+                continue
+            drive, photos = self.clients(auth)
+            prepared.append(
+                _Account(auth.openid.email, drive, photos, self._new_files(auth.openid.email, drive, counts))
+            )
+        return prepared
+
+    async def _finish(  # pylint: disable=too-many-arguments
+        self, account: _Account, file: DriveFile, created: "asyncio.Future[str]", transferred: int, counts: Counter[str]
+    ) -> None:
+        """Count a file of a run in once its media item is created."""
+        try:
+            media_item_id = await created
+        except TRANSFER_ERRORS as error:
+            logger.error("Creating media item from %s of %s failed: %s", file.name, account.email, error)
+            counts["failed"] += 1
+            FILES.labels("failed").inc()
+            return
+        await self._index(account.email, [(file, media_item_id)])
+        counts["bytes"] += transferred
+        counts["files"] += 1
+        FILES.labels("transferred").inc()
+        BYTES.inc(transferred)
+
+    async def run(self, accounts: Iterable[Auth]) -> TransferStats:
+        """Transfer all images of the given accounts, accounts without an access token are skipped.
+        Failed transfers are logged and counted, they do not stop the run."""
+        counts: Counter[str] = Counter()
+        active = self._accounts(accounts, counts)
+        rotation: asyncio.Queue[_Account | None] = asyncio.Queue()
+        for account in active:
+            rotation.put_nowait(account)
+        remaining = len(active)
+        if not remaining:
+            return TransferStats(0, 0, 0, 0.0)
+
+        async def next_file() -> tuple[_Account, DriveFile] | None:
+            """Take the next file of the account whose turn it is, None once all accounts are exhausted."""
+            nonlocal remaining
+            while (account := await rotation.get()) is not None:
+                try:
+                    file = await anext(account.files)
+                except StopAsyncIteration:
+                    file = None
+                except TRANSFER_ERRORS as error:
+                    logger.error("Listing files of %s failed: %s", account.email, error)
+                    file = None
+                if file is not None:
+                    rotation.put_nowait(account)
+                    return account, file
+                remaining -= 1
+                if not remaining:
+                    for _ in range(self._concurrency):
+                        rotation.put_nowait(None)
+            return None
+
+        finishing: list[asyncio.Task] = []
+
+        async def worker() -> None:
+            """Upload files until there are none left, media items are created from the uploads in the background."""
+            while (item := await next_file()) is not None:
+                account, file = item
+                try:
+                    upload_token, transferred = await self.upload(account.drive, account.photos, file)
+                except TRANSFER_ERRORS as error:
+                    logger.error("Transferring %s of %s failed: %s", file.name, account.email, error)
+                    counts["failed"] += 1
+                    FILES.labels("failed").inc()
+                    continue
+                created = self._batcher.submit(account.photos, file, upload_token)
+                finishing.append(asyncio.create_task(self._finish(account, file, created, transferred, counts)))
+
+        start = time.monotonic()
+        workers = [asyncio.create_task(worker()) for _ in range(self._concurrency)]
+        try:
+            await asyncio.gather(*workers)
+            await self._batcher.flush()
+            await asyncio.gather(*finishing)
+        finally:
+            for task in workers + finishing:
+                task.cancel()
+            await asyncio.gather(*workers, *finishing, return_exceptions=True)
+            for account in active:
+                await account.files.aclose()
+        seconds = time.monotonic() - start
+        logger.info(
+            "Transferred %d files (%d bytes) in %.2f s, %d skipped as transferred before, batches %.0f%% full",
+            counts["files"],
+            counts["bytes"],
+            seconds,
+            counts["skipped"],
+            self.batch_metrics.fill_ratio * 100,
+        )
+        return TransferStats(counts["files"], counts["bytes"], counts["failed"], seconds, counts["skipped"])
@@ -0,0 +1,275 @@
+"""Clients of the Google Drive and Google Photos APIs used by transfers.
+Both clients are thin wrappers around a shared `httpx.AsyncClient`, authorized by an account's access token."""
+
+import logging
+from contextlib import asynccontextmanager
+from typing import AsyncGenerator, AsyncIterable, AsyncIterator, NamedTuple
+from urllib.parse import quote
+
+import httpx
+
+from photom.models import DriveFile
+from photom.transfer.limits import ACCOUNT_EXTENSION, API_EXTENSION
+
+logger = logging.getLogger(__name__)
+
+DRIVE_URL = "https://www.googleapis.com/drive/v3"
+PHOTOS_URL = "https://photoslibrary.googleapis.com/v1"
+
+LIST_PAGE_SIZE = 1000
+MAX_BATCH_CREATE = 50
+DRIVE_FILE_FIELDS = "id,name,mimeType,md5Checksum,size"
+FOLDER_MIME_TYPE = "application/vnd.google-apps.folder"
+IMAGE_QUERY = "mimeType contains 'image/' and trashed = false"
+
+
+class FilesPage(NamedTuple):
+    """Page of a Drive files listing."""
+
+    files: list[DriveFile]
+    next_page_token: str | None
+
+
+class ChangesPage(NamedTuple):
+    """Page of Drive changes, the last page has a token to list future changes with instead of the next page."""
+
+    files: list[DriveFile]
+    next_page_token: str | None
+    new_start_page_token: str | None
+
+
+class MediaItemError(Exception):
+    """Google Photos refused to create a media item from an upload."""
+
+
+class DriveClient:
+    """Google Drive API client of a single account."""
+
+    def __init__(
+        self,
+        client: httpx.AsyncClient,
+        account: str,
+        access_token: str,
+        base_url: str = DRIVE_URL,
+        auth: httpx.Auth | None = None,
+    ):  # pylint: disable=too-many-arguments
+        """Initialize the client of the account with the given email, requests are authorized by `auth` if given, with
+        the access token otherwise."""
+        self._client = client
+        self._headers = {} if auth else {"Authorization": f"Bearer {access_token}"}
+        self._auth = auth or httpx.USE_CLIENT_DEFAULT
+        self._extensions = {API_EXTENSION: "drive", ACCOUNT_EXTENSION: account}
+        self._base_url = base_url.rstrip("/")
+
+    async def list_page(
+        self,
+        page_token: str | None = None,
+        query: str = IMAGE_QUERY,
+        page_size: int | None = None,
+        fields: str = DRIVE_FILE_FIELDS,
+    ) -> FilesPage:
+        """Get a single page of files matching the query, with only the given fields of each."""
+        params = {
+            "q": query,
+            "pageSize": str(page_size or LIST_PAGE_SIZE),
+            "fields": f"nextPageToken,files({fields})",
+        }
+        if page_token:
+            params["pageToken"] = page_token
+        response = await self._client.get(
+            f"{self._base_url}/files",
+            params=params,
+            headers=self._headers,
+            auth=self._auth,
+            extensions=self._extensions,
+        )
+        response.raise_for_status()
+        page = response.json()
+        files = [DriveFile.model_validate(item) for item in page.get("files", [])]
+        return FilesPage(files, page.get("nextPageToken"))
+
+    async def list_files(
+        self, query: str = IMAGE_QUERY, page_size: int | None = None
+    ) -> AsyncGenerator[DriveFile, None]:
+        """Iterate through files matching the query, the next page is only requested once the current one is used up."""
+        page = FilesPage([], "")
+        while page.next_page_token is not None:
+            page = await self.list_page(page.next_page_token, query, page_size)
+            for file in page.files:
+                yield file
+
+    async def start_page_token(self) -> str:
+        """Get the token to list changes made from now on with."""
+        response = await self._client.get(
+            f"{self._base_url}/changes/startPageToken",
+            headers=self._headers,
+            auth=self._auth,
+            extensions=self._extensions,
+        )
+        response.raise_for_status()
+        return response.json()["startPageToken"]
+
+    async def list_changes(self, page_token: str, page_size: int | None = None) -> ChangesPage:
+        """Get a single page of changes, only images that were added or modified are kept."""
+        params = {
+            "pageToken": page_token,
+            "pageSize": str(page_size or LIST_PAGE_SIZE),
+            "fields": f"nextPageToken,newStartPageToken,changes(removed,file({DRIVE_FILE_FIELDS},trashed))",
+        }
+        response = await self._client.get(
+            f"{self._base_url}/changes",
+            params=params,
+            headers=self._headers,
+            auth=self._auth,
+            extensions=self._extensions,
+        )
+        response.raise_for_status()
+        page = response.json()
+        files = [
+            DriveFile.model_validate(change["file"])
+            for change in page.get("changes", [])
+            if not change.get("removed")
+            and not change.get("file", {}).get("trashed", True)
+            and change["file"].get("mimeType", "").startswith("image/")
+        ]
+        return ChangesPage(files, page.get("nextPageToken"), page.get("newStartPageToken"))
+
+    @asynccontextmanager
+    async def download(self, file: DriveFile) -> AsyncIterator[httpx.Response]:
+        """Open a streamed download of the file content, the body is read as it is consumed."""
+        async with self._client.stream(
+            "GET",
+            f"{self._base_url}/files/{file.id}",
+            params={"alt": "media"},
+            headers=self._headers,
+            auth=self._auth,
+            extensions=self._extensions,
+        ) as response:
+            response.raise_for_status()
+            yield response
+
+
+class PhotosClient:
+    """Google Photos Library API client of a single account."""
+
+    def __init__(
+        self,
+        client: httpx.AsyncClient,
+        account: str,
+        access_token: str,
+        base_url: str = PHOTOS_URL,
+        auth: httpx.Auth | None = None,
+    ):  # pylint: disable=too-many-arguments
+        """Initialize the client of the account with the given email, requests are authorized by `auth` if given, with
+        the access token otherwise."""
+        self._client = client
+        self.account = account
+        self.access_token = access_token
+        self._headers = {} if auth else {"Authorization": f"Bearer {access_token}"}
+        self._auth = auth or httpx.USE_CLIENT_DEFAULT
+        self._extensions = {API_EXTENSION: "photos", ACCOUNT_EXTENSION: account}
+        self._base_url = base_url.rstrip("/")
+
+    async def upload(self, file: DriveFile, content: AsyncIterable[bytes], length: int | None = None) -> str:
+        """Upload file content as it is produced, return the upload token to create a media item with.
+        Without the content `length` known upfront, the content is sent in chunked encoding."""
+        headers = self._headers | {
+            "Content-Type": "application/octet-stream",
+            "X-Goog-Upload-Content-Type": file.mime_type,
+            "X-Goog-Upload-File-Name": quote(file.name),
+            "X-Goog-Upload-Protocol": "raw",
+        }
+        if length is not None:
+            headers["Content-Length"] = str(length)
+        response = await self._client.post(
+            f"{self._base_url}/uploads", content=content, headers=headers, auth=self._auth, extensions=self._extensions
+        )
+        response.raise_for_status()
+        return response.text
+
+    async def start_upload(self, file: DriveFile, size: int) -> tuple[str, int]:
+        """Start a resumable upload session of `size` bytes, return its URL and the chunk granularity."""
+        headers = self._headers | {
+            "X-Goog-Upload-Command": "start",
+            "X-Goog-Upload-Content-Type": file.mime_type,
+            "X-Goog-Upload-File-Name": quote(file.name),
+            "X-Goog-Upload-Protocol": "resumable",
+            "X-Goog-Upload-Raw-Size": str(size),
+        }
+        response = await self._client.post(
+            f"{self._base_url}/uploads", headers=headers, auth=self._auth, extensions=self._extensions
+        )
+        response.raise_for_status()
+        granularity = int(response.headers.get("X-Goog-Upload-Chunk-Granularity", 1))
+        return response.headers["X-Goog-Upload-URL"], granularity
+
+    async def upload_chunk(self, upload_url: str, offset: int, data: memoryview, finalize: bool) -> str | None:
+        """Send a chunk of a resumable upload straight from the given buffer, without copying it.
+        The upload token is returned once the last chunk is sent with `finalize`."""
+
+        async def content() -> AsyncIterator[memoryview]:
+            yield data
+
+        headers = self._headers | {
+            "Content-Length": str(len(data)),
+            "X-Goog-Upload-Command": "upload, finalize" if finalize else "upload",
+            "X-Goog-Upload-Offset": str(offset),
+        }
+        response = await self._client.post(
+            upload_url,
+            content=content(),  # type: ignore[arg-type]
+            headers=headers,
+            auth=self._auth,
+            extensions=self._extensions,
+        )
+        response.raise_for_status()
+        return response.text if finalize else None
+
+    async def query_upload(self, upload_url: str) -> int:
+        """Get the number of bytes a resumable upload session has received so far."""
+        headers = self._headers | {"X-Goog-Upload-Command": "query"}
+        response = await self._client.post(upload_url, headers=headers, auth=self._auth, extensions=self._extensions)
+        response.raise_for_status()
+        return int(response.headers["X-Goog-Upload-Size-Received"])
+
+    async def create_media_items(
+        self, uploads: list[tuple[DriveFile, str]], album_id: str | None = None
+    ) -> list[str | MediaItemError]:
+        """Create media items from up to `MAX_BATCH_CREATE` uploaded files given with their upload tokens, optionally
+        adding them to an album. Return the ID of each created media item, or the error it failed with, in order."""
+        if len(uploads) > MAX_BATCH_CREATE:
+            raise ValueError(f"At most {MAX_BATCH_CREATE} media items can be created at once, got {len(uploads)}")
+        body: dict = {
+            "newMediaItems": [
+                {"simpleMediaItem": {"uploadToken": upload_token, "fileName": file.name}}
+                for file, upload_token in uploads
+            ]
+        }
+        if album_id is not None:
+            body["albumId"] = album_id
+        response = await self._client.post(
+            f"{self._base_url}/mediaItems:batchCreate",
+            json=body,
+            headers=self._headers,
+            auth=self._auth,
+            extensions=self._extensions,
+        )
+        response.raise_for_status()
+        results = response.json().get("newMediaItemResults", [])
+        by_token = {result["uploadToken"]: result for result in results if "uploadToken" in result}
+        created: list[str | MediaItemError] = []
+        for index, (file, upload_token) in enumerate(uploads):
+            result = by_token.get(upload_token) or (results[index] if index < len(results) else {})
+            if "mediaItem" not in result or result.get("status", {}).get("code", 0):
+                message = result.get("status", {}).get("message", "no result")
+                created.append(MediaItemError(f"Creating media item from {file.name} failed: {message}"))
+            else:
+                created.append(result["mediaItem"]["id"])
+        return created
+
+    async def create_media_item(self, file: DriveFile, upload_token: str) -> str:
+        """Create a media item from an uploaded file, return its ID."""
+        (result,) = await self.create_media_items([(file, upload_token)])
+        if isinstance(result, MediaItemError):
+            raise result
+        return result
@@ -0,0 +1,92 @@
+"""Shared HTTP client of requests to Google APIs.
+A single keep-alive connection pool is opened for the lifespan of the application and shared by the login flow, Drive
+listings and Photos uploads, so that connections and TLS sessions are reused instead of set up for every request.
+HTTP/2 is used if the `h2` package is installed (the `http2` extra). Requests go through the rate limiter, the time
+they take once sent is recorded in `photom_google_request_seconds`."""
+
+import importlib.util
+import logging
+import time
+from typing import Any
+
+import httpx
+
+from photom.metrics import histogram
+from photom.transfer.limits import API_EXTENSION, RateLimitedTransport, RateLimiter, google_api
+
+logger = logging.getLogger(__name__)
+
+HTTP2 = importlib.util.find_spec("h2") is not None
+
+DEFAULT_MAX_CONNECTIONS = 100
+DEFAULT_MAX_KEEPALIVE = 20
+DEFAULT_KEEPALIVE_EXPIRY = 30.0
+DEFAULT_DISCOVERY_TTL = 3600.0
+
+REQUEST_SECONDS = histogram(
+    "photom_google_request_seconds",
+    "Duration of requests to Google APIs until their response headers",
+    ("api", "status"),
+)
+
+
+class InstrumentedTransport(httpx.AsyncBaseTransport):
+    """Transport timing requests sent by another transport, labelled by Google API and status code."""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport):
+        """Initialize the transport on top of another one."""
+        self._transport = transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        """Send a request and record how long it took, failed requests are recorded with status `error`."""
+        status = "error"
+        start = time.perf_counter()
+        try:
+            response = await self._transport.handle_async_request(request)
+            status = str(response.status_code)
+            return response
+        finally:
+            REQUEST_SECONDS.labels(google_api(request) or "other", status).observe(time.perf_counter() - start)
+
+    async def aclose(self) -> None:
+        """Close the underlying transport."""
+        await self._transport.aclose()
+
+
+def create_client(
+    limiter: RateLimiter,
+    max_connections: int = DEFAULT_MAX_CONNECTIONS,
+    max_keepalive: int = DEFAULT_MAX_KEEPALIVE,
+    keepalive_expiry: float = DEFAULT_KEEPALIVE_EXPIRY,
+) -> httpx.AsyncClient:
+    """Client keeping up to `max_keepalive` idle connections open for `keepalive_expiry` seconds, with at most
+    `max_connections` connections at once, sending requests to Google APIs through the limiter."""
+    limits = httpx.Limits(
+        max_connections=max_connections, max_keepalive_connections=max_keepalive, keepalive_expiry=keepalive_expiry
+    )
+    logger.debug("Opening HTTP client pool, HTTP/2 %s", "enabled" if HTTP2 else "not available")
+    return httpx.AsyncClient(
+        transport=RateLimitedTransport(
+            limiter, InstrumentedTransport(httpx.AsyncHTTPTransport(http2=HTTP2, limits=limits))
+        )
+    )
+
+
+class DiscoveryCache:  # pylint: disable=too-few-public-methods
+    """OpenID discovery documents, fetched again once they are older than `ttl` seconds."""
+
+    def __init__(self, ttl: float = DEFAULT_DISCOVERY_TTL):
+        """Initialize an empty cache."""
+        self._ttl = ttl
+        self._documents: dict[str, tuple[float, dict[str, Any]]] = {}
+
+    async def get(self, client: httpx.AsyncClient, url: str) -> dict[str, Any]:
+        """Get the discovery document at the URL, from the cache unless it expired."""
+        cached = self._documents.get(url)
+        if cached is not None and cached[0] > time.monotonic():
+            return cached[1]
+        response = await client.get(url, extensions={API_EXTENSION: "oauth"})
+        response.raise_for_status()
+        document = response.json()
+        self._documents[url] = (time.monotonic() + self._ttl, document)
+        return document
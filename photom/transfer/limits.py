@@ -0,0 +1,337 @@
+"""Adaptive rate limiting of requests to Google APIs.
+Requests are limited per account and API (Drive, Photos, OAuth) by a token bucket and by a concurrency limit, which
+grows additively while requests succeed and shrinks multiplicatively when Google answers with 429 or 503 (AIMD). A
+`Retry-After` pauses the bucket of the account and API, throttled requests whose content can be sent again are retried
+after a jittered exponential backoff.
+
+The limiter is applied as an httpx transport, so it wraps every request of a client, whoever makes it."""
+
+import asyncio
+import email.utils
+import logging
+import random
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from typing import AsyncIterator, Awaitable, Callable, NamedTuple
+
+import httpx
+
+from photom.metrics import add_collector, counter, gauge
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RATE = 10.0
+DEFAULT_BURST = 20
+DEFAULT_CONCURRENCY = 8
+DEFAULT_MAX_CONCURRENCY = 64
+DEFAULT_RETRIES = 5
+BACKOFF_BASE = 0.5
+MAX_BACKOFF = 60.0
+THROTTLED_STATUSES = frozenset({429, 503})
+
+API_EXTENSION = "photom_api"
+ACCOUNT_EXTENSION = "photom_account"
+API_HOSTS = {
+    "photoslibrary.googleapis.com": "photos",
+    "accounts.google.com": "oauth",
+    "oauth2.googleapis.com": "oauth",
+    "openidconnect.googleapis.com": "oauth",
+}
+
+THROTTLED = counter("photom_google_throttled_total", "Requests to Google APIs answered with 429 or 503", ("api",))
+IN_FLIGHT = gauge("photom_google_in_flight", "Requests to Google APIs in flight, summed over accounts", ("api",))
+CONCURRENCY_LIMIT = gauge(
+    "photom_google_concurrency_limit", "Concurrency limits of Google APIs, summed over accounts", ("api",)
+)
+
+
+def google_api(request: httpx.Request) -> str | None:
+    """Name of the Google API a request goes to, set by the client or derived from the URL, None for other hosts."""
+    if API_EXTENSION in request.extensions:
+        return request.extensions[API_EXTENSION]
+    if request.url.host == "www.googleapis.com":
+        return "drive" if request.url.path.startswith("/drive") else "oauth"
+    return API_HOSTS.get(request.url.host)
+
+
+def retry_after(response: httpx.Response) -> float | None:
+    """Seconds to wait according to the `Retry-After` header, given either in seconds or as a date."""
+    value = response.headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (date - datetime.now(timezone.utc)).total_seconds())
+
+
+def backoff(attempt: int) -> float:
+    """Exponential backoff delay of a retry, jittered over its upper half."""
+    delay = min(MAX_BACKOFF, BACKOFF_BASE * 2**attempt)
+    return random.uniform(delay / 2, delay)
+
+
+class TokenBucket:
+    """Allows `rate` acquisitions per second on average, with bursts of up to `burst`."""
+
+    def __init__(self, rate: float, burst: int):
+        """Initialize a full bucket."""
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        """Add tokens for the time passed."""
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self) -> None:
+        """Take a token, waiting until there is one and the bucket is not paused."""
+        while True:
+            now = time.monotonic()
+            self._refill(now)
+            if now < self._paused_until:
+                await asyncio.sleep(self._paused_until - now)
+            elif self._tokens >= 1:
+                self._tokens -= 1
+                return
+            else:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds: float) -> None:
+        """Hand out no tokens for the given time."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+class AIMDLimit:
+    """Concurrency limit growing by one per limit's worth of successes and halved on overload."""
+
+    def __init__(self, initial: int, maximum: int, minimum: int = 1, decrease: float = 0.5):
+        """Initialize the limit."""
+        self.limit = float(initial)
+        self.maximum = maximum
+        self.minimum = minimum
+        self.in_flight = 0
+        self.epoch = 0
+        self._decrease = decrease
+        self._waiters: list[asyncio.Future[None]] = []
+
+    async def acquire(self) -> int:
+        """Wait for a free slot, return the epoch of the limit the slot was taken at."""
+        while self.in_flight >= int(self.limit):
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                # a slot this waiter was woken for goes to the next one
+                self._waiters.remove(waiter)
+                self._wake()
+                raise
+            self._waiters.remove(waiter)
+        self.in_flight += 1
+        return self.epoch
+
+    def release(self) -> None:
+        """Free a slot."""
+        self.in_flight -= 1
+        self._wake()
+
+    def _wake(self) -> None:
+        """Let waiters take the free slots."""
+        for waiter in self._waiters[: max(0, int(self.limit) - self.in_flight)]:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def succeeded(self) -> None:
+        """Grow the limit after a successful request."""
+        self.limit = min(self.maximum, self.limit + 1 / self.limit)
+        self._wake()
+
+    def overloaded(self, epoch: int) -> None:
+        """Shrink the limit after an overloaded request, only once for all requests started at the same limit."""
+        if epoch != self.epoch:
+            return
+        self.epoch += 1
+        self.limit = max(self.minimum, self.limit * self._decrease)
+        logger.info("Overloaded, concurrency limit lowered to %d", int(self.limit))
+
+
+class LimitMetrics(NamedTuple):
+    """Current limits of an account and API."""
+
+    account: str
+    api: str
+    concurrency_limit: int
+    in_flight: int
+    rate: float
+    throttled: int
+
+
+class _Limits:  # pylint: disable=too-few-public-methods
+    """Limits of a single account and API."""
+
+    def __init__(self, bucket: TokenBucket, concurrency: AIMDLimit):
+        self.bucket = bucket
+        self.concurrency = concurrency
+        self.throttled = 0
+
+
+class RateLimiter:
+    """Limits requests per account and API, shared by all clients of a process."""
+
+    def __init__(
+        self,
+        rate: float = DEFAULT_RATE,
+        burst: int = DEFAULT_BURST,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+        retries: int = DEFAULT_RETRIES,
+    ):  # pylint: disable=too-many-arguments
+        """Initialize the limiter, limits of every account and API start at `concurrency` requests at once."""
+        self._rate = rate
+        self._burst = burst
+        self._concurrency = concurrency
+        self._max_concurrency = max(concurrency, max_concurrency)
+        self._retries = retries
+        self._limits: dict[tuple[str, str], _Limits] = {}
+        self._lock = threading.Lock()
+        add_collector(self.collect_metrics)
+
+    def _get_limits(self, account: str, api: str) -> _Limits:
+        """Limits of an account and API, created on first use."""
+        with self._lock:
+            if (account, api) not in self._limits:
+                self._limits[account, api] = _Limits(
+                    TokenBucket(self._rate, self._burst), AIMDLimit(self._concurrency, self._max_concurrency)
+                )
+            return self._limits[account, api]
+
+    async def send(
+        self, account: str, api: str, send: Callable[[], Awaitable[httpx.Response]], replayable: bool
+    ) -> httpx.Response:
+        """Send a request within the limits of the account and API, retrying it while throttled if it is
+        `replayable`. The concurrency slot is held until the response is closed."""
+        limits = self._get_limits(account, api)
+        attempt = 0
+        while True:
+            await limits.bucket.acquire()
+            epoch = await limits.concurrency.acquire()
+            try:
+                response = await send()
+            except BaseException:
+                limits.concurrency.release()
+                raise
+            if response.status_code not in THROTTLED_STATUSES:
+                limits.concurrency.succeeded()
+                return self._releasing(response, limits.concurrency)
+            limits.throttled += 1
+            THROTTLED.labels(api).inc()
+            limits.concurrency.overloaded(epoch)
+            wait = retry_after(response)
+            if wait is not None:
+                limits.bucket.pause(wait)
+            if not replayable or attempt >= self._retries:
+                return self._releasing(response, limits.concurrency)
+            await response.aclose()
+            limits.concurrency.release()
+            delay = max(wait or 0.0, backoff(attempt))
+            logger.warning(
+                "%s API of %s throttled with %d, retrying in %.2f s", api, account, response.status_code, delay
+            )
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    @staticmethod
+    def _releasing(response: httpx.Response, concurrency: AIMDLimit) -> httpx.Response:
+        """Free the slot of a response once it is closed, right away if its content is already in memory."""
+        if isinstance(response.stream, httpx.ByteStream):
+            concurrency.release()
+        else:
+            response.stream = _ReleasingStream(response.stream, concurrency.release)
+        return response
+
+    def metrics(self) -> list[LimitMetrics]:
+        """Current limits of all accounts and APIs requests were made to."""
+        with self._lock:
+            items = list(self._limits.items())
+        return [
+            LimitMetrics(
+                account,
+                api,
+                int(limits.concurrency.limit),
+                limits.concurrency.in_flight,
+                limits.bucket.rate,
+                limits.throttled,
+            )
+            for (account, api), limits in items
+        ]
+
+    def collect_metrics(self) -> None:
+        """Set the gauges of current limits, summed over accounts so that metrics do not grow with their number."""
+        in_flight: Counter[str] = Counter()
+        concurrency: Counter[str] = Counter()
+        for metrics in self.metrics():
+            in_flight[metrics.api] += metrics.in_flight
+            concurrency[metrics.api] += metrics.concurrency_limit
+        for api, limit in concurrency.items():
+            IN_FLIGHT.labels(api).set(in_flight[api])
+            CONCURRENCY_LIMIT.labels(api).set(limit)
+
+
+class _ReleasingStream(httpx.AsyncByteStream):
+    """Response stream calling back once it is closed."""
+
+    def __init__(self, stream: httpx.SyncByteStream | httpx.AsyncByteStream, release: Callable[[], None]):
+        self._stream = stream
+        self._release: Callable[[], None] | None = release
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        """Pass the content through."""
+        async for chunk in self._stream:  # type: ignore[union-attr]
+            yield chunk
+
+    async def aclose(self) -> None:
+        """Close the stream and free its slot, only once."""
+        try:
+            await self._stream.aclose()  # type: ignore[union-attr]
+        finally:
+            if self._release is not None:
+                self._release()
+                self._release = None
+
+
+class RateLimitedTransport(httpx.AsyncBaseTransport):
+    """Transport sending requests to Google APIs through a rate limiter, other requests are sent as they are.
+    Requests are attributed to the account whose email is in their `photom_account` extension, if any."""
+
+    def __init__(self, limiter: RateLimiter, transport: httpx.AsyncBaseTransport | None = None):
+        """Initialize the transport on top of another one, a default HTTP transport if not given."""
+        self._limiter = limiter
+        self._transport = transport or httpx.AsyncHTTPTransport()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        """Send a request within the limits of its account and API."""
+        api = google_api(request)
+        if api is None:
+            return await self._transport.handle_async_request(request)
+        account = request.extensions.get(ACCOUNT_EXTENSION, "")
+        return await self._limiter.send(
+            account,
+            api,
+            lambda: self._transport.handle_async_request(request),
+            isinstance(request.stream, httpx.ByteStream),
+        )
+
+    async def aclose(self) -> None:
+        """Close the underlying transport."""
+        await self._transport.aclose()
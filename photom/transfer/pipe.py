@@ -0,0 +1,159 @@
+"""Streaming pipe from a Drive download into a Photos resumable upload session.
+The download is read into one reusable buffer of a fixed size and every filled buffer is sent as a chunk of the upload
+straight from memory, so memory used by a transfer is bounded by the chunk size no matter how large the file is.
+
+A chunk that fails is resumed from the offset confirmed by the upload session. Should the session ever ask for data
+the buffer no longer holds, it is served from a spool file. The spool is only started once an upload fails, so that
+healthy transfers never touch the disk."""
+
+import asyncio
+import logging
+import tempfile
+from typing import IO, AsyncIterator
+
+import httpx
+
+from photom.models import DriveFile
+from photom.transfer.google import PhotosClient
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 4 * 1024 * 1024
+DEFAULT_RETRIES = 3
+RETRY_DELAY = 0.5
+
+
+class PipeError(Exception):
+    """A file could not be piped into its upload session."""
+
+
+def _retryable(error: Exception) -> bool:
+    """Whether a failed upload request is worth retrying."""
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code == 429 or error.response.status_code >= 500
+    return isinstance(error, httpx.TransportError)
+
+
+class _ChunkReader:  # pylint: disable=too-few-public-methods
+    """Reads a stream of arbitrarily sized pieces into fixed-size buffers."""
+
+    def __init__(self, source: AsyncIterator[bytes]):
+        self._source = source
+        self._pending = memoryview(b"")
+
+    async def readinto(self, buffer: bytearray) -> int:
+        """Fill the buffer, return the number of bytes read, which is less than its size only at the end."""
+        view = memoryview(buffer)
+        filled = 0
+        while filled < len(view):
+            if not self._pending:
+                try:
+                    self._pending = memoryview(await anext(self._source))
+                except StopAsyncIteration:
+                    break
+            length = min(len(self._pending), len(view) - filled)
+            view[filled : filled + length] = self._pending[:length]
+            self._pending = self._pending[length:]
+            filled += length
+        return filled
+
+
+class _Session:
+    """Resumable upload session of a single file."""
+
+    def __init__(self, photos: PhotosClient, url: str, size: int, retries: int):
+        self._photos = photos
+        self._url = url
+        self._size = size
+        self._retries = retries
+        self._spool: IO[bytes] | None = None
+        self._spool_start = 0
+        self.spooled = 0
+
+    async def _spool_chunk(self, offset: int, data: memoryview) -> None:
+        """Keep a chunk in the spool, starting the spool at its offset if there is none yet."""
+        if self._spool is None:
+            self._spool = tempfile.TemporaryFile()  # pylint: disable=consider-using-with
+            self._spool_start = offset
+            logger.debug("Spooling %s from offset %d", self._url, offset)
+        await asyncio.to_thread(self._spool.write, data)
+        self.spooled += len(data)
+
+    async def _replay(self, position: int, until: int, chunk_size: int) -> None:
+        """Send spooled data from `position` up to `until`."""
+        if self._spool is None or position < self._spool_start:
+            raise PipeError(f"Upload session {self._url} rewound to {position}, which is no longer available")
+        buffer = bytearray(min(chunk_size, until - position))
+        while position < until:
+            length = min(len(buffer), until - position)
+            self._spool.seek(position - self._spool_start)
+            view = memoryview(buffer)[:length]
+            await asyncio.to_thread(self._spool.readinto, view)  # type: ignore[attr-defined]
+            await self._photos.upload_chunk(self._url, position, view, finalize=False)
+            position += length
+
+    async def send(self, offset: int, data: memoryview) -> str | None:
+        """Send a chunk starting at `offset`, resuming it on failures. Returns the upload token after the last one."""
+        end = offset + len(data)
+        if self._spool is not None:
+            await self._spool_chunk(offset, data)
+        position = offset
+        attempt = 0
+        while True:
+            try:
+                if position < offset:
+                    await self._replay(position, offset, len(data))
+                    position = offset
+                return await self._photos.upload_chunk(
+                    self._url, position, data[position - offset :], finalize=end == self._size
+                )
+            except (httpx.HTTPStatusError, httpx.TransportError) as error:
+                attempt += 1
+                if not _retryable(error) or attempt > self._retries:
+                    raise
+                logger.warning("Upload of chunk at %d failed (%s), resuming", offset, error)
+                if self._spool is None:
+                    await self._spool_chunk(offset, data)
+                await asyncio.sleep(RETRY_DELAY * 2 ** (attempt - 1))
+                position = await self._photos.query_upload(self._url)
+                if position > end:
+                    raise PipeError(
+                        f"Upload session {self._url} received {position} bytes, only {end} were sent"
+                    ) from error
+
+    def close(self) -> None:
+        """Drop the spool."""
+        if self._spool is not None:
+            self._spool.close()
+
+
+class StreamingPipe:  # pylint: disable=too-few-public-methods
+    """Pipes a download into a resumable upload, holding at most `chunk_size` bytes of it in memory."""
+
+    def __init__(self, photos: PhotosClient, chunk_size: int = DEFAULT_CHUNK_SIZE, retries: int = DEFAULT_RETRIES):
+        """Initialize the pipe, chunk size is rounded down to the granularity required by the upload session."""
+        self._photos = photos
+        self._chunk_size = chunk_size
+        self._retries = retries
+        self.spooled = 0
+
+    async def pipe(self, file: DriveFile, source: AsyncIterator[bytes], size: int) -> str:
+        """Upload `size` bytes read from the source, return the upload token to create a media item with."""
+        url, granularity = await self._photos.start_upload(file, size)
+        chunk_size = max(granularity, self._chunk_size - self._chunk_size % granularity)
+        buffer = bytearray(min(chunk_size, size))
+        reader = _ChunkReader(source)
+        session = _Session(self._photos, url, size, self._retries)
+        offset = 0
+        try:
+            while True:
+                length = await reader.readinto(buffer)
+                if length < len(buffer) and offset + length < size:
+                    raise PipeError(f"Download of {file.name} ended after {offset + length} of {size} bytes")
+                upload_token = await session.send(offset, memoryview(buffer)[:length])
+                offset += length
+                if upload_token is not None:
+                    return upload_token
+        finally:
+            session.close()
+            self.spooled += session.spooled
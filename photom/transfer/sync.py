@@ -0,0 +1,142 @@
+"""Incremental sync of Drive images to Google Photos.
+The first sync of an account lists its whole Drive, later syncs only go through Drive changes made since. Progress is
+checkpointed in the store as `DriveSyncState` keyed by the account's email. The checkpoint advances in the same
+transaction that records files transferred from a page, so an interrupted sync resumes from the last processed page
+instead of scanning the Drive again. Files that failed to transfer are kept in the checkpoint and tried again by every
+sync until they are transferred, as unchanged files never show up in the changes again. With a progress bus, the state
+of every sync is published whenever a file was handled, see `photom.progress`."""
+
+import asyncio
+import logging
+import time
+from typing import Iterable
+
+from photom.models import Auth, DriveFile, DriveSyncState, TransferRecord
+from photom.progress import ProgressBus, SyncProgress
+from photom.store.base import AsyncStore
+from photom.transfer.engine import TRANSFER_ERRORS, TransferEngine, TransferStats
+
+logger = logging.getLogger(__name__)
+
+RETRY_BATCH_SIZE = 100
+
+
+def record_key(email: str, file_id: str) -> str:
+    """Key of a transfer record in the store."""
+    return f"{email}:{file_id}"
+
+
+def _checkpoint(state: DriveSyncState, records: Iterable[TransferRecord], **tokens: str | None) -> DriveSyncState:
+    """Checkpoint following a processed page with the given tokens, files that failed to transfer from the page are
+    added to those to try again and files transferred are taken out of them."""
+    failed = dict.fromkeys(state.failed)
+    for record in records:
+        if record.media_item_id is None:
+            failed[record.file.id] = None
+        else:
+            failed.pop(record.file.id, None)
+    return state.model_copy(update={**tokens, "failed": list(failed)})
+
+
+class DriveSync:
+    """Synchronizes Drives of accounts to Photos, transferring only files not transferred before."""
+
+    def __init__(self, engine: TransferEngine, store: AsyncStore, progress: ProgressBus | None = None):
+        """Initialize the sync, files are transferred by the engine, checkpoints and records are kept in the store.
+        Progress of syncs is published to the `progress` bus, if any."""
+        self._engine = engine
+        self._store = store
+        self._progress = progress
+
+    async def _transfer(self, auth: Auth, files: list[DriveFile], progress: SyncProgress) -> list[TransferRecord]:
+        """Transfer files that were not transferred yet or whose content changed since."""
+        email = auth.openid.email
+        done = await self._store.get_many([record_key(email, file.id) for file in files], TransferRecord)
+        pending = []
+        for file in files:
+            record = done.get(record_key(email, file.id))
+            if record is None or record.media_item_id is None or record.file.md5_checksum != file.md5_checksum:
+                pending.append(file)
+        progress.listed(len(pending))
+        return await self._engine.transfer_batch(auth, pending, progress.handled)
+
+    async def _commit(self, email: str, records: list[TransferRecord], state: DriveSyncState) -> None:
+        """Store records of a processed page together with the checkpoint following it."""
+        async with self._store.transaction():
+            await self._store.set_many({record_key(email, record.file.id): record for record in records})
+            await self._store.set(email, state)
+
+    async def _retry(self, auth: Auth, state: DriveSyncState, progress: SyncProgress) -> DriveSyncState:
+        """Transfer files that failed to transfer in previous syncs again, a batch at a time. Files whose records are
+        gone or that were transferred meanwhile are not tried again."""
+        email = auth.openid.email
+        retrying = state.failed
+        for start in range(0, len(retrying), RETRY_BATCH_SIZE):
+            batch = retrying[start : start + RETRY_BATCH_SIZE]
+            records = await self._store.get_many([record_key(email, file_id) for file_id in batch], TransferRecord)
+            page_records = await self._transfer(auth, [record.file for record in records.values()], progress)
+            # files failing again are added back by the checkpoint
+            retried = set(batch)
+            state = state.model_copy(update={"failed": [file_id for file_id in state.failed if file_id not in retried]})
+            state = _checkpoint(state, page_records)
+            await self._commit(email, page_records, state)
+        return state
+
+    async def sync(self, auth: Auth) -> TransferStats:
+        """Transfer images of an account added or modified since the last sync, or all of them on the first one."""
+        progress = SyncProgress(auth.openid.email, self._progress)
+        try:
+            return await self._sync(auth, progress)
+        finally:
+            progress.finish()
+
+    async def _sync(self, auth: Auth, progress: SyncProgress) -> TransferStats:
+        """Transfer images of an account, counting handled files in `progress`."""
+        start = time.monotonic()
+        email = auth.openid.email
+        drive, _ = self._engine.clients(auth)
+        state = await self._store.get(email, DriveSyncState)
+        if state is None:
+            # changes are tracked from before the listing starts, so that files added meanwhile are not missed
+            state = DriveSyncState(changes_token=await drive.start_page_token(), listing_token="")
+            await self._store.set(email, state)
+        state = await self._retry(auth, state, progress)
+        while state.listing_token is not None:
+            files_page = await drive.list_page(state.listing_token)
+            page_records = await self._transfer(auth, files_page.files, progress)
+            state = _checkpoint(state, page_records, listing_token=files_page.next_page_token)
+            await self._commit(email, page_records, state)
+        while True:
+            changes_page = await drive.list_changes(state.changes_token)
+            page_records = await self._transfer(auth, changes_page.files, progress)
+            next_token = changes_page.next_page_token or changes_page.new_start_page_token or state.changes_token
+            state = _checkpoint(state, page_records, changes_token=next_token)
+            await self._commit(email, page_records, state)
+            if changes_page.next_page_token is None:
+                break
+        return TransferStats(
+            progress.files, progress.bytes, progress.failed, time.monotonic() - start, progress.skipped
+        )
+
+    async def sync_all(self, accounts: Iterable[Auth]) -> TransferStats:
+        """Sync accounts concurrently, sharing the concurrency limit of the engine.
+        Accounts without an access token are skipped, an account failing to sync does not stop the others."""
+        start = time.monotonic()
+        ready = []
+        for auth in accounts:
+            if auth.access_token is None:
+                logger.warning("Skipping %s, there is no access token", auth.openid.email)
+            else:
+                ready.append(auth)
+        results = await asyncio.gather(*(self.sync(auth) for auth in ready), return_exceptions=True)
+        files = transferred = failed = skipped = 0
+        for auth, result in zip(ready, results):
+            if isinstance(result, BaseException):
+                if not isinstance(result, TRANSFER_ERRORS):
+                    raise result
+                logger.error("Syncing %s failed: %s", auth.openid.email, result)
+                continue
+            logger.info("Synced %s: %d files transferred, %d failed", auth.openid.email, result.files, result.failed)
+            files, transferred, failed = files + result.files, transferred + result.bytes, failed + result.failed
+            skipped += result.skipped
+        return TransferStats(files, transferred, failed, time.monotonic() - start, skipped)
@@ -0,0 +1,167 @@
+"""Access tokens of Google accounts, refreshed before they expire.
+Every account has at most one refresh in flight, callers asking for a token while it runs wait for the same refresh,
+and its result is written to the store once. Tokens are refreshed in the background `margin` seconds ahead of their
+expiry, requests made with an expired token anyway refresh it and are sent again."""
+
+import asyncio
+import logging
+import time
+from typing import AsyncGenerator, Generator
+
+import httpx
+
+from photom.models import Auth
+from photom.store.base import AsyncStore
+
+logger = logging.getLogger(__name__)
+
+TOKEN_URL = "https://oauth2.googleapis.com/token"
+REFRESH_MARGIN = 300.0
+
+
+class TokenRefreshError(Exception):
+    """An access token could not be refreshed."""
+
+
+class TokenManager:  # pylint: disable=too-many-instance-attributes
+    """Keeps access tokens of accounts fresh, refreshed logins are written to the store."""
+
+    def __init__(
+        self,
+        client: httpx.AsyncClient,
+        store: AsyncStore,
+        client_id: str,
+        client_secret: str,
+        token_url: str = TOKEN_URL,
+        margin: float = REFRESH_MARGIN,
+    ):  # pylint: disable=too-many-arguments
+        """Initialize the manager, tokens are refreshed at the token endpoint with the given client credentials."""
+        self._client = client
+        self._store = store
+        self._credentials = {"client_id": client_id, "client_secret": client_secret}
+        self._token_url = token_url
+        self._margin = margin
+        self._auths: dict[str, Auth] = {}
+        self._refreshing: dict[str, asyncio.Task[Auth]] = {}
+        self._timers: dict[str, asyncio.TimerHandle] = {}
+        self.refreshes = 0
+
+    async def __aenter__(self) -> "TokenManager":
+        """Enter the manager context."""
+        return self
+
+    async def __aexit__(self, *_) -> None:
+        """Exit the manager context, stopping background refreshes."""
+        await self.close()
+
+    def _expiring(self, auth: Auth) -> bool:
+        """Whether the access token is missing or expires within the margin, tokens of unknown expiry never do."""
+        if auth.access_token is None:
+            return True
+        return auth.expires_at is not None and auth.expires_at - self._margin <= time.time()
+
+    def _schedule(self, auth: Auth) -> None:
+        """Refresh the access token in the background once it gets close to its expiry."""
+        email = auth.openid.email
+        if email in self._timers:
+            self._timers.pop(email).cancel()
+        if auth.expires_at is None:
+            return
+        delay = max(0.0, auth.expires_at - self._margin - time.time())
+        self._timers[email] = asyncio.get_running_loop().call_later(delay, self._refresh_in_background, email)
+
+    def _refresh_in_background(self, email: str) -> None:
+        """Start a refresh from a timer, failures are only logged."""
+        self._timers.pop(email, None)
+        task = self._start_refresh(self._auths[email])
+        task.add_done_callback(lambda done: done.cancelled() or done.exception())
+
+    def _start_refresh(self, auth: Auth) -> "asyncio.Task[Auth]":
+        """Get the refresh of the account in flight, starting one if there is none."""
+        email = auth.openid.email
+        task = self._refreshing.get(email)
+        if task is None:
+            task = self._refreshing[email] = asyncio.create_task(self._refresh(auth))
+            task.add_done_callback(lambda _: self._refreshing.pop(email, None))
+        return task
+
+    async def _refresh(self, auth: Auth) -> Auth:
+        """Exchange the refresh token for a new access token and store the refreshed login."""
+        email = auth.openid.email
+        logger.info("Refreshing access token of %s", email)
+        data = self._credentials | {"grant_type": "refresh_token", "refresh_token": auth.refresh_token}
+        try:
+            response = await self._client.post(self._token_url, data=data)
+            response.raise_for_status()
+            token = response.json()
+        except httpx.HTTPError as error:
+            logger.error("Refreshing access token of %s failed: %s", email, error)
+            raise TokenRefreshError(f"Refreshing access token of {email} failed: {error}") from error
+        refreshed = auth.model_copy(
+            update={
+                "access_token": token["access_token"],
+                "refresh_token": token.get("refresh_token") or auth.refresh_token,
+                "expires_at": time.time() + token["expires_in"] if "expires_in" in token else None,
+            }
+        )
+        await self._store.set(email, refreshed)
+        self._auths[email] = refreshed
+        self.refreshes += 1
+        self._schedule(refreshed)
+        return refreshed
+
+    async def get(self, auth: Auth) -> Auth:
+        """Get the current login of an account with an access token that is not about to expire.
+        The first login seen for an account is tracked from then on, later ones are only used to identify it."""
+        email = auth.openid.email
+        if email not in self._auths:
+            self._auths[email] = auth
+            self._schedule(auth)
+        current = self._auths[email]
+        if self._expiring(current):
+            return await self.refresh(current)
+        return current
+
+    async def refresh(self, auth: Auth) -> Auth:
+        """Refresh the access token of a login that was rejected, unless it was refreshed since.
+        Concurrent callers share a single refresh, which is not cancelled when any of them is."""
+        current = self._auths.setdefault(auth.openid.email, auth)
+        if current.access_token != auth.access_token and not self._expiring(current):
+            return current
+        return await asyncio.shield(self._start_refresh(current))
+
+    def httpx_auth(self, auth: Auth) -> httpx.Auth:
+        """Authentication of requests made on behalf of the account, with its current access token."""
+        return _BearerAuth(self, auth)
+
+    async def close(self) -> None:
+        """Stop background refreshes, waiting for those in flight."""
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers.clear()
+        await asyncio.gather(*self._refreshing.values(), return_exceptions=True)
+
+
+class _BearerAuth(httpx.Auth):
+    """Authorizes requests with the current access token of an account, refreshing it once the token is rejected.
+    Rejected requests are sent again if their content can be sent twice, streamed uploads are not."""
+
+    def __init__(self, manager: TokenManager, auth: Auth):
+        self._manager = manager
+        self._auth = auth
+
+    def sync_auth_flow(self, request: httpx.Request) -> Generator[httpx.Request, httpx.Response, None]:
+        """Tokens are refreshed by asyncio code only."""
+        raise RuntimeError("Managed tokens can only be used with an async client")
+
+    async def async_auth_flow(self, request: httpx.Request) -> AsyncGenerator[httpx.Request, httpx.Response]:
+        """Send the request with the current token, once more with a refreshed one if it is rejected."""
+        auth = await self._manager.get(self._auth)
+        request.headers["Authorization"] = f"Bearer {auth.access_token}"
+        response = yield request
+        if response.status_code != 401:
+            return
+        auth = await self._manager.refresh(auth)
+        if isinstance(request.stream, httpx.ByteStream):
+            request.headers["Authorization"] = f"Bearer {auth.access_token}"
+            yield request
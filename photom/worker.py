@@ -0,0 +1,215 @@
+"""Worker processes running jobs of the job queue.
+
+    python -m photom.worker --processes 4
+
+Every worker process claims one job at a time and extends its lease with heartbeats while it runs. Files of a job are
+transferred concurrently already, more processes put more cores to use. With `--burst`, workers exit once the queue is
+empty instead of waiting for new jobs. SIGTERM or SIGINT lets running jobs finish before the workers exit. With
+`--metrics-port`, every worker serves its metrics on `/metrics` of its own port, counting up from the given one.
+Progress of syncs is written to the store database, from where the API streams it to clients."""
+
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import time
+import uuid
+from contextlib import suppress
+from typing import Any, Callable, Coroutine, Mapping
+
+from photom.config import Config
+from photom.metrics import histogram, start_server
+from photom.models import Auth, Job
+from photom.progress import BUS, record
+from photom.store.base import AsyncStore
+from photom.store.jobs import JobQueue
+from photom.store.sqlite import close_pools
+from photom.store.threaded import shutdown_executor
+from photom.transfer.engine import TransferEngine
+from photom.transfer.sync import DriveSync
+from photom.transfer.tokens import TokenManager
+
+logger = logging.getLogger(__name__)
+
+SYNC = "sync"
+DEFAULT_POLL_INTERVAL = 1.0
+
+JOB_SECONDS = histogram("photom_job_seconds", "Duration of jobs run by workers", ("kind", "outcome"))
+
+Handler = Callable[[Job], Coroutine[Any, Any, dict[str, Any] | None]]
+
+
+class JobError(Exception):
+    """A job failed in a way that running it again would not fix."""
+
+
+class Worker:
+    """Claims jobs from the queue one at a time and runs them with the handler of their kind."""
+
+    def __init__(
+        self,
+        queue: JobQueue,
+        handlers: Mapping[str, Handler],
+        name: str | None = None,
+        poll_interval: float = DEFAULT_POLL_INTERVAL,
+        heartbeat_interval: float | None = None,
+    ):  # pylint: disable=too-many-arguments
+        """Initialize the worker, idle workers look for jobs every `poll_interval` seconds and running jobs send a
+        heartbeat every `heartbeat_interval` seconds, a third of the lease by default."""
+        self.name = name or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._queue = queue
+        self._handlers = handlers
+        self._poll_interval = poll_interval
+        self._heartbeat_interval = heartbeat_interval or queue.lease_seconds / 3
+        self.processed = 0
+
+    async def run(self, stop: asyncio.Event | None = None, burst: bool = False) -> int:
+        """Run jobs until stopped, or until the queue is empty with `burst`. Return the number of jobs run."""
+        stop = stop or asyncio.Event()
+        logger.info("Worker %s started", self.name)
+        while not stop.is_set():
+            job = await asyncio.to_thread(self._queue.claim, self.name)
+            if job is None:
+                if burst:
+                    break
+                with suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(stop.wait(), self._poll_interval)
+                continue
+            await self.process(job)
+        logger.info("Worker %s stopped after %d jobs", self.name, self.processed)
+        return self.processed
+
+    async def process(self, job: Job) -> None:
+        """Run a claimed job while keeping its lease, record how it went. A job whose lease was lost is abandoned."""
+        handler = self._handlers.get(job.kind)
+        if handler is None:
+            await asyncio.to_thread(self._queue.fail, job.id, self.name, f"Unknown job kind {job.kind}", False)
+            return
+        logger.info("Running %s job %d, attempt %d", job.kind, job.id, job.attempts)
+        start = time.perf_counter()
+        task = asyncio.create_task(handler(job))
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=self._heartbeat_interval)
+            if done:
+                break
+            if not await asyncio.to_thread(self._queue.heartbeat, job.id, self.name):
+                task.cancel()
+                with suppress(asyncio.CancelledError):
+                    await task
+                JOB_SECONDS.labels(job.kind, "lost").observe(time.perf_counter() - start)
+                return
+        self.processed += 1
+        outcome = "failed"
+        try:
+            result = task.result()
+        except JobError as error:
+            logger.error("Job %d failed: %s", job.id, error)
+            await asyncio.to_thread(self._queue.fail, job.id, self.name, str(error), False)
+        except Exception as error:  # pylint: disable=broad-exception-caught
+            logger.exception("Job %d failed", job.id)
+            await asyncio.to_thread(self._queue.fail, job.id, self.name, f"{type(error).__name__}: {error}")
+        else:
+            outcome = "done"
+            await asyncio.to_thread(self._queue.complete, job.id, self.name, result)
+        JOB_SECONDS.labels(job.kind, outcome).observe(time.perf_counter() - start)
+
+
+def sync_handler(sync: DriveSync, store: AsyncStore) -> Handler:
+    """Handler of jobs syncing the Drive of the account with the email in their payload to Photos."""
+
+    async def run(job: Job) -> dict[str, Any]:
+        email = job.payload["email"]
+        auth = await store.get(email, Auth)
+        if auth is None:
+            raise JobError(f"There is no login of {email}")
+        return (await sync.sync(auth))._asdict()
+
+    return run
+
+
+async def serve(burst: bool = False, metrics_host: str = "127.0.0.1", metrics_port: int | None = None) -> int:
+    """Run a worker with the configured store and Google client until it is stopped, return the number of jobs run.
+    Metrics are served on the given port until the process exits, if any."""
+    config = Config()
+    queue = config.job_queue
+    if queue is None:
+        raise RuntimeError("The job queue needs the SQLite store with its database in a file")
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+    if metrics_port is not None:
+        start_server(metrics_host, metrics_port)
+    recording = None
+    if config.progress_log is not None:
+        recording = asyncio.create_task(record(BUS, config.progress_log, config.progress_interval))
+    try:
+        async with config.get_http_client() as client, config.get_async_store_backend() as store:
+            # refreshed logins are written through a store of their own, so they never join a transaction of a sync
+            async with config.get_async_store_backend() as token_store, TokenManager(
+                client, token_store, config.google_client_id, config.google_client_secret
+            ) as tokens:
+                engine = TransferEngine(
+                    client,
+                    config.transfer_concurrency,
+                    chunk_size=config.transfer_chunk_size,
+                    dedup=config.dedup_index,
+                    batch_wait=config.transfer_batch_wait,
+                    tokens=tokens,
+                )
+                handlers = {SYNC: sync_handler(DriveSync(engine, store, BUS), store)}
+                return await Worker(queue, handlers, poll_interval=config.worker_poll_interval).run(stop, burst)
+    finally:
+        if recording is not None:
+            recording.cancel()
+            with suppress(asyncio.CancelledError):
+                await recording
+        shutdown_executor()
+        close_pools()
+
+
+def _run(burst: bool, metrics_host: str, metrics_port: int | None) -> None:
+    """Run a worker in this process."""
+    asyncio.run(serve(burst, metrics_host, metrics_port))
+
+
+def main(argv: list[str] | None = None) -> None:
+    """Start worker processes and wait for them to exit."""
+    parser = argparse.ArgumentParser(prog="python -m photom.worker", description=__doc__.split("\n", 1)[0])
+    parser.add_argument("--processes", type=int, default=1, help="number of worker processes")
+    parser.add_argument("--burst", action="store_true", help="exit once the queue is empty")
+    parser.add_argument("--metrics-host", default="127.0.0.1", help="address to serve metrics on")
+    parser.add_argument("--metrics-port", type=int, help="port of the first worker to serve metrics on")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(processName)s %(name)s %(levelname)s %(message)s")
+    if args.processes <= 1:
+        _run(args.burst, args.metrics_host, args.metrics_port)
+        return
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(
+            target=_run,
+            args=(args.burst, args.metrics_host, None if args.metrics_port is None else args.metrics_port + index),
+            name=f"worker-{index}",
+        )
+        for index in range(args.processes)
+    ]
+    for process in processes:
+        process.start()
+
+    def terminate(*_) -> None:
+        for process in processes:
+            process.terminate()
+
+    # workers share the process group, a terminal interrupt reaches them anyway
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, terminate)
+    for process in processes:
+        process.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,21 @@
+"""Shared API test fixtures"""
+
+import os
+from pathlib import Path
+from typing import Iterator
+
+import pytest
+from fastapi.testclient import TestClient
+
+from photom.api.asgi import app
+from photom.config import Config
+
+
+@pytest.fixture(name="file_client")
+def file_client_fixture(monkeypatch: pytest.MonkeyPatch, tmp_path: Path) -> Iterator[TestClient]:
+    """Test client of the app storing logins and jobs in a SQLite database file"""
+    monkeypatch.setenv("STORE_BACKEND", "photom.store.sqlite.SQLiteStore")
+    monkeypatch.setenv("STORE_BACKEND_PATH", os.path.join(tmp_path, "test.db"))
+    Config().reload()
+    with TestClient(app, base_url="http://photom.dev") as client:
+        yield client
@@ -1,7 +1,9 @@
 """Test authentication endpoints"""
 
+import json
 import os
-from typing import Any, Dict
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, Iterator
 
 import oauthlib.oauth2.rfc6749.errors
 import pytest
@@ -10,14 +12,18 @@ from fastapi_sso.sso.base import DiscoveryDocument, OpenID
 from fastapi_sso.sso.google import GoogleSSO
 from starlette.requests import Request
 
+from photom.api._auth import stream_json_array
 from photom.api.asgi import app
+from photom.config import Config
 from photom.models import Auth
+from tests.transfer.fake_google import FakeGoogle
 
 
 @pytest.fixture(name="client")
-def client_fixture() -> TestClient:
-    """Get app's test client"""
-    return TestClient(app, base_url="http://photom.dev")
+def client_fixture() -> Iterator[TestClient]:
+    """Get app's test client, running the app's lifespan"""
+    with TestClient(app, base_url="http://photom.dev") as client:
+        yield client
 
 
 test_id = OpenID(id="test", email="test@example.com", display_name="Test Testowitch", provider="google")
@@ -29,6 +35,7 @@ def set_env_vars():
     os.environ["GOOGLE_CLIENT_ID"] = "test_client_id"
     os.environ["GOOGLE_CLIENT_SECRET"] = "test_client_secret"
     os.environ["OAUTHLIB_INSECURE_TRANSPORT"] = "1"
+    Config().reload()
 
 
 class PatchedGoogleSSO(GoogleSSO):
@@ -50,7 +57,7 @@ class PatchedGoogleSSO(GoogleSSO):
         *,
         params: Dict[str, Any] | None = None,
         headers: Dict[str, Any] | None = None,
-        redirect_uri: str | None = None
+        redirect_uri: str | None = None,
     ) -> OpenID | None:
         """Mock successful response from Google SSO"""
         if request.query_params.get("code") == "success":
@@ -70,7 +77,7 @@ async def discovery_document_patch(_) -> DiscoveryDocument:
 @pytest.fixture(name="_patch_google_sso")
 def patch_google_sso(monkeypatch: pytest.MonkeyPatch):
     """Patch google sso with our test class"""
-    monkeypatch.setattr("photom.api._auth.get_google_sso", lambda: PatchedGoogleSSO("client_id", "client_secret"))
+    monkeypatch.setattr("photom.api._auth.get_google_sso", lambda _: PatchedGoogleSSO("client_id", "client_secret"))
 
 
 class TestAuth:
@@ -78,7 +85,7 @@ class TestAuth:
 
     def test_login_url(self, client: TestClient, monkeypatch: pytest.MonkeyPatch, _set_env_vars):
         """Test login url"""
-        monkeypatch.setattr("fastapi_sso.sso.google.GoogleSSO.get_discovery_document", discovery_document_patch)
+        monkeypatch.setattr("photom.api._auth.LimitedGoogleSSO.get_discovery_document", discovery_document_patch)
         response = client.get("http://photom.dev/auth/login", follow_redirects=False)
         assert response.status_code == 303
         assert response.headers["location"].startswith("http://photom.dev/oauth2/auth")
@@ -103,3 +110,77 @@ class TestAuth:
         )
         assert response.status_code == 307
         assert response.headers["location"] == "http://photom.dev/"
+
+    def test_login_flow_pooled(self, google: FakeGoogle, monkeypatch: pytest.MonkeyPatch, _set_env_vars):
+        """Test that login flows share keep-alive connections and the discovery document, through the rate limiter"""
+        google.add_files("alice", 1)
+        monkeypatch.setattr("photom.api._auth.LimitedGoogleSSO.discovery_url", google.discovery_url)
+        with TestClient(app, base_url="http://photom.dev") as client:
+            responses = [client.get("http://photom.dev/auth/callback?code=alice") for _ in range(5)]
+        assert all(response.status_code == 200 for response in responses)
+        auth = Auth(**responses[-1].json())
+        assert (auth.openid.email, auth.access_token, auth.refresh_token) == (
+            "alice@example.com",
+            "alice",
+            "alice-refresh",
+        )
+        assert auth.expires_at
+        assert (google.requests["discovery"], google.requests["token"]) == (1, 5)
+        assert len(google.connections) == 1
+        (limits,) = Config().rate_limiter.metrics()
+        assert (limits.api, limits.in_flight) == ("oauth", 0)
+
+    def test_list_accounts(self, client: TestClient, monkeypatch: pytest.MonkeyPatch, tmp_path: Path):
+        """Test listing stored logins page by page"""
+        monkeypatch.setenv("STORE_BACKEND", "photom.store.file.FileStore")
+        monkeypatch.setenv("STORE_BACKEND_PATH", str(tmp_path))
+        Config().reload()
+        assert client.get("http://photom.dev/auth/").json() == []
+        with Config().get_store_backend() as store:
+            for index in range(5):
+                email = f"test{index}@example.com"
+                store.set(email, Auth(openid=OpenID(email=email), access_token=None, refresh_token="token"))
+
+        response = client.get("http://photom.dev/auth/")
+        assert response.headers["content-type"] == "application/json"
+        assert [Auth(**item).openid.email for item in response.json()] == [
+            f"test{index}@example.com" for index in range(5)
+        ]
+
+        response = client.get("http://photom.dev/auth/?limit=2&after=test1@example.com")
+        assert [item["openid"]["email"] for item in response.json()] == ["test2@example.com", "test3@example.com"]
+
+        assert client.get("http://photom.dev/auth/?limit=0").status_code == 422
+
+
+async def _collect(values: list[OpenID]) -> list[str]:
+    """Stream values as a JSON array and collect the chunks"""
+
+    async def iterate() -> AsyncIterator[OpenID]:
+        for value in values:
+            yield value
+
+    return [chunk async for chunk in stream_json_array(iterate())]
+
+
+@pytest.mark.asyncio
+async def test_stream_json_array(monkeypatch: pytest.MonkeyPatch):
+    """Test that models are streamed in chunks forming a valid JSON array"""
+    monkeypatch.setattr("photom.api._auth.STREAM_CHUNK_SIZE", 2)
+    values = [OpenID(id=str(index)) for index in range(5)]
+    chunks = await _collect(values)
+    assert len(chunks) == 3
+    assert [OpenID(**item) for item in json.loads("".join(chunks))] == values
+    assert await _collect([]) == ["[]"]
+
+
+def test_delete_account(client: TestClient, monkeypatch: pytest.MonkeyPatch, tmp_path: Path):
+    """Test deleting a stored login"""
+    monkeypatch.setenv("STORE_BACKEND", "photom.store.file.FileStore")
+    monkeypatch.setenv("STORE_BACKEND_PATH", str(tmp_path))
+    Config().reload()
+    with Config().get_store_backend() as store:
+        store.set("test@example.com", Auth(openid=test_id, access_token=None, refresh_token="token"))
+    response = client.delete("http://photom.dev/auth/test@example.com")
+    assert response.status_code == 204
+    assert client.get("http://photom.dev/auth/").json() == []
@@ -0,0 +1,38 @@
+"""Test background job endpoints"""
+
+import pytest
+from fastapi.testclient import TestClient
+from fastapi_sso.sso.base import OpenID
+
+from photom.api.asgi import app
+from photom.config import Config
+from photom.models import Auth, Job
+
+
+class TestJobs:
+    """Test suite for job endpoints"""
+
+    def test_enqueue_sync(self, file_client: TestClient):
+        """Test that a sync is queued for a stored login, once while it waits for a worker"""
+        assert file_client.post("http://photom.dev/jobs/sync/test@example.com").status_code == 404
+        with Config().get_store_backend() as store:
+            store.set(
+                "test@example.com",
+                Auth(openid=OpenID(email="test@example.com"), access_token="access", refresh_token="refresh"),
+            )
+        response = file_client.post("http://photom.dev/jobs/sync/test@example.com")
+        assert response.status_code == 202
+        job = Job(**response.json())
+        assert (job.kind, job.status, job.payload) == ("sync", "queued", {"email": "test@example.com"})
+        assert file_client.post("http://photom.dev/jobs/sync/test@example.com").json()["id"] == job.id
+        assert Job(**file_client.get(f"http://photom.dev/jobs/{job.id}").json()) == job
+        assert file_client.get(f"http://photom.dev/jobs/{job.id + 1}").status_code == 404
+
+    def test_no_queue(self, monkeypatch: pytest.MonkeyPatch):
+        """Test that jobs are unavailable without a store database file to keep them in"""
+        monkeypatch.setenv("STORE_BACKEND", "photom.store.sqlite.SQLiteStore")
+        monkeypatch.setenv("STORE_BACKEND_PATH", ":memory:")
+        Config().reload()
+        with TestClient(app, base_url="http://photom.dev") as client:
+            response = client.post("http://photom.dev/jobs/sync/test@example.com")
+        assert response.status_code == 503
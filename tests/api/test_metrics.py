@@ -0,0 +1,41 @@
+"""Test the metrics endpoint"""
+
+from fastapi.testclient import TestClient
+
+from photom.api._metrics import REQUEST_SECONDS
+from photom.store.instrumented import CALL_SECONDS
+from tests.metrics import sample
+
+
+class TestMetrics:
+    """Test suite for the metrics endpoint"""
+
+    def test_request_timing(self, file_client: TestClient):
+        """Test that requests are timed by the path template of their route"""
+        jobs = {"method": "GET", "route": "/jobs/{job_id}", "status": "404"}
+        unmatched = {"method": "GET", "route": "unmatched", "status": "404"}
+        before = (sample(REQUEST_SECONDS, "_count", **jobs), sample(REQUEST_SECONDS, "_count", **unmatched))
+        for job_id in (1, 2):
+            assert file_client.get(f"http://photom.dev/jobs/{job_id}").status_code == 404
+        assert file_client.get("http://photom.dev/nowhere").status_code == 404
+        assert sample(REQUEST_SECONDS, "_count", **jobs) == before[0] + 2
+        assert sample(REQUEST_SECONDS, "_count", **unmatched) == before[1] + 1
+
+    def test_metrics(self, file_client: TestClient):
+        """Test that metrics of requests, store calls and jobs are exposed in the Prometheus text format"""
+        assert file_client.post("http://photom.dev/jobs/sync/test@example.com").status_code == 404
+        response = file_client.get("http://photom.dev/metrics")
+        assert response.status_code == 200
+        assert response.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+        lines = response.text.splitlines()
+        assert "# TYPE photom_http_request_seconds histogram" in lines
+        labels = {"method": "POST", "route": "/jobs/sync/{email}", "status": "404"}
+        count = sample(REQUEST_SECONDS, "_count", **labels)
+        assert (
+            f'photom_http_request_seconds_count{{method="POST",route="/jobs/sync/{{email}}",status="404"}} {count}'
+            in lines
+        )
+        assert 'photom_jobs{status="queued"} 0.0' in lines
+        assert "# TYPE photom_store_call_seconds histogram" in lines
+        assert sample(CALL_SECONDS, "_count", backend="SQLiteStore", model="Auth", method="get") > 0
+        assert "/metrics" not in file_client.get("http://photom.dev/openapi.json").json()["paths"]
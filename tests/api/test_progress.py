@@ -0,0 +1,127 @@
+"""Test progress routes"""
+
+import asyncio
+import json
+import time
+from typing import Iterator
+
+import pytest
+from fastapi.testclient import TestClient
+
+from photom.api.asgi import app
+from photom.config import Config
+from photom.models import AccountProgress
+from photom.progress import BUS
+
+SUBSCRIBERS = 300
+EMAILS = ("alice@example.com", "bob@example.com", "carol@example.com")
+
+
+@pytest.fixture(name="bus", autouse=True)
+def bus_fixture() -> Iterator[None]:
+    """Progress bus without the states published by other tests"""
+    BUS.latest.clear()
+    yield
+    BUS.latest.clear()
+
+
+async def _stream(path: str, chunks: list[bytes], headers: dict[str, str], disconnect: asyncio.Event) -> None:
+    """Request a streaming route of the app, collecting the chunks of the response until the client disconnects"""
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"host", b"photom.dev"), (b"accept", b"text/event-stream")],
+        "client": ("127.0.0.1", 50000),
+        "server": ("photom.dev", 80),
+    }
+    requested = False
+
+    async def receive() -> dict:
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await disconnect.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message: dict) -> None:
+        if message["type"] == "http.response.start":
+            headers.update((name.decode(), value.decode()) for name, value in message["headers"])
+        elif message.get("body"):
+            chunks.append(message["body"])
+
+    await app(scope, receive, send)
+
+
+def _events(chunks: list[bytes]) -> list[AccountProgress]:
+    """States of the `progress` events of a stream"""
+    states = []
+    for event in b"".join(chunks).decode().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in event.splitlines() if not line.startswith(":"))
+        if lines.get("event") == "progress":
+            states.append(AccountProgress.model_validate(json.loads(lines["data"])))
+    return states
+
+
+class TestProgress:
+    """Progress routes test suite"""
+
+    @pytest.mark.asyncio
+    async def test_stream(self, monkeypatch: pytest.MonkeyPatch):
+        """Test that hundreds of clients streaming at once get the latest state of every account, at most once per
+        interval, and unsubscribe once they disconnect"""
+        monkeypatch.setenv("PROGRESS_INTERVAL", "0.05")
+        Config().reload()
+        BUS.publish(AccountProgress(email="alice@example.com", pending=1000))
+        disconnect = asyncio.Event()
+        streams: list[list[bytes]] = [[] for _ in range(SUBSCRIBERS)]
+        headers: list[dict[str, str]] = [{} for _ in range(SUBSCRIBERS)]
+        tasks = [
+            asyncio.create_task(_stream("/progress/stream", chunks, response, disconnect))
+            for chunks, response in zip(streams, headers)
+        ]
+        while not all(streams):
+            await asyncio.sleep(0.01)
+        assert BUS.subscribers == SUBSCRIBERS
+        start = time.monotonic()
+        for files in range(1, 1001):
+            for email in EMAILS:
+                BUS.publish(AccountProgress(email=email, files=files, pending=1000 - files))
+            if files % 50 == 0:
+                await asyncio.sleep(0.01)
+        final = {email: AccountProgress(email=email, files=1000, pending=0) for email in EMAILS}
+        while any({state.email: state for state in _events(chunks)} != final for chunks in streams):
+            assert time.monotonic() - start < 30, "every client gets the final states"
+            await asyncio.sleep(0.05)
+        seconds = time.monotonic() - start
+        disconnect.set()
+        await asyncio.wait_for(asyncio.gather(*tasks), 30)
+        assert BUS.subscribers == 0
+        for chunks, response in zip(streams, headers):
+            assert response["content-type"].startswith("text/event-stream")
+            events = _events(chunks)
+            assert events[0] == AccountProgress(email="alice@example.com", pending=1000), "the latest state comes first"
+            assert len(events) < 3 * 1000 / 10, "states published in between are dropped"
+            assert len(events) <= 1 + len(EMAILS) * (seconds / 0.05 + 2)
+
+    def test_relay(self, file_client: TestClient):
+        """Test that progress written by worker processes is relayed to the API"""
+        assert file_client.get("/progress/").json() == []
+        log = Config().progress_log
+        assert log is not None
+        log.write([AccountProgress(email="bob@example.com", files=2), AccountProgress(email="alice@example.com")])
+        start = time.monotonic()
+        while len(states := file_client.get("/progress/").json()) < 2:
+            assert time.monotonic() - start < 10
+            time.sleep(0.01)
+        assert [AccountProgress.model_validate(state) for state in states] == [
+            AccountProgress(email="alice@example.com"),
+            AccountProgress(email="bob@example.com", files=2),
+        ]
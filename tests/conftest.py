@@ -0,0 +1,35 @@
+"""Shared test fixtures"""
+
+import threading
+import time
+from typing import Iterator
+
+import pytest
+import uvicorn
+
+from photom.config import Config
+from tests.transfer.fake_google import FakeGoogle
+
+
+@pytest.fixture(autouse=True)
+def _reload_config() -> Iterator[None]:
+    """Make sure environment changes made by a test do not leak to other tests through resolved config"""
+    Config().reload()
+    yield
+    Config().reload()
+
+
+@pytest.fixture(name="google")
+def google_fixture() -> Iterator[FakeGoogle]:
+    """Fake Google APIs served over HTTP on a local port"""
+    fake = FakeGoogle()
+    server = uvicorn.Server(uvicorn.Config(fake.app, host="127.0.0.1", port=0, log_level="warning", lifespan="off"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    port = server.servers[0].sockets[0].getsockname()[1]
+    fake.url = f"http://127.0.0.1:{port}"
+    yield fake
+    server.should_exit = True
+    thread.join()
@@ -0,0 +1,12 @@
+"""Reading samples of metrics in tests"""
+
+from prometheus_client.metrics import MetricWrapperBase
+
+
+def sample(metric: MetricWrapperBase, suffix: str = "", **labels: str) -> float:
+    """Value of the sample of a metric with the given name suffix and labels, 0 if it was not recorded yet"""
+    for family in metric.collect():
+        for recorded in family.samples:
+            if recorded.name == family.name + suffix and recorded.labels == labels:
+                return recorded.value
+    return 0.0
@@ -0,0 +1,110 @@
+"""Test the caching store layer."""
+
+import os
+from pathlib import Path
+
+import pytest
+from fastapi_sso.sso.base import OpenID
+
+from photom.models import Auth
+from photom.store.cached import CachedStore, CacheStats, StoreCache
+from photom.store.sqlite import SQLiteStore, close_pools
+
+test_auth = Auth(openid=OpenID(id="test", email="test@example.com"), access_token=None, refresh_token="refresh")
+
+
+@pytest.fixture(name="store")
+def store_fixture(tmp_path: Path):
+    """Cached store on top of a fresh SQLite database."""
+    with CachedStore(SQLiteStore(os.path.join(tmp_path, "test.db")), StoreCache(2)) as store:
+        yield store
+    close_pools()
+
+
+class TestStoreCache:
+    """Test the LRU cache."""
+
+    def test_lru_eviction(self):
+        """Test that least recently used instances are evicted first."""
+        cache = StoreCache(2)
+        cache.put("a", test_auth)
+        cache.put("b", test_auth)
+        assert cache.get(Auth, "a") is test_auth
+        cache.put("c", test_auth)
+        assert cache.get(Auth, "b") is None
+        assert cache.get(Auth, "a") is test_auth
+        assert cache.stats == CacheStats(hits=2, misses=1, evictions=1, expirations=0, size=2)
+
+    def test_ttl(self, monkeypatch: pytest.MonkeyPatch):
+        """Test that instances expire."""
+        now = [100.0]
+        monkeypatch.setattr("time.monotonic", lambda: now[0])
+        cache = StoreCache(2, ttl=10)
+        cache.put("a", test_auth)
+        now[0] += 9
+        assert cache.get(Auth, "a") is test_auth
+        now[0] += 2
+        assert cache.get(Auth, "a") is None
+        assert cache.stats.expirations == 1
+
+    def test_fill_after_write(self):
+        """Test that a read racing with a write does not cache an outdated instance."""
+        cache = StoreCache(2)
+        generation = cache.generation
+        cache.invalidate(Auth, "a")
+        cache.fill("a", test_auth, generation)
+        assert cache.get(Auth, "a") is None
+        cache.fill("a", test_auth, cache.generation)
+        assert cache.get(Auth, "a") is test_auth
+
+
+class TestCachedStore:
+    """Test the read-through, write-through store."""
+
+    def test_read_through(self, store: CachedStore, monkeypatch: pytest.MonkeyPatch):
+        """Test that cached reads do not reach the wrapped store."""
+        store.store.set("a", test_auth)
+        assert store.get("a", Auth) == test_auth
+        monkeypatch.setattr(store.store, "get", None)
+        assert store.get("a", Auth) == test_auth
+        assert store.cache.stats.hits == 1
+
+    def test_write_through(self, store: CachedStore, monkeypatch: pytest.MonkeyPatch):
+        """Test that writes update the cache and deletions invalidate it."""
+        store.set("a", test_auth)
+        store.set_many({"b": test_auth})
+        monkeypatch.setattr(store.store, "get_many", None)
+        assert store.get_many(["a", "b"], Auth) == {"a": test_auth, "b": test_auth}
+        monkeypatch.undo()
+        store.delete("a", Auth)
+        store.delete_many(["b"], Auth)
+        assert store.cache.stats.size == 0
+        assert not store.get_many(["a", "b"], Auth)
+
+    def test_get_many_partially_cached(self, store: CachedStore):
+        """Test that only keys missing from the cache are read from the wrapped store."""
+        store.store.set_many({"a": test_auth, "b": test_auth})
+        store.get("a", Auth)
+        assert store.get_many(["a", "b", "c"], Auth) == {"a": test_auth, "b": test_auth}
+        assert store.cache.stats.size == 2
+
+    def test_transaction(self, store: CachedStore):
+        """Test that the cache is updated on commit and left clean on rollback."""
+        with store.transaction():
+            store.set("a", test_auth)
+            assert store.cache.stats.size == 0
+        assert store.cache.get(Auth, "a") is test_auth
+        with pytest.raises(ValueError), store.transaction():
+            store.delete("a", Auth)
+            store.set("b", test_auth)
+            raise ValueError()
+        assert store.cache.stats.size == 0
+        assert store.get("a", Auth) == test_auth
+        assert store.get("b", Auth) is None
+
+    def test_iteration(self, store: CachedStore):
+        """Test that iteration goes to the wrapped store and does not fill the cache."""
+        store.store.set_many({"a": test_auth, "b": test_auth})
+        assert list(store.iter_keys(Auth)) == ["a", "b"]
+        assert list(store.iter_values(Auth, limit=1)) == [test_auth]
+        assert store.cache.stats.size == 0
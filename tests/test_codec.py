@@ -0,0 +1,52 @@
+"""Test store codecs."""
+
+from importlib.util import find_spec
+
+import pytest
+from fastapi_sso.sso.base import OpenID
+
+from photom.models import Auth
+from photom.store.codec import Codec, JSONCodec, MsgpackCodec, get_codec
+
+requires_msgpack = pytest.mark.skipif(find_spec("msgpack") is None, reason="msgpack is not installed")
+
+test_auth = Auth(openid=OpenID(id="test", email="test@example.com"), access_token=None, refresh_token="refresh")
+
+
+@pytest.mark.parametrize("codec_class", [JSONCodec, pytest.param(MsgpackCodec, marks=requires_msgpack)])
+def test_round_trip(codec_class: type[Codec]):
+    """Test that models survive encoding and decoding."""
+    codec = codec_class()
+    data = codec.encode(test_auth)
+    assert codec.decode(data, Auth) == test_auth
+    if isinstance(data, str):
+        assert codec.decode(data.encode("utf-8"), Auth) == test_auth
+
+
+@requires_msgpack
+def test_msgpack_reads_json():
+    """Test that msgpack codec decodes values written by the JSON codec."""
+    data = JSONCodec().encode(test_auth)
+    assert MsgpackCodec().decode(data, Auth) == test_auth
+    assert MsgpackCodec().decode(data.encode("utf-8"), Auth) == test_auth
+    assert len(MsgpackCodec().encode(test_auth)) < len(data)
+
+
+def test_get_codec():
+    """Test getting codecs by name."""
+    assert isinstance(get_codec("json"), JSONCodec)
+    with pytest.raises(ValueError, match="Unknown codec"):
+        get_codec("xml")
+
+
+@requires_msgpack
+def test_get_msgpack_codec():
+    """Test getting the msgpack codec by name."""
+    assert isinstance(get_codec("msgpack"), MsgpackCodec)
+
+
+def test_msgpack_missing(monkeypatch: pytest.MonkeyPatch):
+    """Test that a missing optional dependency is reported."""
+    monkeypatch.setattr("photom.store.codec.msgpack", None)
+    with pytest.raises(RuntimeError, match="msgpack extra"):
+        MsgpackCodec()
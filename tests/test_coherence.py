@@ -0,0 +1,150 @@
+"""Test coherence of store caches of processes sharing a SQLite database"""
+
+import multiprocessing
+import os
+import sqlite3
+import time
+from pathlib import Path
+from queue import Queue
+
+import pytest
+from fastapi_sso.sso.base import OpenID
+
+from photom.config import Config
+from photom.models import Auth, DriveSyncState
+from photom.store.cached import CachedStore, StoreCache
+from photom.store.coherence import ChangeWatcher
+from photom.store.sqlite import CHANGES_TABLE, SQLiteStore, close_pools
+
+
+def _auth(access_token: str) -> Auth:
+    """Stored login with the given access token"""
+    return Auth(openid=OpenID(id="test", email="test@example.com"), access_token=access_token, refresh_token="refresh")
+
+
+def _write_tokens(database: str, count: int, written: Queue, seen: Queue) -> None:
+    """Write new access tokens one by one, once the reader has seen the previous one, and tell when each was
+    committed"""
+    with SQLiteStore(database, track_changes=True) as store:
+        for index in range(count):
+            store.set("test@example.com", _auth(str(index)))
+            written.put(time.monotonic())
+            seen.get()
+    close_pools()
+
+
+@pytest.fixture(name="database")
+def database_fixture(tmp_path: Path):
+    """Path of a fresh SQLite database"""
+    yield os.path.join(tmp_path, "test.db")
+    close_pools()
+
+
+class TestChangeWatcher:
+    """Test following the change log"""
+
+    def test_poll(self, database: str):
+        """Test that writes of tracked stores are listed in order, once"""
+        watcher = ChangeWatcher(database)
+        with SQLiteStore(database, track_changes=True) as store:
+            store.set("a", _auth("a"))
+            store.set_many({"b": _auth("b"), "a": _auth("c")})
+            store.delete("b", Auth)
+            store.set("a", DriveSyncState(changes_token="1"))
+            assert watcher.poll() == [
+                ("Auth", "a"),
+                ("Auth", "b"),
+                ("Auth", "a"),
+                ("Auth", "b"),
+                ("DriveSyncState", "a"),
+            ]
+            assert watcher.poll() == []
+            with pytest.raises(RuntimeError), store.transaction():
+                store.set("a", _auth("d"))
+                raise RuntimeError("Rolled back")
+            store.set("c", _auth("c"))
+            assert watcher.poll() == [("Auth", "c")]
+        watcher.close()
+        assert watcher.poll() is None, "changes made while closed are not known"
+        assert watcher.poll() == []
+        watcher.close()
+
+    def test_untracked_writers(self, database: str):
+        """Test that writes of stores not tracking changes are logged once a tracking store used the table"""
+        watcher = ChangeWatcher(database)
+        with SQLiteStore(database) as untracked, SQLiteStore(database, track_changes=True) as tracked:
+            untracked.set("a", _auth("a"))
+            assert watcher.poll() == []
+            tracked.get("a", Auth)
+            untracked.set("a", _auth("b"))
+            assert watcher.poll() == [("Auth", "a")]
+        watcher.close()
+
+    def test_interval(self, database: str, monkeypatch: pytest.MonkeyPatch):
+        """Test that the log is polled at most once per interval"""
+        now = [100.0]
+        monkeypatch.setattr("time.monotonic", lambda: now[0])
+        watcher = ChangeWatcher(database, interval=1.0)
+        assert watcher.poll() == []
+        with SQLiteStore(database, track_changes=True) as store:
+            store.set("a", _auth("a"))
+            now[0] += 0.5
+            assert watcher.poll() == []
+            now[0] += 0.5
+            assert watcher.poll() == [("Auth", "a")]
+        watcher.close()
+
+    def test_missed_changes(self, database: str):
+        """Test that the whole cache is dropped when the log was trimmed past the last change seen"""
+        cache = StoreCache(10, watcher=ChangeWatcher(database))
+        with CachedStore(SQLiteStore(database, track_changes=True), cache) as store:
+            store.set("a", _auth("a"))
+            store.set("b", _auth("b"))
+            store.get_many(["a", "b"], Auth)
+            assert cache.stats.size == 2
+            store.set("c", _auth("c"))
+            store.store.set("d", _auth("d"))
+            with sqlite3.connect(database) as connection:
+                connection.execute(f"DELETE FROM {CHANGES_TABLE} WHERE key = 'c'")
+            assert store.get("a", Auth) == _auth("a")
+            assert cache.stats.size == 1, "only the value read since is cached"
+
+
+class TestCoherence:
+    """Test caches of separate processes"""
+
+    def test_config(self, monkeypatch: pytest.MonkeyPatch, database: str):
+        """Test that the configured cache drops values written by other processes"""
+        monkeypatch.setenv("STORE_BACKEND", "photom.store.sqlite.SQLiteStore")
+        monkeypatch.setenv("STORE_BACKEND_PATH", database)
+        monkeypatch.setenv("STORE_CACHE_SIZE", "10")
+        Config().reload()
+        with Config().get_store_backend() as store, SQLiteStore(database) as other:
+            store.set("test@example.com", _auth("old"))
+            assert store.get("test@example.com", Auth) == _auth("old")
+            other.set("test@example.com", _auth("new"))
+            assert store.get("test@example.com", Auth) == _auth("new")
+            assert Config().store_cache.stats.invalidations >= 1  # type: ignore[union-attr]
+
+    @pytest.mark.parametrize("interval", [0.0, 0.05])
+    def test_staleness(self, database: str, interval: float):
+        """Test that a value written by another process is served from the cache for at most `interval` seconds"""
+        context = multiprocessing.get_context("spawn")
+        written, seen = context.Queue(), context.Queue()
+        cache = StoreCache(10, watcher=ChangeWatcher(database, interval))
+        count, stale, windows = 20, 0, []
+        with CachedStore(SQLiteStore(database, track_changes=True), cache) as store:
+            store.set("test@example.com", _auth("initial"))
+            writer = context.Process(target=_write_tokens, args=(database, count, written, seen))
+            writer.start()
+            for index in range(count):
+                committed = written.get(timeout=60)
+                while store.get("test@example.com", Auth) != _auth(str(index)):
+                    stale += 1
+                windows.append(time.monotonic() - committed)
+                seen.put(None)
+            writer.join(timeout=60)
+        assert writer.exitcode == 0
+        if not interval:
+            assert stale == 0, "no stale value is served once the write is committed"
+        assert max(windows) < interval + 0.5
@@ -1,11 +1,19 @@
 """Test photom.config module"""
 
 import os
+import time
 from pathlib import Path
+from typing import Callable
 
+import httpx
 import pytest
+from pydantic import ValidationError
 
+from photom.api._auth import get_google_sso
 from photom.config import Config
+from photom.store.cached import CachedStore
+from photom.store.file import FileStore
+from photom.store.instrumented import InstrumentedStore
 
 
 class TestConfig:
@@ -15,6 +23,7 @@ class TestConfig:
         """Test unset store"""
         os.environ["STORE_BACKEND_PATH"] = ":memory:"
         config = Config()
+        config.reload()
         with pytest.warns(UserWarning, match="Using in-memory SQLite store. Data will not be saved."):
             config.get_store_backend()
 
@@ -36,6 +45,103 @@ class TestConfig:
         os.environ["STORE_BACKEND_PATH"] = store_path
 
         config = Config()
+        config.reload()
         assert config.store_backend_path == store_path
         assert config.store_backend == store
-        assert config.get_store_backend().__class__.__name__ == store.split(".")[-1]
+        backend = config.get_store_backend()
+        assert isinstance(backend, InstrumentedStore)
+        assert backend.store.__class__.__name__ == store.split(".")[-1]
+        assert (config.dedup_index is not None) == (store == "photom.store.sqlite.SQLiteStore")
+
+    def test_sqlite_options(self, monkeypatch: pytest.MonkeyPatch):
+        """Test SQLite pool options"""
+        monkeypatch.setenv("SQLITE_POOL_SIZE", "2")
+        monkeypatch.setenv("SQLITE_SYNCHRONOUS", "FULL")
+        monkeypatch.delenv("SQLITE_CACHE_SIZE", raising=False)
+        config = Config()
+        config.reload()
+        assert config.sqlite_pool_size == 2
+        assert config.sqlite_pragmas == {"synchronous": "FULL", "cache_size": None, "mmap_size": None}
+
+    def test_rate_limiter(self, monkeypatch: pytest.MonkeyPatch):
+        """Test Google API rate limiter, shared until the config is reloaded"""
+        monkeypatch.setenv("GOOGLE_RATE_LIMIT", "2.5")
+        monkeypatch.setenv("GOOGLE_CONCURRENCY", "3")
+        config = Config()
+        config.reload()
+        limiter = config.rate_limiter
+        assert config.rate_limiter is limiter
+        assert (config.settings.google_rate_limit, config.settings.google_concurrency) == (2.5, 3)
+        config.reload()
+        assert config.rate_limiter is not limiter
+
+    def test_store_cache(self, monkeypatch: pytest.MonkeyPatch, tmp_path: Path):
+        """Test store cache"""
+        monkeypatch.setenv("STORE_BACKEND", "photom.store.file.FileStore")
+        monkeypatch.setenv("STORE_BACKEND_PATH", str(tmp_path))
+        monkeypatch.setenv("STORE_CACHE_SIZE", "10")
+        monkeypatch.setenv("STORE_CACHE_TTL", "1.5")
+        config = Config()
+        config.reload()
+        store = config.get_store_backend()
+        assert isinstance(store, CachedStore)
+        assert isinstance(store.store, InstrumentedStore) and isinstance(store.store.store, FileStore)
+        assert config.get_store_backend().cache is store.cache
+        assert config.store_cache_ttl == 1.5
+        monkeypatch.delenv("STORE_CACHE_SIZE")
+        assert isinstance(config.get_store_backend(), CachedStore), "Config changed without reload"
+        config.reload()
+        backend = config.get_store_backend()
+        assert isinstance(backend, InstrumentedStore) and isinstance(backend.store, FileStore)
+
+    @pytest.mark.parametrize(
+        "variable, value, match",
+        [
+            ("STORE_CODEC", "xml", "Unknown codec xml"),
+            ("STORE_THREADS", "0", "greater than or equal to 1"),
+            ("SQLITE_SYNCHRONOUS", "OFF; DROP TABLE Auth", "should match pattern"),
+        ],
+    )
+    def test_invalid_settings(self, monkeypatch: pytest.MonkeyPatch, variable: str, value: str, match: str):
+        """Test that invalid settings are rejected when they are resolved"""
+        monkeypatch.setenv(variable, value)
+        config = Config()
+        config.reload()
+        with pytest.raises(ValidationError, match=match):
+            config.get_store_backend()
+
+    def test_settings_immutable(self):
+        """Test that resolved settings cannot be changed"""
+        with pytest.raises(ValidationError):
+            Config().settings.store_threads = 1  # type: ignore[misc]
+
+    def test_resolution_overhead(
+        self, monkeypatch: pytest.MonkeyPatch, tmp_path: Path, record_property: Callable[[str, object], None]
+    ):
+        """Measure startup and per-request overhead, requests must not read environment or import anything"""
+        monkeypatch.setenv("STORE_BACKEND", "photom.store.file.FileStore")
+        monkeypatch.setenv("STORE_BACKEND_PATH", str(tmp_path))
+        monkeypatch.setenv("GOOGLE_CLIENT_ID", "client_id")
+        monkeypatch.setenv("GOOGLE_CLIENT_SECRET", "client_secret")
+        config = Config()
+        config.reload()
+        client = httpx.AsyncClient()
+        start = time.perf_counter()
+        config.get_store_backend()
+        get_google_sso(client)
+        startup = time.perf_counter() - start
+
+        def unexpected(*_, **__):
+            raise AssertionError("Configuration resolved again on a hot path")
+
+        monkeypatch.setattr("photom.config.Settings.from_env", unexpected)
+        monkeypatch.setattr("photom.config.import_module", unexpected)
+        requests = 1000
+        start = time.perf_counter()
+        for _ in range(requests):
+            config.get_store_backend()
+            assert get_google_sso(client).client_id == "client_id"
+        per_request = (time.perf_counter() - start) / requests
+        record_property("config_startup_us", startup * 1_000_000)
+        record_property("config_per_request_us", per_request * 1_000_000)
+        assert per_request < startup
@@ -0,0 +1,125 @@
+"""Test the index of transferred content."""
+
+import os
+from pathlib import Path
+from typing import Any, ContextManager
+
+import pytest
+
+from photom.models import DriveFile
+from photom.store.dedup import BloomFilter, DedupIndex
+from photom.store.sqlite import SchemaConnection, borrow_connection, close_pools, get_pool
+
+
+def _file(index: int, md5_checksum: str | None = None, size: int | None = 1000) -> DriveFile:
+    """Drive file with content identified by its index."""
+    return DriveFile(
+        id=f"file-{index}",
+        name=f"{index}.jpg",
+        mimeType="image/jpeg",
+        md5Checksum=md5_checksum or f"md5-{index}",
+        size=size,
+    )
+
+
+@pytest.fixture(name="database")
+def database_fixture(tmp_path: Path):
+    """Path to a fresh on-disk database, pools are closed afterwards."""
+    yield os.path.join(tmp_path, "test.db")
+    close_pools()
+
+
+class TestBloomFilter:
+    """Test the Bloom filter."""
+
+    def test_no_false_negatives(self):
+        """Test that every added key is found and the false positive rate stays near the configured one."""
+        bloom = BloomFilter(1000, 0.01)
+        for index in range(1000):
+            bloom.add(f"in-{index}".encode())
+        assert all(f"in-{index}".encode() in bloom for index in range(1000))
+        false_positives = sum(f"out-{index}".encode() in bloom for index in range(10_000))
+        assert false_positives < 300
+
+    def test_empty(self):
+        """Test that an empty filter holds no keys, even when sized for a single one."""
+        bloom = BloomFilter(0)
+        assert b"" not in bloom
+        assert b"key" not in bloom
+
+
+class TestDedupIndex:
+    """Test the dedup index."""
+
+    def test_find(self, database: str):
+        """Test that content is matched by checksum and size, per account."""
+        index = DedupIndex(database)
+        index.add("alice", [(_file(1), "item-1"), (_file(2), "item-2"), (_file(3, size=None), "item-3")])
+        files = [_file(1), _file(2, size=2000), _file(3, size=None), _file(4, md5_checksum="md5-1")]
+        assert index.find("alice", files) == {"file-1": "item-1", "file-4": "item-1"}
+        assert not index.find("bob", files)
+
+    def test_content_keeps_first_media_item(self, database: str):
+        """Test that content indexed again keeps the media item it was indexed with first."""
+        index = DedupIndex(database)
+        index.add("alice", [(_file(1), "item-1")])
+        index.add("alice", [(_file(1), "item-2")])
+        assert index.find("alice", [_file(1)]) == {"file-1": "item-1"}
+
+    def test_page_in_one_statement(self, database: str):
+        """Test that candidates of a whole page are looked up in one statement and negatives never hit the table."""
+        index = DedupIndex(database)
+        index.add("alice", [(_file(number), f"item-{number}") for number in range(0, 2000, 2)])
+        statements: list[str] = []
+        connection = get_pool(database).acquire()
+        connection.set_trace_callback(statements.append)
+        get_pool(database).release(connection)
+        found = index.find("alice", [_file(number) for number in range(1000)])
+        connection.set_trace_callback(None)
+        assert len(found) == 500
+        lookups = [statement for statement in statements if "json_each" in statement]
+        assert len(lookups) == 1
+        statements.clear()
+        connection.set_trace_callback(statements.append)
+        assert not index.find("alice", [_file(number) for number in range(1, 2000, 2)])
+        connection.set_trace_callback(None)
+        assert not [statement for statement in statements if "json_each" in statement]
+
+    def test_rows_added_elsewhere(self, database: str):
+        """Test that content indexed by another process is picked up, growing the Bloom filter as needed."""
+        index = DedupIndex(database, capacity=10, refresh_interval=0.0)
+        assert not index.find("alice", [_file(1)])
+        DedupIndex(database).add("alice", [(_file(number), f"item-{number}") for number in range(50)])
+        assert len(index.find("alice", [_file(number) for number in range(60)])) == 50
+
+    def test_refresh_interval(self, database: str, monkeypatch: pytest.MonkeyPatch):
+        """Test that rows added by other processes are read once the refresh interval passed, content indexed by the
+        process is found right away and negatives in between do not touch the database."""
+        now = [100.0]
+        monkeypatch.setattr("time.monotonic", lambda: now[0])
+        index = DedupIndex(database, refresh_interval=5.0)
+        assert not index.find("alice", [_file(1)])
+        DedupIndex(database).add("alice", [(_file(1), "item-1")])
+        index.add("alice", [(_file(2), "item-2")])
+        borrowed: list[str] = []
+
+        def spy(path: str, *args: Any) -> ContextManager[SchemaConnection]:
+            borrowed.append(path)
+            return borrow_connection(path, *args)
+
+        monkeypatch.setattr("photom.store.dedup.borrow_connection", spy)
+        assert not index.find("alice", [_file(1), _file(3)])
+        assert not borrowed
+        assert index.find("alice", [_file(2)]) == {"file-2": "item-2"}
+        now[0] += 5.0
+        assert index.find("alice", [_file(1), _file(2)]) == {"file-1": "item-1", "file-2": "item-2"}
+
+    def test_table_created_on_existing_connection(self, database: str, monkeypatch: pytest.MonkeyPatch):
+        """Test that a connection opened before the migration was registered gets the table on first use."""
+        with monkeypatch.context() as patch:
+            patch.setattr("photom.store.sqlite._migrations", {})
+            pool = get_pool(database)
+            pool.release(pool.acquire())
+        index = DedupIndex(database)
+        index.add("alice", [(_file(1), "item-1")])
+        assert index.find("alice", [_file(1)]) == {"file-1": "item-1"}
@@ -0,0 +1,129 @@
+"""Test specifics of the file store."""
+
+import os
+from pathlib import Path
+
+import pytest
+from fastapi_sso.sso.base import OpenID
+
+from photom.models import Auth, DriveFile, TransferRecord
+from photom.store.file import STAGING_DIRECTORY, FileStore
+
+test_auth = Auth(openid=OpenID(id="test", email="test@example.com"), access_token=None, refresh_token="refresh")
+
+
+def _record(email: str) -> TransferRecord:
+    """Create a sample transfer record."""
+    return TransferRecord(email=email, file=DriveFile(id="file", name="file", mimeType="image/jpeg"))
+
+
+@pytest.fixture(name="store")
+def store_fixture(tmp_path: Path) -> FileStore:
+    """File store in a fresh directory."""
+    return FileStore(str(tmp_path))
+
+
+class TestFileStore:
+    """Test file store writes and indexes."""
+
+    def test_no_leftovers(self, store: FileStore, tmp_path: Path):
+        """Test that staged files are moved in place."""
+        store.set_many({"a": test_auth, "b": test_auth})
+        store.delete("a", Auth)
+        assert not os.listdir(tmp_path / STAGING_DIRECTORY)
+        assert os.listdir(tmp_path / "Auth") == ["b"]
+
+    def test_rollback(self, store: FileStore, tmp_path: Path):
+        """Test that a failed transaction discards staged writes."""
+        store.set("a", test_auth)
+        with pytest.raises(ValueError), store.transaction():
+            store.set("b", test_auth)
+            store.delete("a", Auth)
+            raise ValueError()
+        assert not os.listdir(tmp_path / STAGING_DIRECTORY)
+        assert list(store.iter_keys(Auth)) == ["a"]
+
+    def test_reads_see_staged_writes(self, store: FileStore):
+        """Test that reads within a transaction see writes staged within it."""
+        store.set("a", test_auth)
+        with store.transaction():
+            store.set("b", test_auth)
+            store.delete("a", Auth)
+            assert list(store.iter_keys(Auth)) == ["b"]
+            assert store.get("a", Auth) is None
+            assert store.get("b", Auth) == test_auth
+            store.set("b", test_auth.model_copy(update={"access_token": "updated"}))
+        assert store.get("b", Auth).access_token == "updated"  # type: ignore[union-attr]
+
+    def test_group_commit(self, store: FileStore, monkeypatch: pytest.MonkeyPatch):
+        """Test that files and their directory are fsynced once per transaction."""
+        synced: list[str] = []
+        monkeypatch.setattr("photom.store.file._fsync", synced.append)
+        with store.transaction():
+            for index in range(10):
+                store.set(f"key{index}", test_auth)
+            assert not synced
+        assert len(synced) == 11
+        assert synced.count(store._get_key("", Auth).rstrip(os.sep)) == 1  # pylint: disable=protected-access
+
+    def test_no_fsync(self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+        """Test that fsync can be turned off."""
+        synced: list[str] = []
+        monkeypatch.setattr("photom.store.file._fsync", synced.append)
+        FileStore(str(tmp_path), fsync=False).set("a", test_auth)
+        assert not synced
+
+    def test_index_detects_external_changes(self, store: FileStore, tmp_path: Path):
+        """Test that files added by someone else are picked up."""
+        store.set("a", test_auth)
+        assert list(store.iter_keys(Auth)) == ["a"]
+        (tmp_path / "Auth" / "b").write_text(test_auth.model_dump_json(), encoding="utf-8")
+        assert list(store.iter_keys(Auth)) == ["a", "b"]
+        assert store.get("b", Auth) == test_auth
+
+    def test_manifest(self, store: FileStore, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+        """Test that a fresh process lists keys from the manifest instead of scanning the directory."""
+        store.set("a", test_auth)
+        assert list(store.iter_keys(Auth)) == ["a"]
+        store.set_many({"b": test_auth, "c": test_auth})
+        assert os.path.isfile(tmp_path / ".Auth.manifest")
+        monkeypatch.setattr("photom.store.file._indexes", {})
+        monkeypatch.setattr("os.scandir", None)
+        assert list(store.iter_keys(Auth)) == ["a", "b", "c"]
+
+    def test_get_skips_unknown_keys(self, store: FileStore, monkeypatch: pytest.MonkeyPatch):
+        """Test that missing keys are resolved without opening files."""
+        store.set("a", test_auth)
+        list(store.iter_keys(Auth))
+        monkeypatch.setattr("builtins.open", None)
+        assert store.get("missing", Auth) is None
+
+    def test_get_unindexed_keys(self, store: FileStore, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+        """Test that files missing from an index that looks up to date are still read."""
+        store.set("a", test_auth)
+        list(store.iter_keys(Auth))
+        mtime_ns = os.stat(tmp_path / "Auth").st_mtime_ns
+        (tmp_path / "Auth" / "b").write_text(test_auth.model_dump_json(), encoding="utf-8")
+        monkeypatch.setattr("photom.store.file._mtime_ns", lambda _: mtime_ns)
+        assert list(store.iter_keys(Auth)) == ["a"]
+        assert store.get("b", Auth) == test_auth
+
+    def test_field_index(self, store: FileStore, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+        """Test that a fresh process finds values by the persisted inverted index kept up to date by commits."""
+        store.set_many({"a": _record("a@example.com"), "b": _record("b@example.com")})
+        assert list(store.find(TransferRecord, email="a@example.com")) == [_record("a@example.com")]
+        assert os.path.isfile(tmp_path / ".TransferRecord.email.index")
+        store.set("c", _record("a@example.com"))
+        store.delete("a", TransferRecord)
+        monkeypatch.setattr("photom.store.file._indexes", {})
+        monkeypatch.setattr("photom.store.file._field_indexes", {})
+        monkeypatch.setattr(FileStore, "_build_field_indexes", None)
+        assert list(store.find(TransferRecord, email="a@example.com")) == [_record("a@example.com")]
+        assert list(store.iter_keys(TransferRecord)) == ["b", "c"]
+
+    def test_field_index_detects_external_changes(self, store: FileStore, tmp_path: Path):
+        """Test that the inverted index is rebuilt when files were added by someone else."""
+        store.set("a", _record("a@example.com"))
+        assert len(list(store.find(TransferRecord, email="b@example.com"))) == 0
+        (tmp_path / "TransferRecord" / "b").write_text(_record("b@example.com").model_dump_json(), encoding="utf-8")
+        assert list(store.find(TransferRecord, email="b@example.com")) == [_record("b@example.com")]
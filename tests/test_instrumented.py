@@ -0,0 +1,78 @@
+"""Test the instrumentation store layer."""
+
+import os
+import time
+import uuid
+from pathlib import Path
+
+import pytest
+from fastapi_sso.sso.base import OpenID
+
+from photom.models import Auth, Job, TransferRecord
+from photom.store.instrumented import CALL_SECONDS, ERRORS, InstrumentedStore
+from photom.store.sqlite import SQLiteStore, close_pools
+from tests.metrics import sample
+
+
+def _auth(index: int) -> Auth:
+    """Create a sample record."""
+    return Auth(
+        openid=OpenID(id=str(index), email=f"user{index}@example.com"), access_token=None, refresh_token="refresh"
+    )
+
+
+@pytest.fixture(name="store")
+def store_fixture(tmp_path: Path):
+    """Instrumented store on top of a fresh SQLite database, with a backend label of its own."""
+    with InstrumentedStore(SQLiteStore(os.path.join(tmp_path, "test.db")), uuid.uuid4().hex) as store:
+        yield store
+    close_pools()
+
+
+class TestInstrumentedStore:
+    """Test the instrumentation store layer."""
+
+    def test_calls(self, store: InstrumentedStore):
+        """Test that calls are recorded by backend, model and method."""
+        backend = store.backend
+        store.set("a", _auth(0))
+        store.set_many({f"user{index}": _auth(index) for index in range(5)})
+        assert store.get("a", Auth) == _auth(0)
+        assert len(store.get_many(["user1", "user2", "missing"], Auth)) == 2
+        assert list(store.iter_keys(Auth, limit=2)) == ["a", "user0"]
+        assert len(list(store.iter_values(Auth))) == 6
+        store.delete("a", Auth)
+        store.delete_many(["user1"], Auth)
+        store.set_many({"job": Job(id=1, kind="test", payload={}, status="queued", created_at=0), "b": _auth(9)})
+        for method in ("set", "get", "get_many", "iter_keys", "iter_values", "delete", "delete_many"):
+            assert sample(CALL_SECONDS, "_count", backend=backend, model="Auth", method=method) == 1, method
+        assert sample(CALL_SECONDS, "_count", backend=backend, model="Auth", method="set_many") == 1
+        assert sample(CALL_SECONDS, "_count", backend=backend, model="mixed", method="set_many") == 1
+        assert sample(CALL_SECONDS, "_sum", backend=backend, model="Auth", method="get") > 0
+        assert not list(store.find(TransferRecord, email="user0@example.com"))
+        assert sample(CALL_SECONDS, "_count", backend=backend, model="TransferRecord", method="find") == 1
+
+    def test_iteration_excludes_caller(self, store: InstrumentedStore):
+        """Test that iterations are timed while the wrapped store produces items, even if they are abandoned."""
+        backend = store.backend
+        store.set_many({f"user{index}": _auth(index) for index in range(10)})
+        for _ in store.iter_keys(Auth):
+            time.sleep(0.02)
+        keys = iter(store.iter_keys(Auth))
+        assert next(keys) == "user0"
+        del keys
+        labels = {"backend": backend, "model": "Auth", "method": "iter_keys"}
+        assert sample(CALL_SECONDS, "_count", **labels) == 2 and sample(CALL_SECONDS, "_sum", **labels) < 0.1
+
+    def test_errors(self, store: InstrumentedStore):
+        """Test that failing calls are counted and timed, and transactions reach the wrapped store."""
+        backend = store.backend
+        with pytest.raises(RuntimeError), store.transaction():
+            store.set("a", _auth(0))
+            raise RuntimeError("Rolled back")
+        assert store.get("a", Auth) is None
+        with pytest.raises(TypeError):
+            store.get_many(None, Auth)  # type: ignore[arg-type]
+        assert sample(ERRORS, "_total", backend=backend, model="Auth", method="get_many") == 1
+        assert sample(CALL_SECONDS, "_count", backend=backend, model="Auth", method="get_many") == 1
+        assert sample(ERRORS, "_total", backend=backend, model="Auth", method="get") == 0
@@ -0,0 +1,102 @@
+"""Test the job queue."""
+
+import multiprocessing
+import os
+import time
+from pathlib import Path
+
+import pytest
+
+from photom.store.jobs import JobQueue
+from photom.store.sqlite import close_pools
+
+
+@pytest.fixture(name="database")
+def database_fixture(tmp_path: Path):
+    """Path to a fresh on-disk database, pools are closed afterwards."""
+    yield os.path.join(tmp_path, "test.db")
+    close_pools()
+
+
+def _drain(database: str, owner: str) -> list[int]:
+    """Claim and complete jobs until the queue is empty, return their IDs."""
+    queue = JobQueue(database)
+    claimed = []
+    while (job := queue.claim(owner)) is not None:
+        claimed.append(job.id)
+        assert queue.complete(job.id, owner, {"owner": owner})
+    close_pools()
+    return claimed
+
+
+class TestJobQueue:
+    """Test the job queue."""
+
+    def test_claim_in_order(self, database: str):
+        """Test that jobs are claimed oldest first, each of them once, and completed with their results."""
+        queue = JobQueue(database)
+        enqueued = [queue.enqueue("test", {"index": index}) for index in range(3)]
+        assert [job.status for job in enqueued] == ["queued"] * 3
+        claimed = [queue.claim("worker") for _ in range(3)]
+        assert [job.payload["index"] for job in claimed if job] == [0, 1, 2]
+        assert all(job and (job.status, job.attempts) == ("running", 1) for job in claimed)
+        assert queue.claim("worker") is None
+        assert queue.complete(enqueued[0].id, "worker", {"files": 1})
+        done = queue.get(enqueued[0].id)
+        assert done and (done.status, done.result) == ("done", {"files": 1}) and done.finished_at
+        assert queue.counts() == {"queued": 0, "running": 2, "done": 1, "failed": 0}
+        assert queue.get(1000) is None
+
+    def test_key(self, database: str):
+        """Test that a job with the key of a queued job is not queued again, but once that job started it is."""
+        queue = JobQueue(database)
+        first = queue.enqueue("sync", {"email": "alice"}, key="sync:alice")
+        assert queue.enqueue("sync", {"email": "alice"}, key="sync:alice").id == first.id
+        assert queue.enqueue("sync", {"email": "bob"}, key="sync:bob").id != first.id
+        queue.claim("worker")
+        assert queue.enqueue("sync", {"email": "alice"}, key="sync:alice").id != first.id
+
+    def test_lease_expiry(self, database: str):
+        """Test that a job whose worker stopped sending heartbeats is claimed by another worker, and fails once it runs
+        out of attempts"""
+        queue = JobQueue(database, lease_seconds=0.05, max_attempts=2)
+        job = queue.enqueue("test", {})
+        assert queue.claim("dead")
+        assert queue.heartbeat(job.id, "dead")
+        time.sleep(0.1)
+        retried = queue.claim("alive")
+        assert retried and (retried.id, retried.attempts, retried.error) == (job.id, 2, "Lease of dead expired")
+        assert not queue.heartbeat(job.id, "dead")
+        assert not queue.complete(job.id, "dead")
+        time.sleep(0.1)
+        assert queue.claim("other") is None
+        failed = queue.get(job.id)
+        assert failed and (failed.status, failed.error) == ("failed", "Lease of alive expired")
+
+    def test_fail(self, database: str):
+        """Test that failed jobs are retried while they have attempts left, unless retrying is pointless"""
+        queue = JobQueue(database, max_attempts=2)
+        job = queue.enqueue("test", {})
+        queue.claim("worker")
+        assert queue.fail(job.id, "worker", "Flaky")
+        assert queue.claim("worker")
+        assert queue.fail(job.id, "worker", "Flaky again")
+        failed = queue.get(job.id)
+        assert failed and (failed.status, failed.attempts, failed.error) == ("failed", 2, "Flaky again")
+        hopeless = queue.enqueue("test", {})
+        queue.claim("worker")
+        assert queue.fail(hopeless.id, "worker", "Hopeless", retry=False)
+        assert queue.counts()["failed"] == 2
+
+    def test_concurrent_workers(self, database: str):
+        """Test that worker processes claiming at the same time never get the same job"""
+        queue = JobQueue(database)
+        jobs = {queue.enqueue("test", {"index": index}).id for index in range(400)}
+        close_pools()
+        with multiprocessing.get_context("fork").Pool(4) as pool:
+            claimed = pool.starmap(_drain, [(database, f"worker-{index}") for index in range(4)])
+            pool.close()
+            pool.join()
+        every = [job_id for worker in claimed for job_id in worker]
+        assert sorted(every) == sorted(jobs)
+        assert queue.counts()["done"] == 400
@@ -0,0 +1,93 @@
+"""Test process-wide metrics."""
+
+import gc
+import socket
+import time
+import uuid
+
+import httpx
+import pytest
+
+from photom.metrics import _Disabled, add_collector, gauge, histogram, render, start_server
+
+ITEMS = gauge("test_items", "Items")
+SECONDS = histogram("test_seconds", "Durations", ("kind",), buckets=(0.1, 1.0))
+
+
+class _Source:  # pylint: disable=too-few-public-methods
+    """Object exposing a gauge through a collector."""
+
+    def __init__(self) -> None:
+        self.items = 3
+        add_collector(self.collect)
+
+    def collect(self) -> None:
+        """Set the gauge."""
+        ITEMS.set(self.items)
+
+
+class TestMetrics:
+    """Test process-wide metrics."""
+
+    def test_render(self):
+        """Test that metrics are rendered in the Prometheus text format, with the buckets they were registered with."""
+        kind = uuid.uuid4().hex
+        for value in (0.05, 0.1, 0.5, 5.0):
+            SECONDS.labels(kind).observe(value)
+        lines = render().decode().splitlines()
+        assert "# TYPE test_seconds histogram" in lines
+        assert [line for line in lines if f'kind="{kind}"' in line] == [
+            f'test_seconds_bucket{{kind="{kind}",le="0.1"}} 2.0',
+            f'test_seconds_bucket{{kind="{kind}",le="1.0"}} 3.0',
+            f'test_seconds_bucket{{kind="{kind}",le="+Inf"}} 4.0',
+            f'test_seconds_count{{kind="{kind}"}} 4.0',
+            f'test_seconds_sum{{kind="{kind}"}} 5.65',
+        ]
+
+    def test_collectors(self, caplog: pytest.LogCaptureFixture):
+        """Test that collectors run before every scrape, as long as their object lives, and a failing one is
+        skipped."""
+        failing = True
+
+        def broken() -> None:
+            if failing:
+                raise RuntimeError("Broken collector")
+
+        source = _Source()
+        add_collector(broken)
+        assert "test_items 3.0" in render().decode()
+        assert "Collecting metrics failed" in caplog.text
+        failing = False
+        source.items = 5
+        assert "test_items 5.0" in render().decode()
+        del source
+        gc.collect()
+        ITEMS.set(0)
+        assert "test_items 0.0" in render().decode()
+
+    def test_disabled(self):
+        """Test that metrics record nothing without prometheus_client."""
+        metric = _Disabled()
+        metric.labels("a", "b").inc()
+        metric.labels().set(1)
+        with metric.time():
+            metric.observe(1)
+
+    def test_server(self):
+        """Test that metrics are served over HTTP."""
+        with socket.socket() as free:
+            free.bind(("127.0.0.1", 0))
+            port = free.getsockname()[1]
+        ITEMS.set(7)
+        start_server("127.0.0.1", port)
+        start = time.monotonic()
+        while True:
+            try:
+                response = httpx.get(f"http://127.0.0.1:{port}/metrics")
+                break
+            except httpx.ConnectError:
+                assert time.monotonic() - start < 5
+                time.sleep(0.01)
+        assert response.status_code == 200
+        assert response.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+        assert "test_items 7.0\n" in response.text
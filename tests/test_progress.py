@@ -0,0 +1,128 @@
+"""Test the progress bus and the progress log shared by processes"""
+
+import asyncio
+import os
+import time
+from pathlib import Path
+
+import pytest
+
+from photom.models import AccountProgress, DriveFile, TransferRecord
+from photom.progress import ProgressBus, SyncProgress, record, relay
+from photom.store.progress import ProgressLog
+from photom.store.sqlite import close_pools
+
+
+def _progress(email: str, files: int) -> AccountProgress:
+    """State of an account with the given number of files done"""
+    return AccountProgress(email=email, files=files)
+
+
+@pytest.fixture(name="log")
+def log_fixture(tmp_path: Path):
+    """Progress log in a fresh SQLite database"""
+    yield ProgressLog(os.path.join(tmp_path, "test.db"))
+    close_pools()
+
+
+class TestProgressBus:
+    """Progress bus test suite"""
+
+    @pytest.mark.asyncio
+    async def test_coalesce(self):
+        """Test that subscribers get the latest state of every account, dropping the states published in between"""
+        bus = ProgressBus()
+        bus.publish(_progress("alice@example.com", 1))
+        with bus.subscribe(interval=0.0) as subscription, bus.subscribe(snapshot=False) as fresh:
+            assert bus.subscribers == 2
+            assert await subscription.get() == [_progress("alice@example.com", 1)]
+            for files in range(1000):
+                bus.publish(_progress("alice@example.com", files))
+                bus.publish(_progress("bob@example.com", files))
+            assert await subscription.get() == [_progress("alice@example.com", 999), _progress("bob@example.com", 999)]
+            assert subscription.dropped == 2 * 999
+            assert len(fresh.flush()) == 2
+            assert await subscription.get(timeout=0.01) == []
+        assert bus.subscribers == 0
+        assert bus.latest == {
+            "alice@example.com": _progress("alice@example.com", 999),
+            "bob@example.com": _progress("bob@example.com", 999),
+        }
+
+    @pytest.mark.asyncio
+    async def test_interval(self):
+        """Test that states are handed out at most once every interval"""
+        bus = ProgressBus()
+        with bus.subscribe(interval=0.1) as subscription:
+            bus.publish(_progress("alice@example.com", 1))
+            start = time.monotonic()
+            assert await subscription.get() == [_progress("alice@example.com", 1)]
+            assert time.monotonic() - start < 0.1, "the first states are handed out right away"
+            bus.publish(_progress("alice@example.com", 2))
+            assert await subscription.get() == [_progress("alice@example.com", 2)]
+            assert time.monotonic() - start >= 0.1
+
+    def test_sync_progress(self, monkeypatch: pytest.MonkeyPatch):
+        """Test that the rate and ETA are extrapolated from the files handled so far"""
+        now = [100.0]
+        monkeypatch.setattr("time.monotonic", lambda: now[0])
+        published: list[AccountProgress] = []
+        bus = ProgressBus()
+        bus.publish = published.append  # type: ignore[method-assign]
+        progress = SyncProgress("alice@example.com", bus)
+        progress.listed(4)
+        assert published[-1].eta is None, "nothing to extrapolate from yet"
+        now[0] += 2.0
+        file = DriveFile(id="1", name="1.jpg", mimeType="image/jpeg", size=1000)
+        progress.handled(TransferRecord(email="alice@example.com", file=file, media_item_id="media"))
+        progress.handled(TransferRecord(email="alice@example.com", file=file, error="failed"))
+        assert published[-1].model_dump() == {
+            "email": "alice@example.com",
+            "files": 1,
+            "bytes": 1000,
+            "failed": 1,
+            "skipped": 0,
+            "pending": 2,
+            "seconds": 2.0,
+            "bytes_per_second": 500.0,
+            "eta": 2.0,
+            "done": False,
+        }
+        progress.finish()
+        assert published[-1].done and published[-1].eta == 0.0
+
+
+class TestProgressLog:
+    """Progress log test suite"""
+
+    def test_read(self, log: ProgressLog):
+        """Test that readers get the latest state of accounts written since the version they read last"""
+        assert log.read() == (0, [])
+        log.write([_progress("alice@example.com", 1), _progress("bob@example.com", 1)])
+        version, states = log.read()
+        assert (version, states) == (2, [_progress("alice@example.com", 1), _progress("bob@example.com", 1)])
+        log.write([_progress("alice@example.com", 2)])
+        log.write([])
+        assert log.read(version) == (3, [_progress("alice@example.com", 2)])
+        assert log.read(3) == (3, [])
+        assert log.read() == (3, [_progress("bob@example.com", 1), _progress("alice@example.com", 2)])
+
+    @pytest.mark.asyncio
+    async def test_relay(self, log: ProgressLog):
+        """Test that states published in one process reach subscribers of another through the log"""
+        worker, api = ProgressBus(), ProgressBus()
+        tasks = [asyncio.create_task(record(worker, log, 0.01)), asyncio.create_task(relay(api, log, 0.01))]
+        with api.subscribe(interval=0.0) as subscription:
+            await asyncio.sleep(0.05)
+            for files in range(100):
+                worker.publish(_progress("alice@example.com", files))
+                await asyncio.sleep(0)
+            received: list[AccountProgress] = []
+            while not received or received[-1] != _progress("alice@example.com", 99):
+                received.extend(await asyncio.wait_for(subscription.get(), 5))
+        assert len(received) < 100, "states published in between are dropped"
+        worker.publish(_progress("bob@example.com", 1))
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        assert log.read(0)[1][-1] == _progress("bob@example.com", 1), "pending states are written on cancellation"
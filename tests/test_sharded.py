@@ -0,0 +1,170 @@
+"""Test the sharded SQLite store"""
+
+import os
+import sqlite3
+from pathlib import Path
+
+import pytest
+
+from photom.config import Config
+from photom.models import DriveFile, TransferRecord
+from photom.store import dedup, jobs, progress, sharded
+from photom.store.sharded import LAYOUT_TABLE, ShardedSQLiteStore, main, rebalance, shard_of, shard_path
+from photom.store.sqlite import CHANGES_TABLE, MIGRATIONS_TABLE, close_pools
+
+
+def _record(email: str, file_id: str) -> TransferRecord:
+    """Transfer record of a file of an account"""
+    return TransferRecord(email=email, file=DriveFile(id=file_id, name=file_id, mimeType="image/jpeg"))
+
+
+def _records(accounts: int, files: int) -> dict[str, TransferRecord]:
+    """Transfer records of several files of several accounts, by their keys"""
+    return {
+        f"user{account}@example.com:{index}": _record(f"user{account}@example.com", str(index))
+        for account in range(accounts)
+        for index in range(files)
+    }
+
+
+def _rows(database: str, index: int) -> int:
+    """Transfer records stored in a shard"""
+    with sqlite3.connect(shard_path(database, index)) as connection:
+        return connection.execute("SELECT COUNT(*) FROM TransferRecord").fetchone()[0]
+
+
+def _tables(database: str) -> set[str]:
+    """Names of the tables of a database"""
+    with sqlite3.connect(database) as connection:
+        rows = connection.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'")
+        return {name for (name,) in rows}
+
+
+@pytest.fixture(name="database")
+def database_fixture(tmp_path: Path):
+    """Path of a fresh main database"""
+    yield os.path.join(tmp_path, "test.db")
+    close_pools()
+
+
+class TestShardedSQLiteStore:
+    """Sharded store test suite"""
+
+    def test_routing(self):
+        """Test that values of an account share a shard, and that adding a shard only moves accounts to it"""
+        assert len({shard_of(f"alice@example.com:{index}", 8) for index in range(100)}) == 1
+        assert shard_of("alice@example.com", 8) == shard_of("alice@example.com:file", 8)
+        shards = [shard_of(f"user{index}@example.com", 4) for index in range(4000)]
+        assert all(800 < shards.count(shard) < 1200 for shard in range(4))
+        grown = [shard_of(f"user{index}@example.com", 5) for index in range(4000)]
+        assert all(new in (old, 4) for old, new in zip(shards, grown))
+
+    def test_spread(self, database: str):
+        """Test that values are spread over the shards and read back from all of them in key order"""
+        records = _records(accounts=12, files=3)
+        with ShardedSQLiteStore(database, shards=3) as store:
+            store.set_many(records)
+            assert all(_rows(database, index) for index in range(3))
+            assert list(store.iter_keys(TransferRecord)) == sorted(records)
+            assert (
+                list(store.iter_keys(TransferRecord, limit=4, after_key="user3"))
+                == [key for key in sorted(records) if key > "user3"][:4]
+            )
+            assert list(store.iter_values(TransferRecord, limit=2)) == [records[key] for key in sorted(records)[:2]]
+            assert list(store.find(TransferRecord, email="user5@example.com")) == [
+                _record("user5@example.com", str(index)) for index in range(3)
+            ]
+            assert store.get_many(["user1@example.com:0", "user7@example.com:2", "missing"], TransferRecord) == {
+                "user1@example.com:0": records["user1@example.com:0"],
+                "user7@example.com:2": records["user7@example.com:2"],
+            }
+            store.delete_many(sorted(records)[:6], TransferRecord)
+            store.delete("user9@example.com:0", TransferRecord)
+            assert len(list(store.iter_keys(TransferRecord))) == 29
+
+    def test_schemas(self, database: str):
+        """Test that shards only get model tables and their change log, and the main database the tables shared by
+        processes"""
+        with ShardedSQLiteStore(database, shards=2, track_changes=True) as store:
+            store.set_many(_records(accounts=4, files=1))
+        for index in range(2):
+            assert _tables(shard_path(database, index)) == {"TransferRecord", CHANGES_TABLE, MIGRATIONS_TABLE}
+        assert _tables(database) == {dedup.TABLE, jobs.TABLE, progress.TABLE, LAYOUT_TABLE, MIGRATIONS_TABLE}
+
+    def test_transaction(self, database: str):
+        """Test that a transaction spanning shards is rolled back on all of them"""
+        with ShardedSQLiteStore(database, shards=3) as store:
+            with pytest.raises(RuntimeError), store.transaction():
+                store.set_many(_records(accounts=6, files=1))
+                store.set("alice@example.com", _record("alice@example.com", "1"))
+                raise RuntimeError("Rolled back")
+            assert not list(store.iter_keys(TransferRecord))
+
+    def test_layout(self, database: str):
+        """Test that a database is not opened with another number of shards than its values are laid out for"""
+        with ShardedSQLiteStore(database, shards=3) as store:
+            store.set_many(_records(accounts=4, files=1))
+        with pytest.raises(RuntimeError, match="laid out for 3 shards"), ShardedSQLiteStore(database, shards=4):
+            pass
+        with pytest.raises(ValueError):
+            ShardedSQLiteStore(database, shards=0)
+
+    def test_config(self, monkeypatch: pytest.MonkeyPatch, database: str):
+        """Test that the sharded backend is configured with its shards and the job queue, and that its cache drops
+        values other processes wrote to any shard"""
+        monkeypatch.setenv("STORE_BACKEND", "photom.store.sharded.ShardedSQLiteStore")
+        monkeypatch.setenv("STORE_BACKEND_PATH", database)
+        monkeypatch.setenv("STORE_SHARDS", "2")
+        monkeypatch.setenv("STORE_CACHE_SIZE", "10")
+        Config().reload()
+        assert Config().job_queue is not None
+        emails = ("alice@example.com", "bob@example.com")
+        assert {shard_of(email, 2) for email in emails} == {0, 1}
+        with Config().get_store_backend() as store, ShardedSQLiteStore(database, shards=2) as other:
+            for email in emails:
+                store.set(email, _record(email, "old"))
+                assert store.get(email, TransferRecord) == _record(email, "old")
+                other.set(email, _record(email, "new"))
+                assert store.get(email, TransferRecord) == _record(email, "new")
+
+
+class TestRebalance:
+    """Rebalancing tool test suite"""
+
+    @pytest.mark.parametrize("before, after", [(2, 5), (5, 2)])
+    def test_rebalance(self, database: str, before: int, after: int):
+        """Test that values move to their new shards and only accounts changing their shard move"""
+        records = _records(accounts=40, files=2)
+        with ShardedSQLiteStore(database, shards=before) as store:
+            store.set_many(records)
+        moved = rebalance(database, after, batch_size=7)
+        assert moved == 2 * sum(shard_of(key, before) != shard_of(key, after) for key in records if key.endswith(":0"))
+        assert 0 < moved < len(records)
+        assert sum(_rows(database, index) for index in range(after)) == len(records)
+        with ShardedSQLiteStore(database, shards=after) as store:
+            assert store.get_many(list(records), TransferRecord) == records
+            assert list(store.iter_values(TransferRecord)) == [records[key] for key in sorted(records)]
+
+    def test_resume(self, database: str, monkeypatch: pytest.MonkeyPatch):
+        """Test that stores refuse an interrupted rebalance and that running it again completes it"""
+        records = _records(accounts=40, files=1)
+        with ShardedSQLiteStore(database, shards=2) as store:
+            store.set_many(records)
+        move = sharded._move  # pylint: disable=protected-access
+        moves = [0]
+
+        def interrupted(*args) -> None:
+            moves[0] += 1
+            if moves[0] > 1:
+                raise KeyboardInterrupt
+            move(*args)
+
+        monkeypatch.setattr(sharded, "_move", interrupted)
+        with pytest.raises(KeyboardInterrupt):
+            rebalance(database, 4, batch_size=5)
+        monkeypatch.undo()
+        with pytest.raises(RuntimeError, match="being rebalanced from 2 to 4"), ShardedSQLiteStore(database, shards=4):
+            pass
+        main([database, "--shards", "4"])
+        with ShardedSQLiteStore(database, shards=4) as store:
+            assert store.get_many(list(records), TransferRecord) == records
@@ -0,0 +1,301 @@
+"""Test SQLite specifics of the sqlite store."""
+
+import os
+import sqlite3
+import subprocess
+import sys
+from pathlib import Path
+from sqlite3 import Connection, Cursor
+
+import pytest
+from fastapi_sso.sso.base import OpenID
+
+from photom.models import Auth, BaseModel, DriveFile, TransferRecord
+from photom.store.codec import JSONCodec
+from photom.store.dedup import DedupIndex
+from photom.store.sqlite import (
+    MIGRATIONS_TABLE,
+    ConnectionPool,
+    SQLiteStore,
+    borrow_connection,
+    close_pools,
+    get_pool,
+    migration,
+)
+
+test_auth = Auth(openid=OpenID(id="test", email="test@example.com"), access_token=None, refresh_token="refresh")
+
+
+def _record(email: str) -> TransferRecord:
+    """Create a sample transfer record."""
+    return TransferRecord(email=email, file=DriveFile(id="file", name="file", mimeType="image/jpeg"))
+
+
+def _applied(connection: Connection) -> list[int]:
+    """Versions of the migrations recorded as applied to a database."""
+    return [version for (version,) in connection.execute(f"SELECT version FROM {MIGRATIONS_TABLE} ORDER BY version")]
+
+
+@pytest.fixture(name="database")
+def database_fixture(tmp_path: Path):
+    """Path to a fresh on-disk database, pools are closed afterwards."""
+    yield os.path.join(tmp_path, "test.db")
+    close_pools()
+
+
+class TestConnectionPool:
+    """Test connection pooling."""
+
+    def test_connection_reused(self, database: str):
+        """Test that entering the store again borrows the same connection."""
+        store = SQLiteStore(database)
+        with store:
+            first = store._connection  # pylint: disable=protected-access
+        with store:
+            assert store._connection is first  # pylint: disable=protected-access
+
+    def test_pool_shared(self, database: str):
+        """Test that the pool is process-wide per database."""
+        assert get_pool(database) is get_pool(database)
+
+    def test_pragmas(self, database: str):
+        """Test that WAL and configured pragmas are applied to new connections."""
+        pool = ConnectionPool(database, pragmas={"cache_size": -1234, "synchronous": None})
+        connection = pool.acquire()
+        assert connection.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        assert connection.execute("PRAGMA cache_size").fetchone()[0] == -1234
+        assert connection.execute("PRAGMA synchronous").fetchone()[0] == 1
+        pool.release(connection)
+        pool.close()
+
+    def test_pool_size(self, database: str):
+        """Test that at most `size` idle connections are retained."""
+        pool = ConnectionPool(database, size=1)
+        first, second = pool.acquire(), pool.acquire()
+        pool.release(first)
+        pool.release(second)
+        assert pool.acquire() is first
+        pool.close()
+
+    def test_uncommitted_rolled_back(self, database: str):
+        """Test that a released connection does not leak an open transaction."""
+        pool = ConnectionPool(database)
+        connection = pool.acquire()
+        connection.execute("CREATE TABLE test (key TEXT)")
+        connection.commit()
+        connection.execute("INSERT INTO test VALUES ('leaked')")
+        pool.release(connection)
+        assert pool.acquire().execute("SELECT COUNT(*) FROM test").fetchone()[0] == 0
+        pool.close()
+
+    def test_closed_pool(self, database: str):
+        """Test that a closed pool refuses borrowing."""
+        pool = ConnectionPool(database)
+        pool.close()
+        with pytest.raises(RuntimeError, match="is closed"):
+            pool.acquire()
+
+    def test_in_memory_not_retained(self):
+        """Test that in-memory connections are not shared, as each one is a separate database."""
+        pool = ConnectionPool(":memory:")
+        first = pool.acquire()
+        pool.release(first)
+        assert pool.acquire() is not first
+
+
+class TestSchema:
+    """Test the table registry and migrations."""
+
+    def test_ddl_skipped_for_known_tables(self, database: str):
+        """Test that no DDL nor commit is issued once the table is known."""
+        store = SQLiteStore(database)
+        with store:
+            store.set("test", test_auth)
+            statements: list[str] = []
+            store._connection.set_trace_callback(statements.append)  # pylint: disable=protected-access
+            store.get("test", Auth)
+            store._connection.set_trace_callback(None)  # pylint: disable=protected-access
+        assert len(statements) == 1
+        assert statements[0].startswith("SELECT")
+
+    def test_schema_loaded_on_connect(self, database: str):
+        """Test that tables created by other connections are known to new ones."""
+        with SQLiteStore(database) as store:
+            store.set("test", test_auth)
+        pool = ConnectionPool(database)
+        assert "Auth" in pool.acquire().known_tables
+        pool.close()
+
+    def test_migrations(self, database: str, monkeypatch: pytest.MonkeyPatch):
+        """Test that migrations are applied once, in order."""
+        monkeypatch.setattr("photom.store.sqlite._migrations", {})
+        applied: list[int] = []
+
+        @migration(2)
+        def _second(cursor: Cursor):
+            applied.append(2)
+            cursor.execute("CREATE INDEX test_index ON test (key)")
+
+        @migration(1)
+        def _first(cursor: Cursor):
+            applied.append(1)
+            cursor.execute("CREATE TABLE test (key TEXT)")
+
+        for _ in range(2):
+            pool = ConnectionPool(database)
+            connection = pool.acquire()
+            assert _applied(connection) == [1, 2]
+            assert "test" in connection.known_tables
+            pool.close()
+        assert applied == [1, 2]
+
+    def test_failed_migration_rolled_back(self, database: str, monkeypatch: pytest.MonkeyPatch):
+        """Test that a failing migration leaves the database at the previous version."""
+        monkeypatch.setattr("photom.store.sqlite._migrations", {})
+
+        @migration(1)
+        def _broken(cursor: Cursor):
+            cursor.execute("CREATE TABLE test (key TEXT)")
+            raise ValueError("broken")
+
+        with pytest.raises(ValueError, match="broken"):
+            ConnectionPool(database).acquire()
+        monkeypatch.setattr("photom.store.sqlite._migrations", {})
+        connection = ConnectionPool(database).acquire()
+        assert not {"test", MIGRATIONS_TABLE} & connection.known_tables
+
+    def test_late_migration(self, database: str, monkeypatch: pytest.MonkeyPatch):
+        """Test that a migration registered after the database was migrated past its version is applied."""
+        monkeypatch.setattr("photom.store.sqlite._migrations", {})
+        migration(5)(lambda cursor: cursor.execute("CREATE TABLE later (key TEXT)"))
+        with borrow_connection(database, "later") as connection:
+            assert _applied(connection) == [5]
+        migration(1)(lambda cursor: cursor.execute("CREATE TABLE earlier (key TEXT)"))
+        with borrow_connection(database, "earlier") as connection:
+            assert _applied(connection) == [1, 5]
+            assert "earlier" in connection.known_tables
+
+    def test_modules_imported_later(self, database: str):
+        """Test that a database migrated by a process importing only some store modules gets the tables of the
+        others once a process importing them opens it."""
+        code = (
+            "import sys\n"
+            "import photom.store.progress\n"
+            "from photom.store.sqlite import SQLiteStore\n"
+            "assert 'photom.store.dedup' not in sys.modules\n"
+            "with SQLiteStore(sys.argv[1]) as store:\n"
+            "    store.get('key', photom.store.progress.AccountProgress)\n"
+        )
+        subprocess.run([sys.executable, "-c", code, database], check=True)
+        assert DedupIndex(database).find("test@example.com", [_record("test@example.com").file]) == {}
+
+    def test_legacy_database(self, database: str):
+        """Test that migrations are applied again to databases migrated before they were recorded."""
+        with SQLiteStore(database) as store:
+            store.get("test", Auth)
+        with sqlite3.connect(database) as connection:
+            connection.execute(f"DROP TABLE {MIGRATIONS_TABLE}")
+        close_pools()
+        with SQLiteStore(database) as store:
+            store.set("test", test_auth)
+            assert store.get("test", Auth) == test_auth
+
+    def test_duplicate_migration(self, monkeypatch: pytest.MonkeyPatch):
+        """Test that a migration version can only be registered once."""
+        monkeypatch.setattr("photom.store.sqlite._migrations", {})
+        migration(1)(lambda _: None)
+        with pytest.raises(ValueError, match="already registered"):
+            migration(1)(lambda _: None)
+
+
+class TestIndexes:
+    """Test indexed fields."""
+
+    def test_find_uses_index(self, database: str):
+        """Test that finding values is a single query searching the index, in key order."""
+        with SQLiteStore(database) as store:
+            store.set("a", _record("a@example.com"))
+            statements: list[str] = []
+            store._connection.set_trace_callback(statements.append)  # pylint: disable=protected-access
+            assert list(store.find(TransferRecord, email="a@example.com")) == [_record("a@example.com")]
+            store._connection.set_trace_callback(None)  # pylint: disable=protected-access
+            assert len(statements) == 1
+            plan = store._connection.execute(  # pylint: disable=protected-access
+                f"EXPLAIN QUERY PLAN {statements[0]}"
+            ).fetchall()
+        assert "USING INDEX TransferRecord_idx_email" in plan[0][-1]
+        assert "TEMP B-TREE" not in " ".join(row[-1] for row in plan)
+
+    def test_nested_field(self, database: str):
+        """Test that fields of nested models are indexed by their dotted paths."""
+        auth = Auth(openid=OpenID(id="42", email="a@example.com"), access_token=None, refresh_token="refresh")
+        with SQLiteStore(database) as store:
+            store.set("a", auth)
+            assert list(store.find(Auth, **{"openid.id": "42"})) == [auth]
+            plan = store._connection.execute(  # pylint: disable=protected-access
+                "EXPLAIN QUERY PLAN SELECT key, value FROM Auth WHERE idx_openid_id IS ? ORDER BY key", ("42",)
+            ).fetchall()
+        assert "USING INDEX Auth_idx_openid_id" in plan[0][-1]
+
+    def test_existing_table_indexed(self, database: str):
+        """Test that a table created before the field was indexed gets the index, rows written before included."""
+        with SQLiteStore(database) as store, store.provide_cursor() as cursor:
+            cursor.execute("CREATE TABLE TransferRecord (key TEXT PRIMARY KEY, value TEXT)")
+            cursor.execute("INSERT INTO TransferRecord VALUES ('a', ?)", (_record("a@example.com").model_dump_json(),))
+            store._connection.commit()  # pylint: disable=protected-access
+        close_pools()
+        with SQLiteStore(database) as store:
+            assert list(store.find(TransferRecord, email="a@example.com")) == [_record("a@example.com")]
+            assert "TransferRecord_idx_email" in store._connection.known_indexes  # pylint: disable=protected-access
+
+
+class TestTransactions:
+    """Test SQLite transactions."""
+
+    def test_rollback(self, database: str):
+        """Test that a failed transaction leaves no trace, including tables it created."""
+        store = SQLiteStore(database)
+        with store:
+            with pytest.raises(ValueError), store.transaction():
+                store.set("test", test_auth)
+                with store.transaction():
+                    store.set_many({"other": test_auth})
+                raise ValueError()
+            assert store.get("test", Auth) is None
+            assert not store.get_many(["test", "other"], Auth)
+
+    def test_single_commit(self, database: str):
+        """Test that a batch write is committed once."""
+        store = SQLiteStore(database)
+        with store:
+            store.set("warmup", test_auth)
+            statements: list[str] = []
+            store._connection.set_trace_callback(statements.append)  # pylint: disable=protected-access
+            store.set_many({f"key{index}": test_auth for index in range(100)})
+            store._connection.set_trace_callback(None)  # pylint: disable=protected-access
+        assert statements.count("COMMIT") == 1
+
+    def test_get_many_batches(self, database: str, monkeypatch: pytest.MonkeyPatch):
+        """Test that large key lists are split across queries."""
+        monkeypatch.setattr("photom.store.sqlite.MAX_QUERY_VARIABLES", 3)
+        with SQLiteStore(database) as store:
+            store.set_many({f"key{index}": test_auth for index in range(10)})
+            assert len(store.get_many((f"key{index}" for index in range(12)), Auth)) == 10
+
+
+def test_single_encode(database: str):
+    """Test that a value is serialized once per write."""
+    encoded: list[Auth] = []
+
+    class SpyCodec(JSONCodec):
+        """Codec recording encoded values."""
+
+        def encode(self, value: BaseModel) -> str:
+            encoded.append(value)
+            return super().encode(value)
+
+    with SQLiteStore(database, codec=SpyCodec()) as store:
+        store.set("test", test_auth)
+        store.set("test", test_auth)
+        assert store.get("test", Auth) == test_auth
+    assert len(encoded) == 2
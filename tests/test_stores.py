@@ -2,14 +2,17 @@
 
 import os
 import shutil
+from importlib.util import find_spec
 from tempfile import gettempdir
 
 import pytest
 from fastapi_sso.sso.base import OpenID
 
-from photom.models import Auth, BaseModel
+from photom.models import Auth, BaseModel, DriveFile, TransferRecord
 from photom.store.base import Store
+from photom.store.codec import MsgpackCodec
 from photom.store.file import FileStore
+from photom.store.sharded import ShardedSQLiteStore
 from photom.store.sqlite import SQLiteStore
 
 test_models = [
@@ -22,8 +25,35 @@ test_models = [
 
 test_tempdir = os.path.join(gettempdir(), "photom_test")
 
-stores = [SQLiteStore(":memory:"), FileStore(test_tempdir)]
-pytestmark = [pytest.mark.parametrize("test_model", test_models), pytest.mark.parametrize("store", stores)]
+
+def _auth(email: str, openid_id: str) -> Auth:
+    """Create a sample login."""
+    return Auth(openid=OpenID(id=openid_id, email=email), access_token=None, refresh_token="refresh")
+
+
+def _record(email: str, file_id: str, media_item_id: str | None = None) -> TransferRecord:
+    """Create a sample transfer record."""
+    return TransferRecord(
+        email=email, file=DriveFile(id=file_id, name=file_id, mimeType="image/jpeg"), media_item_id=media_item_id
+    )
+
+
+requires_msgpack = pytest.mark.skipif(find_spec("msgpack") is None, reason="msgpack is not installed")
+
+stores = [
+    pytest.param(lambda: SQLiteStore(":memory:"), id="sqlite"),
+    pytest.param(lambda: FileStore(test_tempdir), id="file"),
+    pytest.param(lambda: SQLiteStore(":memory:", codec=MsgpackCodec()), id="sqlite-msgpack", marks=requires_msgpack),
+    pytest.param(lambda: FileStore(test_tempdir, codec=MsgpackCodec()), id="file-msgpack", marks=requires_msgpack),
+    pytest.param(lambda: ShardedSQLiteStore(":memory:", shards=3), id="sharded"),
+]
+pytestmark = pytest.mark.parametrize("store", stores, indirect=True)
+
+
+@pytest.fixture(name="store")
+def store_fixture(request: pytest.FixtureRequest) -> Store:
+    """Store created when the test runs, so that stores needing a missing optional dependency are skipped."""
+    return request.param()
 
 
 @pytest.fixture(autouse=True)
@@ -36,6 +66,7 @@ def prepare_and_cleanup():
         shutil.rmtree(test_tempdir)
 
 
+@pytest.mark.parametrize("test_model", test_models)
 class TestStores:
     """Test stores."""
 
@@ -79,3 +110,80 @@ class TestStores:
             assert store.get("test", test_model.__class__) == test_model
             store.delete("test", model=test_model.__class__)
             assert store.get("test", test_model.__class__) is None
+
+    def test_pagination(self, store: Store, test_model: BaseModel):
+        """Test keyset pagination of iter_keys and iter_values."""
+        with store:
+            for key in ("c", "a", "d", "b"):
+                store.set(key, test_model)
+            model = test_model.__class__
+            assert list(store.iter_keys(model)) == ["a", "b", "c", "d"]
+            assert list(store.iter_keys(model, limit=2)) == ["a", "b"]
+            assert list(store.iter_keys(model, limit=2, after_key="b")) == ["c", "d"]
+            assert list(store.iter_keys(model, after_key="bb")) == ["c", "d"]
+            assert not list(store.iter_keys(model, after_key="d"))
+            assert len(list(store.iter_values(model, limit=3, after_key="a"))) == 3
+
+    def test_get_many(self, store: Store, test_model: BaseModel):
+        """Test get_many."""
+        with store:
+            store.set("a", test_model)
+            store.set("b", test_model)
+            assert store.get_many(["a", "b", "missing"], test_model.__class__) == {"a": test_model, "b": test_model}
+            assert not store.get_many([], test_model.__class__)
+
+    def test_set_many(self, store: Store, test_model: BaseModel):
+        """Test set_many."""
+        with store:
+            store.set_many({f"key{index}": test_model for index in range(10)})
+            assert list(store.iter_keys(test_model.__class__)) == [f"key{index}" for index in range(10)]
+            assert store.get("key3", test_model.__class__) == test_model
+
+    def test_delete_many(self, store: Store, test_model: BaseModel):
+        """Test delete_many."""
+        with store:
+            store.set_many({"a": test_model, "b": test_model, "c": test_model})
+            store.delete_many(["a", "c", "missing"], test_model.__class__)
+            assert list(store.iter_keys(test_model.__class__)) == ["b"]
+
+    def test_transaction(self, store: Store, test_model: BaseModel):
+        """Test that writes grouped in a transaction are stored."""
+        with store:
+            with store.transaction():
+                store.set("a", test_model)
+                with store.transaction():
+                    store.set_many({"b": test_model})
+                store.delete("a", test_model.__class__)
+            assert list(store.iter_keys(test_model.__class__)) == ["b"]
+
+
+class TestFind:
+    """Test finding values by indexed fields."""
+
+    def test_find_nested(self, store: Store):
+        """Test finding values by indexed fields of nested models."""
+        with store:
+            store.set_many({key: _auth(key, openid_id) for key, openid_id in (("a", "1"), ("b", "2"), ("c", "1"))})
+            assert [auth.openid.email for auth in store.find(Auth, **{"openid.id": "1"})] == ["a", "c"]
+            store.set("a", _auth("a", "3"))
+            assert list(store.find(Auth, **{"openid.id": "1"})) == [_auth("c", "1")]
+
+    def test_find(self, store: Store):
+        """Test finding values by their indexed fields, including writes staged within a transaction."""
+        with store:
+            assert not list(store.find(TransferRecord, email="a@example.com"))
+            store.set_many({f"{email}:{index}": _record(email, str(index)) for email in "ab" for index in range(3)})
+            store.set("a:1", _record("b", "1", "moved"))
+            store.delete("a:2", TransferRecord)
+            assert list(store.find(TransferRecord, email="a")) == [_record("a", "0")]
+            assert [record.file.id for record in store.find(TransferRecord, email="b")] == ["1", "0", "1", "2"]
+            with store.transaction():
+                store.set("c:0", _record("a", "9"))
+                store.set("a:0", _record("c", "0"))
+                assert list(store.find(TransferRecord, email="a")) == [_record("a", "9")]
+            assert list(store.find(TransferRecord, email="a")) == [_record("a", "9")]
+            assert len(list(store.find(TransferRecord))) == 6
+            with pytest.raises(ValueError):
+                store.find(TransferRecord, media_item_id="moved")
+            with pytest.raises(ValueError):
+                store.find(Auth, email="a")
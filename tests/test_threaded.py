@@ -0,0 +1,110 @@
+"""Test the asynchronous thread pool store."""
+
+import asyncio
+import os
+import threading
+from pathlib import Path
+
+import pytest
+from fastapi_sso.sso.base import OpenID
+
+from photom.models import Auth, DriveFile, TransferRecord
+from photom.store.base import Store
+from photom.store.file import FileStore
+from photom.store.sqlite import SQLiteStore, close_pools
+from photom.store.threaded import ThreadedStore, shutdown_executor
+
+test_auth = Auth(openid=OpenID(id="test", email="test@example.com"), access_token=None, refresh_token="refresh")
+
+
+@pytest.fixture(name="store", params=["sqlite", "file"])
+def store_fixture(request: pytest.FixtureRequest, tmp_path: Path):
+    """Threaded store wrapping each of the synchronous stores."""
+    backend: Store = (
+        SQLiteStore(os.path.join(tmp_path, "test.db")) if request.param == "sqlite" else FileStore(str(tmp_path))
+    )
+    yield ThreadedStore(backend, max_workers=2)
+    shutdown_executor()
+    close_pools()
+
+
+class TestThreadedStore:
+    """Test threaded store."""
+
+    @pytest.mark.asyncio
+    async def test_operations(self, store: ThreadedStore):
+        """Test that all operations are delegated."""
+        async with store:
+            await store.set("a", test_auth)
+            await store.set_many({"b": test_auth, "c": test_auth})
+            assert await store.get("a", Auth) == test_auth
+            assert await store.get_many(["a", "missing"], Auth) == {"a": test_auth}
+            await store.delete("a", Auth)
+            await store.delete_many(["b"], Auth)
+            assert [key async for key in store.iter_keys(Auth)] == ["c"]
+            assert [value async for value in store.iter_values(Auth)] == [test_auth]
+            record = TransferRecord(email="a", file=DriveFile(id="file", name="file", mimeType="image/jpeg"))
+            await store.set("record", record)
+            assert [value async for value in store.find(TransferRecord, email="a")] == [record]
+
+    @pytest.mark.asyncio
+    async def test_iteration_batches(self, store: ThreadedStore, monkeypatch: pytest.MonkeyPatch):
+        """Test that iteration is advanced in batches and keeps pagination."""
+        monkeypatch.setattr("photom.store.threaded.ITER_BATCH_SIZE", 2)
+        async with store:
+            await store.set_many({f"key{index}": test_auth for index in range(7)})
+            assert [key async for key in store.iter_keys(Auth)] == [f"key{index}" for index in range(7)]
+            assert [key async for key in store.iter_keys(Auth, limit=3, after_key="key1")] == ["key2", "key3", "key4"]
+
+    @pytest.mark.asyncio
+    async def test_transaction(self, store: ThreadedStore):
+        """Test that transactions are committed and rolled back."""
+        async with store:
+            async with store.transaction():
+                await store.set("a", test_auth)
+            with pytest.raises(ValueError):
+                async with store.transaction():
+                    await store.set("b", test_auth)
+                    raise ValueError()
+            assert [key async for key in store.iter_keys(Auth)] == ["a"]
+
+    @pytest.mark.asyncio
+    async def test_concurrent_transactions(self, store: ThreadedStore):
+        """Test that writes of other tasks wait for a transaction in progress instead of joining it."""
+        opened = asyncio.Event()
+
+        async def commit() -> None:
+            async with store.transaction():
+                await store.set("a", test_auth)
+                opened.set()
+                await asyncio.sleep(0.05)
+
+        async def fail() -> None:
+            await opened.wait()
+            async with store.transaction():
+                await store.set("b", test_auth)
+                raise ValueError()
+
+        async def write() -> None:
+            await opened.wait()
+            await store.set("c", test_auth)
+
+        async with store:
+            results = await asyncio.gather(commit(), fail(), write(), return_exceptions=True)
+            assert isinstance(results[1], ValueError)
+            assert [key async for key in store.iter_keys(Auth)] == ["a", "c"]
+
+    @pytest.mark.asyncio
+    async def test_off_event_loop(self, store: ThreadedStore, monkeypatch: pytest.MonkeyPatch):
+        """Test that blocking calls do not run on the event loop thread."""
+        threads: list[threading.Thread] = []
+        get = store.store.get
+
+        def spy(key: str, model: type[Auth]):
+            threads.append(threading.current_thread())
+            return get(key, model)
+
+        monkeypatch.setattr(store.store, "get", spy)
+        async with store:
+            await store.get("a", Auth)
+        assert threads and threads[0] is not threading.current_thread()
@@ -0,0 +1,117 @@
+"""Test worker processes running queued jobs"""
+
+import asyncio
+import os
+from pathlib import Path
+
+import httpx
+import pytest
+from fastapi_sso.sso.base import OpenID
+
+from photom.models import Auth, Job
+from photom.store.jobs import JobQueue
+from photom.store.sqlite import SQLiteStore, close_pools
+from photom.store.threaded import ThreadedStore, shutdown_executor
+from photom.transfer.engine import TransferEngine
+from photom.transfer.sync import DriveSync
+from photom.worker import JOB_SECONDS, SYNC, JobError, Worker, sync_handler
+from tests.metrics import sample
+from tests.transfer.fake_google import FakeGoogle
+
+
+@pytest.fixture(name="database")
+def database_fixture(tmp_path: Path):
+    """Path to a fresh on-disk database, pools are closed afterwards"""
+    yield os.path.join(tmp_path, "test.db")
+    shutdown_executor()
+    close_pools()
+
+
+class TestWorker:
+    """Worker test suite"""
+
+    @pytest.mark.asyncio
+    async def test_burst(self, database: str):
+        """Test that a bursting worker runs all queued jobs with the handlers of their kinds and exits"""
+        queue = JobQueue(database)
+        ran: list[int] = []
+
+        async def double(job: Job) -> dict:
+            ran.append(job.id)
+            return {"value": job.payload["value"] * 2}
+
+        jobs = [queue.enqueue("double", {"value": value}) for value in range(5)]
+        unknown = queue.enqueue("unknown", {})
+        done = sample(JOB_SECONDS, "_count", kind="double", outcome="done")
+        assert await Worker(queue, {"double": double}).run(burst=True) == 5
+        assert ran == [job.id for job in jobs]
+        assert [(job.status, job.result) for job in map(queue.get, ran) if job] == [
+            ("done", {"value": value * 2}) for value in range(5)
+        ]
+        failed = queue.get(unknown.id)
+        assert failed and (failed.status, failed.error) == ("failed", "Unknown job kind unknown")
+        assert sample(JOB_SECONDS, "_count", kind="double", outcome="done") - done == 5
+
+    @pytest.mark.asyncio
+    async def test_failures(self, database: str):
+        """Test that failing jobs are retried, unless they failed for good"""
+        queue = JobQueue(database, max_attempts=3)
+        attempts: list[int] = []
+
+        async def flaky(job: Job) -> None:
+            attempts.append(job.attempts)
+            if job.payload["hopeless"]:
+                raise JobError("Hopeless")
+            if job.attempts < 2:
+                raise ValueError("Flaky")
+
+        flaky_job = queue.enqueue("flaky", {"hopeless": False})
+        hopeless_job = queue.enqueue("flaky", {"hopeless": True})
+        await Worker(queue, {"flaky": flaky}).run(burst=True)
+        assert attempts == [1, 2, 1]
+        done, failed = queue.get(flaky_job.id), queue.get(hopeless_job.id)
+        assert done and done.status == "done"
+        assert failed and (failed.status, failed.error) == ("failed", "Hopeless")
+
+    @pytest.mark.asyncio
+    async def test_lost_lease(self, database: str):
+        """Test that a job is abandoned once its lease expired and another worker took it over"""
+        queue = JobQueue(database, lease_seconds=0.05)
+        cancelled = asyncio.Event()
+
+        async def slow(_: Job) -> None:
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        job = queue.enqueue("slow", {})
+        worker = Worker(queue, {"slow": slow}, name="slow", heartbeat_interval=0.2)
+        running = asyncio.create_task(worker.run(burst=True))
+        await asyncio.sleep(0.1)
+        assert queue.claim("other")
+        assert queue.complete(job.id, "other")
+        assert await asyncio.wait_for(running, 5) == 0
+        assert cancelled.is_set()
+        done = queue.get(job.id)
+        assert done and (done.status, done.attempts) == ("done", 2)
+
+    @pytest.mark.asyncio
+    async def test_sync_job(self, database: str, google: FakeGoogle):
+        """Test that a sync job transfers the Drive of the stored login in its payload"""
+        google.add_files("alice", 12)
+        queue = JobQueue(database)
+        async with httpx.AsyncClient() as client, ThreadedStore(SQLiteStore(database)) as store:
+            auth = Auth(openid=OpenID(email="alice@example.com"), access_token="alice", refresh_token="refresh")
+            await store.set("alice@example.com", auth)
+            engine = TransferEngine(client, 4, drive_url=google.drive_url, photos_url=google.photos_url)
+            handlers = {SYNC: sync_handler(DriveSync(engine, store), store)}
+            synced = queue.enqueue(SYNC, {"email": "alice@example.com"})
+            missing = queue.enqueue(SYNC, {"email": "bob@example.com"})
+            assert await Worker(queue, handlers).run(burst=True) == 2
+        done, failed = queue.get(synced.id), queue.get(missing.id)
+        assert done and done.status == "done"
+        assert done.result and (done.result.get("files"), done.result.get("failed")) == (12, 0)
+        assert len(google.media_items["alice"]) == 12
+        assert failed and (failed.status, failed.attempts) == ("failed", 1)
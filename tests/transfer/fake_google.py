@@ -0,0 +1,411 @@
+"""Local stand-in for the Google Drive and Google Photos APIs"""
+
+import asyncio
+import hashlib
+import itertools
+import re
+import tempfile
+from collections import Counter
+from urllib.parse import parse_qs
+
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from photom.models import DriveFile
+
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+FOLDER_MIME_TYPE = "application/vnd.google-apps.folder"
+
+
+class FakeUpload:
+    """Content of an upload, written to a temporary file so that the fake does not hold it in memory"""
+
+    def __init__(self, mime_type: str):
+        self.mime_type = mime_type
+        self.size: int | None = None
+        self.received = 0
+        self.chunks: list[tuple[int, int, bool]] = []
+        self._file = tempfile.TemporaryFile()  # pylint: disable=consider-using-with
+
+    def write(self, data: bytes) -> None:
+        """Append received data"""
+        self._file.write(data)
+        self.received += len(data)
+
+    def rewind(self, offset: int) -> None:
+        """Forget data received after the offset"""
+        self._file.truncate(offset)
+        self._file.seek(offset)
+        self.received = offset
+
+    def md5(self) -> str:
+        """MD5 checksum of the content"""
+        self._file.seek(0)
+        digest = hashlib.md5()
+        while block := self._file.read(DOWNLOAD_CHUNK_SIZE):
+            digest.update(block)
+        return digest.hexdigest()
+
+
+class ConnectionTracker:  # pylint: disable=too-few-public-methods
+    """Middleware remembering the client address of every request, each connection has its own port"""
+
+    def __init__(self, app: ASGIApp, connections: set[tuple[str, int]]):
+        self.app = app
+        self.connections = connections
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http" and scope.get("client"):
+            self.connections.add(tuple(scope["client"]))  # type: ignore[arg-type]
+        await self.app(scope, receive, send)
+
+
+class FakeGoogle:  # pylint: disable=too-many-instance-attributes
+    """Fake Drive and Photos APIs keeping all state in memory, accounts are identified by their access tokens"""
+
+    def __init__(self, delay: float = 0.0):
+        self.url = ""
+        self.delay = delay
+        self.files: dict[str, list[tuple[DriveFile, bytes]]] = {}
+        self.children: dict[tuple[str, str], list[int]] = {}
+        self.folders: dict[str, tuple[str, int]] = {}
+        self.list_fields: set[str] = set()
+        self.broken: set[str] = set()
+        self.trashed: set[str] = set()
+        self.changes: dict[str, list[dict]] = {}
+        self.granularity = 1
+        self.sessions: dict[str, FakeUpload] = {}
+        self.upload_failures: dict[int, tuple[int, int | None]] = {}
+        self.uploads: dict[str, FakeUpload] = {}
+        self.media_items: dict[str, list[tuple[str, str]]] = {}
+        self.albums: dict[str, list[str]] = {}
+        self.batches: list[int] = []
+        self.rejected: set[str] = set()
+        self.aliases: dict[str, str] = {}
+        self.expired: set[str] = set()
+        self.token_delay = 0.0
+        self.token_lifetime = 3600
+        self.downloads: list[tuple[str, str]] = []
+        self.requests: Counter[str] = Counter()
+        self.connections: set[tuple[str, int]] = set()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._tokens = itertools.count()
+        self._versions = itertools.count()
+        self.app = FastAPI()
+        self.app.add_middleware(ConnectionTracker, connections=self.connections)
+        self.app.get("/.well-known/openid-configuration")(self.discovery)
+        self.app.get("/oauth2/userinfo")(self.userinfo)
+        self.app.get("/drive/v3/files")(self.list_files)
+        self.app.get("/drive/v3/changes/startPageToken")(self.start_page_token)
+        self.app.get("/drive/v3/changes")(self.list_changes)
+        self.app.get("/drive/v3/files/{file_id}")(self.download)
+        self.app.post("/v1/uploads")(self.upload)
+        self.app.post("/v1/mediaItems:batchCreate")(self.batch_create)
+        self.app.post("/oauth2/token")(self.token)
+
+    @property
+    def drive_url(self) -> str:
+        """Base URL of the fake Drive API"""
+        return f"{self.url}/drive/v3"
+
+    @property
+    def photos_url(self) -> str:
+        """Base URL of the fake Photos API"""
+        return f"{self.url}/v1"
+
+    @property
+    def token_url(self) -> str:
+        """URL of the fake OAuth token endpoint"""
+        return f"{self.url}/oauth2/token"
+
+    @property
+    def discovery_url(self) -> str:
+        """URL of the fake OpenID discovery document"""
+        return f"{self.url}/.well-known/openid-configuration"
+
+    def add_files(  # pylint: disable=too-many-arguments
+        self, token: str, count: int, size: int = 1000, prefix: str = "", parent: str | None = None
+    ) -> None:
+        """Add generated image files to the Drive of an account, into a folder if `parent` is given"""
+        files = self.files.setdefault(token, [])
+        for _ in range(count):
+            index = len(files)
+            pattern = f"{token}/{index}:".encode()
+            content = (pattern * (size // len(pattern) + 1))[:size]
+            file = DriveFile(
+                id=f"{prefix}{token}-{index}",
+                name=f"{prefix}{index:05}.jpg",
+                mimeType="image/jpeg",
+                md5Checksum=hashlib.md5(content).hexdigest(),
+                size=size,
+                parents=[parent or "root"],
+            )
+            self._add(token, file, content)
+            self._change(token, file)
+        if parent in self.folders:
+            self.touch_folder(token, parent)
+
+    def add_folder(self, token: str, parent: str = "root") -> str:
+        """Add an empty folder to the Drive of an account, return its ID"""
+        files = self.files.setdefault(token, [])
+        folder = DriveFile(
+            id=f"{token}-folder-{len(files)}",
+            name=f"folder-{len(files)}",
+            mimeType=FOLDER_MIME_TYPE,
+            parents=[parent],
+            modifiedTime=str(next(self._versions)),
+        )
+        self.folders[folder.id] = (token, len(files))
+        self._add(token, folder, b"")
+        if parent in self.folders:
+            self.touch_folder(token, parent)
+        return folder.id
+
+    def add_tree(  # pylint: disable=too-many-arguments
+        self, token: str, depth: int, fanout: int, files_per_folder: int, size: int = 10
+    ) -> list[str]:
+        """Add `depth` levels of `fanout` nested folders each, every folder holding generated image files, to the
+        Drive of an account, return IDs of all the folders"""
+        level, folders = ["root"], []
+        for _ in range(depth):
+            level = [self.add_folder(token, parent) for parent in level for _ in range(fanout)]
+            folders.extend(level)
+        for folder in folders:
+            self.add_files(token, files_per_folder, size, parent=folder)
+        return folders
+
+    def touch_folder(self, token: str, folder_id: str) -> None:
+        """Change the modified time of a folder, as Drive does when its contents change"""
+        _, index = self.folders[folder_id]
+        folder, content = self.files[token][index]
+        self.files[token][index] = (folder.model_copy(update={"modified_time": str(next(self._versions))}), content)
+
+    def _add(self, token: str, file: DriveFile, content: bytes) -> None:
+        """Append a file and index it by its parents"""
+        files = self.files[token]
+        for parent in file.parents or ["root"]:
+            self.children.setdefault((token, parent), []).append(len(files))
+        files.append((file, content))
+
+    def update_file(self, token: str, index: int, content: bytes | None = None, name: str | None = None) -> None:
+        """Change content or name of a file"""
+        file, old_content = self.files[token][index]
+        content = old_content if content is None else content
+        update = {"name": name or file.name, "md5_checksum": hashlib.md5(content).hexdigest(), "size": len(content)}
+        file = file.model_copy(update=update)
+        self.files[token][index] = (file, content)
+        self._change(token, file)
+
+    def trash_file(self, token: str, index: int) -> None:
+        """Move a file to trash"""
+        file = self.files[token][index][0]
+        self.trashed.add(file.id)
+        self._change(token, file)
+
+    def _change(self, token: str, file: DriveFile) -> None:
+        """Log a change of a file"""
+        change = {"removed": False, "file": file.model_dump(by_alias=True) | {"trashed": file.id in self.trashed}}
+        self.changes.setdefault(token, []).append(change)
+
+    def _account(self, request: Request) -> str:
+        """Get the access token of a request"""
+        token = request.headers.get("authorization", "").removeprefix("Bearer ")
+        token = self.aliases.get(token, token) if token not in self.expired else ""
+        if token not in self.files:
+            raise HTTPException(status_code=401, detail="Invalid credentials")
+        return token
+
+    async def discovery(self):
+        """OpenID discovery document pointing to the fake endpoints"""
+        self.requests["discovery"] += 1
+        return {
+            "authorization_endpoint": f"{self.url}/oauth2/auth",
+            "token_endpoint": self.token_url,
+            "userinfo_endpoint": f"{self.url}/oauth2/userinfo",
+        }
+
+    async def userinfo(self, request: Request):
+        """OpenID user info of an account"""
+        token = self._account(request)
+        return {"sub": token, "email": f"{token}@example.com", "email_verified": True}
+
+    async def list_files(
+        self, request: Request, q: str = "", fields: str = "", pageSize: int = 100, pageToken: str = "0"
+    ):
+        """List files of an account matching the query page by page, with only the requested fields.
+        The query may select children of a folder, images and folders, all files are listed otherwise."""
+        # pylint: disable=invalid-name,too-many-arguments,too-many-locals
+        self.requests["list"] += 1
+        token = self._account(request)
+        files = self.files[token]
+        parent = re.search(r"'([^']+)' in parents", q)
+        if parent is not None:
+            files = [files[index] for index in self.children.get((token, parent.group(1)), [])]
+        images, folders = "mimeType contains 'image/'" in q, f"mimeType = '{FOLDER_MIME_TYPE}'" in q
+
+        def matches(file: DriveFile) -> bool:
+            if file.id in self.trashed:
+                return False
+            if not images and not folders:
+                return True
+            return images and file.mime_type.startswith("image/") or folders and file.mime_type == FOLDER_MIME_TYPE
+
+        files = [(file, content) for file, content in files if matches(file)]
+        selected = re.search(r"files\((.*)\)", fields)
+        self.list_fields.add(selected.group(1) if selected else "")
+        keys = set(selected.group(1).split(",")) if selected else None
+        start = int(pageToken)
+        page = {
+            "files": [
+                {key: value for key, value in file.model_dump(by_alias=True).items() if keys is None or key in keys}
+                for file, _ in files[start : start + pageSize]
+            ]
+        }
+        if start + pageSize < len(files):
+            page["nextPageToken"] = str(start + pageSize)
+        return page
+
+    async def start_page_token(self, request: Request):
+        """Get the token of the next change"""
+        return {"startPageToken": str(len(self.changes.get(self._account(request), [])))}
+
+    async def list_changes(self, request: Request, pageToken: str, pageSize: int = 100):
+        """List changes of an account page by page"""
+        # pylint: disable=invalid-name
+        self.requests["changes"] += 1
+        changes = self.changes.get(self._account(request), [])
+        start = int(pageToken)
+        page: dict = {"changes": changes[start : start + pageSize]}
+        if start + pageSize < len(changes):
+            page["nextPageToken"] = str(start + pageSize)
+        else:
+            page["newStartPageToken"] = str(len(changes))
+        return page
+
+    async def download(self, request: Request, file_id: str, alt: str):
+        """Stream content of a file"""
+        self.requests["download"] += 1
+        token = self._account(request)
+        if alt != "media" or file_id in self.broken:
+            raise HTTPException(status_code=500, detail="Download failed")
+        file, content = next((file, content) for file, content in self.files[token] if file.id == file_id)
+        self.downloads.append((token, file.id))
+
+        async def stream():
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            try:
+                for offset in range(0, len(content), DOWNLOAD_CHUNK_SIZE):
+                    await asyncio.sleep(self.delay)
+                    yield content[offset : offset + DOWNLOAD_CHUNK_SIZE]
+            finally:
+                self.in_flight -= 1
+
+        headers = {"Content-Length": str(len(content))}
+        return StreamingResponse(stream(), media_type=file.mime_type, headers=headers)
+
+    async def upload(self, request: Request, upload_id: str | None = None):
+        """Receive a raw upload or handle a command of a resumable upload session"""
+        self.requests["upload"] += 1
+        self._account(request)
+        if upload_id is not None:
+            return await self._resumable(request, self.sessions[upload_id])
+        protocol = request.headers.get("x-goog-upload-protocol")
+        upload = FakeUpload(request.headers["x-goog-upload-content-type"])
+        if protocol == "resumable" and request.headers.get("x-goog-upload-command") == "start":
+            upload.size = int(request.headers["x-goog-upload-raw-size"])
+            upload_id = str(next(self._tokens))
+            self.sessions[upload_id] = upload
+            headers = {
+                "X-Goog-Upload-URL": f"{self.photos_url}/uploads?upload_id={upload_id}",
+                "X-Goog-Upload-Chunk-Granularity": str(self.granularity),
+            }
+            return Response(headers=headers)
+        if protocol != "raw":
+            raise HTTPException(status_code=400, detail="Unsupported upload protocol")
+        async for chunk in request.stream():
+            upload.write(chunk)
+        return PlainTextResponse(self._finalize(upload))
+
+    async def _resumable(self, request: Request, upload: "FakeUpload") -> Response:
+        """Handle a command of a resumable upload session"""
+        command = request.headers["x-goog-upload-command"]
+        if command == "query":
+            return Response(headers={"X-Goog-Upload-Size-Received": str(upload.received)})
+        offset = int(request.headers["x-goog-upload-offset"])
+        finalize = command == "upload, finalize"
+        length = int(request.headers["content-length"])
+        upload.chunks.append((offset, length, finalize))
+        if offset != upload.received:
+            raise HTTPException(status_code=400, detail=f"Expected offset {upload.received}")
+        if not finalize and length % self.granularity:
+            raise HTTPException(status_code=400, detail="Chunk is not a multiple of the granularity")
+        failure = self.upload_failures.pop(len(upload.chunks), None)
+        kept = length if failure is None else failure[0]
+        async for chunk in request.stream():
+            upload.write(chunk[: max(0, kept - (upload.received - offset))])
+        if failure is not None:
+            if failure[1] is not None:
+                upload.rewind(failure[1])
+            return Response(status_code=503)
+        if finalize:
+            if upload.received != upload.size:
+                raise HTTPException(status_code=400, detail="Upload is incomplete")
+            return PlainTextResponse(self._finalize(upload))
+        return Response()
+
+    def _finalize(self, upload: "FakeUpload") -> str:
+        """Finish an upload and hand out its upload token"""
+        upload_token = f"upload-{next(self._tokens)}"
+        self.uploads[upload_token] = upload
+        return upload_token
+
+    async def token(self, request: Request):
+        """Exchange the refresh token of an account, which is its access token followed by `-refresh`, for a new
+        access token, or an authorization code, which is the access token itself, for both"""
+        self.requests["token"] += 1
+        form = {key: values[0] for key, values in parse_qs((await request.body()).decode()).items()}
+        await asyncio.sleep(self.token_delay)
+        if form.get("grant_type") == "authorization_code" and form.get("code") in self.files:
+            account = form["code"]
+            return {
+                "access_token": account,
+                "refresh_token": f"{account}-refresh",
+                "expires_in": self.token_lifetime,
+                "token_type": "Bearer",
+            }
+        account = form.get("refresh_token", "").removesuffix("-refresh")
+        if form.get("grant_type") != "refresh_token" or account not in self.files:
+            return Response('{"error": "invalid_grant"}', status_code=400, media_type="application/json")
+        access_token = f"{account}~{self.requests['token']}"
+        self.aliases[access_token] = account
+        return {"access_token": access_token, "expires_in": self.token_lifetime, "token_type": "Bearer"}
+
+    async def batch_create(self, request: Request) -> dict:
+        """Create media items from upload tokens"""
+        self.requests["batch_create"] += 1
+        token = self._account(request)
+        body = await request.json()
+        if len(body["newMediaItems"]) > 50:
+            raise HTTPException(status_code=400, detail="Too many media items")
+        self.batches.append(len(body["newMediaItems"]))
+        results = []
+        for item in body["newMediaItems"]:
+            upload_token = item["simpleMediaItem"]["uploadToken"]
+            upload = self.uploads.pop(upload_token, None)
+            if upload is None or item["simpleMediaItem"]["fileName"] in self.rejected:
+                status = {"code": 3, "message": "Invalid upload token" if upload is None else "Unsupported file"}
+                results.append({"uploadToken": upload_token, "status": status})
+                continue
+            media_items = self.media_items.setdefault(token, [])
+            media_items.append((item["simpleMediaItem"]["fileName"], upload.md5()))
+            media_item_id = f"{token}-item-{len(media_items)}"
+            if "albumId" in body:
+                self.albums.setdefault(body["albumId"], []).append(media_item_id)
+            results.append(
+                {"uploadToken": upload_token, "status": {"message": "Success"}, "mediaItem": {"id": media_item_id}}
+            )
+        # results are not guaranteed to come back in order
+        return {"newMediaItemResults": results[::-1]}
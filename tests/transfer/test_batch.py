@@ -0,0 +1,120 @@
+"""Test batched creation of media items"""
+
+import asyncio
+
+import httpx
+import pytest
+from fastapi_sso.sso.base import OpenID
+
+from photom.models import Auth, DriveFile
+from photom.transfer.batch import MediaItemBatcher
+from photom.transfer.engine import TransferEngine
+from photom.transfer.google import MediaItemError, PhotosClient
+from tests.transfer.fake_google import FakeGoogle
+
+alice = Auth(openid=OpenID(email="alice@example.com"), access_token="alice", refresh_token="refresh")
+
+
+async def _uploads(google: FakeGoogle, photos: PhotosClient, count: int) -> list[tuple[DriveFile, str]]:
+    """Upload generated files of an account, return them with their upload tokens"""
+    google.add_files(photos.access_token, count)
+    uploads = []
+    for file, content in google.files[photos.access_token][-count:]:
+
+        async def source(content: bytes = content):
+            yield content
+
+        uploads.append((file, await photos.upload(file, source(), len(content))))
+    return uploads
+
+
+class TestMediaItemBatcher:
+    """Media item batcher test suite"""
+
+    @pytest.mark.asyncio
+    async def test_full_batches(self, google: FakeGoogle):
+        """Test that uploads of a transfer batch are created 50 at a time, the rest once all files are uploaded"""
+        google.add_files("alice", 120)
+        async with httpx.AsyncClient() as client:
+            engine = TransferEngine(client, 8, drive_url=google.drive_url, photos_url=google.photos_url, batch_wait=60)
+            files = [file for file, _ in google.files["alice"]]
+            records = await asyncio.wait_for(engine.transfer_batch(alice, files), 30)
+        assert all(record.media_item_id for record in records)
+        assert len({record.media_item_id for record in records}) == 120
+        assert google.batches == [50, 50, 20]
+        assert engine.batch_metrics.batches == 3
+        assert engine.batch_metrics.fill_ratio == pytest.approx(120 / 150)
+        assert 0 < engine.batch_metrics.mean_flush_seconds <= engine.batch_metrics.max_flush_seconds
+
+    @pytest.mark.asyncio
+    async def test_max_wait(self, google: FakeGoogle):
+        """Test that a batch which does not fill up is flushed after the maximum wait"""
+        batcher = MediaItemBatcher(max_wait=0.05)
+        async with httpx.AsyncClient() as client:
+            photos = PhotosClient(client, "alice@example.com", "alice", google.photos_url)
+            uploads = await _uploads(google, photos, 3)
+            media_item_ids = await asyncio.wait_for(
+                asyncio.gather(*(batcher.create(photos, file, token) for file, token in uploads)), 5
+            )
+        assert google.batches == [3]
+        assert sorted(media_item_ids) == ["alice-item-1", "alice-item-2", "alice-item-3"]
+
+    @pytest.mark.asyncio
+    async def test_per_item_results(self, google: FakeGoogle):
+        """Test that every upload gets its own result, refused ones fail alone"""
+        batcher = MediaItemBatcher()
+        async with httpx.AsyncClient() as client:
+            photos = PhotosClient(client, "alice@example.com", "alice", google.photos_url)
+            uploads = await _uploads(google, photos, 4)
+            google.rejected.add(uploads[1][0].name)
+            futures = [batcher.submit(photos, file, token) for file, token in uploads]
+            await batcher.flush()
+        assert isinstance(futures[1].exception(), MediaItemError)
+        created = [future.result() for index, future in enumerate(futures) if index != 1]
+        assert [name for name, _ in google.media_items["alice"]] == [uploads[index][0].name for index in (0, 2, 3)]
+        assert created == ["alice-item-1", "alice-item-2", "alice-item-3"]
+
+    @pytest.mark.asyncio
+    async def test_albums(self, google: FakeGoogle):
+        """Test that uploads are batched per album"""
+        batcher = MediaItemBatcher()
+        async with httpx.AsyncClient() as client:
+            photos = PhotosClient(client, "alice@example.com", "alice", google.photos_url)
+            uploads = await _uploads(google, photos, 4)
+            futures = [
+                batcher.submit(photos, file, token, "album" if index % 2 else None)
+                for index, (file, token) in enumerate(uploads)
+            ]
+            await batcher.flush()
+        assert google.batches == [2, 2]
+        assert sorted(google.albums["album"]) == sorted(futures[index].result() for index in (1, 3))
+
+    @pytest.mark.asyncio
+    async def test_token_refresh(self, google: FakeGoogle):
+        """Test that uploads of an account stay in one batch across a token refresh, created with the fresh token"""
+        batcher = MediaItemBatcher()
+        async with httpx.AsyncClient() as client:
+            photos = PhotosClient(client, "alice@example.com", "alice", google.photos_url)
+            uploads = await _uploads(google, photos, 4)
+            futures = [batcher.submit(photos, file, token) for file, token in uploads[:2]]
+            google.expired.add("alice")
+            google.aliases["alice~1"] = "alice"
+            refreshed = PhotosClient(client, "alice@example.com", "alice~1", google.photos_url)
+            futures += [batcher.submit(refreshed, file, token) for file, token in uploads[2:]]
+            batcher.flush_account("alice@example.com")
+            await batcher.flush()
+        assert google.batches == [4]
+        assert all(future.result() for future in futures)
+
+    @pytest.mark.asyncio
+    async def test_failed_call(self, google: FakeGoogle):
+        """Test that a failing batch create call fails all of its uploads"""
+        batcher = MediaItemBatcher()
+        async with httpx.AsyncClient() as client:
+            photos = PhotosClient(client, "alice@example.com", "alice", google.photos_url)
+            uploads = await _uploads(google, photos, 2)
+            revoked = PhotosClient(client, "revoked@example.com", "revoked", google.photos_url)
+            futures = [batcher.submit(revoked, file, token) for file, token in uploads]
+            await batcher.flush()
+        assert all(isinstance(future.exception(), httpx.HTTPStatusError) for future in futures)
+        assert batcher.metrics.batches == 1
@@ -0,0 +1,152 @@
+"""Test the Drive folder-tree crawler"""
+
+import asyncio
+import os
+from pathlib import Path
+from typing import AsyncIterator
+
+import httpx
+import pytest
+import pytest_asyncio
+
+from photom.models import DriveFile, DriveFolder, DriveTree
+from photom.store.sqlite import SQLiteStore, close_pools
+from photom.store.threaded import ThreadedStore, shutdown_executor
+from photom.transfer.crawler import CRAWL_FIELDS, DriveCrawler, folder_key, prefetched_pages
+from photom.transfer.google import IMAGE_QUERY, DriveClient
+from tests.transfer.fake_google import FakeGoogle
+
+
+@pytest.fixture(name="store")
+def store_fixture(tmp_path: Path):
+    """Store keeping snapshots of crawled trees"""
+    yield ThreadedStore(SQLiteStore(os.path.join(tmp_path, "test.db")))
+    shutdown_executor()
+    close_pools()
+
+
+@pytest_asyncio.fixture(name="drive")
+async def drive_fixture(google: FakeGoogle) -> AsyncIterator[DriveClient]:
+    """Drive client of the account `alice` of the fake APIs"""
+    async with httpx.AsyncClient() as client:
+        yield DriveClient(client, "alice@example.com", "alice", google.drive_url)
+
+
+async def _crawl(crawler: DriveCrawler, drive: DriveClient) -> list[DriveFile]:
+    """Crawl the Drive of `alice`"""
+    return [file async for file in crawler.crawl("alice@example.com", drive)]
+
+
+def _images(google: FakeGoogle, token: str = "alice") -> set[str]:
+    """IDs of images in a Drive of the fake APIs that are not trashed"""
+    return {
+        file.id
+        for file, _ in google.files[token]
+        if file.mime_type.startswith("image/") and file.id not in google.trashed
+    }
+
+
+class TestDriveCrawler:
+    """Drive crawler test suite"""
+
+    @pytest.mark.asyncio
+    async def test_crawl(self, google: FakeGoogle, drive: DriveClient):
+        """Test that all images of a folder tree are listed once, with only the fields transfers need"""
+        folders = google.add_tree("alice", depth=3, fanout=3, files_per_folder=4)
+        google.add_files("alice", 5)
+        files = await _crawl(DriveCrawler(concurrency=4, page_size=3), drive)
+        assert len(files) == 39 * 4 + 5
+        assert {file.id for file in files} == _images(google)
+        assert google.list_fields == {CRAWL_FIELDS}
+        assert all(file.md5_checksum and file.size and file.parents for file in files)
+        assert len(folders) == 39
+        # pages of 3: root holds 3 folders and 5 files, 12 inner folders 3 folders and 4 files, 27 leaves 4 files
+        assert google.requests["list"] == 3 + 12 * 3 + 27 * 2
+
+    @pytest.mark.asyncio
+    async def test_breadth_first(self, google: FakeGoogle, drive: DriveClient):
+        """Test that files of shallower folders come before those of deeper ones"""
+        google.add_tree("alice", depth=3, fanout=2, files_per_folder=2)
+        files = await _crawl(DriveCrawler(concurrency=1), drive)
+        depths = {"root": 0}
+        for file, _ in google.files["alice"]:
+            if file.id in google.folders:
+                depths[file.id] = depths[file.parents[0]] + 1
+        assert [depths[file.parents[0]] for file in files] == sorted(depths[file.parents[0]] for file in files)
+
+    @pytest.mark.asyncio
+    async def test_prefetch(self, google: FakeGoogle, drive: DriveClient):
+        """Test that the next page is requested while the current one is being processed"""
+        google.add_files("alice", 10)
+        pages = prefetched_pages(drive, IMAGE_QUERY, page_size=4)
+        page = await anext(pages)
+        assert len(page.files) == 4
+        await asyncio.sleep(0.2)
+        assert google.requests["list"] == 2
+        await pages.aclose()
+        assert google.requests["list"] == 2
+
+    @pytest.mark.asyncio
+    async def test_recrawl(self, google: FakeGoogle, drive: DriveClient, store: ThreadedStore):
+        """Test that a re-crawl only lists folders whose modified time changed"""
+        folders = google.add_tree("alice", depth=2, fanout=3, files_per_folder=3)
+        async with store:
+            crawler = DriveCrawler(store, concurrency=4)
+            assert len(await _crawl(crawler, drive)) == 36
+            tree = await store.get("alice@example.com", DriveTree)
+            assert tree is not None and set(tree.folders) == {"root", *folders}
+            listed = google.requests["list"]
+            assert listed == 13
+
+            google.add_files("alice", 2, parent=folders[-1])
+            google.trash_file("alice", google.folders[folders[0]][1])
+            files = await _crawl(crawler, drive)
+            assert {file.id for file in files} == _images(google) - {
+                file.id for file, _ in google.files["alice"] if file.parents[0] in (folders[0], *folders[3:6])
+            }
+            assert len(files) == 26
+            assert google.requests["list"] - listed == 3, "folders are listed once, then only root and the changed one"
+
+            tree = await store.get("alice@example.com", DriveTree)
+            assert tree is not None and folders[0] not in tree.folders and folders[3] not in tree.folders
+            assert await store.get(folder_key("alice@example.com", folders[0]), DriveFolder) is None
+            assert len(await _crawl(crawler, drive)) == 26
+            assert google.requests["list"] - listed == 5
+
+    @pytest.mark.asyncio
+    async def test_interrupted(self, google: FakeGoogle, drive: DriveClient, store: ThreadedStore):
+        """Test that a crawl stopped early does not store a snapshot and leaves no listing running"""
+        google.add_tree("alice", depth=2, fanout=4, files_per_folder=10)
+        async with store:
+            crawler = DriveCrawler(store, concurrency=4, page_size=2)
+            files = crawler.crawl("alice@example.com", drive)
+            async for _ in files:
+                break
+            await files.aclose()
+            await asyncio.sleep(0.2)
+            listed = google.requests["list"]
+            await asyncio.sleep(0.2)
+            assert google.requests["list"] == listed
+            assert await store.get("alice@example.com", DriveTree) is None
+
+    @pytest.mark.asyncio
+    async def test_error(self, google: FakeGoogle):
+        """Test that a failed listing ends the crawl with its error"""
+        google.add_tree("alice", depth=1, fanout=2, files_per_folder=1)
+        async with httpx.AsyncClient() as client:
+            with pytest.raises(httpx.HTTPStatusError):
+                await _crawl(DriveCrawler(), DriveClient(client, "mallory@example.com", "mallory", google.drive_url))
+
+    @pytest.mark.asyncio
+    async def test_large_tree(self, google: FakeGoogle, drive: DriveClient, store: ThreadedStore):
+        """Test crawling a tree of 10^5 files and re-crawling it after a change"""
+        folders = google.add_tree("alice", depth=2, fanout=30, files_per_folder=107)
+        google.add_files("alice", 490)
+        async with store:
+            crawler = DriveCrawler(store)
+            files = await _crawl(crawler, drive)
+            assert len(files) == 100_000 and len({file.id for file in files}) == 100_000
+            listed = google.requests["list"]
+            google.add_files("alice", 1, parent=folders[100])
+            assert len(await _crawl(crawler, drive)) == 100_001
+            assert google.requests["list"] - listed == 3
@@ -0,0 +1,122 @@
+"""Test the Drive to Photos transfer engine"""
+
+import os
+from pathlib import Path
+
+import httpx
+import pytest
+from fastapi_sso.sso.base import OpenID
+
+from photom.models import Auth
+from photom.store.dedup import DedupIndex
+from photom.store.sqlite import close_pools
+from photom.transfer.crawler import DriveCrawler
+from photom.transfer.engine import TransferEngine
+from tests.transfer.fake_google import FakeGoogle
+
+
+def _auth(token: str | None, email: str | None = None) -> Auth:
+    """Stored login of an account identified by its access token"""
+    return Auth(openid=OpenID(email=email or f"{token}@example.com"), access_token=token, refresh_token="refresh")
+
+
+def _engine(
+    client: httpx.AsyncClient, google: FakeGoogle, concurrency: int, dedup: DedupIndex | None = None
+) -> TransferEngine:
+    """Transfer engine talking to the fake APIs"""
+    return TransferEngine(client, concurrency, drive_url=google.drive_url, photos_url=google.photos_url, dedup=dedup)
+
+
+class TestTransferEngine:
+    """Transfer engine test suite"""
+
+    @pytest.mark.asyncio
+    async def test_transfer(self, google: FakeGoogle, monkeypatch: pytest.MonkeyPatch):
+        """Test that all images of all accounts are moved to Photos unchanged"""
+        monkeypatch.setattr("photom.transfer.google.LIST_PAGE_SIZE", 7)
+        google.add_files("alice", 20, size=150_000)
+        google.add_files("bob", 3)
+        async with httpx.AsyncClient() as client:
+            stats = await _engine(client, google, 4).run([_auth("alice"), _auth("bob")])
+        assert stats.files == 23
+        assert stats.bytes == 20 * 150_000 + 3 * 1000
+        assert stats.failed == 0
+        assert stats.files_per_second > 0
+        assert stats.bytes_per_second > stats.files_per_second
+        assert google.requests["list"] == 3 + 1
+        for token, files in google.files.items():
+            assert sorted(google.media_items[token]) == [(file.name, file.md5_checksum) for file, _ in files]
+
+    @pytest.mark.asyncio
+    async def test_concurrency_limit(self, google: FakeGoogle):
+        """Test that transfers run concurrently, but never more than allowed"""
+        google.delay = 0.01
+        google.add_files("alice", 30, size=200_000)
+        async with httpx.AsyncClient() as client:
+            stats = await _engine(client, google, 5).run([_auth("alice")])
+        assert stats.files == 30
+        assert google.max_in_flight == 5
+
+    @pytest.mark.asyncio
+    async def test_fairness(self, google: FakeGoogle):
+        """Test that a large Drive does not hold back transfers of other accounts"""
+        google.add_files("large", 50)
+        google.add_files("small", 5)
+        async with httpx.AsyncClient() as client:
+            await _engine(client, google, 2).run([_auth("large"), _auth("small")])
+        first = [token for token, _ in google.downloads[:12]]
+        assert first.count("small") == 5
+
+    @pytest.mark.asyncio
+    async def test_failures(self, google: FakeGoogle):
+        """Test that failed transfers and accounts are skipped without stopping the run"""
+        google.add_files("alice", 5)
+        google.broken.add("alice-2")
+        async with httpx.AsyncClient() as client:
+            stats = await _engine(client, google, 3).run([_auth("alice"), _auth("revoked"), _auth(None, "none@x.com")])
+        assert (stats.files, stats.failed) == (4, 1)
+        assert len(google.media_items["alice"]) == 4
+
+    @pytest.mark.asyncio
+    async def test_no_accounts(self):
+        """Test that a run without any accounts finishes right away"""
+        async with httpx.AsyncClient() as client:
+            stats = await TransferEngine(client).run([])
+        assert stats.files == 0
+        assert stats.files_per_second == 0
+
+    @pytest.mark.asyncio
+    async def test_rerun_deduplicated(self, google: FakeGoogle, monkeypatch: pytest.MonkeyPatch, tmp_path: Path):
+        """Test that running again over a migrated Drive only lists it, without downloading anything"""
+        monkeypatch.setattr("photom.transfer.google.LIST_PAGE_SIZE", 10)
+        dedup = DedupIndex(os.path.join(tmp_path, "test.db"))
+        google.add_files("alice", 25)
+        try:
+            async with httpx.AsyncClient() as client:
+                first = await _engine(client, google, 4, dedup).run([_auth("alice")])
+                google.add_files("alice", 2)
+                google.requests.clear()
+                second = await _engine(client, google, 4, dedup).run([_auth("alice")])
+        finally:
+            close_pools()
+        assert (first.files, first.skipped) == (25, 0)
+        assert (second.files, second.skipped) == (2, 25)
+        assert google.requests["list"] == 3
+        assert google.requests["download"] == 2
+        assert len(google.media_items["alice"]) == 27
+
+    @pytest.mark.asyncio
+    async def test_crawler(self, google: FakeGoogle):
+        """Test that runs with a crawler list files by walking the folder tree, deduplicating a crawled page at once"""
+        google.add_tree("alice", depth=2, fanout=2, files_per_folder=3)
+        google.add_files("alice", 2)
+        async with httpx.AsyncClient() as client:
+            engine = TransferEngine(
+                client, 4, drive_url=google.drive_url, photos_url=google.photos_url, crawler=DriveCrawler()
+            )
+            stats = await engine.run([_auth("alice")])
+        assert (stats.files, stats.failed) == (6 * 3 + 2, 0)
+        assert google.requests["list"] == 1 + 6
+        assert sorted(google.media_items["alice"]) == sorted(
+            (file.name, file.md5_checksum) for file, _ in google.files["alice"] if file.id not in google.folders
+        )
@@ -0,0 +1,71 @@
+"""Test the shared HTTP client of requests to Google APIs"""
+
+import asyncio
+
+import httpx
+import pytest
+from fastapi_sso.sso.base import OpenID
+
+from photom.config import Config
+from photom.models import Auth
+from photom.transfer.engine import BYTES, FILES, TransferEngine
+from photom.transfer.http import REQUEST_SECONDS, DiscoveryCache, InstrumentedTransport
+from tests.metrics import sample
+from tests.transfer.fake_google import FakeGoogle
+
+
+class TestHTTPClient:
+    """Shared HTTP client test suite"""
+
+    @pytest.mark.asyncio
+    async def test_discovery_cache(self):
+        """Test that the discovery document is fetched once per TTL"""
+        fetched: list[str] = []
+
+        def handler(request: httpx.Request) -> httpx.Response:
+            fetched.append(str(request.url))
+            return httpx.Response(200, json={"token_endpoint": f"https://example.com/token/{len(fetched)}"})
+
+        cache = DiscoveryCache(ttl=0.1)
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            documents = [await cache.get(client, "https://example.com/discovery") for _ in range(10)]
+            await asyncio.sleep(0.15)
+            expired = await cache.get(client, "https://example.com/discovery")
+        assert all(document == documents[0] for document in documents)
+        assert expired["token_endpoint"].endswith("/2")
+        assert len(fetched) == 2
+
+    @pytest.mark.asyncio
+    async def test_transfers_share_pool(self, google: FakeGoogle, monkeypatch: pytest.MonkeyPatch):
+        """Test that Drive downloads and Photos uploads reuse the pooled connections, within the configured limits"""
+        monkeypatch.setenv("HTTP_MAX_CONNECTIONS", "4")
+        google.add_files("alice", 30)
+        auth = Auth(openid=OpenID(email="alice@example.com"), access_token="alice", refresh_token="refresh")
+        transferred, transferred_bytes = sample(FILES, "_total", outcome="transferred"), sample(BYTES, "_total")
+        async with Config().get_http_client() as client:
+            engine = TransferEngine(client, 2, drive_url=google.drive_url, photos_url=google.photos_url)
+            stats = await engine.run([auth])
+        assert (stats.files, stats.failed) == (30, 0)
+        assert sum(google.requests.values()) > 60
+        assert sample(FILES, "_total", outcome="transferred") - transferred == 30
+        assert sample(BYTES, "_total") - transferred_bytes == stats.bytes
+        assert len(google.connections) <= 4
+
+    @pytest.mark.asyncio
+    async def test_request_metrics(self):
+        """Test that requests are timed by Google API and status, failed ones with status error"""
+
+        def handler(request: httpx.Request) -> httpx.Response:
+            if request.url.host == "broken.example.com":
+                raise httpx.ConnectError("Refused", request=request)
+            return httpx.Response(204)
+
+        drive = {"api": "drive", "status": "204"}
+        errors = {"api": "other", "status": "error"}
+        before = (sample(REQUEST_SECONDS, "_count", **drive), sample(REQUEST_SECONDS, "_count", **errors))
+        async with httpx.AsyncClient(transport=InstrumentedTransport(httpx.MockTransport(handler))) as client:
+            await client.get("https://www.googleapis.com/drive/v3/files")
+            with pytest.raises(httpx.ConnectError):
+                await client.get("https://broken.example.com/")
+        assert sample(REQUEST_SECONDS, "_count", **drive) == before[0] + 1
+        assert sample(REQUEST_SECONDS, "_count", **errors) == before[1] + 1
@@ -0,0 +1,172 @@
+"""Test adaptive rate limiting of requests to Google APIs"""
+
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+from typing import Callable
+
+import httpx
+import pytest
+
+from photom.transfer.google import DriveClient
+from photom.transfer.limits import (
+    CONCURRENCY_LIMIT,
+    IN_FLIGHT,
+    THROTTLED,
+    RateLimitedTransport,
+    RateLimiter,
+    retry_after,
+)
+from tests.metrics import sample
+
+PHOTOS = "https://photoslibrary.googleapis.com/v1/mediaItems"
+DRIVE = "https://www.googleapis.com/drive/v3/files"
+
+
+@pytest.fixture(name="_no_backoff")
+def no_backoff_fixture(monkeypatch: pytest.MonkeyPatch):
+    """Retry throttled requests almost right away"""
+    monkeypatch.setattr("photom.transfer.limits.BACKOFF_BASE", 0.001)
+
+
+def _client(limiter: RateLimiter, handler: Callable[[httpx.Request], httpx.Response]) -> httpx.AsyncClient:
+    """Client sending requests through the limiter to a handler"""
+    return httpx.AsyncClient(transport=RateLimitedTransport(limiter, httpx.MockTransport(handler)))
+
+
+class _Overloaded:  # pylint: disable=too-few-public-methods
+    """Async handler answering 503 while more than `capacity` requests are in flight"""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(0.005)
+            return httpx.Response(503 if self.in_flight > self.capacity else 200, request=request)
+        finally:
+            self.in_flight -= 1
+
+
+class TestRateLimiter:
+    """Rate limiter test suite"""
+
+    @pytest.mark.asyncio
+    async def test_retry_after(self):
+        """Test that a throttled request waits as long as asked, then succeeds, halving the concurrency limit"""
+        responses = iter([httpx.Response(429, headers={"Retry-After": "0.2"}), httpx.Response(200)])
+        limiter = RateLimiter(concurrency=8)
+        throttled = sample(THROTTLED, "_total", api="photos")
+        start = time.monotonic()
+        async with _client(limiter, lambda _: next(responses)) as client:
+            response = await client.get(PHOTOS, extensions={"photom_account": "alice"})
+        assert response.status_code == 200
+        assert time.monotonic() - start >= 0.2
+        (limits,) = limiter.metrics()
+        assert (limits.account, limits.api, limits.throttled, limits.in_flight) == ("alice", "photos", 1, 0)
+        assert limits.concurrency_limit == 4
+        assert sample(THROTTLED, "_total", api="photos") - throttled == 1
+
+    @pytest.mark.asyncio
+    @pytest.mark.usefixtures("_no_backoff")
+    async def test_adapts_to_capacity(self):
+        """Test that concurrent requests are cut down to what the API handles, all of them succeed eventually"""
+        handler = _Overloaded(3)
+        limiter = RateLimiter(rate=10_000, burst=10_000, concurrency=16, retries=20)
+        async with httpx.AsyncClient(transport=RateLimitedTransport(limiter, httpx.MockTransport(handler))) as client:
+            responses = await asyncio.gather(*(client.get(DRIVE) for _ in range(100)))
+        assert all(response.status_code == 200 for response in responses)
+        (limits,) = limiter.metrics()
+        assert limits.api == "drive"
+        assert limits.throttled > 0
+        assert limits.concurrency_limit <= 8
+
+    @pytest.mark.asyncio
+    async def test_additive_increase(self):
+        """Test that the concurrency limit grows by about one per limit's worth of successful requests"""
+        limiter = RateLimiter(rate=10_000, burst=10_000, concurrency=4, max_concurrency=6)
+        async with _client(limiter, lambda _: httpx.Response(200)) as client:
+            for _ in range(9):
+                await client.get(DRIVE)
+            assert limiter.metrics()[0].concurrency_limit == 5
+            for _ in range(100):
+                await client.get(DRIVE)
+        assert limiter.metrics()[0].concurrency_limit == 6
+
+    @pytest.mark.asyncio
+    async def test_token_bucket(self):
+        """Test that requests beyond the burst are spread out at the rate, separately per account"""
+        limiter = RateLimiter(rate=20, burst=5)
+        start = time.monotonic()
+        async with _client(limiter, lambda _: httpx.Response(200)) as client:
+            await asyncio.gather(*(client.get(DRIVE, extensions={"photom_account": "alice"}) for _ in range(15)))
+            alice = time.monotonic() - start
+            await asyncio.gather(*(client.get(DRIVE, extensions={"photom_account": "bob"}) for _ in range(5)))
+        assert alice >= 0.45
+        assert time.monotonic() - start - alice < 0.1
+
+    @pytest.mark.asyncio
+    @pytest.mark.usefixtures("_no_backoff")
+    async def test_account_clients(self, caplog: pytest.LogCaptureFixture):
+        """Test that clients of an account share its limits across token refreshes, and that tokens are not logged"""
+        responses = iter([httpx.Response(429), httpx.Response(200, json={}), httpx.Response(200, json={})])
+        limiter = RateLimiter(concurrency=8)
+        async with _client(limiter, lambda _: next(responses)) as client:
+            for token in ("secret-1", "secret-2"):
+                await DriveClient(client, "alice@example.com", token).list_page()
+        (limits,) = limiter.metrics()
+        assert (limits.account, limits.throttled, limits.concurrency_limit) == ("alice@example.com", 1, 4)
+        assert "alice@example.com" in caplog.text and "secret" not in caplog.text
+
+    @pytest.mark.asyncio
+    async def test_streamed_content_not_retried(self):
+        """Test that a throttled request whose content was streamed is handed back instead of retried"""
+        calls = []
+
+        def handler(request: httpx.Request) -> httpx.Response:
+            calls.append(request)
+            return httpx.Response(429, headers={"Retry-After": "0"})
+
+        async def content():
+            yield b"data"
+
+        async with _client(RateLimiter(), handler) as client:
+            response = await client.post(PHOTOS, content=content())
+        assert response.status_code == 429
+        assert len(calls) == 1
+
+    @pytest.mark.asyncio
+    async def test_slot_held_until_closed(self):
+        """Test that a streamed response holds its concurrency slot until it is closed"""
+
+        async def content():
+            yield b"content"
+
+        limiter = RateLimiter()
+        async with _client(limiter, lambda _: httpx.Response(200, content=content())) as client:
+            async with client.stream("GET", DRIVE) as response:
+                assert limiter.metrics()[0].in_flight == 1
+                limiter.collect_metrics()
+                assert (sample(IN_FLIGHT, api="drive"), sample(CONCURRENCY_LIMIT, api="drive")) == (1, 8)
+                await response.aread()
+            assert limiter.metrics()[0].in_flight == 0
+
+    @pytest.mark.asyncio
+    async def test_other_hosts(self):
+        """Test that requests to other hosts are not limited"""
+        limiter = RateLimiter()
+        async with _client(limiter, lambda _: httpx.Response(429)) as client:
+            assert (await client.get("https://example.com/")).status_code == 429
+        assert not limiter.metrics()
+
+    def test_retry_after_date(self):
+        """Test that `Retry-After` is understood as a date too"""
+        date = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=30), usegmt=True)
+        assert 28 < (retry_after(httpx.Response(503, headers={"Retry-After": date})) or 0) <= 30
+        assert retry_after(httpx.Response(503, headers={"Retry-After": "soon"})) is None
+        assert retry_after(httpx.Response(503)) is None
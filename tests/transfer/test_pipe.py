@@ -0,0 +1,124 @@
+"""Test the streaming pipe from Drive downloads to Photos uploads"""
+
+import hashlib
+import tracemalloc
+from typing import AsyncIterator
+
+import httpx
+import pytest
+
+from photom.models import DriveFile
+from photom.transfer.engine import TransferEngine
+from photom.transfer.google import DriveClient, PhotosClient
+from photom.transfer.pipe import PipeError, StreamingPipe
+from tests.transfer.fake_google import FakeGoogle
+
+CHUNK_SIZE = 10_000
+
+
+async def _source(content: bytes, piece: int = 3000) -> AsyncIterator[bytes]:
+    """Stream content in pieces not aligned with chunks"""
+    for offset in range(0, len(content), piece):
+        yield content[offset : offset + piece]
+
+
+@pytest.fixture(name="_no_delay")
+def no_delay_fixture(monkeypatch: pytest.MonkeyPatch):
+    """Retry failed chunks right away"""
+    monkeypatch.setattr("photom.transfer.pipe.RETRY_DELAY", 0)
+
+
+class TestStreamingPipe:
+    """Streaming pipe test suite"""
+
+    async def _pipe(self, google: FakeGoogle, size: int, pipe_size: int | None = None) -> tuple[StreamingPipe, str]:
+        """Pipe a file of an account into its upload session, return the pipe and the checksum of the upload"""
+        google.add_files("alice", 1, size=size)
+        file, content = google.files["alice"][0]
+        async with httpx.AsyncClient() as client:
+            pipe = StreamingPipe(PhotosClient(client, "alice@example.com", "alice", google.photos_url), CHUNK_SIZE)
+            upload_token = await pipe.pipe(file, _source(content), size if pipe_size is None else pipe_size)
+        assert google.uploads[upload_token].md5() == file.md5_checksum
+        return pipe, upload_token
+
+    @pytest.mark.asyncio
+    async def test_chunk_boundaries(self, google: FakeGoogle):
+        """Test that chunks have a fixed size rounded down to the granularity and are sent in order"""
+        google.granularity = 1024
+        pipe, upload_token = await self._pipe(google, 100_000)
+        chunks = google.uploads[upload_token].chunks
+        assert [length for _, length, _ in chunks] == [9216] * 10 + [100_000 - 92160]
+        assert [offset for offset, _, _ in chunks] == list(range(0, 100_000, 9216))
+        assert [finalize for _, _, finalize in chunks] == [False] * 10 + [True]
+        assert pipe.spooled == 0
+
+    @pytest.mark.asyncio
+    async def test_empty_file(self, google: FakeGoogle):
+        """Test that an empty file is uploaded as a single final chunk"""
+        _, upload_token = await self._pipe(google, 0)
+        assert google.uploads[upload_token].chunks == [(0, 0, True)]
+
+    @pytest.mark.asyncio
+    async def test_resume(self, google: FakeGoogle, _no_delay):
+        """Test that a failed chunk is resumed from the offset the session confirms"""
+        google.upload_failures[2] = (1234, None)
+        pipe, upload_token = await self._pipe(google, 35_000)
+        chunks = google.uploads[upload_token].chunks
+        assert chunks[1:3] == [(10_000, 10_000, False), (11_234, 8766, False)]
+        assert pipe.spooled == 25_000, "Spool is only written from the failure on"
+
+    @pytest.mark.asyncio
+    async def test_rewind_from_spool(self, google: FakeGoogle, _no_delay):
+        """Test that a session rewound past the buffer is replayed from the spool"""
+        google.upload_failures[2] = (0, None)
+        google.upload_failures[5] = (0, 20_000)
+        _, upload_token = await self._pipe(google, 45_000)
+        offsets = [offset for offset, _, _ in google.uploads[upload_token].chunks]
+        assert offsets == [0, 10_000, 10_000, 20_000, 30_000, 20_000, 30_000, 40_000]
+
+    @pytest.mark.asyncio
+    async def test_rewind_unavailable(self, google: FakeGoogle, _no_delay):
+        """Test that rewinding before the spool fails the transfer"""
+        google.upload_failures[3] = (0, 0)
+        with pytest.raises(PipeError, match="no longer available"):
+            await self._pipe(google, 45_000)
+
+    @pytest.mark.asyncio
+    async def test_retries_exhausted(self, google: FakeGoogle, _no_delay):
+        """Test that a chunk failing over and over fails the transfer"""
+        google.upload_failures.update({index: (0, None) for index in range(2, 6)})
+        with pytest.raises(httpx.HTTPStatusError):
+            await self._pipe(google, 45_000)
+
+    @pytest.mark.asyncio
+    async def test_short_download(self, google: FakeGoogle):
+        """Test that a download shorter than announced fails the transfer"""
+        with pytest.raises(PipeError, match="ended after 45000 of 50000 bytes"):
+            await self._pipe(google, 45_000, pipe_size=50_000)
+
+    @pytest.mark.asyncio
+    async def test_peak_memory(self, google: FakeGoogle):
+        """Test that memory used by a transfer is bounded by the chunk size, not by the file size"""
+        chunk_size = 1024 * 1024
+        size = 32 * chunk_size
+        google.add_files("alice", 1, size=size)
+        file = google.files["alice"][0][0]
+        async with httpx.AsyncClient() as client:
+            drive = DriveClient(client, "alice@example.com", "alice", google.drive_url)
+            photos = PhotosClient(client, "alice@example.com", "alice", google.photos_url)
+            engine = TransferEngine(client, chunk_size=chunk_size)
+            tracemalloc.start()
+            try:
+                _, transferred = await engine.transfer(drive, photos, file)
+                _, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+        assert transferred == size
+        assert google.media_items["alice"] == [(file.name, hashlib.md5(google.files["alice"][0][1]).hexdigest())]
+        assert peak < 4 * chunk_size
+
+
+def test_drive_file_aliases():
+    """Test that Drive files are read from Drive API field names"""
+    file = DriveFile.model_validate({"id": "1", "name": "a.jpg", "mimeType": "image/jpeg", "size": "10"})
+    assert (file.mime_type, file.size, file.md5_checksum) == ("image/jpeg", 10, None)
@@ -0,0 +1,211 @@
+"""Test incremental Drive sync"""
+
+import asyncio
+import os
+import sqlite3
+from contextlib import suppress
+from pathlib import Path
+from typing import AsyncIterator
+
+import httpx
+import pytest
+import pytest_asyncio
+from fastapi_sso.sso.base import OpenID
+
+from photom.models import AccountProgress, Auth, DriveSyncState, TransferRecord
+from photom.progress import ProgressBus
+from photom.store.dedup import DedupIndex
+from photom.store.sqlite import SQLiteStore, close_pools
+from photom.store.threaded import ThreadedStore, shutdown_executor
+from photom.transfer.engine import TransferEngine
+from photom.transfer.sync import DriveSync, record_key
+from tests.transfer.fake_google import FakeGoogle
+
+alice = Auth(openid=OpenID(email="alice@example.com"), access_token="alice", refresh_token="refresh")
+
+
+@pytest.fixture(name="store")
+def store_fixture(tmp_path: Path):
+    """Store keeping sync checkpoints and transfer records"""
+    yield ThreadedStore(SQLiteStore(os.path.join(tmp_path, "test.db")))
+    shutdown_executor()
+    close_pools()
+
+
+@pytest_asyncio.fixture(name="sync")
+async def sync_fixture(
+    google: FakeGoogle, store: ThreadedStore, monkeypatch: pytest.MonkeyPatch, tmp_path: Path
+) -> AsyncIterator[DriveSync]:
+    """Sync transferring files to the fake APIs, listing them in pages of 10, deduplicated in the store database"""
+    monkeypatch.setattr("photom.transfer.google.LIST_PAGE_SIZE", 10)
+    dedup = DedupIndex(os.path.join(tmp_path, "test.db"))
+    async with httpx.AsyncClient() as client, store:
+        engine = TransferEngine(client, 4, drive_url=google.drive_url, photos_url=google.photos_url, dedup=dedup)
+        yield DriveSync(engine, store)
+
+
+class TestDriveSync:
+    """Drive sync test suite"""
+
+    @pytest.mark.asyncio
+    async def test_incremental(self, google: FakeGoogle, sync: DriveSync, store: ThreadedStore):
+        """Test that only files added or modified since the last sync are transferred"""
+        google.add_files("alice", 25)
+        stats = await sync.sync(alice)
+        assert (stats.files, stats.bytes, stats.failed) == (25, 25_000, 0)
+        assert google.requests["list"] == 3
+        state = await store.get("alice@example.com", DriveSyncState)
+        assert state == DriveSyncState(changes_token="25")
+
+        google.add_files("alice", 3)
+        google.update_file("alice", 0, b"new content")
+        google.update_file("alice", 1, name="renamed.jpg")
+        google.trash_file("alice", 2)
+        stats = await sync.sync(alice)
+        assert (stats.files, stats.failed) == (4, 0)
+        assert google.requests["list"] == 3, "Drive is not listed again"
+        assert google.requests["download"] == 29
+        record = await store.get(record_key("alice@example.com", "alice-0"), TransferRecord)
+        assert record and record.file.size == len(b"new content") and record.media_item_id
+
+        stats = await sync.sync(alice)
+        assert stats.files == 0
+        assert google.requests["download"] == 29
+
+    @pytest.mark.asyncio
+    async def test_resume(
+        self, google: FakeGoogle, sync: DriveSync, store: ThreadedStore, monkeypatch: pytest.MonkeyPatch
+    ):
+        """Test that an interrupted sync resumes from the last processed page"""
+        google.add_files("alice", 25)
+        transfer_batch = TransferEngine.transfer_batch
+        batches = 0
+
+        async def crashing_batch(self, auth, files, on_record=None):
+            nonlocal batches
+            batches += 1
+            if batches == 2:
+                raise RuntimeError("Crash")
+            return await transfer_batch(self, auth, files, on_record)
+
+        monkeypatch.setattr(TransferEngine, "transfer_batch", crashing_batch)
+        with pytest.raises(RuntimeError):
+            await sync.sync(alice)
+        assert google.requests["download"] == 10
+        state = await store.get("alice@example.com", DriveSyncState)
+        assert state == DriveSyncState(changes_token="25", listing_token="10")
+
+        stats = await sync.sync(alice)
+        assert stats.files == 15
+        assert google.requests["download"] == 25
+        assert google.requests["list"] == 2 + 2, "Only the interrupted page is listed again"
+
+    @pytest.mark.asyncio
+    async def test_checkpoint_lost(self, google: FakeGoogle, sync: DriveSync, store: ThreadedStore):
+        """Test that a sync starting over lists the Drive again, but does not download content transferred before"""
+        google.add_files("alice", 25)
+        await sync.sync(alice)
+        first = await store.get(record_key("alice@example.com", "alice-7"), TransferRecord)
+        await store.delete("alice@example.com", DriveSyncState)
+        await store.delete_many(
+            [record_key("alice@example.com", f"alice-{index}") for index in range(25)], TransferRecord
+        )
+
+        stats = await sync.sync(alice)
+        assert (stats.files, stats.skipped, stats.failed) == (0, 25, 0)
+        assert google.requests["download"] == 25
+        assert google.requests["list"] == 3 + 3
+        record = await store.get(record_key("alice@example.com", "alice-7"), TransferRecord)
+        assert first and record and record.deduplicated and record.media_item_id == first.media_item_id
+
+    @pytest.mark.asyncio
+    async def test_retry_failed(self, google: FakeGoogle, sync: DriveSync, store: ThreadedStore):
+        """Test that files failing to transfer are tried again by later syncs, though they did not change"""
+        google.add_files("alice", 25)
+        google.broken.update({"alice-3", "alice-17"})
+        stats = await sync.sync(alice)
+        assert (stats.files, stats.failed) == (23, 2)
+        state = await store.get("alice@example.com", DriveSyncState)
+        assert state == DriveSyncState(changes_token="25", failed=["alice-3", "alice-17"])
+
+        google.broken.discard("alice-17")
+        stats = await sync.sync(alice)
+        assert (stats.files, stats.failed) == (1, 1)
+        assert google.requests["list"] == 3, "Drive is not listed again"
+        state = await store.get("alice@example.com", DriveSyncState)
+        assert state and state.failed == ["alice-3"]
+
+        google.broken.clear()
+        stats = await sync.sync(alice)
+        assert (stats.files, stats.failed) == (1, 0)
+        state = await store.get("alice@example.com", DriveSyncState)
+        assert state == DriveSyncState(changes_token="25")
+        assert len(google.media_items["alice"]) == 25
+        record = await store.get(record_key("alice@example.com", "alice-3"), TransferRecord)
+        assert record and record.media_item_id and record.error is None
+
+    @pytest.mark.asyncio
+    async def test_sync_all(self, google: FakeGoogle, sync: DriveSync):
+        """Test that accounts failing to sync or without a token do not stop the others"""
+        google.add_files("alice", 5)
+        google.add_files("bob", 7)
+        google.broken.add("bob-3")
+        accounts = [
+            alice,
+            Auth(openid=OpenID(email="bob@example.com"), access_token="bob", refresh_token="refresh"),
+            Auth(openid=OpenID(email="revoked@example.com"), access_token="revoked", refresh_token="refresh"),
+            Auth(openid=OpenID(email="none@example.com"), access_token=None, refresh_token="refresh"),
+        ]
+        stats = await sync.sync_all(accounts)
+        assert (stats.files, stats.failed) == (11, 1)
+        assert stats.bytes_per_second > 0
+
+    @pytest.mark.asyncio
+    async def test_failing_commit(
+        self, google: FakeGoogle, sync: DriveSync, store: ThreadedStore, monkeypatch: pytest.MonkeyPatch
+    ):
+        """Test that a commit failing while the commit of another account is in progress does not discard the other"""
+        google.add_files("alice", 5)
+        google.add_files("bob", 5)
+        bob = Auth(openid=OpenID(email="bob@example.com"), access_token="bob", refresh_token="refresh")
+        set_many = store.set_many
+        committing = asyncio.Event()
+
+        async def set_many_failing(values):
+            await set_many(values)
+            if any(key.startswith("bob@") for key in values):
+                with suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(committing.wait(), 1)
+                raise sqlite3.OperationalError("disk I/O error")
+            committing.set()
+            await asyncio.sleep(0.05)
+
+        monkeypatch.setattr(store, "set_many", set_many_failing)
+        results = await asyncio.gather(sync.sync(alice), sync.sync(bob), return_exceptions=True)
+        assert isinstance(results[1], sqlite3.OperationalError)
+        assert await store.get("alice@example.com", DriveSyncState) == DriveSyncState(changes_token="5")
+        assert await store.get(record_key("alice@example.com", "alice-4"), TransferRecord)
+        state = await store.get("bob@example.com", DriveSyncState)
+        assert state and state.listing_token == "", "bob resumes from the start"
+        assert await store.get(record_key("bob@example.com", "bob-4"), TransferRecord) is None
+
+    @pytest.mark.asyncio
+    async def test_progress(self, google: FakeGoogle, store: ThreadedStore, monkeypatch: pytest.MonkeyPatch):
+        """Test that the state of a sync is published whenever a file was handled, and once it finished"""
+        monkeypatch.setattr("photom.transfer.google.LIST_PAGE_SIZE", 10)
+        google.add_files("alice", 25)
+        google.broken.add("alice-3")
+        bus = ProgressBus()
+        published: list[AccountProgress] = []
+        bus.publish = published.append  # type: ignore[method-assign]
+        async with httpx.AsyncClient() as client, store:
+            engine = TransferEngine(client, 4, drive_url=google.drive_url, photos_url=google.photos_url)
+            stats = await DriveSync(engine, store, bus).sync(alice)
+        handled = [state for state in published if not state.done]
+        assert len(handled) == 25 + 3 + 1, "a state per file and per page of the listing and of changes"
+        assert max(state.pending for state in handled) <= 10
+        assert [state.files + state.failed for state in handled if state.pending == 0][-1] == 25
+        final = published[-1]
+        assert final.done and (final.files, final.bytes, final.failed, final.pending) == (24, 24_000, 1, 0)
+        assert final.eta == 0.0 and final.bytes_per_second > 0
+        assert (stats.files, stats.failed) == (final.files, final.failed)
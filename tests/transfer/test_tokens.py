@@ -0,0 +1,115 @@
+"""Test refreshing of access tokens"""
+
+import asyncio
+import os
+import time
+from pathlib import Path
+from typing import AsyncIterator
+
+import httpx
+import pytest
+import pytest_asyncio
+from fastapi_sso.sso.base import OpenID
+
+from photom.models import Auth, BaseModel
+from photom.store.sqlite import SQLiteStore, close_pools
+from photom.store.threaded import ThreadedStore, shutdown_executor
+from photom.transfer.engine import TransferEngine
+from photom.transfer.tokens import TokenManager, TokenRefreshError
+from tests.transfer.fake_google import FakeGoogle
+
+
+def _auth(expires_in: float | None, refresh_token: str = "alice-refresh") -> Auth:
+    """Login of alice, with an access token expiring in the given number of seconds"""
+    expires_at = None if expires_in is None else time.time() + expires_in
+    return Auth(
+        openid=OpenID(email="alice@example.com"),
+        access_token="alice",
+        refresh_token=refresh_token,
+        expires_at=expires_at,
+    )
+
+
+@pytest_asyncio.fixture(name="store")
+async def store_fixture(tmp_path: Path) -> AsyncIterator[ThreadedStore]:
+    """Store counting its writes"""
+    store = ThreadedStore(SQLiteStore(os.path.join(tmp_path, "test.db")))
+    writes: list[BaseModel] = []
+    set_value = store.set
+
+    async def counting_set(key: str, value: BaseModel) -> None:
+        writes.append(value)
+        await set_value(key, value)
+
+    store.set = counting_set  # type: ignore[method-assign]
+    store.writes = writes  # type: ignore[attr-defined]
+    async with store:
+        yield store
+    shutdown_executor()
+    close_pools()
+
+
+@pytest_asyncio.fixture(name="tokens")
+async def tokens_fixture(google: FakeGoogle, store: ThreadedStore) -> AsyncIterator[TokenManager]:
+    """Token manager refreshing tokens at the fake token endpoint, a minute ahead of their expiry"""
+    async with httpx.AsyncClient() as client:
+        async with TokenManager(client, store, "client", "secret", google.token_url, margin=60) as manager:
+            yield manager
+
+
+class TestTokenManager:
+    """Token manager test suite"""
+
+    @pytest.mark.asyncio
+    async def test_single_flight(self, google: FakeGoogle, tokens: TokenManager, store: ThreadedStore):
+        """Test that many callers of an expired account share one refresh, which is stored once"""
+        google.add_files("alice", 1)
+        google.token_delay = 0.05
+        auths = await asyncio.gather(*(tokens.get(_auth(-10)) for _ in range(500)))
+        assert google.requests["token"] == 1
+        assert tokens.refreshes == 1
+        assert {auth.access_token for auth in auths} == {"alice~1"}
+        assert store.writes == [auths[0]]  # type: ignore[attr-defined]
+        assert await store.get("alice@example.com", Auth) == auths[0]
+        assert auths[0].expires_at and auths[0].expires_at > time.time() + 3000
+
+    @pytest.mark.asyncio
+    async def test_fresh_token_kept(self, google: FakeGoogle, tokens: TokenManager):
+        """Test that tokens far from their expiry, or of unknown expiry, are used as they are"""
+        google.add_files("alice", 1)
+        assert (await tokens.get(_auth(3600))).access_token == "alice"
+        assert (await tokens.get(_auth(None))).access_token == "alice"
+        assert google.requests["token"] == 0
+
+    @pytest.mark.asyncio
+    async def test_background_refresh(self, google: FakeGoogle, tokens: TokenManager):
+        """Test that a token is refreshed ahead of its expiry without anyone asking for it"""
+        google.add_files("alice", 1)
+        assert (await tokens.get(_auth(60.05))).access_token == "alice"
+        await asyncio.sleep(0.2)
+        assert google.requests["token"] == 1
+        assert (await tokens.get(_auth(60.05))).access_token == "alice~1"
+        assert google.requests["token"] == 1
+
+    @pytest.mark.asyncio
+    async def test_rejected_token(self, google: FakeGoogle, tokens: TokenManager):
+        """Test that concurrent transfers rejected with an expired token refresh it once and carry on"""
+        google.add_files("alice", 30)
+        google.expired.add("alice")
+        async with httpx.AsyncClient() as client:
+            engine = TransferEngine(client, 8, drive_url=google.drive_url, photos_url=google.photos_url, tokens=tokens)
+            stats = await engine.run([_auth(None)])
+        assert (stats.files, stats.failed) == (30, 0)
+        assert google.requests["token"] == 1
+
+    @pytest.mark.asyncio
+    async def test_refresh_failure(self, google: FakeGoogle, tokens: TokenManager, store: ThreadedStore):
+        """Test that a refused refresh fails every waiting caller, and the next caller tries again"""
+        google.add_files("alice", 1)
+        results = await asyncio.gather(*(tokens.get(_auth(0, "revoked")) for _ in range(10)), return_exceptions=True)
+        assert all(isinstance(result, TokenRefreshError) for result in results)
+        assert google.requests["token"] == 1
+        with pytest.raises(TokenRefreshError):
+            await tokens.get(_auth(0, "revoked"))
+        assert google.requests["token"] == 2
+        assert not store.writes  # type: ignore[attr-defined]